@@ -0,0 +1 @@
+"""Benchmarks for the Google Drive traversal and copy engines."""
@@ -0,0 +1,86 @@
+'''
+Measures the cold start of the drive-copy entry point in fresh interpreters.
+
+bench_suite records the same measurements with its results, so they are stored
+per commit and compared with a baseline like every other engine.
+
+Usage: python -m benchmarks.bench_startup [--runs N]
+'''
+import sys
+import time
+import argparse
+import statistics
+import subprocess  # nosec B404
+
+# drive-copy --help: import the entry point and print the options
+HELP_SNIPPET = "from gcp.copy_folder import main\ntry:\n    main(['--help'])\nexcept SystemExit:\n    pass"
+
+# Time to first request: import, build the service and execute one call against a mock transport
+FIRST_REQUEST_SNIPPET = '''
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.http import HttpMockSequence
+from gcp.copy_folder import create_drive_service
+drive_service = create_drive_service(AnonymousCredentials())
+request = drive_service.files().get(fileId='root', fields='name')
+request.execute(http=HttpMockSequence([({'status': '200'}, '{"name": "root"}')]))
+'''
+
+# Measurements by name, as they appear in the results of bench_suite
+MEASUREMENTS = {
+    'help': HELP_SNIPPET,
+    'first-request': FIRST_REQUEST_SNIPPET,
+}
+
+# Define a function to time a snippet in a fresh interpreter
+def time_snippet(snippet, runs):
+    """
+    Runs a snippet in a new Python process runs times.
+
+    Args:
+        snippet (str): The Python code to run.
+        runs (int): The number of runs.
+
+    Returns:
+        timings (list): The wall time of each run in seconds.
+    """
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', snippet], check=True,  # nosec B603
+                       stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+# Define a function to measure the cold starts as results of the suite
+def measure_startup(runs):
+    """
+    Times every measurement in fresh interpreters, as bench_suite results of the 'startup' shape.
+
+    Args:
+        runs (int): The number of runs of each measurement.
+
+    Returns:
+        results (list): One result per measurement, with the median time of the runs.
+    """
+    results = []
+    for name, snippet in MEASUREMENTS.items():
+        timings = time_snippet(snippet, runs)
+        results.append({'shape': 'startup', 'engine': name, 'items': 0,
+                        'seconds': statistics.median(timings), 'best_seconds': min(timings),
+                        'calls': 0, 'round_trips': 0, 'peak_bytes': None})
+    return results
+
+def main(argv=None):
+    """
+    Prints the median and best cold start times of --help and of the first request.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"{'measurement':<16}{'median':>10}{'best':>10}")
+    for result in measure_startup(args.runs):
+        print(f"{result['engine']:<16}{result['seconds']:>10.3f}{result['best_seconds']:>10.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+'''
+Measures how the counting, report, traversal and copy engines scale on synthetic trees.
+
+Every engine runs against an in-process fake Drive with simulated latency and
+pagination (or, with --emulator, against the local HTTP emulator through the
+real client and transport), on wide, deep, skewed and balanced trees. Wall time, API calls,
+HTTP round trips and peak memory are printed and stored per commit, so a run
+can be compared with the results of an earlier commit.
+
+Usage: python -m benchmarks.bench_suite [--size N] [--shapes ...] [--engines ...]
+                                        [--compare RESULTS.json]
+'''
+import io
+import csv
+import itertools
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import subprocess  # nosec B404
+from pathlib import Path
+from google.auth.credentials import AnonymousCredentials
+from gcp.copy_folder import (
+    add_child_folders,
+    copy_child_objects,
+    count_child_objects,
+    create_drive_service,
+)
+from gcp.async_copy import copy_child_objects_async
+from gcp.listing import MIME_FOLDER
+from gcp.snapshot import build_tree_snapshot
+from gcp.transport import TRANSPORTS, PooledHttp
+from benchmarks.fake_drive import SHAPES, FakeDrive
+from benchmarks.emulator import DriveEmulator
+from benchmarks.bench_startup import measure_startup
+
+# Where results are stored, one file per commit
+RESULTS_DIRECTORY = Path(__file__).parent / 'results'
+# Relative slowdown (or memory growth) reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+# Define a function to count a tree with the recursive counter
+def run_count_child_objects(_drive, service_factory, _workers):
+    """
+    Counts the tree with count_child_objects (one recursive walk).
+    """
+    return count_child_objects('root', service_factory())
+
+# Define a function to write the folder report the pre-snapshot way
+def run_add_child_folders(drive, service_factory, _workers):
+    """
+    Writes one report row per top-level folder with add_child_folders.
+    """
+    output = io.StringIO()
+    add_child_folders('root', csv.writer(output), service_factory())
+    rows = list(csv.reader(io.StringIO(output.getvalue())))
+    root_files = sum(1 for child_id in drive.children['root']
+                     if drive.items[child_id]['mimeType'] != MIME_FOLDER)
+    return (root_files + sum(int(row[1]) for row in rows),
+            len(rows) + sum(int(row[2]) for row in rows))
+
+# Define a function to create the destination folder of a copy
+def create_destination(drive):
+    """
+    Adds an empty destination folder outside the source tree.
+    """
+    drive.add_item('dest', 'Destination', MIME_FOLDER, 'destination-parent')
+    return 'dest'
+
+# Define a function to build the engine of a snapshot traversal
+def snapshot_engine(traversal):
+    """
+    Returns an engine that counts the tree from a snapshot built with the given traversal.
+    """
+    def run(_drive, service_factory, workers):
+        kwargs = {}
+        if traversal == 'concurrent':
+            kwargs = {'service_factory': service_factory, 'max_workers': workers}
+        return build_tree_snapshot('root', service_factory(), traversal=traversal,
+                                   **kwargs).count_child_objects()
+    return run
+
+# Define a function to build the engine of a copy
+def copy_engine(batch_size=None):
+    """
+    Returns an engine that copies the tree with copy_child_objects (or the async pipeline).
+    """
+    def run(drive, service_factory, workers):
+        dest_id = create_destination(drive)
+        if batch_size is None:
+            copy_child_objects_async('root', dest_id, service_factory, copy_workers=workers)
+        else:
+            copy_child_objects('root', dest_id, service_factory(), batch_size=batch_size)
+        return drive.count_items(dest_id)
+    return run
+
+# Every engine gets the fake, a factory of service objects for it and the number of workers,
+# and returns the number of files and folders it counted (or copied)
+ENGINES = {
+    'count_child_objects': run_count_child_objects,
+    'add_child_folders': run_add_child_folders,
+    'snapshot-recursive': snapshot_engine('recursive'),
+    'snapshot-bfs': snapshot_engine('bfs'),
+    'snapshot-concurrent': snapshot_engine('concurrent'),
+    'snapshot-corpus': snapshot_engine('corpus'),
+    'copy-sequential': copy_engine(batch_size=1),
+    'copy-batched': copy_engine(batch_size=100),
+    'copy-async': copy_engine(),
+}
+
+# Define a function to run an engine once on a fresh clone of a tree
+def run_once(name, tree, latency, workers, emulate, trace_memory, transport='httplib2'):
+    """
+    Runs an engine once, on its own clone of the tree (served over HTTP if emulate).
+    Over HTTP, the clients connect with the given transport ('httplib2' or 'pooled').
+
+    Returns:
+        counted (tuple): The number of files and folders the engine counted or copied.
+        measurement (dict): The seconds, API calls, round trips and peak memory (or None).
+    """
+    if emulate:
+        drive = tree.clone(0.0)
+        emulator = DriveEmulator(drive, latency=latency).start()
+        http = PooledHttp(AnonymousCredentials(), workers) if transport == 'pooled' else None
+        service_factory = lambda: create_drive_service(AnonymousCredentials(), emulator.url, http)
+    else:
+        drive = tree.clone(latency)
+        emulator = None
+        http = None
+        service_factory = lambda: drive
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        counted = ENGINES[name](drive, service_factory, workers)
+    finally:
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        tracemalloc.stop()
+        if http:
+            http.close()
+        if emulator:
+            emulator.stop()
+    if emulator:
+        calls, round_trips = emulator.stats['calls'], emulator.stats['requests']
+    else:
+        calls, round_trips = drive.api_calls(), drive.round_trips
+    return tuple(counted), {'seconds': elapsed, 'calls': calls, 'round_trips': round_trips,
+                            'peak_bytes': peak}
+
+# Define a function to run one engine on one tree
+def run_engine(name, tree, latency=0.0, workers=8, repeat=1, emulate=False, trace_memory=True,
+               transport='httplib2'):
+    """
+    Runs an engine on fresh clones of a tree and measures the best of repeat runs.
+
+    Wall time is measured without tracemalloc, which slows allocation-heavy code
+    several times over; peak memory is measured in one more, traced, run.
+
+    Args:
+        name (str): The name of the engine in ENGINES.
+        tree (FakeDrive): The source tree (never modified).
+        latency (float): The simulated round-trip time of every call, in seconds.
+        workers (int): The number of workers of the concurrent engines.
+        repeat (int): The number of timed runs.
+        emulate (bool): Whether to serve the clone over HTTP with the DriveEmulator.
+        trace_memory (bool): Whether to measure peak memory.
+        transport (str): The HTTP transport of the clients with emulate, 'httplib2' or 'pooled'.
+
+    Returns:
+        result (dict): The seconds, API calls, round trips and peak memory, or the error.
+    """
+    expected = tree.count_items('root')
+    result = {'engine': name, 'items': len(tree.items), 'peak_bytes': None}
+    for run in range(repeat + trace_memory):
+        traced = run == repeat
+        try:
+            counted, measurement = run_once(name, tree, latency, workers, emulate, traced,
+                                            transport)
+        except RecursionError as error:
+            return dict(result, error=f'{type(error).__name__}: {error}')
+        if counted != expected:
+            return dict(result, error=f'counted {counted}, expected {expected}')
+        if traced:
+            result['peak_bytes'] = measurement['peak_bytes']
+        elif 'seconds' not in result or measurement['seconds'] < result['seconds']:
+            result.update(seconds=measurement['seconds'], calls=measurement['calls'],
+                          round_trips=measurement['round_trips'])
+    return result
+
+# Define a function to run every engine on every shape
+def run_suite(shapes, engines, size, latency=0.0, workers=8, repeat=1, emulate=False,
+              trace_memory=True, transport='httplib2'):
+    """
+    Builds each tree shape once and runs every engine on it.
+
+    Args:
+        shapes (list): The names of the shapes in SHAPES.
+        engines (list): The names of the engines in ENGINES.
+        size (int): The approximate number of items of every tree.
+        latency (float): The simulated round-trip time of every call, in seconds.
+        workers (int): The number of workers of the concurrent engines.
+        repeat (int): The number of runs of each engine.
+        emulate (bool): Whether to run the engines over HTTP against the DriveEmulator.
+        trace_memory (bool): Whether to measure peak memory.
+        transport (str): The HTTP transport of the clients with emulate, 'httplib2' or 'pooled'.
+
+    Yields:
+        result (dict): The result of run_engine, with the shape.
+    """
+    for shape in shapes:
+        tree = SHAPES[shape](FakeDrive(), size)
+        for engine in engines:
+            yield dict(run_engine(engine, tree, latency, workers, repeat, emulate, trace_memory,
+                                  transport), shape=shape)
+
+# Define a function to identify the measured commit
+def current_commit():
+    """
+    Returns the short hash of HEAD, suffixed with -dirty for uncommitted changes.
+    """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'],  # nosec B603 B607
+                              capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# Define a function to store the results of a run
+def save_results(results, settings, directory=RESULTS_DIRECTORY):
+    """
+    Writes the results of a run to <directory>/<commit>.json.
+
+    Args:
+        results (list): The results of run_suite.
+        settings (dict): The size, latency, workers and repeat of the run.
+        directory (Path): The results directory.
+
+    Returns:
+        path (Path): The path to the results file.
+    """
+    commit = current_commit()
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'{commit}.json'
+    document = {
+        'commit': commit,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'settings': settings,
+        'results': results,
+    }
+    path.write_text(json.dumps(document, indent=2), encoding='utf-8')
+    return path
+
+# Define a function to compare a run with stored results
+def compare_results(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Lists the engines that got slower, made more calls or used more memory than the baseline.
+
+    Args:
+        results (list): The results of run_suite.
+        baseline (list): The results stored by an earlier run.
+        threshold (float): The relative growth of time or memory reported as a regression.
+
+    Returns:
+        regressions (list): One message per regression.
+    """
+    previous = {(result['shape'], result['engine']): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['shape'], result['engine']))
+        if before is None or 'error' in before:
+            continue
+        label = f"{result['shape']}/{result['engine']}"
+        if 'error' in result:
+            regressions.append(f"{label}: {result['error']}")
+            continue
+        if result['calls'] > before['calls']:
+            regressions.append(f"{label}: {before['calls']} -> {result['calls']} API calls")
+        for key, unit in (('seconds', 's'), ('peak_bytes', ' bytes')):
+            if result[key] is None or before.get(key) is None:
+                continue
+            if result[key] > before[key] * (1 + threshold):
+                regressions.append(f"{label}: {key} {before[key]:.3f}{unit} -> "
+                                   f"{result[key]:.3f}{unit}")
+    return regressions
+
+def main(argv=None):
+    """
+    Runs the suite, prints a table, stores the results and compares them with a baseline.
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2000,
+                        help='Approximate number of items per tree (e.g. 100000).')
+    parser.add_argument('--shapes', nargs='+', choices=list(SHAPES), default=list(SHAPES))
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--latency', type=float, default=0.001)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--emulator', action='store_true',
+                        help='Serve the trees over HTTP and use the real Drive client.')
+    parser.add_argument('--transport', choices=TRANSPORTS, default='httplib2',
+                        help='HTTP transport of the clients with --emulator; pooled shares one '
+                             'connection pool of --workers connections.')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='Skip the extra traced run that measures peak memory.')
+    parser.add_argument('--startup-runs', type=int, default=5,
+                        help='Fresh interpreters timed for the cold start of drive-copy, '
+                             'recorded as the startup shape (0 to skip).')
+    parser.add_argument('--results-dir', default=str(RESULTS_DIRECTORY))
+    parser.add_argument('--compare', help='Results file of an earlier commit to compare with.')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    print(f"{'shape':<10}{'engine':<22}{'items':>8}{'seconds':>10}{'calls':>8}"
+          f"{'requests':>10}{'peak MB':>9}")
+    results = []
+    suite = itertools.chain(
+        run_suite(args.shapes, args.engines, args.size, args.latency, args.workers,
+                  args.repeat, args.emulator, not args.no_memory, args.transport),
+        measure_startup(args.startup_runs) if args.startup_runs > 0 else [])
+    for result in suite:
+        results.append(result)
+        if 'error' in result:
+            print(f"{result['shape']:<10}{result['engine']:<22}{result['items']:>8}  "
+                  f"FAILED: {result['error']}")
+            continue
+        print(f"{result['shape']:<10}{result['engine']:<22}{result['items']:>8}"
+              f"{result['seconds']:>10.3f}{result['calls']:>8}{result['round_trips']:>10}"
+              + (f"{result['peak_bytes'] / 2 ** 20:>9.1f}" if result['peak_bytes'] is not None
+                 else f"{'-':>9}"))
+
+    settings = {'size': args.size, 'latency': args.latency, 'workers': args.workers,
+                'repeat': args.repeat, 'emulator': args.emulator,
+                'startup_runs': args.startup_runs}
+    if args.emulator and args.transport != 'httplib2':
+        settings['transport'] = args.transport
+    # Read the baseline first, it may be the file this run is about to overwrite
+    baseline = json.loads(Path(args.compare).read_text(encoding='utf-8')) if args.compare else None
+    print(f"Results written to {save_results(results, settings, args.results_dir)}")
+
+    if baseline:
+        if baseline.get('settings') != settings:
+            print(f"WARNING: baseline settings differ: {baseline.get('settings')}")
+        regressions = compare_results(results, baseline['results'], args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {baseline['commit']}.")
+
+if __name__ == '__main__':
+    main()
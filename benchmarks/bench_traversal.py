@@ -0,0 +1,62 @@
+'''
+Compares the sequential recursive counters with the snapshot traversal engines.
+
+Usage: python -m benchmarks.bench_traversal [--latency SECONDS] [--workers N]
+'''
+import time
+import argparse
+from gcp.copy_folder import count_child_objects
+from gcp.listing import MIME_FOLDER
+from gcp.snapshot import build_tree_snapshot
+from benchmarks.fake_drive import FakeDrive, build_tree
+
+# Define a function to run the pre-snapshot sequential path (assessments 1 & 2)
+def sequential_report(root_id, drive):
+    """
+    Produces the assessment 2 rows the way main() used to: one recursive walk per folder row.
+    """
+    total_num_files, total_num_folders = count_child_objects(root_id, drive)
+    rows = [['TOTAL', total_num_files, total_num_folders]]
+    for folder_id in drive.children[root_id]:
+        folder = drive.items[folder_id]
+        if folder['mimeType'] == MIME_FOLDER:
+            rows.append([folder['name'], *count_child_objects(folder_id, drive)])
+    return rows
+
+def main(argv=None):
+    """
+    Runs every engine against the same synthetic tree and prints wall time and API calls.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--depth', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    tree = build_tree(FakeDrive(), depth=args.depth)
+    engines = {
+        'sequential': lambda drive: sequential_report('root', drive),
+        'recursive': lambda drive: build_tree_snapshot('root', drive).folder_report(),
+        'bfs': lambda drive: build_tree_snapshot('root', drive, traversal='bfs').folder_report(),
+        'concurrent': lambda drive: build_tree_snapshot(
+            'root', drive, traversal='concurrent', service_factory=lambda: drive,
+            max_workers=args.workers).folder_report(),
+        'corpus': lambda drive: build_tree_snapshot('root', drive, traversal='corpus').folder_report(),
+    }
+
+    print(f"{'engine':<12}{'seconds':>10}{'calls':>8}{'speedup':>9}")
+    baseline = None
+    expected = None
+    for name, engine in engines.items():
+        drive = FakeDrive(latency=args.latency)
+        drive.items, drive.children = tree.items, tree.children
+        started = time.perf_counter()
+        rows = engine(drive)
+        elapsed = time.perf_counter() - started
+        baseline = baseline or elapsed
+        expected = expected or sorted(map(tuple, rows))
+        assert sorted(map(tuple, rows)) == expected, f'{name} report differs'
+        print(f"{name:<12}{elapsed:>10.2f}{sum(drive.calls.values()):>8}{baseline / elapsed:>8.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+'''
+A local HTTP emulator of the subset of the Drive v3 API the tool uses, with
+simulated latency, per-user rate limits and random server errors.
+
+It serves files.list (with q parsing and pagination), files.get, files.copy,
+files.create, changes.getStartPageToken, changes.list and batch requests from
+a FakeDrive, over a real HTTP stack, so transport, batching and connection
+reuse are exercised offline.
+
+Usage: python -m benchmarks.emulator [--port 8080] [--shape balanced] [--size N]
+                                     [--latency SECONDS] [--rate-limit N] [--error-rate P]
+
+Then point the tool at it: GOOGLE_DRIVE_API_ENDPOINT=http://127.0.0.1:8080/
+'''
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+import urllib.parse
+from http import HTTPStatus
+from collections import Counter
+from email.parser import FeedParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from benchmarks.fake_drive import MIME_FOLDER, SHAPES, FakeDrive
+
+FILES_PATH = '/drive/v3/files'
+CHANGES_PATH = '/drive/v3/changes'
+BATCH_PATH = '/batch/drive/v3'
+
+# Largest page the Drive API returns
+MAX_PAGE_SIZE = 1000
+# Seconds a rate-limited client is asked to wait (429 responses only)
+RETRY_AFTER_SECONDS = 1
+
+# Error reasons, as reported in error.errors[].reason by the Drive API
+ERROR_REASONS = {
+    400: 'badRequest',
+    403: 'userRateLimitExceeded',
+    404: 'notFound',
+    429: 'rateLimitExceeded',
+    500: 'backendError',
+    503: 'backendError',
+}
+
+# Define a function to build a Drive error response
+def error_response(status, message):
+    """
+    Returns the JSON body of a Drive API error.
+
+    Args:
+        status (int): The HTTP status.
+        message (str): The error message.
+
+    Returns:
+        response (dict): The error body, with its reason in error.errors.
+    """
+    domain = 'usageLimits' if status in (403, 429) else 'global'
+    return {'error': {'code': status, 'message': message, 'errors': [
+        {'domain': domain, 'reason': ERROR_REASONS.get(status, 'error'), 'message': message}]}}
+
+class TokenBucket:
+    """
+    Per-user token buckets: every user may make rate calls per second, in bursts of up to burst.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst or rate
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, user):
+        """
+        Takes one token from the user's bucket.
+
+        Args:
+            user (str): The user key, e.g. the Authorization header.
+
+        Returns:
+            bool: False if the user is over the limit.
+        """
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self._buckets.get(user, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[user] = (tokens - allowed, now)
+        return allowed
+
+class DriveEmulator:
+    """
+    An HTTP server emulating the Drive v3 API on top of a FakeDrive.
+
+    Every API call, including each call of a batch, counts against the caller's
+    rate limit and may fail with a random server error, like the real service.
+
+    Attributes:
+        drive (FakeDrive): The emulated Drive contents.
+        latency (float): The simulated time to answer every HTTP request, in seconds.
+        limiter (TokenBucket): The per-user rate limits (None for no limit).
+        rate_limit_status (int): The status of rate-limited calls, 403 or 429.
+        error_rate (float): The probability of a 500 or 503 response for every call.
+        stats (Counter): The number of connections, requests, calls, batches and faults.
+    """
+
+    def __init__(self, drive=None, host='127.0.0.1', port=0, latency=0.0, rate_limit=None,
+                 burst=None, rate_limit_status=403, error_rate=0.0, seed=None):
+        self.drive = drive if drive is not None else FakeDrive()
+        self.latency = latency
+        self.limiter = TokenBucket(rate_limit, burst) if rate_limit else None
+        self.rate_limit_status = rate_limit_status
+        self.error_rate = error_rate
+        self.stats = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        handler = type('BoundEmulatorHandler', (EmulatorHandler,), {'emulator': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        """
+        The root URL to pass to create_drive_service, e.g. 'http://127.0.0.1:8080/'.
+        """
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """
+        Serves requests on a background thread.
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving and closes the socket.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, key, amount=1):
+        """
+        Adds to a statistic (thread-safe).
+        """
+        with self._lock:
+            self.stats[key] += amount
+
+    def handle(self, method, target, body, user):
+        """
+        Answers one API call, after applying the rate limit and random errors.
+
+        Args:
+            method (str): The HTTP method.
+            target (str): The path and query string.
+            body (dict): The decoded JSON body.
+            user (str): The user key of the rate limit.
+
+        Returns:
+            status (int): The HTTP status.
+            headers (dict): The extra response headers.
+            response (dict): The JSON response.
+        """
+        self.count('calls')
+        if self.limiter and not self.limiter.allow(user):
+            self.count('rate_limited')
+            headers = {}
+            if self.rate_limit_status == 429:
+                headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+            return self.rate_limit_status, headers, error_response(
+                self.rate_limit_status, 'User rate limit exceeded.')
+        with self._lock:
+            failed = self.error_rate and self._random.random() < self.error_rate
+            status = self._random.choice((500, 503))
+        if failed:
+            self.count('server_errors')
+            return status, {}, error_response(status, 'Backend error.')
+        try:
+            return 200, {}, self.route(method, target, body)
+        except KeyError as error:
+            return 404, {}, error_response(404, f'File not found: {error}.')
+        except (AttributeError, TypeError, ValueError) as error:
+            return 400, {}, error_response(400, f'Bad request: {error}.')
+
+    def route(self, method, target, body):
+        """
+        Dispatches an API call to the FakeDrive.
+
+        Args:
+            method (str): The HTTP method.
+            target (str): The path and query string.
+            body (dict): The decoded JSON body.
+
+        Returns:
+            response (dict): The JSON response.
+        """
+        parsed = urllib.parse.urlsplit(target)
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        page_size = min(int(params.get('pageSize', 100)), MAX_PAGE_SIZE)
+        drive = self.drive
+        if parsed.path == FILES_PATH:
+            if method == 'GET':
+                return drive.list_items(params.get('q', ''), page_size, params.get('pageToken'),
+                                        params.get('orderBy'))
+            if method == 'POST':
+                return drive.create_item(body)
+        elif parsed.path.startswith(FILES_PATH + '/'):
+            file_id, _, action = parsed.path[len(FILES_PATH) + 1:].partition('/')
+            item = drive.items[urllib.parse.unquote(file_id)]
+            if method == 'GET' and not action:
+                return dict(item)
+            if method == 'POST' and action == 'copy':
+                return drive.create_item(dict(item, **body))
+        elif parsed.path == CHANGES_PATH + '/startPageToken' and method == 'GET':
+            return {'startPageToken': str(len(drive.change_log))}
+        elif parsed.path == CHANGES_PATH and method == 'GET':
+            return drive.list_changes(params['pageToken'], page_size)
+        raise ValueError(f'{method} {parsed.path} is not emulated')
+
+    def handle_batch(self, content_type, payload, user):
+        """
+        Answers a multipart/mixed batch request, one handle() call per part.
+
+        Args:
+            content_type (str): The Content-Type header, with the boundary.
+            payload (str): The request body.
+            user (str): The user key of the outer request.
+
+        Returns:
+            content_type (str): The Content-Type of the multipart response.
+            body (str): The multipart response.
+        """
+        self.count('batches')
+        parser = FeedParser()
+        parser.feed(f'Content-Type: {content_type}\r\n\r\n{payload}')
+        boundary = f'batch_{uuid.uuid4().hex}'
+        parts = []
+        for part in parser.close().get_payload():
+            request_text = part.get_payload().replace('\r\n', '\n')
+            head, _, body = request_text.partition('\n\n')
+            request_line, *header_lines = head.split('\n')
+            method, target, _ = request_line.split(' ', 2)
+            headers = dict(line.split(': ', 1) for line in header_lines if ': ' in line)
+            headers = {key.lower(): value for key, value in headers.items()}
+            status, extra_headers, response = self.handle(
+                method, target, json.loads(body) if body.strip() else {},
+                headers.get('authorization', user))
+            response_head = ''.join(f'{key}: {value}\r\n' for key, value in extra_headers.items())
+            parts.append(f'--{boundary}\r\nContent-Type: application/http\r\n'
+                         f'Content-ID: <response-{part["Content-ID"][1:-1]}>\r\n\r\n'
+                         f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'
+                         f'Content-Type: application/json; charset=UTF-8\r\n{response_head}\r\n'
+                         f'{json.dumps(response)}\r\n')
+        return f'multipart/mixed; boundary={boundary}', ''.join(parts) + f'--{boundary}--\r\n'
+
+class EmulatorHandler(BaseHTTPRequestHandler):
+    """
+    Answers the HTTP requests of a DriveEmulator, keeping connections alive.
+    """
+    protocol_version = 'HTTP/1.1'
+    emulator = None
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately - don't let Nagle delay the body
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.emulator.count('connections')
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Answers a GET request.
+        """
+        self.dispatch('GET')
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Answers a POST request.
+        """
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        """
+        Reads the request, waits for the simulated latency and writes the response.
+        """
+        payload = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        self.emulator.count('requests')
+        if self.emulator.latency:
+            time.sleep(self.emulator.latency)
+        user = self.headers.get('Authorization', 'anonymous')
+        headers = {}
+        if method == 'POST' and urllib.parse.urlsplit(self.path).path == BATCH_PATH:
+            status = 200
+            content_type, body = self.emulator.handle_batch(self.headers['Content-Type'], payload,
+                                                            user)
+        elif self.headers.get('X-HTTP-Method-Override'):
+            # The client sends long GET URLs as a POST with the query string as the body
+            status, headers, response = self.emulator.handle(
+                self.headers['X-HTTP-Method-Override'], f'{self.path}?{payload}', {}, user)
+            content_type, body = 'application/json; charset=UTF-8', json.dumps(response)
+        else:
+            try:
+                request_body = json.loads(payload) if payload.strip() else {}
+            except ValueError:
+                request_body = None
+            status, headers, response = self.emulator.handle(method, self.path, request_body,
+                                                             user)
+            content_type, body = 'application/json; charset=UTF-8', json.dumps(response)
+
+        data = body.encode('utf-8')
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """
+        Keeps the console quiet - see DriveEmulator.stats for the traffic.
+        """
+
+# Define a function to create a drive with a source tree and an empty destination
+def build_emulated_drive(shape='balanced', size=1000):
+    """
+    Fills a FakeDrive with a synthetic source tree 'root' and an empty folder 'dest'.
+
+    Args:
+        shape (str): The name of the tree shape in SHAPES.
+        size (int): The approximate number of items of the source tree.
+
+    Returns:
+        drive (FakeDrive): The populated fake.
+    """
+    drive = FakeDrive()
+    drive.add_item('root', 'Source', MIME_FOLDER, 'my-drive')
+    drive.add_item('dest', 'Destination', MIME_FOLDER, 'my-drive')
+    return SHAPES[shape](drive, size)
+
+def main(argv=None):
+    """
+    Serves an emulated Drive until interrupted.
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--shape', choices=list(SHAPES), default='balanced')
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, help='Calls per second and user.')
+    parser.add_argument('--burst', type=float, help='Calls a user may make at once.')
+    parser.add_argument('--rate-limit-status', type=int, choices=[403, 429], default=403)
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Probability of a 500 or 503 response for every call.')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    emulator = DriveEmulator(build_emulated_drive(args.shape, args.size), args.host, args.port,
+                             args.latency, args.rate_limit, args.burst, args.rate_limit_status,
+                             args.error_rate, args.seed)
+    print(f"Emulating Drive at {emulator.url} ({len(emulator.drive.items)} items)")
+    print(f"export GOOGLE_DRIVE_API_ENDPOINT={emulator.url}")
+    print("export GOOGLE_DRIVE_SOURCE_FOLDER_ID=root GOOGLE_DRIVE_DESTINATION_FOLDER_ID=dest")
+    try:
+        emulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.server.server_close()
+        print(f"Served: {dict(emulator.stats)}")
+
+if __name__ == '__main__':
+    main()
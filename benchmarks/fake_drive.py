@@ -0,0 +1,534 @@
+'''
+An in-process fake of the Drive v3 files resource with simulated per-call latency,
+pagination, batch requests and synthetic trees of configurable shapes.
+'''
+import re
+import time
+import operator
+import functools
+import itertools
+import threading
+from collections import Counter, defaultdict
+
+MIME_FOLDER = 'application/vnd.google-apps.folder'
+
+PARENT_PATTERN = re.compile(r"'([^']+)' in parents")
+# Tokens of the query language: string literals, operators and parentheses, words
+QUERY_TOKEN = re.compile(r"\s*(?:('(?:[^'\\]|\\.)*')|(!=|<=|>=|=|<|>|\(|\))|(\w+))")
+QUERY_FIELDS = ('mimeType', 'name', 'modifiedTime', 'trashed')
+QUERY_COMPARISONS = {'=': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+                     '>': operator.gt, '>=': operator.ge}
+
+# Define a function to split a query into tokens
+def tokenize_query(query):
+    """
+    Splits a files.list query into string literals (unescaped), operators and words.
+    """
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = QUERY_TOKEN.match(query, position)
+        if not match:
+            raise ValueError(f"Unsupported query: {query}")
+        literal, symbol, word = match.groups()
+        if literal is not None:
+            tokens.append(('literal', re.sub(r"\\(.)", r"\1", literal[1:-1])))
+        else:
+            tokens.append(('symbol', symbol) if symbol else ('word', word))
+        position = match.end()
+    return tokens
+
+# Define a function to compile a query into a predicate on items
+@functools.lru_cache(maxsize=1024)
+def compile_query(query):
+    """
+    Compiles the subset of the Drive query language the tool sends into a predicate.
+
+    Supports 'ID' in parents, comparisons of mimeType, name, modifiedTime and
+    trashed, FIELD contains 'TEXT', and, or, not and parentheses.
+    """
+    tokens = tokenize_query(query)
+    position = 0
+
+    def take(*expected):
+        nonlocal position
+        if position >= len(tokens) or (expected and tokens[position][1] not in expected):
+            raise ValueError(f"Unsupported query: {query}")
+        position += 1
+        return tokens[position - 1]
+
+    def peek():
+        return tokens[position][1] if position < len(tokens) else None
+
+    def disjunction():
+        terms = [conjunction()]
+        while peek() == 'or':
+            take()
+            terms.append(conjunction())
+        return terms[0] if len(terms) == 1 else lambda item: any(term(item) for term in terms)
+
+    def conjunction():
+        factors = [factor()]
+        while peek() == 'and':
+            take()
+            factors.append(factor())
+        return (factors[0] if len(factors) == 1
+                else lambda item: all(factor(item) for factor in factors))
+
+    def factor():
+        if peek() == 'not':
+            take()
+            negated = factor()
+            return lambda item: not negated(item)
+        if peek() == '(':
+            take()
+            inner = disjunction()
+            take(')')
+            return inner
+        kind, value = take()
+        if kind == 'literal':
+            take('in')
+            take('parents')
+            return lambda item: value in item.get('parents', [])
+        if value not in QUERY_FIELDS:
+            raise ValueError(f"Unsupported query field {value}: {query}")
+        field = value
+        _, symbol = take('contains', *QUERY_COMPARISONS)
+        _, operand = take()
+        if field == 'trashed':
+            expected = operand == 'true'
+            return lambda item: bool(item.get('trashed')) == expected
+        if symbol == 'contains' and field == 'name':
+            # Drive only matches names by prefix
+            return lambda item: item.get(field, '').lower().startswith(operand.lower())
+        if symbol == 'contains':
+            return lambda item: operand.lower() in item.get(field, '').lower()
+        compare = QUERY_COMPARISONS[symbol]
+        # Timestamps are stored with milliseconds, queried to the second
+        return lambda item: compare(item.get(field, '')[:len(operand)] if field == 'modifiedTime'
+                                    else item.get(field, ''), operand)
+
+    if not tokens:
+        return lambda item: True
+    predicate = disjunction()
+    if position != len(tokens):
+        raise ValueError(f"Unsupported query: {query}")
+    return predicate
+
+class FakeRequest:
+    """
+    A deferred call, mirroring googleapiclient.http.HttpRequest.execute().
+    """
+
+    def __init__(self, drive, method, handler):
+        self.drive = drive
+        self.method = method
+        self.methodId = f'drive.{method}' # pylint: disable=invalid-name
+        self.handler = handler
+
+    def execute(self, **_kwargs):
+        """
+        Sleeps for the simulated latency, counts the call and returns the response.
+
+        Returns:
+            response (dict): The decoded response.
+        """
+        self.drive.record_call(self.method, round_trip=True)
+        if self.drive.latency:
+            time.sleep(self.drive.latency)
+        return self.handler()
+
+class FakeBatch:
+    """
+    A batch request, mirroring googleapiclient.http.BatchHttpRequest: one round trip for all calls.
+    """
+
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        """
+        Queues a request under request_id.
+        """
+        self.requests.append((request_id, request))
+
+    def execute(self, **_kwargs):
+        """
+        Sleeps for the latency of one round trip and calls back with every response.
+        """
+        self.drive.record_call('batch', round_trip=True)
+        if self.drive.latency:
+            time.sleep(self.drive.latency)
+        for request_id, request in self.requests:
+            self.drive.record_call(request.method)
+            self.callback(request_id, request.handler(), None)
+
+class FakeFiles:
+    """
+    The files() collection of a FakeDrive.
+    """
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q='', pageSize=100, pageToken=None, orderBy=None,  # pylint: disable=invalid-name
+             **_kwargs):
+        """
+        Lists the items matching a (subset of the) Drive query language.
+        """
+        return FakeRequest(self.drive, 'files.list',
+                           lambda: self.drive.list_items(q, pageSize, pageToken, orderBy))
+
+    def get(self, fileId, **_kwargs):  # pylint: disable=invalid-name
+        """
+        Returns the metadata of a single item.
+        """
+        # Parents that were never added are folders of My Drive
+        return FakeRequest(self.drive, 'files.get', lambda: dict(self.drive.items.get(
+            fileId, {'id': fileId, 'name': fileId, 'mimeType': MIME_FOLDER})))
+
+    def copy(self, fileId, body, **_kwargs):  # pylint: disable=invalid-name
+        """
+        Copies a file into the folders listed in body['parents'].
+        """
+        def handler():
+            source = self.drive.items[fileId]
+            return self.drive.create_item(dict(source, **body))
+        return FakeRequest(self.drive, 'files.copy', handler)
+
+    def create(self, body, **_kwargs):
+        """
+        Creates a file or folder from its metadata.
+        """
+        return FakeRequest(self.drive, 'files.create', lambda: self.drive.create_item(body))
+
+class FakeChanges:
+    """
+    The changes() collection of a FakeDrive, reporting items created through the API.
+    """
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    def getStartPageToken(self, **_kwargs):  # pylint: disable=invalid-name
+        """
+        Returns the cursor of the next change.
+        """
+        return FakeRequest(self.drive, 'changes.getStartPageToken',
+                           lambda: {'startPageToken': str(len(self.drive.change_log))})
+
+    def list(self, pageToken, pageSize=100, **_kwargs):  # pylint: disable=invalid-name
+        """
+        Lists the changes since a cursor.
+        """
+        return FakeRequest(self.drive, 'changes.list',
+                           lambda: self.drive.list_changes(pageToken, pageSize))
+
+class FakeDrive:
+    """
+    An in-memory Drive holding a folder tree, usable wherever a service object is expected.
+
+    Attributes:
+        latency (float): The simulated round-trip time of every call, in seconds.
+        items (dict): The item resources keyed by ID.
+        children (dict): The child IDs keyed by parent ID.
+        calls (Counter): The number of calls made, keyed by method (batched calls included).
+        round_trips (int): The number of HTTP requests made (a batch is one).
+        change_log (list): The IDs of the items created through the API, in order.
+    """
+
+    # Calls from several threads are serialized by a lock, so listings may be prefetched
+    thread_safe = True
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.items = {}
+        self.children = defaultdict(list)
+        self.calls = Counter()
+        self.round_trips = 0
+        self._lock = threading.Lock()
+        self._new_ids = itertools.count()
+        self._pending_queries = {}
+        self.change_log = []
+
+    def clone(self, latency=None):
+        """
+        Returns a fresh fake holding a copy of the tree, with its own counters.
+
+        Args:
+            latency (float): The latency of the clone (optional, defaults to this one's).
+
+        Returns:
+            drive (FakeDrive): The clone.
+        """
+        drive = FakeDrive(self.latency if latency is None else latency)
+        drive.items = dict(self.items)
+        drive.children = defaultdict(list, {parent_id: list(child_ids)
+                                            for parent_id, child_ids in self.children.items()})
+        return drive
+
+    def files(self):
+        """
+        Returns the files() collection.
+        """
+        return FakeFiles(self)
+
+    def changes(self):
+        """
+        Returns the changes() collection.
+        """
+        return FakeChanges(self)
+
+    def new_batch_http_request(self, callback=None):
+        """
+        Returns a new batch request.
+        """
+        return FakeBatch(self, callback)
+
+    def record_call(self, method, round_trip=False):
+        """
+        Counts one call of the given method, and one HTTP request if round_trip (thread-safe).
+        """
+        with self._lock:
+            if method != 'batch':
+                self.calls[method] += 1
+            self.round_trips += round_trip
+
+    def api_calls(self):
+        """
+        Returns the total number of API calls, counting each batched call.
+        """
+        return sum(self.calls.values())
+
+    def add_item(self, item_id, name, mime_type, parent_id, **fields):
+        """
+        Adds a file or folder under parent_id.
+        """
+        self.items[item_id] = dict(fields, id=item_id, name=name, mimeType=mime_type,
+                                   parents=[parent_id])
+        self.children[parent_id].append(item_id)
+
+    def create_item(self, metadata):
+        """
+        Adds an item with a new ID under its first parent and returns it (thread-safe).
+        """
+        with self._lock:
+            item_id = f'new{next(self._new_ids)}'
+            # Copies keep the content fields (size, md5Checksum, ...) of their source
+            fields = {key: value for key, value in metadata.items()
+                      if key not in ('id', 'name', 'mimeType', 'parents')}
+            self.add_item(item_id, metadata['name'], metadata.get('mimeType', 'text/plain'),
+                          metadata['parents'][0], **fields)
+            self.change_log.append(item_id)
+        return {'id': item_id}
+
+    def list_changes(self, page_token, page_size):
+        """
+        Returns one page of changes after page_token, with the current state of each item.
+        """
+        start = int(page_token)
+        end = min(start + page_size, len(self.change_log))
+        response = {'changes': [{'fileId': item_id, 'removed': False,
+                                 'file': dict(self.items[item_id])}
+                                for item_id in self.change_log[start:end]]}
+        if end < len(self.change_log):
+            response['nextPageToken'] = str(end)
+        else:
+            response['newStartPageToken'] = str(end)
+        return response
+
+    def count_items(self, folder_id):
+        """
+        Returns the number of files and folders below a folder, without any API call.
+        """
+        num_files = num_folders = 0
+        stack = [folder_id]
+        while stack:
+            for child_id in self.children.get(stack.pop(), []):
+                if self.items[child_id]['mimeType'] == MIME_FOLDER:
+                    num_folders += 1
+                    stack.append(child_id)
+                else:
+                    num_files += 1
+        return num_files, num_folders
+
+    def list_items(self, query, page_size, page_token, order_by=None):
+        """
+        Evaluates a files.list query and returns one page of results.
+
+        The matches of a query are kept until its last page is served, so paging
+        through a large folder costs O(items) rather than O(items * pages).
+        """
+        key = (query, order_by)
+        with self._lock:
+            matches = self._pending_queries.pop(key, None) if page_token else None
+        if matches is None:
+            matches = self.match_items(query, order_by)
+
+        start = int(page_token or 0)
+        end = start + page_size
+        response = {'files': [dict(item) for item in matches[start:end]]}
+        if end < len(matches):
+            response['nextPageToken'] = str(end)
+            with self._lock:
+                self._pending_queries[key] = matches
+        return response
+
+    def match_items(self, query, order_by=None):
+        """
+        Returns every item matching a query, in listing order.
+        """
+        parent_ids = PARENT_PATTERN.findall(query)
+        if parent_ids:
+            # An item in several of the listed folders is returned once, as by Drive
+            candidates = [self.items[child_id] for child_id in dict.fromkeys(
+                child_id for parent_id in parent_ids
+                for child_id in self.children.get(parent_id, []))]
+        else:
+            candidates = list(self.items.values())
+        predicate = compile_query(query)
+        matches = [item for item in candidates if predicate(item)]
+        if order_by:
+            matches.sort(key=lambda item: item['name'])
+        return matches
+
+# Define a function to generate a balanced synthetic tree
+def build_tree(drive, root_id='root', depth=3, folders_per_folder=4, files_per_folder=10):
+    """
+    Fills a FakeDrive with a balanced tree of folders and files under root_id.
+
+    Args:
+        drive (FakeDrive): The fake to populate.
+        root_id (str): The ID of the root folder.
+        depth (int): The number of folder levels below the root.
+        folders_per_folder (int): The number of subfolders of every non-leaf folder.
+        files_per_folder (int): The number of files in every folder.
+
+    Returns:
+        drive (FakeDrive): The populated fake.
+    """
+    level = [root_id]
+    for current_depth in range(depth + 1):
+        next_level = []
+        for parent_id in level:
+            for index in range(files_per_folder):
+                drive.add_item(f'{parent_id}-file{index}', f'file{index}.txt', 'text/plain', parent_id)
+            if current_depth == depth:
+                continue
+            for index in range(folders_per_folder):
+                folder_id = f'{parent_id}-folder{index}'
+                drive.add_item(folder_id, f'folder{index}', MIME_FOLDER, parent_id)
+                next_level.append(folder_id)
+        level = next_level
+    return drive
+
+# Define a function to generate a wide tree
+def build_wide_tree(drive, size, root_id='root', files_per_folder=9):
+    """
+    Fills a FakeDrive with one level of many small folders under root_id.
+
+    Args:
+        drive (FakeDrive): The fake to populate.
+        size (int): The approximate number of items.
+        root_id (str): The ID of the root folder.
+        files_per_folder (int): The number of files in every folder.
+
+    Returns:
+        drive (FakeDrive): The populated fake.
+    """
+    for folder_index in range(max(1, size // (files_per_folder + 1))):
+        folder_id = f'{root_id}-folder{folder_index}'
+        drive.add_item(folder_id, f'folder{folder_index}', MIME_FOLDER, root_id)
+        for index in range(files_per_folder):
+            drive.add_item(f'{folder_id}-file{index}', f'file{index}.txt', 'text/plain', folder_id)
+    return drive
+
+# Define a function to generate a deep tree
+def build_deep_tree(drive, size, root_id='root', files_per_folder=9, max_depth=500):
+    """
+    Fills a FakeDrive with chains of nested folders, each at most max_depth levels deep.
+
+    Args:
+        drive (FakeDrive): The fake to populate.
+        size (int): The approximate number of items.
+        root_id (str): The ID of the root folder.
+        files_per_folder (int): The number of files in every folder.
+        max_depth (int): The number of folders in one chain.
+
+    Returns:
+        drive (FakeDrive): The populated fake.
+    """
+    num_folders = max(1, size // (files_per_folder + 1))
+    parent_id = root_id
+    for folder_index in range(num_folders):
+        if folder_index % max_depth == 0:
+            # Start a new chain under the root
+            parent_id = root_id
+        folder_id = f'{root_id}-folder{folder_index}'
+        drive.add_item(folder_id, f'folder{folder_index}', MIME_FOLDER, parent_id)
+        for index in range(files_per_folder):
+            drive.add_item(f'{folder_id}-file{index}', f'file{index}.txt', 'text/plain', folder_id)
+        parent_id = folder_id
+    return drive
+
+# Define a function to generate a skewed tree
+def build_skewed_tree(drive, size, root_id='root', num_folders=10, hot_share=0.9):
+    """
+    Fills a FakeDrive with folders where one folder holds most of the files.
+
+    Args:
+        drive (FakeDrive): The fake to populate.
+        size (int): The approximate number of items.
+        root_id (str): The ID of the root folder.
+        num_folders (int): The number of top-level folders.
+        hot_share (float): The share of the files in the first folder.
+
+    Returns:
+        drive (FakeDrive): The populated fake.
+    """
+    num_files = max(0, size - num_folders)
+    hot_files = int(num_files * hot_share)
+    cold_files = (num_files - hot_files) // max(1, num_folders - 1)
+    for folder_index in range(num_folders):
+        folder_id = f'{root_id}-folder{folder_index}'
+        drive.add_item(folder_id, f'folder{folder_index}', MIME_FOLDER, root_id)
+        for index in range(hot_files if folder_index == 0 else cold_files):
+            drive.add_item(f'{folder_id}-file{index}', f'file{index}.txt', 'text/plain', folder_id)
+    return drive
+
+# Define a function to generate a balanced tree of about size items
+def build_balanced_tree(drive, size, root_id='root', folders_per_folder=4, files_per_folder=10):
+    """
+    Fills a FakeDrive with the deepest balanced tree (see build_tree) of at most size items.
+
+    Args:
+        drive (FakeDrive): The fake to populate.
+        size (int): The approximate number of items.
+        root_id (str): The ID of the root folder.
+        folders_per_folder (int): The number of subfolders of every non-leaf folder.
+        files_per_folder (int): The number of files in every folder.
+
+    Returns:
+        drive (FakeDrive): The populated fake.
+    """
+    depth = 0
+    num_items = files_per_folder
+    while True:
+        folders_at_level = folders_per_folder ** (depth + 1)
+        next_items = num_items + folders_at_level * (files_per_folder + 1)
+        if next_items > size:
+            break
+        num_items = next_items
+        depth += 1
+    return build_tree(drive, root_id, depth, folders_per_folder, files_per_folder)
+
+# The synthetic tree shapes, each built from an approximate number of items
+SHAPES = {
+    'balanced': build_balanced_tree,
+    'wide': build_wide_tree,
+    'deep': build_deep_tree,
+    'skewed': build_skewed_tree,
+}
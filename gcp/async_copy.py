@@ -0,0 +1,258 @@
+'''
+An asyncio copy pipeline: folders are created as soon as their parent exists and
+file copies are streamed into a bounded pool of workers as soon as their
+destination folder is known.
+'''
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from googleapiclient.errors import HttpError
+from gcp.filters import filter_fields
+from gcp.listing import MIME_FOLDER, COPY_FIELDS, ThreadLocalServices, list_files
+from gcp.ratelimit import execute_request
+from gcp.journal import KIND_FILE, KIND_FOLDER
+from gcp.progress import item_size
+
+# Default number of concurrent file copies
+DEFAULT_COPY_WORKERS = 16
+# Default number of folders listed and created concurrently
+DEFAULT_FOLDER_WORKERS = 4
+# Files waiting for a copy worker - listing pauses when this many are queued
+QUEUE_SIZE = 1000
+
+# Disable pylint for no-member at the function level
+# pylint: disable=no-member
+
+class CopyPipeline:
+    """
+    Copies a folder tree with three overlapping stages: listing, folder creation and file copies.
+
+    Blocking Drive calls run on a thread pool, each thread with its own service
+    object. The file queue is bounded, so listing stalls instead of buffering
+    the whole tree when the copy workers fall behind.
+
+    Attributes:
+        services (ThreadLocalServices): The per-thread Drive service objects.
+        copy_workers (int): The number of concurrent file copies.
+        folder_workers (int): The number of folders listed and created concurrently.
+        max_retries (int): The number of attempts for each file copy.
+        journal (CopyJournal): The checkpoint journal of completed items (optional).
+        progress (CopyProgress): The progress every copied item is counted in (optional).
+        item_filter (ItemFilter): The filter files must match to be copied (optional).
+        dedup (DuplicateIndex): The index duplicate files are handed to instead of being copied
+            (optional).
+        transfer (StreamingTransfer): The transfer files are handed to when their copy is
+            denied (optional).
+        stats (dict): The number of folders created, files copied and failures.
+    """
+
+    def __init__(self, service_factory, copy_workers=DEFAULT_COPY_WORKERS,
+                 folder_workers=DEFAULT_FOLDER_WORKERS, max_retries=1, queue_size=QUEUE_SIZE,
+                 journal=None, progress=None, item_filter=None, dedup=None, transfer=None):
+        self.services = ThreadLocalServices(service_factory)
+        self.journal = journal
+        self.progress = progress
+        self.item_filter = item_filter
+        self.dedup = dedup
+        self.transfer = transfer
+        self.copy_workers = copy_workers
+        self.folder_workers = folder_workers
+        self.max_retries = max_retries
+        self.queue_size = queue_size
+        self.stats = {'folders': 0, 'files': 0, 'failed': 0}
+        self._executor = None
+        self._folders = None
+        self._files = None
+
+    async def _call(self, function, *args):
+        """
+        Runs a blocking Drive call on the thread pool.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    def _list_children(self, src_folder_id):
+        query = f"'{src_folder_id}' in parents and trashed = false"
+        if not self.item_filter:
+            return list(list_files(self.services.get(), query, fields=COPY_FIELDS))
+        return [item for item in list_files(self.services.get(), self.item_filter.query(query),
+                                            fields=filter_fields(COPY_FIELDS, self.item_filter))
+                if self.item_filter.matches(item)]
+
+    def _create_folder(self, name, dest_parent_id):
+        metadata = {'name': name, 'parents': [dest_parent_id], 'mimeType': MIME_FOLDER}
+        return execute_request(self.services.get().files().create(body=metadata, fields='id'))['id']
+
+    def _copy_file(self, file_id, name, dest_folder_id):
+        metadata = {'name': name, 'parents': [dest_folder_id]}
+        return execute_request(self.services.get().files().copy(fileId=file_id, body=metadata,
+                                                                fields='id'))
+
+    async def _folder_worker(self):
+        """
+        Lists a source folder, queues its files and creates its subfolders.
+
+        The contents of a folder that could not be created (queued without a
+        destination) are listed and counted as failed.
+        """
+        while True:
+            src_folder_id, dest_folder_id = await self._folders.get()
+            try:
+                for item in await self._call(self._list_children, src_folder_id):
+                    if dest_folder_id is None:
+                        self._fail(item)
+                        continue
+                    done_id = self.journal.lookup(item['id']) if self.journal is not None else None
+                    if item['mimeType'] == MIME_FOLDER:
+                        new_folder_id = done_id
+                        if new_folder_id is None:
+                            try:
+                                # The parent exists, so the child folder can be created right away
+                                new_folder_id = await self._call(self._create_folder, item['name'],
+                                                                 dest_folder_id)
+                            except HttpError as error_msg:
+                                logging.error('COPY FAILED: %s: %s', item['name'], error_msg)
+                                self._fail(item)
+                                continue
+                            self.stats['folders'] += 1
+                            if self.journal is not None:
+                                self.journal.record(item['id'], new_folder_id, KIND_FOLDER)
+                            if self.progress:
+                                self.progress.advance(1)
+                        elif self.progress:
+                            self.progress.skip(1)
+                        self._folders.put_nowait((item['id'], new_folder_id))
+                    elif done_id is not None:
+                        # Copied by an interrupted run
+                        if self.progress:
+                            self.progress.skip(1, item_size(item))
+                        continue
+                    elif self.dedup and self.dedup.defer(item, dest_folder_id):
+                        # Shortcut (or skipped) once every canonical copy exists
+                        continue
+                    else:
+                        # Blocks while the copy workers are behind (backpressure)
+                        await self._files.put((item, dest_folder_id))
+            except HttpError as error_msg:
+                logging.error('COPY FAILED: folder %s: %s', src_folder_id, error_msg)
+                self.stats['failed'] += 1
+            finally:
+                self._folders.task_done()
+
+    def _fail(self, item):
+        """
+        Counts an item as failed, and queues a failed folder so its contents are counted too.
+        """
+        self.stats['failed'] += 1
+        if self.progress:
+            self.progress.fail(1)
+        if item['mimeType'] == MIME_FOLDER:
+            self._folders.put_nowait((item['id'], None))
+
+    async def _copy_worker(self):
+        """
+        Copies queued files into their destination folders.
+        """
+        while True:
+            item, dest_folder_id = await self._files.get()
+            try:
+                for retry_attempt in range(self.max_retries):
+                    try:
+                        new_file = await self._call(self._copy_file, item['id'], item['name'],
+                                                    dest_folder_id)
+                        self.stats['files'] += 1
+                        if self.journal is not None:
+                            self.journal.record(item['id'], new_file['id'], KIND_FILE)
+                        if self.progress:
+                            self.progress.advance(1, item_size(item))
+                        break
+                    except HttpError as error_msg:
+                        if retry_attempt < self.max_retries - 1:
+                            logging.error("Error copying file %s, retrying... (%d/%d)",
+                                          item['name'], retry_attempt + 1, self.max_retries)
+                        elif self.transfer and self.transfer.defer(item, dest_folder_id,
+                                                                   error_msg):
+                            # Streamed once the copy is done
+                            break
+                        else:
+                            logging.error('COPY FAILED: %s: %s', item['name'], error_msg)
+                            self.stats['failed'] += 1
+                            if self.progress:
+                                self.progress.fail(1)
+            finally:
+                self._files.task_done()
+
+    @staticmethod
+    async def _join(queue, workers):
+        """
+        Waits for a queue to drain, re-raising the error of any worker that crashed.
+        """
+        join = asyncio.create_task(queue.join())
+        await asyncio.wait([join, *workers], return_when=asyncio.FIRST_COMPLETED)
+        if not join.done():
+            join.cancel()
+            for worker in workers:
+                if worker.done():
+                    worker.result()
+        await join
+
+    async def run(self, src_folder_id, dest_folder_id):
+        """
+        Copies every child of src_folder_id into dest_folder_id.
+
+        Args:
+            src_folder_id (str): The id for the source folder.
+            dest_folder_id (str): The id for the destination folder.
+
+        Returns:
+            stats (dict): The number of folders created, files copied and failures.
+        """
+        self._folders = asyncio.Queue()
+        self._files = asyncio.Queue(maxsize=self.queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.copy_workers + self.folder_workers)
+        workers = [asyncio.create_task(self._folder_worker()) for _ in range(self.folder_workers)]
+        workers += [asyncio.create_task(self._copy_worker()) for _ in range(self.copy_workers)]
+        try:
+            self._folders.put_nowait((src_folder_id, dest_folder_id))
+            # Every folder is listed (and its files queued) before the last copy is awaited
+            await self._join(self._folders, workers)
+            await self._join(self._files, workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._executor.shutdown(wait=True)
+        return self.stats
+
+# Enable pylint for no-member again
+# pylint: enable=no-member
+
+# Define a function to run the asyncio pipeline from synchronous code
+def copy_child_objects_async(src_folder_id, dest_folder_id, service_factory,
+                             copy_workers=DEFAULT_COPY_WORKERS, max_retries=1, journal=None,
+                             progress=None, item_filter=None, dedup=None, transfer=None):
+    """
+    Copies all child objects (files and folders) from source folder to a destination folder
+    with the asyncio pipeline.
+
+    Args:
+        src_folder_id (str): The id for the source folder.
+        dest_folder_id (str): The id for the destination folder.
+        service_factory (callable): Creates a new service object for each worker thread.
+        copy_workers (int): The number of concurrent file copies.
+        max_retries=1 (int): The maximum number of times to try copying a file before giving up.
+        journal (CopyJournal): The checkpoint journal of completed items (optional).
+        progress (CopyProgress): The progress every copied item is counted in (optional).
+        item_filter (ItemFilter): The filter files must match to be copied (optional).
+        dedup (DuplicateIndex): The index duplicate files are handed to instead of being copied
+            (optional).
+        transfer (StreamingTransfer): The transfer files are handed to when their copy is
+            denied (optional).
+
+    Returns:
+        stats (dict): The number of folders created, files copied and failures.
+    """
+    pipeline = CopyPipeline(service_factory, copy_workers=copy_workers, max_retries=max_retries,
+                            journal=journal, progress=progress, item_filter=item_filter,
+                            dedup=dedup, transfer=transfer)
+    return asyncio.run(pipeline.run(src_folder_id, dest_folder_id))
@@ -0,0 +1,87 @@
+'''
+Helpers for grouping mutating Drive calls into batch HTTP requests.
+'''
+import logging
+from googleapiclient.errors import HttpError
+from gcp.metrics import method_name
+from gcp.ratelimit import default_controller, error_status, is_retryable_error
+
+# Largest number of calls the Drive API accepts in one batch request
+BATCH_SIZE = 100
+# Number of batch rounds a retryable failure is re-queued for
+BATCH_ROUNDS = 3
+
+# Disable pylint for no-member at the function level
+# pylint: disable=no-member
+
+# Define a function to execute many requests through batch HTTP requests
+def execute_batched(drive_service, requests, batch_size=BATCH_SIZE, max_rounds=BATCH_ROUNDS,
+                    controller=None):
+    """
+    Executes requests in batches of up to batch_size calls.
+
+    Each response is mapped back to the key it was queued with. Sub-requests
+    that fail with a retryable error are re-queued into the next round, after
+    the rate controller's backoff delay. If a batch request itself still
+    fails after the controller's retries, each of its calls is reported as
+    failed with that error.
+
+    Args:
+        drive_service: The Google Drive service object.
+        requests (list): The (key, request) pairs to execute, e.g. (source item, files().copy(...)).
+        batch_size (int): The maximum number of calls per batch.
+        max_rounds (int): The maximum number of rounds a failing request is attempted in.
+        controller (RateController): The rate controller (optional, defaults to the shared one).
+
+    Returns:
+        responses (list): The (key, response) pairs of the successful calls.
+        failures (list): The (key, error) pairs of the calls that failed.
+    """
+    controller = controller or default_controller
+    responses = []
+    failures = []
+    pending = list(requests)
+    for round_number in range(1, max_rounds + 1):
+        retry = []
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+
+            def callback(request_id, response, exception, chunk=chunk):
+                key, request = chunk[int(request_id)]
+                # Calls inside a batch share its latency, so only their outcome is recorded
+                controller.metrics.observe(
+                    method_name(request),
+                    200 if exception is None else error_status(exception) or 'error',
+                    retry=round_number > 1)
+                if exception is None:
+                    controller.record_success()
+                    responses.append((key, response))
+                    return
+                controller.record_error(exception)
+                if is_retryable_error(exception) and round_number < max_rounds:
+                    retry.append((key, request, exception))
+                else:
+                    failures.append((key, exception))
+
+            batch = drive_service.new_batch_http_request(callback=callback)
+            for index, (_, request) in enumerate(chunk):
+                controller.metrics.meter(request)
+                batch.add(request, request_id=str(index))
+            try:
+                controller.call(batch.execute)
+            except HttpError as error_msg:
+                logging.error('BATCH FAILED: %d requests: %s', len(chunk), error_msg)
+                failures.extend((key, error_msg) for key, _ in chunk)
+
+        if not retry:
+            break
+        delay = max(controller.backoff_delay(round_number - 1, error) for _, _, error in retry)
+        logging.info("Re-queueing %d failed batch requests in %.1fs (round %d/%d)",
+                     len(retry), delay, round_number + 1, max_rounds)
+        controller.metrics.observe_backoff('batch', delay)
+        controller.sleep(delay)
+        pending = [(key, request) for key, request, _ in retry]
+    return responses, failures
+
+# Enable pylint for no-member again
+# pylint: enable=no-member
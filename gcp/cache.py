@@ -0,0 +1,393 @@
+'''
+An optional on-disk cache of files.list and files.get responses, so repeated reports cost almost no API calls.
+'''
+import re
+import json
+import time
+import sqlite3
+import threading
+
+# Default location of the cache
+CACHE_PATH = './outputs/metadata-cache.sqlite3'
+# Responses older than this are fetched again
+CACHE_TTL_SECONDS = 3600
+# Least recently used responses are evicted above this total size
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Folder IDs a listing depends on, e.g. "'abc' in parents and trashed = false"
+PARENT_QUERY = re.compile(r"'([^']+)' in parents")
+
+# Define a function to build the cache key of a request
+def cache_key(method, kwargs):
+    """
+    Returns the cache key of a request: the method and its sorted parameters.
+
+    Args:
+        method (str): The name of the method, e.g. 'list'.
+        kwargs (dict): The request parameters.
+
+    Returns:
+        key (str): The cache key.
+    """
+    return method + ':' + json.dumps(kwargs, sort_keys=True, default=str)
+
+class MetadataCache:
+    """
+    A SQLite cache of Drive metadata responses with a TTL and size-bounded LRU eviction.
+
+    Every entry records the folder IDs it depends on, so writes to a folder
+    invalidate every cached listing (and page) of it.
+
+    Attributes:
+        path (str): The path to the SQLite database.
+        ttl (float): The number of seconds an entry stays valid.
+        max_bytes (int): The total size of stored responses that triggers eviction.
+        stats (dict): The number of hits, misses, evictions and invalidations.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL_SECONDS, max_bytes=CACHE_MAX_BYTES,
+                 clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        self._lock = threading.Lock()
+        self._item_folders = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, '
+                                 'response TEXT, size INTEGER, created REAL, accessed REAL)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS entry_folders '
+                                 '(key TEXT, folder_id TEXT)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS entry_folders_folder '
+                                 'ON entry_folders (folder_id)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS entry_folders_key '
+                                 'ON entry_folders (key)')
+        self._connection.commit()
+        self._total_bytes = self._connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def get(self, key):
+        """
+        Returns a cached response, or None if it is missing or expired.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            response (dict): The cached response.
+        """
+        now = self.clock()
+        with self._lock:
+            row = self._connection.execute('SELECT response, created FROM entries WHERE key = ?',
+                                           (key,)).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                self.stats['misses'] += 1
+                return None
+            self._connection.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+            self.stats['hits'] += 1
+        return json.loads(row[0])
+
+    def put(self, key, response, folder_ids):
+        """
+        Stores a response, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key (str): The cache key.
+            response (dict): The response to store.
+            folder_ids (list): The IDs of the folders the response depends on.
+        """
+        data = json.dumps(response)
+        now = self.clock()
+        with self._lock, self._connection:
+            self._delete([key])
+            self._connection.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?)',
+                                     (key, data, len(data), now, now))
+            self._connection.executemany('INSERT INTO entry_folders VALUES (?, ?)',
+                                         [(key, folder_id) for folder_id in folder_ids])
+            self._total_bytes += len(data)
+            self._evict()
+
+    def remember_parents(self, folder_id, items):
+        """
+        Remembers the folder of each listed item, so later writes to the item invalidate it.
+
+        Args:
+            folder_id (str): The ID of the folder that was listed.
+            items (list): The listed file resources.
+        """
+        with self._lock:
+            for item in items:
+                self._item_folders[item['id']] = folder_id
+
+    def invalidate(self, folder_id):
+        """
+        Removes every entry that depends on a folder.
+
+        Args:
+            folder_id (str): The ID of the folder.
+        """
+        with self._lock, self._connection:
+            keys = [row[0] for row in self._connection.execute(
+                'SELECT key FROM entry_folders WHERE folder_id = ?', (folder_id,))]
+            self.stats['invalidations'] += len(keys)
+            self._delete(keys)
+
+    def invalidate_item(self, item_id):
+        """
+        Removes every entry that depends on an item or on the folder it was listed in.
+
+        Args:
+            item_id (str): The ID of the file or folder.
+        """
+        self.invalidate(item_id)
+        folder_id = self._item_folders.get(item_id)
+        if folder_id is not None:
+            self.invalidate(folder_id)
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM entries')
+            self._connection.execute('DELETE FROM entry_folders')
+            self._total_bytes = 0
+
+    def close(self):
+        """
+        Commits pending access times and closes the database.
+        """
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def _delete(self, keys):
+        for key in keys:
+            row = self._connection.execute('SELECT size FROM entries WHERE key = ?',
+                                           (key,)).fetchone()
+            if row is not None:
+                self._total_bytes -= row[0]
+                self._connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self._connection.execute('DELETE FROM entry_folders WHERE key = ?', (key,))
+
+    def _evict(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        # Collect the least recently used entries until enough space would be freed
+        keys = []
+        excess = self._total_bytes - self.max_bytes
+        for key, size in self._connection.execute('SELECT key, size FROM entries ORDER BY accessed'):
+            if excess <= 0:
+                break
+            keys.append(key)
+            excess -= size
+        self.stats['evictions'] += len(keys)
+        self._delete(keys)
+
+class CachedRequest:
+    """
+    A request whose execute() is answered from the cache when possible.
+
+    Every other attribute (methodId, postproc, ...) is the wrapped request's,
+    so metrics see the Drive method and the real response handler.
+    """
+
+    def __init__(self, request, cache, key, folder_ids):
+        self.request = request
+        self.cache = cache
+        self.key = key
+        self.folder_ids = folder_ids
+
+    def __getattr__(self, name):
+        return getattr(self.request, name)
+
+    @property
+    def postproc(self):
+        """
+        The response handler of the wrapped request.
+        """
+        return self.request.postproc
+
+    @postproc.setter
+    def postproc(self, postproc):
+        self.request.postproc = postproc
+
+    def lookup(self):
+        """
+        Returns the cached response, or None if the request has to be executed.
+        """
+        response = self.cache.get(self.key)
+        if response is not None:
+            self._remember_parents(response)
+        return response
+
+    def fetch(self, *args, **kwargs):
+        """
+        Executes the wrapped request and caches its response.
+        """
+        response = self.request.execute(*args, **kwargs)
+        self.cache.put(self.key, response, self.folder_ids)
+        self._remember_parents(response)
+        return response
+
+    def execute(self, *args, **kwargs):
+        """
+        Returns the cached response, or executes the request and caches its response.
+        """
+        response = self.lookup()
+        if response is None:
+            response = self.fetch(*args, **kwargs)
+        return response
+
+    def _remember_parents(self, response):
+        if len(self.folder_ids) == 1 and 'files' in response:
+            self.cache.remember_parents(self.folder_ids[0], response['files'])
+
+class WriteRequest:
+    """
+    A write request that invalidates cached responses once it succeeds.
+    """
+
+    def __init__(self, request, invalidate):
+        self.request = request
+        self.invalidate = invalidate
+
+    def __getattr__(self, name):
+        return getattr(self.request, name)
+
+    def execute(self, *args, **kwargs):
+        """
+        Executes the request, then invalidates the responses it made stale.
+        """
+        response = self.request.execute(*args, **kwargs)
+        self.invalidate()
+        return response
+
+# Define a function to make a write request invalidate the cache when it executes
+def invalidate_on_success(request, invalidate):
+    """
+    Makes a write request call invalidate once its response arrives.
+
+    API requests hand every successful response to their response handler
+    (postproc), whether they are executed alone or inside a batch, so the
+    handler is wrapped in place. Other requests are wrapped in a WriteRequest.
+
+    Args:
+        request: The write request, e.g. files().copy(...).
+        invalidate (function): Removes the cached responses the write makes stale.
+
+    Returns:
+        request: The request to execute.
+    """
+    # The Drive client is loaded by then, the cache module itself does not need it
+    from googleapiclient.http import HttpRequest  # pylint: disable=import-outside-toplevel
+    if not isinstance(request, HttpRequest):
+        return WriteRequest(request, invalidate)
+    postproc = request.postproc
+    def invalidating_postproc(resp, content):
+        invalidate()
+        return postproc(resp, content)
+    request.postproc = invalidating_postproc
+    return request
+
+class CachedFiles:
+    """
+    The files() resource of a cached service: reads are cached, writes invalidate when they run.
+    """
+
+    def __init__(self, files_resource, cache):
+        self._files = files_resource
+        self._cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self._files, name)
+
+    def list(self, **kwargs):
+        """
+        Returns a cached files.list request, keyed by its query and page.
+
+        Listings without a parent clause (e.g. of a whole drive) cannot be
+        invalidated by folder, so they are not cached.
+        """
+        folder_ids = PARENT_QUERY.findall(kwargs.get('q', ''))
+        if not folder_ids:
+            return self._files.list(**kwargs)
+        return CachedRequest(self._files.list(**kwargs), self._cache, cache_key('list', kwargs),
+                             folder_ids)
+
+    def get(self, **kwargs):
+        """
+        Returns a cached files.get request (media downloads are not cached).
+        """
+        return CachedRequest(self._files.get(**kwargs), self._cache, cache_key('get', kwargs),
+                             [kwargs['fileId']])
+
+    def copy(self, **kwargs):
+        """
+        Returns a files.copy request that invalidates the listings of the destination folders.
+        """
+        return invalidate_on_success(self._files.copy(**kwargs),
+                                     lambda: self._invalidate_parents(kwargs))
+
+    def create(self, **kwargs):
+        """
+        Returns a files.create request that invalidates the listings of the parent folders.
+        """
+        return invalidate_on_success(self._files.create(**kwargs),
+                                     lambda: self._invalidate_parents(kwargs))
+
+    def update(self, **kwargs):
+        """
+        Returns a files.update request that invalidates the item and the folders it moves between.
+        """
+        def invalidate():
+            self._cache.invalidate_item(kwargs['fileId'])
+            for param in ('addParents', 'removeParents'):
+                for parent_id in filter(None, kwargs.get(param, '').split(',')):
+                    self._cache.invalidate(parent_id)
+        return invalidate_on_success(self._files.update(**kwargs), invalidate)
+
+    def delete(self, **kwargs):
+        """
+        Returns a files.delete request that invalidates the item and the folder it was listed in.
+        """
+        return invalidate_on_success(self._files.delete(**kwargs),
+                                     lambda: self._cache.invalidate_item(kwargs['fileId']))
+
+    def _invalidate_parents(self, kwargs):
+        for parent_id in kwargs.get('body', {}).get('parents', []):
+            self._cache.invalidate(parent_id)
+
+class CachedDriveService:
+    """
+    Wraps a Drive service object so files.list and files.get responses are cached.
+
+    Every other resource and method (batches, changes, ...) is passed through.
+
+    Attributes:
+        cache (MetadataCache): The cache of responses.
+    """
+
+    def __init__(self, drive_service, cache):
+        self._service = drive_service
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self._service, name)
+
+    def files(self):
+        """
+        Returns the cached files() resource.
+        """
+        return CachedFiles(self._service.files(), self.cache)
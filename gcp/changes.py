@@ -0,0 +1,289 @@
+'''
+Incremental report refresh: a stored snapshot kept up to date from the Drive changes feed.
+'''
+import os
+import json
+import logging
+from gcp.filters import filter_fields
+from gcp.listing import MIME_FOLDER, PAGE_SIZE
+from gcp.ratelimit import execute_request
+from gcp.snapshot import (
+    SNAPSHOT_FIELDS,
+    TreeSnapshot,
+    build_tree_snapshot,
+    build_tree_snapshot_recursive,
+)
+
+# Default location of the stored snapshot and changes cursor
+REPORT_STATE_PATH = './outputs/report-state.json'
+
+# Changes in shared drives are only returned when both of these are set
+ALL_DRIVES_KWARGS = {'supportsAllDrives': True, 'includeItemsFromAllDrives': True}
+
+# Define a function to project the changed file resources like the snapshot items
+def change_fields(fields=SNAPSHOT_FIELDS):
+    """
+    Returns the changes.list projection matching a files.list projection.
+
+    Args:
+        fields (str): The files.list projection of the snapshot, e.g. 'files(id,name,mimeType)'.
+
+    Returns:
+        change_fields (str): The changes.list projection, including parents and trashed.
+    """
+    file_fields = fields[len('files('):-1].split(',')
+    for field in ('parents', 'trashed'):
+        if field not in file_fields:
+            file_fields.append(field)
+    return f"nextPageToken,newStartPageToken,changes(fileId,removed,file({','.join(file_fields)}))"
+
+# Disable pylint for no-member at the function level
+# pylint: disable=no-member
+
+# Define a function to get the current position of the changes feed
+def get_start_page_token(drive_service, drive_id=None):
+    """
+    Returns a cursor for the changes made from now on.
+
+    Args:
+        drive_service: The Google Drive service object.
+        drive_id (str): The ID of the shared drive (optional).
+
+    Returns:
+        page_token (str): The start page token.
+    """
+    token_kwargs = {'supportsAllDrives': True}
+    if drive_id:
+        token_kwargs['driveId'] = drive_id
+    response = execute_request(drive_service.changes().getStartPageToken(**token_kwargs))
+    return response['startPageToken']
+
+# Define a function to add a folder moved into the tree together with its contents
+def graft_folder(snapshot, folder, parent_ids, drive_service, fields=SNAPSHOT_FIELDS,
+                 item_filter=None):
+    """
+    Adds a folder that is new to the snapshot, listing the contents it already has.
+
+    Args:
+        snapshot (TreeSnapshot): The snapshot to update.
+        folder (dict): The folder resource.
+        parent_ids (list): The IDs of its parent folders in the snapshot.
+        drive_service: The Google Drive service object.
+        fields (str): The partial response projection for each listed item.
+        item_filter (ItemFilter): The filter files must match to be included (optional).
+    """
+    snapshot.update_item(folder, parent_ids)
+    subtree = build_tree_snapshot_recursive(folder['id'], drive_service, fields=fields,
+                                            item_filter=item_filter)
+    for item_id, item in subtree.items.items():
+        snapshot.update_item(item, subtree.parents[item_id])
+
+# Define a function to apply the changes feed to a snapshot
+def apply_changes(snapshot, drive_service, page_token, fields=SNAPSHOT_FIELDS, drive_id=None,
+                  item_filter=None):
+    """
+    Applies every change since page_token that affects the snapshot's subtree.
+
+    Changes to items outside the subtree are ignored. Items moved out of the
+    subtree or trashed are removed with everything below them, and folders moved
+    into it are listed once to pick up their existing contents.
+
+    Args:
+        snapshot (TreeSnapshot): The snapshot to update in place.
+        drive_service: The Google Drive service object.
+        page_token (str): The cursor saved with the snapshot.
+        fields (str): The files.list projection the snapshot was built with.
+        drive_id (str): The ID of the shared drive (optional).
+        item_filter (ItemFilter): The filter the snapshot was built with (optional).
+
+    Returns:
+        page_token (str): The cursor for the next refresh.
+        num_applied (int): The number of changes that affected the snapshot.
+    """
+    # The changes feed cannot be filtered on the server, so every term is checked here
+    file_fields = fields if item_filter is None else filter_fields(fields, item_filter, False)
+    list_kwargs = dict(ALL_DRIVES_KWARGS, fields=change_fields(file_fields), includeRemoved=True,
+                       pageSize=PAGE_SIZE)
+    if drive_id:
+        list_kwargs['driveId'] = drive_id
+
+    num_applied = 0
+    while True:
+        response = execute_request(drive_service.changes().list(pageToken=page_token,
+                                                                **list_kwargs))
+        for change in response.get('changes', []):
+            if apply_change(snapshot, change, drive_service, fields, item_filter):
+                num_applied += 1
+        if 'newStartPageToken' in response:
+            return response['newStartPageToken'], num_applied
+        page_token = response['nextPageToken']
+
+# Define a function to apply one change to a snapshot
+def apply_change(snapshot, change, drive_service, fields=SNAPSHOT_FIELDS, item_filter=None):
+    """
+    Applies a single entry of the changes feed to the snapshot.
+
+    Files that no longer match the filter are removed like trashed ones.
+
+    Args:
+        snapshot (TreeSnapshot): The snapshot to update in place.
+        change (dict): The change resource.
+        drive_service: The Google Drive service object.
+        fields (str): The files.list projection the snapshot was built with.
+        item_filter (ItemFilter): The filter the snapshot was built with (optional).
+
+    Returns:
+        bool: True if the snapshot was changed.
+    """
+    item_id = change['fileId']
+    file = change.get('file')
+    known = item_id in snapshot.items
+
+    if item_id == snapshot.root_id:
+        if file and not file.get('trashed'):
+            snapshot.root_name = file['name']
+        return False
+    if (change.get('removed') or file is None or file.get('trashed')
+            or (item_filter is not None and not item_filter.matches(file, listed=False))):
+        if known:
+            snapshot.remove_item(item_id)
+        return known
+
+    parent_ids = [parent_id for parent_id in file.get('parents', [])
+                  if snapshot.is_folder(parent_id)]
+    if not parent_ids:
+        # Outside the subtree - or just moved out of it
+        if known:
+            snapshot.remove_item(item_id)
+        return known
+
+    if file['mimeType'] == MIME_FOLDER and not known:
+        graft_folder(snapshot, file, parent_ids, drive_service, fields, item_filter)
+    else:
+        snapshot.update_item(file, parent_ids)
+    return True
+
+# Enable pylint for no-member again
+# pylint: enable=no-member
+
+# Define a function to drop the files a relative filter term no longer keeps
+def drop_expired(snapshot, item_filter):
+    """
+    Removes the files that aged out of the relative terms of a filter, e.g. modifiedTime>90d.
+
+    Such files stop matching without changing, so the changes feed never reports
+    them. The filter is parsed on every run, so its ages are resolved again.
+
+    Args:
+        snapshot (TreeSnapshot): The snapshot to update in place.
+        item_filter (ItemFilter): The filter the snapshot was built with.
+
+    Returns:
+        num_removed (int): The number of files removed.
+    """
+    terms = item_filter.expiring_terms
+    if not terms:
+        return 0
+    expired = [item_id for item_id, item in snapshot.items.items()
+               if item['mimeType'] != MIME_FOLDER
+               and not all(term.predicate(item) for term in terms)]
+    for item_id in expired:
+        snapshot.remove_item(item_id)
+    return len(expired)
+
+# Define a function to name the state file of the destination tree
+def destination_state_path(path=REPORT_STATE_PATH):
+    """
+    Returns the state file of the destination snapshot that goes with a source state file.
+
+    Args:
+        path (str): The path to the source state file.
+
+    Returns:
+        path (str): The path to the destination state file, e.g. report-state-destination.json.
+    """
+    root, extension = os.path.splitext(path)
+    return f'{root}-destination{extension}'
+
+# Define a function to store a snapshot with its changes cursor
+def save_report_state(snapshot, page_token, path=REPORT_STATE_PATH, fields=SNAPSHOT_FIELDS,
+                      filters=None):
+    """
+    Writes the snapshot and the changes cursor to a JSON file.
+
+    Args:
+        snapshot (TreeSnapshot): The snapshot of the source tree.
+        page_token (str): The cursor the snapshot is up to date with.
+        path (str): The path to the state file.
+        fields (str): The files.list projection the snapshot was built with.
+        filters (list): The filter terms the snapshot was built with (optional).
+    """
+    with open(path, 'w', encoding='utf-8') as state_file:
+        json.dump({'page_token': page_token, 'fields': fields, 'filters': filters or [],
+                   'snapshot': snapshot.to_dict()}, state_file)
+
+# Define a function to read a stored snapshot
+def load_report_state(path=REPORT_STATE_PATH):
+    """
+    Reads the snapshot and changes cursor written by save_report_state.
+
+    Args:
+        path (str): The path to the state file.
+
+    Returns:
+        snapshot (TreeSnapshot): The stored snapshot, or None if there is no state file.
+        page_token (str): The stored cursor, or None if there is no state file.
+        fields (str): The projection the snapshot was built with, or None if there is no state file.
+        filters (list): The filter terms the snapshot was built with, or None if there is no
+            state file.
+    """
+    if not os.path.exists(path):
+        return None, None, None, None
+    with open(path, encoding='utf-8') as state_file:
+        state = json.load(state_file)
+    return (TreeSnapshot.from_dict(state['snapshot']), state['page_token'],
+            state.get('fields', SNAPSHOT_FIELDS), state.get('filters', []))
+
+# Define a function to refresh a snapshot from the changes feed
+def refresh_snapshot(folder_id, drive_service, root_name=None, path=REPORT_STATE_PATH,
+                     traversal='recursive', **kwargs):
+    """
+    Returns an up-to-date snapshot of folder_id, traversing the tree only on the first run.
+
+    The first run takes a changes cursor, builds the snapshot with the selected
+    traversal and stores both. Later runs load the stored snapshot and apply
+    only the changes made since, drop the files that aged out of a relative
+    filter term, then store the new cursor.
+
+    Args:
+        folder_id (str): The ID of the root folder.
+        drive_service: The Google Drive service object.
+        root_name (str): The name of the root folder (optional).
+        path (str): The path to the state file.
+        traversal (str): The traversal engine for the first run (a key of TRAVERSALS).
+        **kwargs: Any additional options for the traversal engine.
+
+    Returns:
+        snapshot (TreeSnapshot): The snapshot of the folder tree.
+    """
+    fields = kwargs.get('fields', SNAPSHOT_FIELDS)
+    drive_id = kwargs.get('drive_id')
+    item_filter = kwargs.get('item_filter')
+    filters = item_filter.expressions if item_filter is not None else []
+    snapshot, page_token, stored_fields, stored_filters = load_report_state(path)
+    # A snapshot of another folder, or with other fields or filters, cannot be refreshed
+    if (snapshot is not None and snapshot.root_id == folder_id and stored_fields == fields
+            and stored_filters == filters):
+        page_token, num_applied = apply_changes(snapshot, drive_service, page_token, fields,
+                                                drive_id, item_filter)
+        num_expired = drop_expired(snapshot, item_filter) if item_filter is not None else 0
+        snapshot.root_name = root_name or snapshot.root_name
+        logging.info("REFRESHED SNAPSHOT: %d changes applied, %d files aged out", num_applied,
+                     num_expired)
+    else:
+        # Take the cursor first, so changes made during the traversal are replayed next time
+        page_token = get_start_page_token(drive_service, drive_id)
+        snapshot = build_tree_snapshot(folder_id, drive_service, root_name, traversal=traversal,
+                                       **kwargs)
+    save_report_state(snapshot, page_token, path, fields, filters)
+    return snapshot
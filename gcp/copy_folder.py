@@ -3,12 +3,26 @@ A script using the Google Drive API to create reports and copy contents between
 '''
 import os
 import csv
+import argparse
+import itertools
 import logging
 import datetime
-import pandas as pd
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError # pylint: disable=ungrouped-imports
+import urllib.parse
+# The Drive client, the auth libraries and the optional features are imported where they are
+# used, so drive-copy --help and the report functions do not pay for what a run never needs
+from googleapiclient.errors import HttpError
+from gcp.listing import (
+    MIME_FOLDER,
+    COUNT_FIELDS,
+    FOLDER_FIELDS,
+    COPY_FIELDS,
+    list_files,
+)
+from gcp.batch import BATCH_SIZE, execute_batched
+from gcp.filters import ItemFilter, filter_fields
+from gcp.ratelimit import execute_request
+from gcp.journal import KIND_FILE, KIND_FOLDER
+from gcp.progress import item_size
 
 # Define API scopes
 SCOPES = [
@@ -18,72 +32,195 @@ SCOPES = [
 
 # Environment variables
 CLIENT_ID_ENV_VAR = 'GOOGLE_DRIVE_CLIENT_ID_FILE'
+TOKEN_FILE_ENV_VAR = 'GOOGLE_DRIVE_TOKEN_FILE'
+SERVICE_ACCOUNT_ENV_VAR = 'GOOGLE_DRIVE_SERVICE_ACCOUNT_FILE'
+SUBJECT_ENV_VAR = 'GOOGLE_DRIVE_SUBJECT'
+DESTINATION_SUBJECT_ENV_VAR = 'GOOGLE_DRIVE_DESTINATION_SUBJECT'
 SOURCE_FOLDER_ID_ENV_VAR = 'GOOGLE_DRIVE_SOURCE_FOLDER_ID'
 DESTINATION_FOLDER_ID_ENV_VAR = 'GOOGLE_DRIVE_DESTINATION_FOLDER_ID'
+API_ENDPOINT_ENV_VAR = 'GOOGLE_DRIVE_API_ENDPOINT'
 
 # Script Constants
 MISSING_ENVAR_TXT = 'Missing environment variable for'
-MIME_FOLDER = 'application/vnd.google-apps.folder'
 
 # Directories and filenames
 OUTPUTS_DIRECTORY = './outputs/'
+TOKEN_FILE_PATH = os.path.join(OUTPUTS_DIRECTORY, 'token.json')
 
-# Get the current timestamp
-TIMESTAMP = datetime.datetime.now().strftime('%Y%m%d%H%M')
-
-# Create a logger for better error tracking
-LOG_FILENAME = f'gcp-{TIMESTAMP}.log'
-LOG_FILE_PATH = os.path.join(OUTPUTS_DIRECTORY, LOG_FILENAME)
+# Log file format - the timestamped log file is created by configure_logging() in main()
 LOG_FILE_FORMAT='%(asctime)s %(levelname)s %(message)s %(filename)s %(funcName)s %(lineno)d'
-logging.basicConfig(filename=LOG_FILE_PATH, level=logging.INFO, format=LOG_FILE_FORMAT)
 
 # Module-level variables will be initialized in main()
 # This prevents execution on import
 service = None  # pylint: disable=invalid-name
 
+# Create a logger for better error tracking
+def configure_logging(outputs_directory=OUTPUTS_DIRECTORY):
+    """
+    Logs to a timestamped file in the outputs directory.
+
+    Args:
+        outputs_directory (str): The directory for the log file.
+
+    Returns:
+        log_file_path (str): The path to the log file.
+    """
+    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M')
+    os.makedirs(outputs_directory, exist_ok=True)
+    log_file_path = os.path.join(outputs_directory, f'gcp-{timestamp}.log')
+    logging.basicConfig(filename=log_file_path, level=logging.INFO, format=LOG_FILE_FORMAT)
+    return log_file_path
+
+# Define a function to load saved credentials
+def load_token(token_file, api_scopes):
+    """
+    Loads saved authorized-user credentials, refreshing them silently if they expired.
+
+    Args:
+        token_file (str): The path to the saved token JSON file.
+        api_scopes (list): The list of API scopes.
+
+    Returns:
+        credentials (google.oauth2.credentials.Credentials): The valid credentials, or None
+            if there is no usable token and the user has to authorize again.
+    """
+    if not token_file or not os.path.exists(token_file):
+        return None
+    # pylint: disable=import-outside-toplevel
+    import httplib2
+    from google.auth.exceptions import RefreshError
+    from google.oauth2.credentials import Credentials
+    from google_auth_httplib2 import Request
+    # pylint: enable=import-outside-toplevel
+    saved_credentials = Credentials.from_authorized_user_file(token_file, api_scopes)
+    if not saved_credentials.has_scopes(api_scopes):
+        return None
+    if saved_credentials.valid:
+        return saved_credentials
+    if saved_credentials.expired and saved_credentials.refresh_token:
+        try:
+            # Refresh over httplib2, which the Drive client loads anyway
+            saved_credentials.refresh(Request(httplib2.Http()))
+        except RefreshError as error:
+            logging.warning("Saved token could not be refreshed: %s", error)
+            return None
+        save_token(saved_credentials, token_file)
+        return saved_credentials
+    return None
+
+# Define a function to save credentials for the next run
+def save_token(auth_credentials, token_file):
+    """
+    Saves authorized-user credentials (including the refresh token), readable only by the user.
+
+    Args:
+        auth_credentials (google.oauth2.credentials.Credentials): The authorized credentials.
+        token_file (str): The path to the token JSON file.
+    """
+    token_directory = os.path.dirname(token_file)
+    if token_directory:
+        os.makedirs(token_directory, exist_ok=True)
+    file_descriptor = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(file_descriptor, 'w', encoding='utf-8') as output_file:
+        output_file.write(auth_credentials.to_json())
+
 # Create a flow to handle the OAuth2 authentication
-def authenticate_and_authorize(client_id_file, api_scopes):
+def authenticate_and_authorize(client_id_file, api_scopes, token_file=None):
     """
     Handles OAuth2 authentication and authorization.
 
+    A saved token is used (and refreshed) if there is one, so only the first
+    run opens the browser.
+
     Args:
         client_id_file (str): The path to the client ID JSON file.
         api_scopes (list): The list of API scopes.
+        token_file (str): The path to the saved token JSON file (optional, not saved if not provided).
 
     Returns:
         credentials (google.oauth2.credentials.Credentials): The authorized credentials.
     """
+    saved_credentials = load_token(token_file, api_scopes)
+    if saved_credentials:
+        return saved_credentials
+
+    # Only needed the first time, and slow to import
+    from google_auth_oauthlib.flow import InstalledAppFlow  # pylint: disable=import-outside-toplevel
     flow = InstalledAppFlow.from_client_secrets_file(client_id_file, api_scopes)
     auth_credentials = flow.run_local_server()
 
     if auth_credentials and auth_credentials.valid:
+        if token_file:
+            save_token(auth_credentials, token_file)
         return auth_credentials
     return None
 
-def create_drive_service(valid_credentials):
+# Define a function to authenticate as a service account
+def authenticate_service_account(key_file, api_scopes, subject=None):
+    """
+    Loads service-account credentials, for unattended runs without a user token.
+
+    The access token is fetched on the first API call, so this makes no request.
+
+    Args:
+        key_file (str): The path to the service account key JSON file.
+        api_scopes (list): The list of API scopes.
+        subject (str): The user to impersonate with domain-wide delegation (optional).
+
+    Returns:
+        credentials (google.oauth2.service_account.Credentials): The service account credentials.
+    """
+    from google.oauth2 import service_account  # pylint: disable=import-outside-toplevel
+    return service_account.Credentials.from_service_account_file(
+        key_file, scopes=api_scopes, subject=subject)
+
+def create_drive_service(valid_credentials, api_endpoint=None, http=None):
     """
     Creates a Google Drive API service object.
 
     Args:
         valid_credentials (google.oauth2.credentials.Credentials): The authorized credentials.
+        api_endpoint (str): The root URL of another Drive API server, e.g. a local emulator
+            at 'http://127.0.0.1:8080/' (optional, defaults to https://www.googleapis.com/).
+        http (PooledHttp): A shared, already authorized transport (optional, defaults to a new
+            httplib2 connection for this service object).
 
     Returns:
         service (googleapiclient.discovery.Resource): The Drive API service object.
     """
-    return build('drive', 'v3', credentials=valid_credentials)
+    # pylint: disable=import-outside-toplevel
+    from googleapiclient.discovery import build
+    from googleapiclient.http import BatchHttpRequest
+    # pylint: enable=import-outside-toplevel
+    # A shared transport carries the credentials itself
+    auth = {'http': http} if http is not None else {'credentials': valid_credentials}
+    if not api_endpoint:
+        # The discovery document ships with the client library - no request is made
+        return build('drive', 'v3', static_discovery=True, cache_discovery=False, **auth)
+
+    root_url = api_endpoint.rstrip('/') + '/'
+    drive_service = build('drive', 'v3', static_discovery=True, cache_discovery=False, **auth,
+                          client_options={'api_endpoint': urllib.parse.urljoin(root_url,
+                                                                               'drive/v3/')})
+    # The client builds batch URIs from the discovery document's root URL, not the endpoint
+    batch_uri = urllib.parse.urljoin(root_url, 'batch/drive/v3')
+    drive_service.new_batch_http_request = lambda callback=None: BatchHttpRequest(
+        callback=callback, batch_uri=batch_uri)
+    return drive_service
 
 # MAGIC Constants - to improve readability & linting
 # Disable pylint for no-member at the function level
 # pylint: disable=no-member
 
 # Define a function to count files and folders
-def count_files_and_folders(folder_id, drive_service=None):
+def count_files_and_folders(folder_id, drive_service=None, item_filter=None):
     """
     Counts the number of FILES and FOLDERS in a given folder_id.
 
     Args:
         folder_id (str): The ID of the folder to count files and folders in.
         drive_service: The Google Drive service object (optional, uses global if not provided).
+        item_filter (ItemFilter): The filter files must match to be counted (optional).
 
     Returns:
         num_files (int): The total number of files in the folder.
@@ -93,26 +230,28 @@ def count_files_and_folders(folder_id, drive_service=None):
     # Count Files
     query = (f"'{folder_id}' in parents and mimeType != '{MIME_FOLDER}' "
              f"and trashed = false")
-    results = svc.files().list(q=query).execute()
-    files = results.get('files', [])
-    num_files = len(files)
+    fields = COUNT_FIELDS
+    if item_filter is not None:
+        query = item_filter.file_query(query)
+        fields = filter_fields(fields, item_filter)
+    num_files = sum(1 for item in list_files(svc, query, fields=fields)
+                    if item_filter is None or item_filter.matches(item))
     # Count Folders
     query = (f"'{folder_id}' in parents and mimeType = '{MIME_FOLDER}' "
              f"and trashed = false")
-    results = svc.files().list(q=query).execute()
-    folders = results.get('files', [])
-    num_folders = len(folders)
+    num_folders = sum(1 for _ in list_files(svc, query, fields=COUNT_FIELDS))
 
     return num_files, num_folders
 
 # Define a function to count child objects recursively
-def count_child_objects(folder_id, drive_service=None):
+def count_child_objects(folder_id, drive_service=None, item_filter=None):
     """
     Recursively counts the number of files and folders in a given folder and its subfolders.
 
     Args:
         folder_id (str): The ID of the folder to count files and folders for.
         drive_service: The Google Drive service object (optional, uses global if not provided).
+        item_filter (ItemFilter): The filter files must match to be counted (optional).
 
     Returns:
         num_files (int): The total number of files in the folder and its subfolders.
@@ -120,40 +259,101 @@ def count_child_objects(folder_id, drive_service=None):
     """
     svc = drive_service or service
     query = f"'{folder_id}' in parents and trashed = false"
-    results = svc.files().list(q=query).execute()
-    files_and_folders = results.get('files', [])
+    fields = COUNT_FIELDS
+    if item_filter is not None:
+        query = item_filter.query(query)
+        fields = filter_fields(fields, item_filter)
     num_files = 0
     num_folders = 0
+    child_folder_ids = []
 
-    for item in files_and_folders:
-        if item['mimeType'] == 'application/vnd.google-apps.folder':
-            # It's a folder, increment folder count
-            child_num_files, child_num_folders = count_child_objects(item['id'], svc)
-            num_files += child_num_files
-            num_folders += child_num_folders + 1
+    for item in list_files(svc, query, fields=fields):
+        if item_filter is not None and not item_filter.matches(item):
+            continue
+        if item['mimeType'] == MIME_FOLDER:
+            # It's a folder, increment folder count and recurse once the listing is drained
+            child_folder_ids.append(item['id'])
+            num_folders += 1
         else:
             # It's a file, increment file count
             num_files += 1
 
+    for child_folder_id in child_folder_ids:
+        child_num_files, child_num_folders = count_child_objects(child_folder_id, svc,
+                                                                 item_filter)
+        num_files += child_num_files
+        num_folders += child_num_folders
+
     return num_files, num_folders
 
 # Define a function to copy child objects recursively
-def copy_child_objects(src_folder_id, dest_folder_id, drive_service=None, max_retries=1):
+def copy_child_objects(src_folder_id, dest_folder_id, drive_service=None, max_retries=1,
+                       batch_size=BATCH_SIZE, journal=None, progress=None, item_filter=None,
+                       dedup=None, transfer=None):
     """
     Copies all child objects (files and folders) from source folder to a destination folder.
-    Includes a static retry mechanism for file copy failures.
+    Copies and folder creations are grouped into batch requests of up to batch_size calls;
+    with batch_size=1 every call is its own request, with a static retry mechanism.
+    With a journal, items already copied by an interrupted run are skipped and folders
+    it created are reused.
 
     Args:
         src_folder_id (str): The id for the source folder.
         dest_folder_id (str): The id for the destination folder.
         drive_service: The Google Drive service object (optional, uses global if not provided).
         max_retries=1 (int): The maximum number of times to retry copying a file before giving up.
+        batch_size (int): The maximum number of calls per batch request.
+        journal (CopyJournal): The checkpoint journal of completed items (optional).
+        progress (CopyProgress): The progress every copied item is counted in (optional).
+        item_filter (ItemFilter): The filter files must match to be copied (optional).
+        dedup (DuplicateIndex): The index duplicate files are handed to instead of being copied
+            (optional).
+        transfer (StreamingTransfer): The transfer files are handed to when their copy is
+            denied (optional).
     """
     svc = drive_service or service
-    # List files in the source folder
-    query = f"'{src_folder_id}' in parents"
-    results = svc.files().list(q=query).execute()
-    files = results.get('files', [])
+    # List files in the source folder (folders are recreated below, not copied)
+    query = (f"'{src_folder_id}' in parents and mimeType != '{MIME_FOLDER}' "
+             f"and trashed = false")
+    fields = COPY_FIELDS
+    if item_filter is not None:
+        query = item_filter.file_query(query)
+        fields = filter_fields(fields, item_filter)
+    files = [item for item in list_files(svc, query, fields=fields)
+             if item_filter is None or item_filter.matches(item)]
+
+    # List folders in the source folder
+    query = f"'{src_folder_id}' in parents and mimeType = '{MIME_FOLDER}' and trashed = false"
+    folders = list(list_files(svc, query, fields=FOLDER_FIELDS))
+
+    if journal is not None:
+        # Skip files an interrupted run already copied
+        done_ids = [journal.lookup(file['id']) for file in files]
+        done = [file for file, done_id in zip(files, done_ids) if done_id is not None]
+        files = [file for file, done_id in zip(files, done_ids) if done_id is None]
+        if progress is not None and done:
+            progress.skip(len(done), sum(item_size(file) for file in done))
+
+    if dedup is not None:
+        # Duplicates become shortcuts (or are skipped) once every canonical copy exists
+        files = [file for file in files if not dedup.defer(file, dest_folder_id)]
+
+    if batch_size > 1:
+        deferred = len(transfer.pending) if transfer is not None else 0
+        copies = copy_files_batched(files, dest_folder_id, svc, batch_size, journal, transfer)
+        if transfer is not None:
+            # Denied copies are counted once they are transferred
+            deferred = len(transfer.pending) - deferred
+        created = create_folders_batched(folders, dest_folder_id, svc, batch_size, journal)
+        if progress is not None:
+            progress.advance(len(copies) + len(created),
+                             sum(item_size(file) for file, _ in copies))
+            progress.fail(len(files) - len(copies) - deferred + len(folders) - len(created))
+        for folder, new_folder_id in created:
+            # Recursively copy the child objects into the new folder
+            copy_child_objects(folder['id'], new_folder_id, svc, max_retries, batch_size, journal,
+                               progress, item_filter, dedup, transfer)
+        return
 
     try:
         # Copy each file to the destination folder
@@ -163,7 +363,12 @@ def copy_child_objects(src_folder_id, dest_folder_id, drive_service=None, max_re
             for retry_attempt in range(max_retries):
                 try:
                     # Attempt to copy the file
-                    svc.files().copy(fileId=file['id'], body=file_metadata).execute()
+                    new_file = execute_request(svc.files().copy(fileId=file['id'],
+                                                                body=file_metadata))
+                    if journal is not None:
+                        journal.record(file['id'], new_file['id'], KIND_FILE)
+                    if progress is not None:
+                        progress.advance(1, item_size(file))
                     # If the copy is successful, break out of the retry loop
                     break
                 except HttpError as error_msg:
@@ -171,32 +376,111 @@ def copy_child_objects(src_folder_id, dest_folder_id, drive_service=None, max_re
                         # Log the error and retry
                         logging.error("Error copying file %s, retrying... (%d/%d)",
                                       file['name'], retry_attempt + 1, max_retries)
+                    elif transfer is not None and transfer.defer(file, dest_folder_id,
+                                                                 error_msg):
+                        # Streamed once the copy is done
+                        break
                     else:
                         # If all retries fail, log the error and move on to the next file
                         logging.error("Error copying file %s after %d retries: %s",
                                       file['name'], max_retries, error_msg)
+                        if progress is not None:
+                            progress.fail(1)
                         break
 
     except HttpError as error_msg:
         # Handle errors related to copying files
         handle_copy_error(file['name'], error_msg, svc)
 
-    # List folders in the source folder
-    query = f"'{src_folder_id}' in parents and mimeType = '{MIME_FOLDER}'"
-    results = svc.files().list(q=query).execute()
-    folders = results.get('files', [])
-
     # Recursively copy child objects to the destination folder while preserving structure
     for folder in folders:
-        # Create a new folder in the destination with the same name
-        new_folder_metadata = {
-            'name': folder['name'],
-            'parents': [dest_folder_id],
-            'mimeType': 'application/vnd.google-apps.folder'
-        }
-        new_folder = svc.files().create(body=new_folder_metadata, fields='id').execute()
+        # Reuse the folder an interrupted run already created
+        new_folder_id = journal.lookup(folder['id']) if journal is not None else None
+        if new_folder_id is None:
+            # Create a new folder in the destination with the same name
+            new_folder_metadata = {
+                'name': folder['name'],
+                'parents': [dest_folder_id],
+                'mimeType': MIME_FOLDER
+            }
+            new_folder = execute_request(svc.files().create(body=new_folder_metadata, fields='id'))
+            new_folder_id = new_folder['id']
+            if journal is not None:
+                journal.record(folder['id'], new_folder_id, KIND_FOLDER)
+        if progress is not None:
+            progress.advance(1)
         # Recursively copy the child objects into the new folder
-        copy_child_objects(folder['id'], new_folder['id'], svc)
+        copy_child_objects(folder['id'], new_folder_id, svc, max_retries, batch_size, journal,
+                           progress, item_filter, dedup, transfer)
+
+# Define a function to copy files with batch requests
+def copy_files_batched(files, dest_folder_id, drive_service=None, batch_size=BATCH_SIZE,
+                       journal=None, transfer=None):
+    """
+    Copies files into a destination folder, batch_size calls per HTTP request.
+
+    Args:
+        files (list): The source file resources (id and name).
+        dest_folder_id (str): The id for the destination folder.
+        drive_service: The Google Drive service object (optional, uses global if not provided).
+        batch_size (int): The maximum number of calls per batch request.
+        journal (CopyJournal): The checkpoint journal to record the copies in (optional).
+        transfer (StreamingTransfer): The transfer files are handed to when their copy is
+            denied (optional).
+
+    Returns:
+        copies (list): The (source file, new file resource) pairs of the successful copies.
+    """
+    svc = drive_service or service
+    requests = [(file, svc.files().copy(fileId=file['id'], fields='id',
+                                        body={'name': file['name'], 'parents': [dest_folder_id]}))
+                for file in files]
+    copies, failures = execute_batched(svc, requests, batch_size)
+    for file, error in failures:
+        if transfer is None or not transfer.defer(file, dest_folder_id, error):
+            handle_copy_error(file['name'], error, svc)
+    if journal is not None:
+        for file, new_file in copies:
+            journal.record(file['id'], new_file['id'], KIND_FILE)
+    return copies
+
+# Define a function to create folders with batch requests
+def create_folders_batched(folders, dest_folder_id, drive_service=None, batch_size=BATCH_SIZE,
+                           journal=None):
+    """
+    Creates a destination folder with the same name for every source folder.
+    Folders the journal already maps to a destination are reused instead.
+
+    Args:
+        folders (list): The source folder resources (id and name).
+        dest_folder_id (str): The id for the destination parent folder.
+        drive_service: The Google Drive service object (optional, uses global if not provided).
+        batch_size (int): The maximum number of calls per batch request.
+        journal (CopyJournal): The checkpoint journal of created folders (optional).
+
+    Returns:
+        created (list): The (source folder, new folder ID) pairs of the created folders.
+    """
+    svc = drive_service or service
+    existing = []
+    if journal is not None:
+        done_ids = [journal.lookup(folder['id']) for folder in folders]
+        existing = [(folder, done_id) for folder, done_id in zip(folders, done_ids)
+                    if done_id is not None]
+        folders = [folder for folder, done_id in zip(folders, done_ids) if done_id is None]
+    requests = [(folder, svc.files().create(fields='id', body={
+        'name': folder['name'],
+        'parents': [dest_folder_id],
+        'mimeType': MIME_FOLDER
+    })) for folder in folders]
+    created, failures = execute_batched(svc, requests, batch_size)
+    for folder, error in failures:
+        handle_copy_error(folder['name'], error, svc)
+    created = [(folder, new_folder['id']) for folder, new_folder in created]
+    if journal is not None:
+        for folder, new_folder_id in created:
+            journal.record(folder['id'], new_folder_id, KIND_FOLDER)
+    return existing + created
 
 # Define a function to handle copy errors
 def handle_copy_error(file_or_folder_name, error, drive_service=None):
@@ -214,7 +498,7 @@ def handle_copy_error(file_or_folder_name, error, drive_service=None):
         file_id = error.__dict__['fileId']
         try:
             # Retrieve the file's metadata to get parent folder(s)
-            file_metadata = svc.files().get(fileId=file_id, fields='parents').execute()
+            file_metadata = execute_request(svc.files().get(fileId=file_id, fields='parents'))
             parent_folder_ids = file_metadata.get('parents', [])
             # Construct URLs to the parent folders based on their IDs
             for folder_id in parent_folder_ids:
@@ -227,7 +511,7 @@ def handle_copy_error(file_or_folder_name, error, drive_service=None):
     logging.error('COPY FAILED: %s: %s', file_or_folder_name, error)
 
 # Define a function to recursively add child records to the CSV
-def add_child_folders(folder_id, writer, drive_service=None):
+def add_child_folders(folder_id, writer, drive_service=None, item_filter=None):
     """
     Recursively adds child folders to the CSV file.
 
@@ -235,125 +519,550 @@ def add_child_folders(folder_id, writer, drive_service=None):
         folder_id (str): The ID of the folder to add child folders for.
         writer: The CSV writer object.
         drive_service: The Google Drive service object (optional, uses global if not provided).
+        item_filter (ItemFilter): The filter files must match to be counted (optional).
     """
     svc = drive_service or service
     query = (f"'{folder_id}' in parents and "
          f"mimeType = '{MIME_FOLDER}' and "
          f"trashed = false")
-    results = svc.files().list(q=query, orderBy='name asc').execute()
-    folders = results.get('files', [])
+    folders = list(list_files(svc, query, fields=FOLDER_FIELDS, order_by='name asc'))
     for folder in folders:
         folder_id = folder['id']
-        num_files, num_folders = count_child_objects(folder_id, svc)
+        num_files, num_folders = count_child_objects(folder_id, svc, item_filter)
         writer.writerow([folder['name'], num_files, num_folders])
 
 # Enable pylint for no-member again
 # pylint: enable=no-member
 
+# Define a function to write a folder report (assessments 2 & 3) from a snapshot
+def write_folder_report(snapshot, csv_file):
+    """
+    Writes the TOTAL row and one row per top-level folder of a snapshot to a CSV file.
+
+    Args:
+        snapshot (TreeSnapshot): The snapshot of the folder tree.
+        csv_file (str): The path to the CSV file.
+
+    Returns:
+        rows (list): The report rows that were written (excluding the header).
+    """
+    rows = snapshot.folder_report()
+    with open(csv_file, 'w', newline='', encoding='utf-8') as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(['Folder Name', 'Number of Files', 'Number of Child Folders'])
+        writer.writerows(rows)
+    return rows
+
 # Compare the two assessments CSV files
 def compare_csv_files(file1, file2):
     """
-    Compare two CSV files and log whether they are equal or not.
+    Compare two CSV files line by line and log whether they are equal or not.
+
+    Only one row of each file is held in memory. For a per-path diff of two
+    inventories, use gcp.validate.validate_inventory_files.
 
     Args:
         file1 (str): The path to the first CSV file.
         file2 (str): The path to the second CSV file.
+
+    Returns:
+        bool: True if the files have the same rows.
     """
-    # Read the CSV files into pandas DataFrames
-    assessment2 = pd.read_csv(file1)
-    assessment3 = pd.read_csv(file2)
+    equal = True
+    with open(file1, newline='', encoding='utf-8') as input_file1, \
+            open(file2, newline='', encoding='utf-8') as input_file2:
+        rows = itertools.zip_longest(csv.reader(input_file1), csv.reader(input_file2))
+        for line_number, (row1, row2) in enumerate(rows, start=1):
+            if row1 != row2:
+                logging.error("Line %d differs: %s != %s", line_number, row1, row2)
+                equal = False
 
-    # Check if the DataFrames are equal
-    if assessment2.equals(assessment3):
+    if equal:
         logging.info("VALIDATION SUCCESSFUL!")
     else:
         logging.error("VALIDATION FAILED - Source & Destination folder counts do not match.")
         print("ERROR: VALIDATION FAILED!")
+    return equal
+
+# Define a function to serve the reads of a service from the metadata cache
+def with_cache(drive_service, cache):
+    """
+    Wraps a service object so its listings and metadata reads go through the cache, if enabled.
+
+    Args:
+        drive_service: The Google Drive service object.
+        cache (MetadataCache): The metadata cache (optional).
+
+    Returns:
+        service: The cached service, or drive_service itself without a cache.
+    """
+    if cache is None:
+        return drive_service
+    from gcp.cache import CachedDriveService  # pylint: disable=import-outside-toplevel
+    return CachedDriveService(drive_service, cache)
+
+# Define a function to close the metadata cache
+def close_cache(cache):
+    """
+    Logs the cache statistics and closes the cache, if enabled.
+
+    Args:
+        cache (MetadataCache): The metadata cache (optional).
+    """
+    if cache is None:
+        return
+    logging.info("CACHE: %d hits, %d misses, %d evictions, %d invalidations",
+                 cache.stats['hits'], cache.stats['misses'], cache.stats['evictions'],
+                 cache.stats['invalidations'])
+    cache.close()
+
+# Define a function to write the API metrics of the run
+def write_metrics(args):
+    """
+    Logs the per-call metrics of the run and writes the JSON and Prometheus summaries.
+
+    Args:
+        args (argparse.Namespace): The parsed options, with the metrics paths.
+    """
+    from gcp.metrics import api_metrics  # pylint: disable=import-outside-toplevel
+    api_metrics.log_summary()
+    api_metrics.write(args.metrics_json, args.metrics_textfile)
+
+# Define a function to plan the copy without copying
+def write_dry_run_plan(snapshot, destination_folder_id, args):
+    """
+    Writes the copy plan of a source snapshot with cost estimates, and prints a summary.
+
+    The run time is projected from the latency of the network requests the run
+    made so far, i.e. mostly the listings of the traversal. Responses served by
+    the metadata cache are not timed, so a fully cached run assumes
+    DEFAULT_LATENCY_SECONDS.
+
+    Args:
+        snapshot (TreeSnapshot): The snapshot of the source tree.
+        destination_folder_id (str): The id for the destination folder.
+        args (argparse.Namespace): The parsed options (plan path and copy settings).
+
+    Returns:
+        plan (dict): The plan, with its estimate.
+    """
+    # pylint: disable=import-outside-toplevel
+    from gcp.metrics import api_metrics
+    from gcp.plan import (COPY_PLAN_PATH, DEFAULT_LATENCY_SECONDS, build_copy_plan,
+                          estimate_copy_cost, write_plan)
+    from gcp.progress import format_bytes, format_duration
+    # pylint: enable=import-outside-toplevel
+    plan = build_copy_plan(snapshot, destination_folder_id)
+    latency = api_metrics.mean_latency()
+    plan['estimate'] = estimate_copy_cost(plan, latency or DEFAULT_LATENCY_SECONDS,
+                                          copy_workers=args.copy_workers)
+    plan['estimate']['latency_measured'] = latency is not None
+    plan_path = args.plan or COPY_PLAN_PATH
+    write_plan(plan, plan_path)
+
+    totals = plan['totals']
+    print(f"PLAN: {totals['folders']} folders to create, {totals['files']} files to copy "
+          f"({format_bytes(totals['bytes'])}), written to {plan_path}")
+    logging.info("PLAN: %d folders, %d files, %d bytes, %.3fs per request (%s)",
+                 totals['folders'], totals['files'], totals['bytes'],
+                 plan['estimate']['latency_seconds'],
+                 'measured' if latency is not None else 'assumed')
+    for engine, cost in plan['estimate']['engines'].items():
+        print(f"  {engine:<10} {cost['calls']:>9} calls {cost['requests']:>9} requests "
+              f"~{format_duration(cost['seconds'])}")
+        logging.info("ESTIMATE %s: %d calls, %d requests, %.0fs", engine, cost['calls'],
+                     cost['requests'], cost['seconds'])
+    return plan
+
+# Define a function to parse the command line options
+def parse_args(argv=None):
+    """
+    Parses the command line options of the drive-copy tool.
 
-def main():
-    """Main entry point for CLI."""
+    Args:
+        argv (list): The command line arguments (optional, defaults to sys.argv[1:]).
+
+    Returns:
+        args (argparse.Namespace): The parsed options.
+    """
+    # Only the defaults of the features are needed here, not their dependencies
+    # pylint: disable=import-outside-toplevel
+    from gcp.async_copy import DEFAULT_COPY_WORKERS
+    from gcp.cache import CACHE_PATH, CACHE_TTL_SECONDS
+    from gcp.changes import REPORT_STATE_PATH
+    from gcp.dedup import DEDUP_MODES
+    from gcp.journal import JOURNAL_PATH
+    from gcp.metrics import METRICS_JSON_PATH, METRICS_TEXTFILE_PATH
+    from gcp.plan import COPY_PLAN_PATH
+    from gcp.progress import LOG_SECONDS
+    from gcp.snapshot import DEFAULT_WORKERS, TRAVERSALS
+    from gcp.transfer import DEFAULT_TRANSFER_WORKERS
+    from gcp.transport import DEFAULT_POOL_SIZE, TRANSPORTS
+    # pylint: enable=import-outside-toplevel
+    parser = argparse.ArgumentParser(
+        prog='drive-copy',
+        description='Report on and copy the contents of a Google Drive folder. '
+                    f'Folders are read from {SOURCE_FOLDER_ID_ENV_VAR} and '
+                    f'{DESTINATION_FOLDER_ID_ENV_VAR}.')
+    parser.add_argument('--traversal', choices=sorted(TRAVERSALS), default='recursive',
+                        help='How folder trees are listed: one request per folder (recursive) '
+                             'many folders per request, level by level (bfs), or many '
+                             'folders at once on worker threads (concurrent), or one flat '
+                             'listing of the whole drive rebuilt locally (corpus).')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='Number of worker threads for the concurrent traversal '
+                             f'(default: {DEFAULT_WORKERS}).')
+    parser.add_argument('--copy-engine', choices=['sequential', 'async'], default='sequential',
+                        help='How the copy is performed: one item at a time (sequential) or an '
+                             'asyncio pipeline with concurrent folder creation and copies (async).')
+    parser.add_argument('--copy-workers', type=int, default=DEFAULT_COPY_WORKERS,
+                        help='Number of concurrent file copies for the async copy engine '
+                             f'(default: {DEFAULT_COPY_WORKERS}).')
+    parser.add_argument('--journal', default=JOURNAL_PATH,
+                        help=f'Checkpoint journal of completed copies (default: {JOURNAL_PATH}).')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted copy: skip everything already in the journal.')
+    parser.add_argument('--filter', action='append', default=[], metavar='TERM',
+                        help='Copy and report only the files matching TERM, e.g. '
+                             '"mimeType=application/pdf", "modifiedTime>90d", "size<10MB" or '
+                             '"name~invoice" (names starting with invoice, in any case, as '
+                             'Drive matches them). Repeat to combine terms; folders are always '
+                             'kept.')
+    parser.add_argument('--dedup', choices=DEDUP_MODES,
+                        help='Copy byte-identical files (same checksum and size) once, and create '
+                             'shortcuts to that copy for the others (shortcut) or leave them out '
+                             '(skip).')
+    parser.add_argument('--transfer-fallback', action='store_true',
+                        help='Stream the content of files whose copy is denied (403 or 404) '
+                             'with chunked downloads and resumable uploads, exporting Google '
+                             'documents, instead of failing them.')
+    parser.add_argument('--transfer-workers', type=int, default=DEFAULT_TRANSFER_WORKERS,
+                        help='Number of concurrent streaming transfers '
+                             f'(default: {DEFAULT_TRANSFER_WORKERS}).')
+    parser.add_argument('--sync', action='store_true',
+                        help='Copy only files that are missing or changed in the destination, '
+                             'matched by path and then by checksum, size or modified time.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Refresh stored source and destination snapshots from the Drive '
+                             'changes feed instead of traversing the trees again.')
+    parser.add_argument('--report-state', default=REPORT_STATE_PATH,
+                        help='Stored source snapshot and changes cursor for --incremental; the '
+                             'destination is stored next to it with a -destination suffix '
+                             f'(default: {REPORT_STATE_PATH}).')
+    parser.add_argument('--report-only', action='store_true',
+                        help='Write assessments 1 and 2 and stop, without copying.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Traverse the source and write assessments 1 and 2 and a copy plan '
+                             'with API call and time estimates, without copying.')
+    parser.add_argument('--plan',
+                        help='With --dry-run, where the copy plan is written (default: '
+                             f'{COPY_PLAN_PATH}); otherwise, a plan to copy from without '
+                             'traversing the source again.')
+    parser.add_argument('--cache', action='store_true',
+                        help='Cache folder listings and metadata on disk, so repeated runs make '
+                             'almost no API calls. Folders written by the copy are invalidated.')
+    parser.add_argument('--cache-path', default=CACHE_PATH,
+                        help=f'Location of the metadata cache (default: {CACHE_PATH}).')
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL_SECONDS,
+                        help='Seconds a cached response stays valid '
+                             f'(default: {CACHE_TTL_SECONDS}).')
+    parser.add_argument('--drive-id',
+                        help='Shared drive enumerated by the corpus traversal '
+                             "(default: the drive of each folder, or the user's corpus).")
+    parser.add_argument('--transport', choices=TRANSPORTS, default='httplib2',
+                        help='HTTP transport of the Drive clients: one httplib2 connection per '
+                             'client (httplib2), or one thread-safe connection pool shared by '
+                             'every worker (pooled).')
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE,
+                        help='Maximum number of connections of the pooled transport '
+                             f'(default: {DEFAULT_POOL_SIZE}).')
+    parser.add_argument('--no-keep-alive', dest='keep_alive', action='store_false',
+                        help='Close every connection of the pooled transport after one request.')
+    parser.add_argument('--progress-interval', type=float, default=LOG_SECONDS,
+                        help='Seconds between two progress records in the log during the copy '
+                             f'(default: {LOG_SECONDS:g}).')
+    parser.add_argument('--metrics-json', default=METRICS_JSON_PATH,
+                        help='Summary of every Drive API call by phase and method '
+                             f'(default: {METRICS_JSON_PATH}).')
+    parser.add_argument('--metrics-textfile', default=METRICS_TEXTFILE_PATH,
+                        help='The same metrics in the Prometheus textfile format '
+                             f'(default: {METRICS_TEXTFILE_PATH}).')
+    args = parser.parse_args(argv)
+    if args.sync and (args.dry_run or args.plan):
+        parser.error('--dry-run and --plan plan a full copy and cannot be used with --sync')
+    if args.sync and args.dedup:
+        parser.error('--dedup applies to full copies and cannot be used with --sync')
+    if args.sync and args.transfer_fallback:
+        parser.error('--transfer-fallback applies to full copies and cannot be used with --sync')
+    try:
+        args.item_filter = ItemFilter(args.filter) if args.filter else None
+    except ValueError as error:
+        parser.error(str(error))
+    if args.incremental and args.item_filter is not None and args.item_filter.maturing_terms:
+        # Files age into such a term without a change, so a refresh would never add them
+        parser.error(f'--incremental cannot refresh files that age into '
+                     f'{args.item_filter.maturing_terms[0].expression}; use an absolute date')
+    return args
+
+def main(argv=None):
+    """
+    Main entry point for CLI.
+
+    Args:
+        argv (list): The command line arguments (optional, defaults to sys.argv[1:]).
+    """
     global service  # pylint: disable=global-statement
 
+    args = parse_args(argv)
+    configure_logging()
+    # pylint: disable=import-outside-toplevel
+    from gcp.changes import destination_state_path, refresh_snapshot
+    from gcp.journal import CopyJournal
+    from gcp.listing import default_prefetcher
+    from gcp.metrics import api_metrics
+    from gcp.progress import CopyProgress
+    from gcp.snapshot import build_tree_snapshot
+    from gcp.validate import validate_trees
+
     print("Google Drive Report & Copy Tool")
     print("Running copy_folder script...")
 
     # Read environment variables
     client_id_file = os.environ.get(CLIENT_ID_ENV_VAR)
+    token_file = os.environ.get(TOKEN_FILE_ENV_VAR) or TOKEN_FILE_PATH
+    service_account_file = os.environ.get(SERVICE_ACCOUNT_ENV_VAR)
     source_folder_id = os.environ.get(SOURCE_FOLDER_ID_ENV_VAR)
     destination_folder_id = os.environ.get(DESTINATION_FOLDER_ID_ENV_VAR)
+    api_endpoint = os.environ.get(API_ENDPOINT_ENV_VAR)
 
-    # Check if the environment variables are set
-    if not client_id_file:
-        raise ValueError(f"{MISSING_ENVAR_TXT} Google Drive API Client ID JSON: {CLIENT_ID_ENV_VAR}")
+    # Check if the environment variables are set (an emulator needs no credentials)
+    if not client_id_file and not service_account_file and not api_endpoint:
+        raise ValueError(f"{MISSING_ENVAR_TXT} Google Drive API Client ID JSON: {CLIENT_ID_ENV_VAR} "
+                         f"(or service account key JSON: {SERVICE_ACCOUNT_ENV_VAR})")
     if not source_folder_id:
         raise ValueError(f"{MISSING_ENVAR_TXT} Source folder ID: {SOURCE_FOLDER_ID_ENV_VAR}")
     if not destination_folder_id:
         raise ValueError(f"{MISSING_ENVAR_TXT} Destination folder ID: {DESTINATION_FOLDER_ID_ENV_VAR}")
 
-    # Authenticate and authorize the user
-    authed_credentials = authenticate_and_authorize(client_id_file, SCOPES)
+    # Authenticate as the service account, or as the user with a saved and refreshed token
+    if service_account_file:
+        authed_credentials = authenticate_service_account(service_account_file, SCOPES,
+                                                          os.environ.get(SUBJECT_ENV_VAR))
+    elif not client_id_file:
+        from google.auth.credentials import AnonymousCredentials
+        logging.info("Using the Drive API at %s without credentials", api_endpoint)
+        authed_credentials = AnonymousCredentials()
+    else:
+        authed_credentials = authenticate_and_authorize(client_id_file, SCOPES, token_file)
 
     # Check if credentials are valid
-    if authed_credentials:
-        service = create_drive_service(authed_credentials)
-    else:
+    if not authed_credentials:
         logging.error("Authorization failed.")
         raise RuntimeError("Failed to authenticate with Google Drive API")
 
+    # Every service object shares the metadata cache, if enabled
+    cache = None
+    if args.cache:
+        from gcp.cache import MetadataCache
+        cache = MetadataCache(args.cache_path, ttl=args.cache_ttl)
+
+    # Every service object shares one connection pool with the pooled transport
+    http = None
+    if args.transport == 'pooled':
+        from gcp.transport import PooledHttp
+        http = PooledHttp(authed_credentials, pool_size=args.pool_size,
+                          keep_alive=args.keep_alive)
+
+    def new_service():
+        drive_service = create_drive_service(authed_credentials, api_endpoint, http)
+        return with_cache(drive_service, cache)
+
+    service = new_service()
+    # Every prefetch thread lists through a client of its own
+    default_prefetcher.use_services(new_service)
+
+    # Streamed files may be written as another user of the domain (domain-wide delegation)
+    destination_subject = os.environ.get(DESTINATION_SUBJECT_ENV_VAR)
+    if args.transfer_fallback and destination_subject and not service_account_file:
+        raise ValueError(f"{DESTINATION_SUBJECT_ENV_VAR} needs a service account key JSON: "
+                         f"{SERVICE_ACCOUNT_ENV_VAR}")
+
+    def new_destination_service():
+        destination_credentials = authenticate_service_account(service_account_file, SCOPES,
+                                                               destination_subject)
+        drive_service = create_drive_service(destination_credentials, api_endpoint)
+        return with_cache(drive_service, cache)
+
     # Get folder names
     # pylint: disable=no-member
-    source_folder_name = service.files().get(fileId=source_folder_id, fields='name').execute()
-    destination_folder_name = service.files().get(fileId=destination_folder_id, fields='name').execute()
+    source_folder_name = execute_request(service.files().get(fileId=source_folder_id, fields='name'))
+    destination_folder_name = execute_request(
+        service.files().get(fileId=destination_folder_id, fields='name'))
     # pylint: enable=no-member
 
+    # Worker threads need their own clients - the httplib2 transport is not thread-safe
+    traversal_options = {}
+    if args.traversal == 'concurrent':
+        traversal_options = {
+            'service_factory': new_service,
+            'max_workers': args.workers,
+        }
+    elif args.traversal == 'corpus':
+        traversal_options = {'drive_id': args.drive_id}
+
+    if args.sync:
+        from gcp.sync import SYNC_FIELDS
+        # Match destination items by content
+        traversal_options['fields'] = SYNC_FIELDS
+
+    def take_snapshot(folder_id, folder_name, state_path, item_filter=None):
+        # Only the source is filtered - the destination is reported as it is
+        options = dict(traversal_options)
+        if item_filter is not None:
+            options['item_filter'] = item_filter
+        # Stored snapshots (and their fingerprints) are refreshed from the changes feed
+        if args.incremental:
+            return refresh_snapshot(folder_id, service, folder_name, state_path,
+                                    traversal=args.traversal, **options)
+        return build_tree_snapshot(folder_id, service, folder_name, traversal=args.traversal,
+                                   **options)
+
+    # Drive calls are recorded per phase of the run
+    api_metrics.start_phase('assessment-1')
+    destination_state = destination_state_path(args.report_state)
+    destination_index = None
+    if args.sync:
+        # Index the destination first
+        destination_index = take_snapshot(destination_folder_id, destination_folder_name['name'],
+                                          destination_state)
+
     logging.info("STARTING ASSESSMENTS...")
+    plan = None
+    if args.plan and not args.dry_run:
+        from gcp.plan import load_plan, plan_snapshot
+        # A plan holds the whole source tree, so it is not listed again
+        plan = load_plan(args.plan)
+        if (plan['source_id'], plan['destination_id']) != (source_folder_id,
+                                                           destination_folder_id):
+            raise ValueError(f"Plan {args.plan} copies {plan['source_id']} to "
+                             f"{plan['destination_id']}, not {source_folder_id} to "
+                             f"{destination_folder_id}")
+        source_snapshot = plan_snapshot(plan)
+    else:
+        # Traverse the source tree once - every source report is computed from this snapshot
+        source_snapshot = take_snapshot(source_folder_id, source_folder_name['name'],
+                                        args.report_state, args.item_filter)
+
     # ASSESSEMENT 1 - Write the results to a CSV file
     csv_file = './outputs/assessment-1.csv'
     with open(csv_file, 'w', newline='', encoding='utf-8') as output_file:
-        # Get the name of the source folder
-        total_num_files, total_num_folders = count_child_objects(source_folder_id, service)
+        total_num_files, total_num_folders = source_snapshot.count_child_objects()
         writer = csv.writer(output_file)
         writer.writerow(['Folder Name', 'Number of Files', 'Number of Folders'])
         writer.writerow([source_folder_name['name'], total_num_files, total_num_folders])
 
     # ASSESSEMENT 2 - Write the results to a CSV file
-    csv_file = './outputs/assessment-2.csv'
-    with open(csv_file, 'w', newline='', encoding='utf-8') as output_file:
-        writer = csv.writer(output_file)
-        writer.writerow(['Folder Name', 'Number of Files', 'Number of Child Folders'])
-        # Write the Total at the top of the CSV
-        total_num_files, total_num_folders = count_child_objects(source_folder_id, service)
-        writer.writerow(['TOTAL', total_num_files, total_num_folders])
-        add_child_folders(source_folder_id, writer, service)
+    api_metrics.start_phase('assessment-2')
+    write_folder_report(source_snapshot, './outputs/assessment-2.csv')
+    if args.dry_run:
+        write_dry_run_plan(source_snapshot, destination_folder_id, args)
+    if args.report_only or args.dry_run:
+        close_cache(cache)
+        if http is not None:
+            http.close()
+        write_metrics(args)
+        logging.info("ASSESSMENTS COMPLETED!")
+        print("SCRIPT COMPLETED!")
+        return
 
     # Copy all child objects (including nested folders and files) to the new top-level folder
     logging.info("STARTING COPY TO %s...", destination_folder_name['name'])
-    copy_child_objects(source_folder_id, destination_folder_id, service)
+    api_metrics.start_phase('copy')
+    # The totals are known from the source traversal, so progress has an ETA from the start
+    progress = CopyProgress(total_items=total_num_files + total_num_folders,
+                            total_bytes=source_snapshot.total_size(),
+                            log_seconds=args.progress_interval)
+    if args.sync:
+        from gcp.sync import sync_child_objects
+        sync_stats = sync_child_objects(source_snapshot, destination_index, service,
+                                        progress=progress)
+        logging.info("SYNCED: %d copied, %d replaced, %d unchanged, %d folders created (%d failed)",
+                     sync_stats['copied'], sync_stats['replaced'], sync_stats['unchanged'],
+                     sync_stats['folders'], sync_stats['failed'])
+    else:
+        # Identical files are grouped by the checksums of the source traversal
+        dedup = None
+        if args.dedup:
+            from gcp.dedup import DuplicateIndex
+            dedup = DuplicateIndex(source_snapshot, args.dedup)
+        transfer = None
+        if args.transfer_fallback:
+            from gcp.transfer import StreamingTransfer
+            transfer = StreamingTransfer(
+                new_service, new_destination_service if destination_subject else None,
+                workers=args.transfer_workers)
+        with CopyJournal(args.journal, resume=args.resume) as journal:
+            journal.check_roots(source_folder_id, destination_folder_id)
+            if args.resume:
+                logging.info("RESUMING COPY: %d items already in the journal", len(journal))
+            if plan is not None:
+                from gcp.plan import execute_copy_plan
+                copy_stats = execute_copy_plan(plan, service, journal=journal, progress=progress,
+                                               dedup=dedup, transfer=transfer)
+                logging.info("COPIED %d files and %d folders from plan %s "
+                             "(%d skipped, %d failed)", copy_stats['files'],
+                             copy_stats['folders'], args.plan, copy_stats['skipped'],
+                             copy_stats['failed'])
+            elif args.copy_engine == 'async':
+                from gcp.async_copy import copy_child_objects_async
+                copy_stats = copy_child_objects_async(
+                    source_folder_id, destination_folder_id, new_service,
+                    copy_workers=args.copy_workers, journal=journal, progress=progress,
+                    item_filter=args.item_filter, dedup=dedup, transfer=transfer)
+                logging.info("COPIED %d files and %d folders (%d failed)",
+                             copy_stats['files'], copy_stats['folders'], copy_stats['failed'])
+            else:
+                copy_child_objects(source_folder_id, destination_folder_id, service,
+                                   journal=journal, progress=progress,
+                                   item_filter=args.item_filter, dedup=dedup,
+                                   transfer=transfer)
+            if transfer is not None:
+                # Before dedup, so duplicates of streamed files become shortcuts to them
+                transfer.finish(journal, progress)
+                transfer.log_summary()
+                # Validate exported documents against the files their uploads created
+                transfer.update_snapshot(source_snapshot, journal)
+            if dedup is not None:
+                dedup.finish(service, journal, progress=progress)
+                dedup.log_summary()
+                # Validate the destination against the shortcuts and skips it should have
+                dedup.update_snapshot(source_snapshot, journal)
+    progress.finish()
     logging.info("COPY COMPLETED!")
 
     # ASSESSEMENT 3 - Write the results to a CSV file
-    csv_file = './outputs/assessment-3.csv'
-    with open(csv_file, 'w', newline='', encoding='utf-8') as output_file:
-        writer = csv.writer(output_file)
-        writer.writerow(['Folder Name', 'Number of Files', 'Number of Child Folders'])
-
-        # Write the Total at the top of the CSV
-        total_num_files, total_num_folders = count_child_objects(destination_folder_id, service)
-        writer.writerow(['TOTAL', total_num_files, total_num_folders])
-        add_child_folders(destination_folder_id, writer, service)
+    api_metrics.start_phase('assessment-3')
+    destination_snapshot = take_snapshot(destination_folder_id, destination_folder_name['name'],
+                                         destination_state)
+    write_folder_report(destination_snapshot, './outputs/assessment-3.csv')
 
     logging.info("ASSESSMENTS COMPLETED!")
 
     logging.info("STARTING VALIDATION...")
-    # Load source and destination file count CSV reports
-    output_2 = './outputs/assessment-2.csv'
-    output_3 = './outputs/assessment-3.csv'
-
-    compare_csv_files(output_2, output_3)
+    api_metrics.start_phase('validation')
+    # Compare the source and destination trees, descending only into differing fingerprints
+    # (a sync keeps destination-only items, so they are listed but do not fail the validation)
+    validate_trees(source_snapshot, destination_snapshot, './outputs/validation-diff.csv',
+                   keep_extra=args.sync)
+    close_cache(cache)
+    if http is not None:
+        http.close()
+    write_metrics(args)
 
     # FINISH SCRIPT
     logging.info("COPIED: %s to %s", source_folder_name['name'], destination_folder_name['name'])
     print("SCRIPT COMPLETED!")
+    # pylint: enable=import-outside-toplevel
 
 if __name__ == "__main__":
     main()
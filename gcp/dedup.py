@@ -0,0 +1,183 @@
+'''
+Content deduplication for copies: byte-identical files (same md5Checksum and size)
+are copied once, and the other files of their group become shortcuts to that copy
+or are skipped.
+'''
+import logging
+from collections import defaultdict
+from gcp.batch import BATCH_SIZE, execute_batched
+from gcp.journal import KIND_FILE
+from gcp.progress import format_bytes, item_size
+
+# Drive shortcut items
+MIME_SHORTCUT = 'application/vnd.google-apps.shortcut'
+
+# What happens to the duplicates of a copied file
+DEDUP_MODES = ('shortcut', 'skip')
+
+KIND_SHORTCUT = 'shortcut'
+
+# Disable pylint for no-member at the function level
+# pylint: disable=no-member
+
+class DuplicateIndex:
+    """
+    Groups the files of a source snapshot by content and tracks the duplicates of a copy.
+
+    The first file of every group in breadth-first order is its canonical file
+    and is copied as usual. Copy engines hand every other file of the group to
+    defer() instead of copying it. Once the copy is done, finish() creates a
+    shortcut to the canonical copy for each deferred file, or skips it. If the
+    canonical copy does not exist (its copy failed), the duplicate is copied.
+    Google documents have no checksum and are never deduplicated.
+
+    Attributes:
+        mode (str): 'shortcut' or 'skip'.
+        canonical (dict): The canonical source file ID of every duplicate, keyed by file ID.
+        groups (int): The number of groups of identical files.
+        deferred (list): The (file, destination parent ID) pairs handed over by the copy.
+        results (list): The (file, action) pairs of finish(): 'shortcut', 'skip' or 'copy'.
+        stats (dict): The number of duplicates, shortcuts, skipped, copied and failed files,
+            and the copies and bytes avoided.
+    """
+
+    def __init__(self, snapshot, mode='shortcut'):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"Unknown dedup mode: {mode}")
+        self.mode = mode
+        groups = defaultdict(list)
+        pending = [snapshot.root_id]
+        for parent_id in pending:
+            for child_id in snapshot.children.get(parent_id, []):
+                item = snapshot.items[child_id]
+                if snapshot.is_folder(child_id):
+                    pending.append(child_id)
+                elif item.get('md5Checksum'):
+                    groups[(item['md5Checksum'], item_size(item))].append(child_id)
+        self.canonical = {}
+        self.groups = 0
+        for file_ids in groups.values():
+            # The same file in several folders is one item, not a duplicate
+            file_ids = list(dict.fromkeys(file_ids))
+            if len(file_ids) > 1:
+                self.groups += 1
+                for file_id in file_ids[1:]:
+                    self.canonical[file_id] = file_ids[0]
+        self.deferred = []
+        self.results = []
+        self.stats = {'duplicates': len(self.canonical), 'shortcuts': 0, 'skipped': 0,
+                      'copied': 0, 'failed': 0, 'copies_avoided': 0, 'bytes_avoided': 0}
+
+    def defer(self, file, dest_parent_id):
+        """
+        Takes over a file from the copy if it duplicates another one.
+
+        Args:
+            file (dict): The source file resource.
+            dest_parent_id (str): The ID of the destination folder it would be copied into.
+
+        Returns:
+            bool: True if the file is a duplicate and must not be copied now.
+        """
+        if file['id'] not in self.canonical:
+            return False
+        self.deferred.append((file, dest_parent_id))
+        return True
+
+    def finish(self, drive_service, journal, batch_size=BATCH_SIZE, progress=None):
+        """
+        Creates a shortcut for (or skips) every deferred duplicate, in batches.
+
+        Args:
+            drive_service: The Google Drive service object.
+            journal (CopyJournal): The journal the copy recorded the canonical copies in.
+            batch_size (int): The maximum number of calls per batch request.
+            progress (CopyProgress): The progress every duplicate is counted in (optional).
+
+        Returns:
+            stats (dict): The number of duplicates, shortcuts, skipped, copied and failed files,
+                and the copies and bytes avoided.
+        """
+        files_resource = drive_service.files()
+        requests = []
+        for file, dest_parent_id in self.deferred:
+            target_id = journal.lookup(self.canonical[file['id']])
+            if target_id is None:
+                # Without a canonical copy, the duplicate is copied after all
+                requests.append(((file, KIND_FILE), files_resource.copy(
+                    fileId=file['id'], fields='id',
+                    body={'name': file['name'], 'parents': [dest_parent_id]})))
+            elif self.mode == 'skip':
+                self._avoided(file, 'skip')
+                if progress is not None:
+                    progress.skip(1, item_size(file))
+            else:
+                requests.append(((file, KIND_SHORTCUT), files_resource.create(
+                    fields='id', body={'name': file['name'], 'mimeType': MIME_SHORTCUT,
+                                       'parents': [dest_parent_id],
+                                       'shortcutDetails': {'targetId': target_id}})))
+
+        responses, failures = execute_batched(drive_service, requests, batch_size)
+        for (file, _), error in failures:
+            logging.error('COPY FAILED: %s: %s', file['name'], error)
+        for (file, kind), response in responses:
+            journal.record(file['id'], response['id'], kind)
+            if kind == KIND_SHORTCUT:
+                self._avoided(file, 'shortcut')
+            else:
+                self.results.append((file, 'copy'))
+                self.stats['copied'] += 1
+        self.stats['failed'] += len(failures)
+        if progress is not None:
+            progress.advance(len(responses), sum(item_size(file) for (file, kind), _ in responses
+                                                 if kind == KIND_FILE))
+            progress.fail(len(failures))
+        self.deferred = []
+        return self.stats
+
+    def _avoided(self, file, action):
+        self.results.append((file, action))
+        self.stats['shortcuts' if action == 'shortcut' else 'skipped'] += 1
+        self.stats['copies_avoided'] += 1
+        self.stats['bytes_avoided'] += item_size(file)
+
+    def update_snapshot(self, snapshot, journal=None):
+        """
+        Turns a source snapshot into what the destination should hold after finish().
+
+        Shortcut duplicates are replaced by shortcuts and skipped ones removed,
+        so validation compares the destination with what was meant to be copied.
+        A resumed copy skips the shortcuts an interrupted run already made before
+        they reach defer(), so those are read from the journal.
+
+        Args:
+            snapshot (TreeSnapshot): The snapshot of the source tree, updated in place.
+            journal (CopyJournal): The journal the shortcuts were recorded in (optional).
+        """
+        shortcut_ids = [file['id'] for file, action in self.results if action == 'shortcut']
+        if journal is not None:
+            shortcut_ids += journal.source_ids(KIND_SHORTCUT)
+        for file, action in self.results:
+            if action == 'skip':
+                snapshot.remove_item(file['id'])
+        for file_id in dict.fromkeys(shortcut_ids):
+            if file_id in snapshot.items:
+                snapshot.update_item({'id': file_id, 'name': snapshot.items[file_id]['name'],
+                                      'mimeType': MIME_SHORTCUT}, snapshot.parents[file_id])
+
+    def log_summary(self):
+        """
+        Logs and prints the copies and bytes the deduplication avoided.
+        """
+        stats = self.stats
+        logging.info("DEDUP: %d duplicate files in %d groups: %d shortcuts, %d skipped, "
+                     "%d copied (canonical copy missing), %d failed; %d copies and %d bytes "
+                     "avoided", stats['duplicates'], self.groups, stats['shortcuts'],
+                     stats['skipped'], stats['copied'], stats['failed'],
+                     stats['copies_avoided'], stats['bytes_avoided'])
+        print(f"DEDUP: {stats['copies_avoided']} copies and "
+              f"{format_bytes(stats['bytes_avoided'])} avoided "
+              f"({stats['shortcuts']} shortcuts, {stats['skipped']} skipped)")
+
+# Enable pylint for no-member again
+# pylint: enable=no-member
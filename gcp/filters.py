@@ -0,0 +1,263 @@
+'''
+Item filters for selective copies and reports, compiled into the Drive query
+language wherever possible so excluded files never leave the server.
+'''
+import re
+import operator
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from gcp.listing import MIME_FOLDER
+from gcp.progress import item_size
+
+# Fields a filter term can test, and the operators each one supports
+FILTER_OPERATORS = {
+    'mimeType': ('=', '!=', '~'),
+    'name': ('=', '!=', '~'),
+    'modifiedTime': ('<', '<=', '>', '>='),
+    'size': ('<', '<=', '>', '>='),
+}
+
+# One term: a field, an operator ('~' for contains) and a value, e.g. "size<10MB"
+TERM_PATTERN = re.compile(r'^\s*(\w+)\s*(!=|<=|>=|=|<|>|~)\s*(.+?)\s*$')
+# Relative times, e.g. "90d" for 90 days ago
+AGE_PATTERN = re.compile(r'^(\d+)([dh])$')
+# Sizes with an optional binary unit, e.g. "10MB"
+SIZE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*(B|KB|MB|GB|TB)?$', re.IGNORECASE)
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+# Timestamp format of the Drive query language (UTC)
+QUERY_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+COMPARISONS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+# relative is the operator of a term against an age (e.g. '>' for modifiedTime>90d), else None
+FilterTerm = namedtuple('FilterTerm', ['expression', 'field', 'clause', 'predicate', 'relative'],
+                        defaults=(None,))
+
+# Define a function to quote a string for the Drive query language
+def quote(value):
+    """
+    Quotes a string literal for a files.list query, escaping backslashes and quotes.
+
+    Args:
+        value (str): The string.
+
+    Returns:
+        literal (str): The quoted literal, e.g. 'O\\'Brien'.
+    """
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+# Define a function to turn a filter time into a Drive timestamp
+def parse_time(value, now=None):
+    """
+    Parses an absolute date (2024-01-31), datetime (2024-01-31T12:00:00) or age (90d, 12h).
+
+    Ages are rounded down to the start of the day or hour, so the query of a
+    filter stays the same during a day and cached listings can be reused.
+
+    Args:
+        value (str): The time as given in the filter.
+        now (datetime): The current time (optional, for tests).
+
+    Returns:
+        timestamp (str): The UTC timestamp in the format of the query language.
+
+    Raises:
+        ValueError: If the time is not in one of the supported formats.
+    """
+    age = AGE_PATTERN.match(value)
+    if age:
+        now = now or datetime.now(timezone.utc)
+        if age.group(2) == 'd':
+            start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            return (start - timedelta(days=int(age.group(1)))).strftime(QUERY_TIME_FORMAT)
+        start = now.replace(minute=0, second=0, microsecond=0)
+        return (start - timedelta(hours=int(age.group(1)))).strftime(QUERY_TIME_FORMAT)
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return timestamp.strftime(QUERY_TIME_FORMAT)
+
+# Define a function to turn a filter size into bytes
+def parse_size(value):
+    """
+    Parses a size with an optional binary unit (B, KB, MB, GB or TB).
+
+    Args:
+        value (str): The size as given in the filter, e.g. '10MB'.
+
+    Returns:
+        num_bytes (int): The size in bytes.
+
+    Raises:
+        ValueError: If the size is not a number with a known unit.
+    """
+    size = SIZE_PATTERN.match(value)
+    if not size:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(size.group(1)) * SIZE_UNITS[(size.group(2) or 'B').upper()])
+
+# Define a function to compile one filter term
+def parse_filter_term(expression, now=None):
+    """
+    Compiles a filter term into a query clause (if Drive can evaluate it) and a predicate.
+
+    Supported terms:
+        mimeType=TYPE[,TYPE...], mimeType!=TYPE, mimeType~PREFIX (e.g. image/)
+        name=NAME, name!=NAME, name~PREFIX (names starting with PREFIX, in any case)
+        modifiedTime>WHEN (also <, <=, >=), WHEN being a date, a datetime or an age (90d, 12h)
+        size<SIZE (also <=, >, >=), SIZE in bytes or with a unit (10MB); evaluated locally
+
+    Args:
+        expression (str): The term, e.g. 'modifiedTime>90d'.
+        now (datetime): The current time for ages (optional, for tests).
+
+    Returns:
+        term (FilterTerm): The term, its query clause (None for local terms) and its predicate.
+
+    Raises:
+        ValueError: If the term is malformed or uses an unknown field or operator.
+    """
+    match = TERM_PATTERN.match(expression)
+    if not match:
+        raise ValueError(f"Invalid filter: {expression} (expected FIELD OPERATOR VALUE)")
+    field, symbol, value = match.groups()
+    if field not in FILTER_OPERATORS:
+        raise ValueError(f"Invalid filter: {expression} (fields: {', '.join(FILTER_OPERATORS)})")
+    if symbol not in FILTER_OPERATORS[field]:
+        raise ValueError(f"Invalid filter: {expression} ({field} supports "
+                         f"{', '.join(FILTER_OPERATORS[field])})")
+
+    if field == 'size':
+        limit = parse_size(value)
+        return FilterTerm(expression, field, None,
+                          lambda item: COMPARISONS[symbol](item_size(item), limit))
+    if field == 'modifiedTime':
+        timestamp = parse_time(value, now)
+        # Drive returns milliseconds and a zone designator, e.g. 2024-01-31T12:00:00.000Z
+        return FilterTerm(expression, field, f"modifiedTime {symbol} {quote(timestamp)}",
+                          lambda item: COMPARISONS[symbol](
+                              item.get('modifiedTime', '')[:len(timestamp)], timestamp),
+                          symbol if AGE_PATTERN.match(value) else None)
+    if symbol == '~' and field == 'name':
+        # Drive only matches names by prefix, and case-insensitively
+        return FilterTerm(expression, field, f"name contains {quote(value)}",
+                          lambda item: item.get('name', '').lower().startswith(value.lower()))
+    if symbol == '~':
+        return FilterTerm(expression, field, f"{field} contains {quote(value)}",
+                          lambda item: value.lower() in item.get(field, '').lower())
+    if symbol == '!=':
+        return FilterTerm(expression, field, f"{field} != {quote(value)}",
+                          lambda item: item.get(field) != value)
+    values = [part.strip() for part in value.split(',')] if field == 'mimeType' else [value]
+    clause = ' or '.join(f"{field} = {quote(part)}" for part in values)
+    return FilterTerm(expression, field, f"({clause})" if len(values) > 1 else clause,
+                      lambda item: item.get(field) in values)
+
+# Define a function to add the fields a filter tests to a listing projection
+def filter_fields(fields, item_filter, listed=True):
+    """
+    Adds the fields the terms of a filter test to a files.list projection.
+
+    Args:
+        fields (str): The projection, e.g. 'files(id,mimeType)'.
+        item_filter (ItemFilter): The filter.
+        listed (bool): Whether the query is restricted with the filter, so only the fields of
+            local terms, and of relative terms checked again on later refreshes, are needed.
+
+    Returns:
+        fields (str): The projection with the missing fields appended.
+    """
+    file_fields = fields[len('files('):-1].split(',')
+    for term in item_filter.terms:
+        if term.field not in file_fields and not (listed and term.clause and not term.relative):
+            file_fields.append(term.field)
+    return f"files({','.join(file_fields)})"
+
+class ItemFilter:
+    """
+    The files a copy or report is restricted to: every term must match.
+
+    Folders are never filtered, so the traversal still reaches every matching
+    file. Terms on fields that files.list can search are pushed into the query
+    of every listing; the others (size) are checked on the listed items.
+
+    Attributes:
+        terms (list): The compiled filter terms.
+        file_clauses (str): The clauses a listing of files only is extended with.
+        restriction (str): The clause every listing of files and folders is extended with,
+            e.g. " and (mimeType = '<folder>' or (mimeType = 'application/pdf'))".
+    """
+
+    def __init__(self, terms):
+        self.terms = [parse_filter_term(term) if isinstance(term, str) else term
+                      for term in terms]
+        clauses = [term.clause for term in self.terms if term.clause]
+        self.file_clauses = ''.join(f' and {clause}' for clause in clauses)
+        self.restriction = (f" and (mimeType = '{MIME_FOLDER}' or ({' and '.join(clauses)}))"
+                            if clauses else '')
+
+    @property
+    def expressions(self):
+        """
+        Returns the terms as given, e.g. to store with a snapshot.
+
+        Returns:
+            expressions (list): The filter terms.
+        """
+        return [term.expression for term in self.terms]
+
+    @property
+    def expiring_terms(self):
+        """
+        Returns the relative terms files stop matching as time passes, e.g. modifiedTime>90d.
+        """
+        return [term for term in self.terms if term.relative in ('>', '>=')]
+
+    @property
+    def maturing_terms(self):
+        """
+        Returns the relative terms files start matching as time passes, e.g. modifiedTime<90d.
+        """
+        return [term for term in self.terms if term.relative in ('<', '<=')]
+
+    def query(self, query):
+        """
+        Restricts a listing of files and folders to folders and matching files.
+
+        Args:
+            query (str): The files.list query, e.g. "'abc' in parents and trashed = false".
+
+        Returns:
+            query (str): The restricted query.
+        """
+        return query + self.restriction
+
+    def file_query(self, query):
+        """
+        Restricts a listing of files only (mimeType != folder) to matching files.
+
+        Args:
+            query (str): The files.list query.
+
+        Returns:
+            query (str): The restricted query.
+        """
+        return query + self.file_clauses
+
+    def matches(self, item, listed=True):
+        """
+        Returns whether an item passes the filter. Folders always do.
+
+        Args:
+            item (dict): The Drive file resource.
+            listed (bool): Whether the item comes from a listing restricted with query(), so
+                only the local terms are left to check. False for the changes feed.
+
+        Returns:
+            bool: True if the item is kept.
+        """
+        if item.get('mimeType') == MIME_FOLDER:
+            return True
+        return all(term.predicate(item) for term in self.terms
+                   if not (listed and term.clause))
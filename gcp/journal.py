@@ -0,0 +1,148 @@
+'''
+A local SQLite checkpoint journal of completed copies, so interrupted runs can resume.
+'''
+import os
+import logging
+import time
+import sqlite3
+import threading
+
+# Default location of the journal
+JOURNAL_PATH = './outputs/copy-journal.sqlite3'
+# Pending records are written in one transaction once this many accumulate...
+JOURNAL_BATCH_SIZE = 500
+# ...or once this many seconds have passed since the last write
+JOURNAL_FLUSH_SECONDS = 5.0
+
+KIND_FILE = 'file'
+KIND_FOLDER = 'folder'
+# A Google document streamed as an export, so its copy differs from the source
+KIND_EXPORT = 'export'
+
+class CopyJournal:
+    """
+    Records each source ID -> destination ID mapping as folders are created and files copied.
+
+    Completed mappings are kept in memory for lookups and written to SQLite in
+    batches, so journaling does not slow the copy down. The source and
+    destination root IDs are stored too, so a resume cannot continue a
+    different copy by mistake.
+
+    Attributes:
+        path (str): The path to the SQLite database.
+        batch_size (int): The number of pending records that triggers a write.
+        flush_seconds (float): The age of the oldest pending record that triggers a write.
+    """
+
+    def __init__(self, path=JOURNAL_PATH, resume=False, batch_size=JOURNAL_BATCH_SIZE,
+                 flush_seconds=JOURNAL_FLUSH_SECONDS):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        if not resume and os.path.exists(path):
+            logging.warning("Discarding the checkpoint journal of an earlier copy: %s "
+                            "(use --resume to continue it)", path)
+            os.remove(path)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS copies '
+                                 '(source_id TEXT PRIMARY KEY, destination_id TEXT, kind TEXT)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS roots '
+                                 '(name TEXT PRIMARY KEY, folder_id TEXT)')
+        self._connection.commit()
+        self._copies = dict(self._connection.execute('SELECT source_id, destination_id FROM copies'))
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._copies)
+
+    def check_roots(self, src_folder_id, dest_folder_id):
+        """
+        Stores the roots of a new copy, or checks that a resumed journal belongs to them.
+
+        Args:
+            src_folder_id (str): The id for the source folder.
+            dest_folder_id (str): The id for the destination folder.
+
+        Raises:
+            ValueError: If the journal was written for different folders.
+        """
+        roots = dict(self._connection.execute('SELECT name, folder_id FROM roots'))
+        if not roots:
+            self._connection.executemany('INSERT INTO roots VALUES (?, ?)',
+                                         [('source', src_folder_id),
+                                          ('destination', dest_folder_id)])
+            self._connection.commit()
+        elif roots != {'source': src_folder_id, 'destination': dest_folder_id}:
+            raise ValueError(f"Journal {self.path} belongs to a copy of {roots.get('source')} "
+                             f"to {roots.get('destination')}")
+
+    def lookup(self, source_id):
+        """
+        Returns the destination ID of a completed item, or None if it still has to be copied.
+
+        Args:
+            source_id (str): The ID of the source file or folder.
+
+        Returns:
+            destination_id (str): The ID of the copy.
+        """
+        return self._copies.get(source_id)
+
+    def record(self, source_id, destination_id, kind=KIND_FILE):
+        """
+        Records a completed folder creation or file copy.
+
+        Args:
+            source_id (str): The ID of the source file or folder.
+            destination_id (str): The ID of the copy.
+            kind (str): KIND_FILE, KIND_FOLDER or another kind, e.g. KIND_EXPORT.
+        """
+        with self._lock:
+            self._copies[source_id] = destination_id
+            self._pending.append((source_id, destination_id, kind))
+            due = (len(self._pending) >= self.batch_size
+                   or time.monotonic() - self._last_flush >= self.flush_seconds)
+        if due:
+            self.flush()
+
+    def source_ids(self, kind):
+        """
+        Returns the source IDs of every item recorded with a kind, by this run or an earlier one.
+
+        Args:
+            kind (str): The kind of record, e.g. KIND_FOLDER.
+
+        Returns:
+            source_ids (list): The IDs of the source items.
+        """
+        self.flush()
+        with self._lock:
+            return [row[0] for row in self._connection.execute(
+                'SELECT source_id FROM copies WHERE kind = ?', (kind,))]
+
+    def flush(self):
+        """
+        Writes every pending record in one transaction.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+            if pending:
+                with self._connection:
+                    self._connection.executemany(
+                        'INSERT OR REPLACE INTO copies VALUES (?, ?, ?)', pending)
+
+    def close(self):
+        """
+        Flushes pending records and closes the database.
+        """
+        self.flush()
+        self._connection.close()
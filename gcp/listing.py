@@ -0,0 +1,192 @@
+'''
+Paginated, field-projected listing helpers for the Google Drive files resource.
+'''
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from gcp.ratelimit import execute_request
+
+# Drive object types
+MIME_FOLDER = 'application/vnd.google-apps.folder'
+
+# Largest page size accepted by files.list
+PAGE_SIZE = 1000
+
+# Field projections - request only what each caller needs
+COUNT_FIELDS = 'files(id,mimeType)'
+FOLDER_FIELDS = 'files(id,name)'
+COPY_FIELDS = 'files(id,name,mimeType,size)'
+
+# Threads fetching the next page of listings in the background, shared by every listing
+PREFETCH_WORKERS = 8
+
+class ThreadLocalServices:
+    """
+    Hands every worker thread its own Drive service object.
+
+    The default httplib2 transport is not thread-safe, so parallel workers must
+    not share a client. Services are created lazily, once per thread.
+
+    Attributes:
+        service_factory (callable): Creates a new service object (e.g. create_drive_service).
+    """
+
+    def __init__(self, service_factory):
+        self.service_factory = service_factory
+        self._local = threading.local()
+
+    def get(self):
+        """
+        Returns the service object of the calling thread, creating it if needed.
+
+        Returns:
+            service (googleapiclient.discovery.Resource): The Drive API service object.
+        """
+        drive_service = getattr(self._local, 'service', None)
+        if drive_service is None:
+            drive_service = self.service_factory()
+            self._local.service = drive_service
+        return drive_service
+
+# Define a function to tell whether a service object may be used by several threads
+def is_thread_safe(drive_service):
+    """
+    Returns whether a service object, or its transport, declares itself thread-safe.
+
+    Args:
+        drive_service: The Google Drive service object.
+
+    Returns:
+        bool: True for e.g. services over the pooled transport, False for httplib2.
+    """
+    return (getattr(drive_service, 'thread_safe', None) is True
+            or getattr(getattr(drive_service, '_http', None), 'thread_safe', None) is True)
+
+class PagePrefetcher:
+    """
+    Fetches the next page of listings in the background, on one pool of threads.
+
+    The default httplib2 transport is not thread-safe, so with a service
+    factory every prefetch thread lists through its own service object. The
+    factory must create services equivalent to the ones listings are made
+    with. Without one, only listings of thread-safe services are prefetched.
+
+    Attributes:
+        services (ThreadLocalServices): The service objects of the prefetch threads (optional).
+        workers (int): The number of prefetch threads.
+    """
+
+    def __init__(self, service_factory=None, workers=PREFETCH_WORKERS):
+        self.services = None
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        if service_factory is not None:
+            self.use_services(service_factory)
+
+    def use_services(self, service_factory):
+        """
+        Makes every prefetch thread list through its own service object from service_factory.
+
+        Args:
+            service_factory (callable): Creates a new service object (e.g. create_drive_service).
+        """
+        self.services = ThreadLocalServices(service_factory)
+
+    def submit(self, drive_service, list_kwargs, page_token):
+        """
+        Starts fetching a page in the background.
+
+        Args:
+            drive_service: The Google Drive service object of the listing.
+            list_kwargs (dict): The keyword arguments for files().list().
+            page_token (str): The token of the page to fetch.
+
+        Returns:
+            future (Future): The future of the files.list response, or None if the page
+                cannot be prefetched and has to be fetched by the caller.
+        """
+        services = self.services
+        if services is None and not is_thread_safe(drive_service):
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='prefetch')
+        if services is not None:
+            return self._executor.submit(
+                lambda: fetch_page(services.get(), list_kwargs, page_token))
+        return self._executor.submit(fetch_page, drive_service, list_kwargs, page_token)
+
+# The prefetcher every listing shares
+default_prefetcher = PagePrefetcher()
+
+# Disable pylint for no-member at the function level
+# pylint: disable=no-member
+
+# Define a function to fetch a single page of results
+def fetch_page(drive_service, list_kwargs, page_token=None):
+    """
+    Executes a single files.list request.
+
+    Args:
+        drive_service: The Google Drive service object.
+        list_kwargs (dict): The keyword arguments for files().list().
+        page_token (str): The token of the page to fetch (optional, first page if not provided).
+
+    Returns:
+        response (dict): The decoded files.list response.
+    """
+    if page_token:
+        list_kwargs = dict(list_kwargs, pageToken=page_token)
+    return execute_request(drive_service.files().list(**list_kwargs))
+
+# Define a generator that walks every page of a files.list query
+def list_files(drive_service, query, fields=COPY_FIELDS, order_by=None,
+               page_size=PAGE_SIZE, prefetch=True, **extra_kwargs):
+    """
+    Yields every item matching a files.list query, following nextPageToken.
+
+    While the caller handles the items of the current page, the next page is
+    fetched by the shared default_prefetcher, never through the caller's own
+    service object from another thread unless it is thread-safe.
+
+    Args:
+        drive_service: The Google Drive service object.
+        query (str): The Drive search query (the q parameter).
+        fields (str): The partial response projection for the files collection.
+        order_by (str): The sort order of the results (optional).
+        page_size (int): The number of items to request per page.
+        prefetch (bool): Whether to fetch the next page in the background.
+        **extra_kwargs: Any additional files().list() parameters (e.g. corpora).
+
+    Yields:
+        item (dict): Each file resource, restricted to the requested fields.
+    """
+    list_kwargs = {
+        'q': query,
+        'fields': f'nextPageToken,{fields}',
+        'pageSize': page_size,
+    }
+    if order_by:
+        list_kwargs['orderBy'] = order_by
+    list_kwargs.update(extra_kwargs)
+
+    response = fetch_page(drive_service, list_kwargs)
+    while True:
+        page_token = response.get('nextPageToken')
+        next_page = None
+        if page_token and prefetch:
+            # Start the next request before handing out the current page
+            next_page = default_prefetcher.submit(drive_service, list_kwargs, page_token)
+
+        yield from response.get('files', [])
+
+        if not page_token:
+            return
+        if next_page is not None:
+            response = next_page.result()
+        else:
+            response = fetch_page(drive_service, list_kwargs, page_token)
+
+# Enable pylint for no-member again
+# pylint: enable=no-member
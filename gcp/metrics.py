@@ -0,0 +1,294 @@
+'''
+Per-call metrics of the Drive requests of a run, broken down by pipeline phase,
+written as JSON and as a Prometheus textfile at the end of the run.
+'''
+import os
+import json
+import time
+import logging
+import threading
+from collections import Counter
+
+# Default locations of the summaries
+METRICS_JSON_PATH = './outputs/api-metrics.json'
+METRICS_TEXTFILE_PATH = './outputs/drive_copy.prom'
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Prefix of every Prometheus metric name
+METRIC_PREFIX = 'drive_copy'
+
+# Define a function to name the Drive method of a request
+def method_name(request):
+    """
+    Returns the Drive method of a request, e.g. 'files.list', or 'batch' for a batch request.
+
+    Args:
+        request: The request, e.g. files().list(...) or new_batch_http_request().
+
+    Returns:
+        method (str): The method name ('unknown' if it cannot be told).
+    """
+    method_id = getattr(request, 'methodId', None)
+    if isinstance(method_id, str):
+        # e.g. 'drive.files.list'
+        return method_id.split('.', 1)[-1]
+    if type(request).__name__ == 'BatchHttpRequest':
+        return 'batch'
+    return 'unknown'
+
+class MethodStats:
+    """
+    The counters of one Drive method in one phase.
+
+    Attributes:
+        calls (int): The number of attempts, retries included.
+        seconds (float): The total latency of the attempts.
+        buckets (list): The number of timed attempts per latency bucket (not cumulative), plus
+            +Inf. Calls inside a batch are not timed - the batch request is.
+        response_bytes (int): The total size of the response bodies.
+        retries (int): The number of attempts after the first.
+        backoff_seconds (float): The total time spent waiting before retries.
+        statuses (Counter): The number of responses per HTTP status ('error' for transport errors).
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.response_bytes = 0
+        self.retries = 0
+        self.backoff_seconds = 0.0
+        self.statuses = Counter()
+
+    def to_dict(self):
+        """
+        Returns the counters as JSON-serializable data, with cumulative buckets.
+        """
+        cumulative = []
+        total = 0
+        for count in self.buckets:
+            total += count
+            cumulative.append(total)
+        return {
+            'calls': self.calls,
+            'seconds': round(self.seconds, 6),
+            'mean_seconds': round(self.seconds / total, 6) if total else None,
+            'latency_buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                                        cumulative)),
+            'response_bytes': self.response_bytes,
+            'retries': self.retries,
+            'backoff_seconds': round(self.backoff_seconds, 6),
+            'statuses': {str(status): count for status, count in sorted(
+                self.statuses.items(), key=lambda item: str(item[0]))},
+        }
+
+class ApiMetrics:
+    """
+    Thread-safe metrics of every Drive request, keyed by pipeline phase and method.
+
+    The current phase is shared by all threads: main() moves through the phases
+    one after the other, and worker threads record into whichever is current.
+
+    Attributes:
+        phase (str): The current pipeline phase.
+        methods (dict): The MethodStats keyed by (phase, method).
+        phase_seconds (dict): The wall time of every finished phase.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.phase = 'setup'
+        self.methods = {}
+        self.phase_seconds = {}
+        self._phase_started = clock()
+        self._lock = threading.Lock()
+
+    def start_phase(self, phase):
+        """
+        Ends the current phase and starts recording into a new one.
+
+        Args:
+            phase (str): The name of the phase, e.g. 'copy'.
+        """
+        now = self.clock()
+        with self._lock:
+            self.phase_seconds[self.phase] = (self.phase_seconds.get(self.phase, 0.0)
+                                              + now - self._phase_started)
+            self.phase = phase
+            self._phase_started = now
+
+    def _stats(self, method):
+        key = (self.phase, method)
+        if key not in self.methods:
+            self.methods[key] = MethodStats()
+        return self.methods[key]
+
+    def observe(self, method, status, seconds=None, retry=False):
+        """
+        Records one attempt of a call.
+
+        Args:
+            method (str): The Drive method, e.g. 'files.copy'.
+            status: The HTTP status, or 'error' for a transport error.
+            seconds (float): The latency of the attempt (None for calls inside a batch).
+            retry (bool): Whether the attempt retried an earlier failure.
+        """
+        with self._lock:
+            stats = self._stats(method)
+            stats.calls += 1
+            stats.statuses[status] += 1
+            stats.retries += retry
+            if seconds is not None:
+                stats.seconds += seconds
+                index = next((index for index, bound in enumerate(LATENCY_BUCKETS)
+                              if seconds <= bound), len(LATENCY_BUCKETS))
+                stats.buckets[index] += 1
+
+    def observe_backoff(self, method, seconds):
+        """
+        Records the time waited before retrying a call.
+        """
+        with self._lock:
+            self._stats(method).backoff_seconds += seconds
+
+    def observe_bytes(self, method, num_bytes):
+        """
+        Records the size of a response body.
+        """
+        with self._lock:
+            self._stats(method).response_bytes += num_bytes
+
+    def meter(self, request):
+        """
+        Makes a request record the size of its response body, and returns its method.
+
+        The request's response handler (postproc) receives the raw body before
+        decoding, so the size is measured without serializing the response again.
+        Batched requests are decoded the same way, one sub-request at a time.
+
+        Args:
+            request: The request, e.g. files().copy(...).
+
+        Returns:
+            method (str): The Drive method of the request.
+        """
+        method = method_name(request)
+        postproc = getattr(request, 'postproc', None)
+        if method != 'unknown' and callable(postproc) and not getattr(postproc, 'metered', False):
+            def metered_postproc(resp, content):
+                self.observe_bytes(method, len(content or b''))
+                return postproc(resp, content)
+            metered_postproc.metered = True
+            request.postproc = metered_postproc
+        return method
+
+    def mean_latency(self):
+        """
+        Returns the mean latency of every timed request so far, or None if there was none.
+        """
+        with self._lock:
+            seconds = sum(stats.seconds for stats in self.methods.values())
+            timed = sum(sum(stats.buckets) for stats in self.methods.values())
+        return seconds / timed if timed else None
+
+    def summary(self):
+        """
+        Returns the metrics as JSON-serializable data, with the phases in the order they ran.
+        """
+        with self._lock:
+            phases = {phase: {'seconds': round(seconds, 6), 'methods': {}}
+                      for phase, seconds in self.phase_seconds.items()}
+            for (phase, method), stats in sorted(self.methods.items()):
+                phases.setdefault(phase, {'methods': {}})['methods'][method] = stats.to_dict()
+        return {'generated': time.strftime('%Y-%m-%dT%H:%M:%S'), 'phases': phases}
+
+    def prometheus_lines(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        name = METRIC_PREFIX
+        lines = [
+            f'# HELP {name}_api_request_duration_seconds Latency of Drive API requests.',
+            f'# TYPE {name}_api_request_duration_seconds histogram',
+        ]
+        counters = {
+            'api_response_bytes_total': ('Size of Drive API response bodies.', []),
+            'api_retries_total': ('Drive API attempts that retried a failure.', []),
+            'api_backoff_seconds_total': ('Time spent waiting before retries.', []),
+            'api_responses_total': ('Drive API responses by status.', []),
+        }
+        with self._lock:
+            for (phase, method), stats in sorted(self.methods.items()):
+                labels = f'phase="{phase}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                                        stats.buckets):
+                    cumulative += count
+                    lines.append(f'{name}_api_request_duration_seconds_bucket'
+                                 f'{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_api_request_duration_seconds_sum{{{labels}}} '
+                             f'{stats.seconds:.6f}')
+                lines.append(f'{name}_api_request_duration_seconds_count{{{labels}}} '
+                             f'{cumulative}')
+                counters['api_response_bytes_total'][1].append(
+                    f'{{{labels}}} {stats.response_bytes}')
+                counters['api_retries_total'][1].append(f'{{{labels}}} {stats.retries}')
+                counters['api_backoff_seconds_total'][1].append(
+                    f'{{{labels}}} {stats.backoff_seconds:.6f}')
+                for status, count in sorted(stats.statuses.items(), key=lambda item: str(item[0])):
+                    counters['api_responses_total'][1].append(
+                        f'{{{labels},status="{status}"}} {count}')
+            phase_seconds = sorted(self.phase_seconds.items())
+
+        for suffix, (help_text, samples) in counters.items():
+            lines.append(f'# HELP {name}_{suffix} {help_text}')
+            lines.append(f'# TYPE {name}_{suffix} counter')
+            lines.extend(f'{name}_{suffix}{sample}' for sample in samples)
+        lines.append(f'# HELP {name}_phase_duration_seconds Wall time of each pipeline phase.')
+        lines.append(f'# TYPE {name}_phase_duration_seconds gauge')
+        lines.extend(f'{name}_phase_duration_seconds{{phase="{phase}"}} {seconds:.6f}'
+                     for phase, seconds in phase_seconds)
+        lines.append(f'# HELP {name}_last_run_timestamp_seconds End time of the last run.')
+        lines.append(f'# TYPE {name}_last_run_timestamp_seconds gauge')
+        lines.append(f'{name}_last_run_timestamp_seconds {time.time():.0f}')
+        return lines
+
+    def write(self, json_path=METRICS_JSON_PATH, textfile_path=METRICS_TEXTFILE_PATH):
+        """
+        Ends the current phase and writes the JSON summary and the Prometheus textfile.
+
+        The textfile is written to a temporary file and renamed, so a scrape never
+        reads a half-written file.
+
+        Args:
+            json_path (str): The path to the JSON summary (None to skip).
+            textfile_path (str): The path to the Prometheus textfile (None to skip).
+        """
+        self.start_phase('done')
+        if json_path:
+            with open(json_path, 'w', encoding='utf-8') as output_file:
+                json.dump(self.summary(), output_file, indent=2)
+        if textfile_path:
+            temporary_path = f'{textfile_path}.{os.getpid()}.tmp'
+            with open(temporary_path, 'w', encoding='utf-8') as output_file:
+                output_file.write('\n'.join(self.prometheus_lines()) + '\n')
+            os.replace(temporary_path, textfile_path)
+
+    def log_summary(self):
+        """
+        Logs one line per phase and method: calls, mean latency, bytes, retries and errors.
+        """
+        with self._lock:
+            items = sorted(self.methods.items())
+            for (phase, method), stats in items:
+                errors = sum(count for status, count in stats.statuses.items() if status != 200)
+                timed = sum(stats.buckets)
+                mean = stats.seconds / timed if timed else 0.0
+                logging.info("API METRICS %s %s: %d calls, %.3fs mean, %d bytes, %d retries "
+                             "(%.1fs backoff), %d errors", phase, method, stats.calls, mean,
+                             stats.response_bytes, stats.retries, stats.backoff_seconds, errors)
+
+# The metrics every Drive call in a run is recorded in
+api_metrics = ApiMetrics()
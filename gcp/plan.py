@@ -0,0 +1,288 @@
+'''
+Copy plans: what a copy will create and copy and what it will cost in API calls
+and time, written by a dry run and executed later without listing the source again.
+'''
+import math
+import json
+import time
+import logging
+from collections import Counter
+from gcp.batch import BATCH_SIZE, execute_batched
+from gcp.journal import KIND_FILE, KIND_FOLDER
+from gcp.listing import MIME_FOLDER, PAGE_SIZE
+from gcp.progress import item_size
+from gcp.snapshot import TreeSnapshot
+
+# Default location of the plan file
+COPY_PLAN_PATH = './outputs/copy-plan.json'
+# Format of the plan file - plans of another version are refused
+PLAN_VERSION = 1
+# Per-request latency assumed when the dry run made no network requests (e.g. all cached)
+DEFAULT_LATENCY_SECONDS = 0.2
+# Number of batch requests prepared at a time when executing a plan
+PLAN_CHUNK_BATCHES = 10
+
+# Define a function to plan the copy of a snapshot
+def build_copy_plan(snapshot, destination_folder_id):
+    """
+    Lists the folders to create and the files to copy, parents before children.
+
+    Args:
+        snapshot (TreeSnapshot): The snapshot of the source tree.
+        destination_folder_id (str): The id for the destination folder.
+
+    Returns:
+        plan (dict): The source and destination roots, the folders and files (each item with
+            the ID of its source parent) and their totals.
+    """
+    folders = []
+    files = []
+    # Breadth-first, so every folder comes after its parent
+    pending = [snapshot.root_id]
+    for parent_id in pending:
+        for child_id in snapshot.children.get(parent_id, []):
+            item = {key: value for key, value in snapshot.items[child_id].items()
+                    if key != 'parents'}
+            item['parent'] = parent_id
+            if snapshot.is_folder(child_id):
+                folders.append(item)
+                pending.append(child_id)
+            else:
+                files.append(item)
+    return {
+        'version': PLAN_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'source_id': snapshot.root_id,
+        'source_name': snapshot.root_name,
+        'destination_id': destination_folder_id,
+        'totals': {
+            'folders': len(folders),
+            'files': len(files),
+            'bytes': sum(item_size(file) for file in files),
+        },
+        'folders': folders,
+        'files': files,
+    }
+
+# Define a function to group the planned folders by depth
+def plan_levels(plan):
+    """
+    Groups the planned folders by depth below the source root.
+
+    Args:
+        plan (dict): The plan from build_copy_plan (folders in breadth-first order).
+
+    Returns:
+        levels (list): The lists of folders one level below the root, two levels, ...
+    """
+    depth = {plan['source_id']: 0}
+    levels = []
+    for folder in plan['folders']:
+        depth[folder['id']] = depth[folder['parent']] + 1
+        if depth[folder['id']] > len(levels):
+            levels.append([])
+        levels[depth[folder['id']] - 1].append(folder)
+    return levels
+
+# Define a function to estimate what a plan costs with every copy engine
+def estimate_copy_cost(plan, latency=DEFAULT_LATENCY_SECONDS, batch_size=BATCH_SIZE,
+                       copy_workers=1):
+    """
+    Estimates the API calls, HTTP requests and run time of copying a plan with each engine.
+
+    The engines are those a run can be started with: --copy-engine sequential
+    (copy_child_objects, batching its writes by batch_size), --copy-engine
+    async, and --plan. Every HTTP request is assumed to take the measured
+    latency, batch requests included, and requests are assumed to be sent one
+    at a time except by the async engine, which keeps copy_workers in flight.
+    Batches hold more work than a single call, so batched estimates are a
+    lower bound.
+
+    Args:
+        plan (dict): The plan from build_copy_plan.
+        latency (float): The measured mean latency of one request, in seconds.
+        batch_size (int): The maximum number of calls per batch request.
+        copy_workers (int): The number of concurrent file copies of the async engine.
+
+    Returns:
+        estimate (dict): The latency and, per engine (sequential, async and plan), the API
+            calls, HTTP requests and seconds.
+    """
+    files_in = Counter(file['parent'] for file in plan['files'])
+    folders_in = Counter(folder['parent'] for folder in plan['folders'])
+    folder_ids = [plan['source_id']] + [folder['id'] for folder in plan['folders']]
+
+    def pages(num_items):
+        return max(1, math.ceil(num_items / PAGE_SIZE))
+
+    def batches(num_calls):
+        return math.ceil(num_calls / batch_size)
+
+    # copy_child_objects lists every folder twice (files, then subfolders), the async pipeline once
+    list_twice = sum(pages(files_in[folder_id]) + pages(folders_in[folder_id])
+                     for folder_id in folder_ids)
+    list_once = sum(pages(files_in[folder_id] + folders_in[folder_id])
+                    for folder_id in folder_ids)
+    writes = len(plan['folders']) + len(plan['files'])
+
+    # A plan creates one level of folders at a time, then copies every file
+    levels = plan_levels(plan)
+
+    requests = {
+        'sequential': list_twice + sum(batches(files_in[folder_id])
+                                       + batches(folders_in[folder_id])
+                                       for folder_id in folder_ids),
+        'async': list_once + writes,
+        'plan': sum(batches(len(level)) for level in levels) + batches(len(plan['files'])),
+    }
+    calls = {
+        'sequential': list_twice + writes,
+        'async': list_once + writes,
+        'plan': writes,
+    }
+    concurrency = {'sequential': 1, 'async': max(1, copy_workers), 'plan': 1}
+    return {
+        'latency_seconds': latency,
+        'engines': {engine: {'calls': calls[engine], 'requests': requests[engine],
+                             'seconds': requests[engine] * latency / concurrency[engine]}
+                    for engine in requests},
+    }
+
+# Define a function to write a plan file
+def write_plan(plan, path=COPY_PLAN_PATH):
+    """
+    Writes a plan to a JSON file.
+
+    Args:
+        plan (dict): The plan from build_copy_plan.
+        path (str): The path to the plan file.
+    """
+    with open(path, 'w', encoding='utf-8') as output_file:
+        json.dump(plan, output_file)
+
+# Define a function to read a plan file
+def load_plan(path=COPY_PLAN_PATH):
+    """
+    Reads a plan file.
+
+    Args:
+        path (str): The path to the plan file.
+
+    Returns:
+        plan (dict): The plan.
+
+    Raises:
+        ValueError: If the file was written by another version of the planner.
+    """
+    with open(path, 'r', encoding='utf-8') as input_file:
+        plan = json.load(input_file)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f"Plan {path} has version {plan.get('version')}, "
+                         f"expected {PLAN_VERSION}")
+    return plan
+
+# Define a function to restore the source snapshot of a plan
+def plan_snapshot(plan):
+    """
+    Rebuilds the source snapshot a plan was made from, for the reports and validation.
+
+    Args:
+        plan (dict): The plan.
+
+    Returns:
+        snapshot (TreeSnapshot): The snapshot of the source tree.
+    """
+    snapshot = TreeSnapshot(plan['source_id'], plan.get('source_name'))
+    for item in plan['folders'] + plan['files']:
+        snapshot.add_item({key: value for key, value in item.items() if key != 'parent'},
+                          item['parent'])
+    return snapshot
+
+# Disable pylint for no-member at the function level
+# pylint: disable=no-member
+
+# Define a function to copy a tree as planned
+def execute_copy_plan(plan, drive_service, batch_size=BATCH_SIZE, journal=None, progress=None,
+                      dedup=None, transfer=None):
+    """
+    Creates the planned folders level by level, then copies the planned files, all in batches.
+
+    Nothing is listed: the plan already holds every item and its parent. Items
+    under a folder that could not be created are counted as failed.
+
+    Args:
+        plan (dict): The plan.
+        drive_service: The Google Drive service object.
+        batch_size (int): The maximum number of calls per batch request.
+        journal (CopyJournal): The checkpoint journal of completed items (optional).
+        progress (CopyProgress): The progress every planned item is counted in (optional).
+        dedup (DuplicateIndex): The index duplicate files are handed to instead of being copied
+            (optional).
+        transfer (StreamingTransfer): The transfer files are handed to when their copy is
+            denied (optional).
+
+    Returns:
+        stats (dict): The number of folders created, files copied, items skipped and failures.
+    """
+    stats = {'folders': 0, 'files': 0, 'skipped': 0, 'failed': 0}
+    destination = {plan['source_id']: plan['destination_id']}
+
+    def pending_requests(items, make_request):
+        # Items done by an interrupted run are skipped, items of failed folders fail
+        requests = []
+        for item in items:
+            done_id = journal.lookup(item['id']) if journal is not None else None
+            if done_id is not None:
+                destination[item['id']] = done_id
+                stats['skipped'] += 1
+                if progress is not None:
+                    progress.skip(1, item_size(item))
+            elif item['parent'] not in destination:
+                stats['failed'] += 1
+                if progress is not None:
+                    progress.fail(1)
+            elif dedup is None or not dedup.defer(item, destination[item['parent']]):
+                # Duplicates are left to the dedup index
+                requests.append((item, make_request(item, destination[item['parent']])))
+        return requests
+
+    def execute(requests, kind):
+        responses, failures = execute_batched(drive_service, requests, batch_size)
+        if transfer is not None and kind == KIND_FILE:
+            # Denied copies are counted once they are transferred
+            failures = [(item, error) for item, error in failures
+                        if not transfer.defer(item, destination[item['parent']], error)]
+        for item, error in failures:
+            logging.error('COPY FAILED: %s: %s', item['name'], error)
+        for item, response in responses:
+            destination[item['id']] = response['id']
+            if journal is not None:
+                journal.record(item['id'], response['id'], kind)
+        stats['failed'] += len(failures)
+        stats['folders' if kind == KIND_FOLDER else 'files'] += len(responses)
+        if progress is not None:
+            progress.advance(len(responses), sum(item_size(item) for item, _ in responses))
+            progress.fail(len(failures))
+
+    files_resource = drive_service.files()
+
+    def create_folder(folder, dest_parent_id):
+        return files_resource.create(fields='id', body={
+            'name': folder['name'], 'parents': [dest_parent_id], 'mimeType': MIME_FOLDER})
+
+    def copy_file(file, dest_parent_id):
+        return files_resource.copy(fileId=file['id'], fields='id',
+                                   body={'name': file['name'], 'parents': [dest_parent_id]})
+
+    # Requests are prepared a chunk at a time, so a huge plan is not held as request objects
+    chunk_size = batch_size * PLAN_CHUNK_BATCHES
+    # Each level of folders only needs the levels above it
+    for level in plan_levels(plan):
+        for start in range(0, len(level), chunk_size):
+            execute(pending_requests(level[start:start + chunk_size], create_folder), KIND_FOLDER)
+    for start in range(0, len(plan['files']), chunk_size):
+        execute(pending_requests(plan['files'][start:start + chunk_size], copy_file), KIND_FILE)
+    return stats
+
+# Enable pylint for no-member again
+# pylint: enable=no-member
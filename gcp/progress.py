@@ -0,0 +1,253 @@
+'''
+Live progress of a copy: items and bytes copied, rolling throughput and ETA,
+shown on a status line when attached to a terminal and logged periodically.
+'''
+import sys
+import time
+import logging
+import threading
+from collections import deque
+
+# Seconds between two updates of the status line (and throughput samples)
+REFRESH_SECONDS = 0.5
+# Seconds between two progress log records
+LOG_SECONDS = 30.0
+# Seconds of history the rolling throughput is computed over
+WINDOW_SECONDS = 60.0
+
+# Bytes in the MB of the status line and log records
+MEGABYTE = 1024 * 1024
+
+# Define a function to get the size of an item
+def item_size(item):
+    """
+    Returns the size in bytes of a Drive item (0 for folders and Google documents).
+
+    Args:
+        item (dict): The Drive file resource.
+
+    Returns:
+        size (int): The size in bytes.
+    """
+    return int(item.get('size') or 0)
+
+# Define a function to format a number of bytes
+def format_bytes(num_bytes):
+    """
+    Formats a number of bytes with a binary unit, e.g. '1.5 MB'.
+
+    Args:
+        num_bytes (float): The number of bytes.
+
+    Returns:
+        text (str): The formatted size.
+    """
+    if abs(num_bytes) < 1024:
+        return f'{num_bytes:.0f} B'
+    for unit in ('KB', 'MB', 'GB'):
+        num_bytes /= 1024
+        if abs(num_bytes) < 1024:
+            return f'{num_bytes:.1f} {unit}'
+    return f'{num_bytes / 1024:.1f} TB'
+
+# Define a function to format a duration
+def format_duration(seconds):
+    """
+    Formats a duration as H:MM:SS, or '--:--:--' if it is not known.
+
+    Args:
+        seconds (float): The duration in seconds (optional).
+
+    Returns:
+        text (str): The formatted duration.
+    """
+    if seconds is None:
+        return '--:--:--'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
+
+class CopyProgress:
+    """
+    Counts copied items and bytes against the totals known from the source snapshot.
+
+    Counting is a few additions under a lock; the clock is compared on every
+    update, but throughput, ETA and output are only computed every
+    refresh_seconds, so the copy loop pays next to nothing for progress.
+
+    Attributes:
+        total_items (int): The number of files and folders to copy.
+        total_bytes (int): The total size of the files to copy.
+        items (int): The number of files copied and folders created.
+        bytes (int): The total size of the files copied.
+        skipped (int): The number of items done by an earlier run or already up to date.
+        failed (int): The number of items that could not be copied.
+        interactive (bool): Whether the status line is drawn on the stream.
+    """
+
+    def __init__(self, total_items=0, total_bytes=0, stream=None, refresh_seconds=REFRESH_SECONDS,
+                 log_seconds=LOG_SECONDS, window_seconds=WINDOW_SECONDS, clock=time.monotonic):
+        self.total_items = total_items
+        self.total_bytes = total_bytes
+        self.stream = stream if stream is not None else sys.stderr
+        isatty = getattr(self.stream, 'isatty', None)
+        self.interactive = bool(isatty and isatty())
+        self.refresh_seconds = refresh_seconds
+        self.log_seconds = log_seconds
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.items = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.skipped_bytes = 0
+        self.failed = 0
+        self.started = clock()
+        # (time, items, bytes) samples of the last window_seconds
+        self._samples = deque([(self.started, 0, 0)])
+        self._next_refresh = self.started + refresh_seconds
+        self._next_log = self.started + log_seconds
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.finish()
+
+    def advance(self, items=1, num_bytes=0):
+        """
+        Counts items copied by this run.
+
+        Args:
+            items (int): The number of files copied or folders created.
+            num_bytes (int): The total size of the files.
+        """
+        with self._lock:
+            self.items += items
+            self.bytes += num_bytes
+            self._tick()
+
+    def skip(self, items=1, num_bytes=0):
+        """
+        Counts items that need no copy, without counting them towards the throughput.
+
+        Args:
+            items (int): The number of items done by an earlier run or already up to date.
+            num_bytes (int): The total size of the files.
+        """
+        with self._lock:
+            self.skipped += items
+            self.skipped_bytes += num_bytes
+            self._tick()
+
+    def fail(self, items=1):
+        """
+        Counts items that could not be copied.
+
+        Args:
+            items (int): The number of failed items.
+        """
+        with self._lock:
+            self.failed += items
+            self._tick()
+
+    def _tick(self):
+        now = self.clock()
+        if now >= self._next_refresh:
+            self._refresh(now)
+
+    def _refresh(self, now):
+        """
+        Samples the counters, redraws the status line and logs a record when one is due.
+        """
+        self._next_refresh = now + self.refresh_seconds
+        self._samples.append((now, self.items, self.bytes))
+        while len(self._samples) > 2 and self._samples[1][0] <= now - self.window_seconds:
+            self._samples.popleft()
+        status = self._status(now)
+        if self.interactive:
+            self.stream.write('\r' + self.status_line(status) + '\033[K')
+            self.stream.flush()
+        if now >= self._next_log:
+            self._next_log = now + self.log_seconds
+            self._log(status)
+
+    def _status(self, now):
+        oldest_time, oldest_items, oldest_bytes = self._samples[0]
+        elapsed = now - oldest_time
+        items_per_second = (self.items - oldest_items) / elapsed if elapsed > 0 else 0.0
+        bytes_per_second = (self.bytes - oldest_bytes) / elapsed if elapsed > 0 else 0.0
+        done = self.items + self.skipped + self.failed
+        remaining = max(self.total_items - done, 0)
+        eta_seconds = None
+        if remaining == 0:
+            eta_seconds = 0.0
+        elif items_per_second > 0:
+            eta_seconds = remaining / items_per_second
+        return {
+            'items': self.items,
+            'bytes': self.bytes,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'done': done,
+            'done_bytes': self.bytes + self.skipped_bytes,
+            'total_items': self.total_items,
+            'total_bytes': self.total_bytes,
+            'items_per_second': items_per_second,
+            'bytes_per_second': bytes_per_second,
+            'elapsed_seconds': now - self.started,
+            'eta_seconds': eta_seconds,
+        }
+
+    def status(self):
+        """
+        Returns the counters, rolling throughput and ETA.
+
+        Returns:
+            status (dict): items, bytes, skipped, failed, done, done_bytes, total_items, total_bytes,
+                items_per_second, bytes_per_second, elapsed_seconds and eta_seconds (None
+                until there is a throughput to estimate from).
+        """
+        with self._lock:
+            return self._status(self.clock())
+
+    @staticmethod
+    def status_line(status):
+        """
+        Formats a status as one line, e.g. '1200/5000 items (24.0%) | 1.2 GB/4.8 GB | ...'.
+        """
+        percent = 100.0 * status['done'] / status['total_items'] if status['total_items'] else 0.0
+        line = (f"{status['done']}/{status['total_items']} items ({percent:.1f}%) | "
+                f"{format_bytes(status['done_bytes'])}")
+        if status['total_bytes']:
+            line += f"/{format_bytes(status['total_bytes'])}"
+        line += (f" | {status['items_per_second']:.1f} items/s, "
+                 f"{format_bytes(status['bytes_per_second'])}/s | "
+                 f"ETA {format_duration(status['eta_seconds'])}")
+        if status['failed']:
+            line += f" | {status['failed']} failed"
+        return line
+
+    @staticmethod
+    def _log(status):
+        # key=value pairs, with the raw values attached to the record for structured handlers
+        eta = status['eta_seconds']
+        logging.info("PROGRESS done=%d total_items=%d copied=%d skipped=%d failed=%d bytes=%d "
+                     "total_bytes=%d items_per_second=%.2f mb_per_second=%.3f eta_seconds=%s",
+                     status['done'], status['total_items'], status['items'], status['skipped'],
+                     status['failed'], status['bytes'], status['total_bytes'],
+                     status['items_per_second'], status['bytes_per_second'] / MEGABYTE,
+                     'unknown' if eta is None else f'{eta:.0f}', extra={'progress': status})
+
+    def finish(self):
+        """
+        Ends the status line and logs the final record, with the throughput of the whole run.
+        """
+        with self._lock:
+            now = self.clock()
+            self._samples = deque([(self.started, 0, 0)])
+            status = self._status(now)
+            if self.interactive:
+                self.stream.write('\r' + self.status_line(status) + '\033[K\n')
+                self.stream.flush()
+            self._log(status)
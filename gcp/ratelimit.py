@@ -0,0 +1,262 @@
+'''
+A shared rate controller for Drive API calls: jittered exponential backoff that
+honors Retry-After, and AIMD adjustment of the number of calls in flight.
+'''
+import time
+import random
+import logging
+import threading
+import email.utils
+from googleapiclient.errors import HttpError
+from gcp.cache import CachedRequest
+from gcp.metrics import api_metrics
+
+# Errors worth retrying: rate limits and transient server errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+# Backoff defaults
+MAX_RETRIES = 5
+BASE_DELAY = 1.0
+MAX_DELAY = 64.0
+
+# Concurrency defaults
+INITIAL_CONCURRENCY = 16
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 100
+# Minimum time between two multiplicative decreases, so one burst of errors halves the limit once
+DECREASE_INTERVAL = 1.0
+
+# Define a function to get the HTTP status of an error
+def error_status(error):
+    """
+    Returns the HTTP status of a Drive error, or None for other exceptions.
+
+    Args:
+        error (Exception): The error raised by a Drive call.
+
+    Returns:
+        status (int): The HTTP status code.
+    """
+    if not isinstance(error, HttpError):
+        return None
+    return getattr(error.resp, 'status', None)
+
+# Define a function to decide whether an error is a quota error
+def is_rate_limit_error(error):
+    """
+    Returns whether an error means the caller is going too fast (429 or a 403 rate limit).
+
+    Args:
+        error (Exception): The error raised by a Drive call.
+
+    Returns:
+        bool: True for rate limit errors.
+    """
+    status = error_status(error)
+    if status == 429:
+        return True
+    if status == 403:
+        reasons = {detail.get('reason') for detail in (error.error_details or [])
+                   if isinstance(detail, dict)}
+        return bool(reasons & RETRYABLE_REASONS)
+    return False
+
+# Define a function to decide whether a failed call may succeed later
+def is_retryable_error(error):
+    """
+    Returns whether an error is a rate limit or a transient server error.
+
+    Args:
+        error (Exception): The error raised by (or passed back for) a Drive call.
+
+    Returns:
+        bool: True if the call should be retried.
+    """
+    return error_status(error) in RETRYABLE_STATUSES or is_rate_limit_error(error)
+
+# Define a function to read the Retry-After header of an error
+def retry_after_seconds(error):
+    """
+    Returns the delay requested by the server's Retry-After header, if any.
+
+    Args:
+        error (Exception): The error raised by a Drive call.
+
+    Returns:
+        delay (float): The number of seconds to wait, or None if not provided.
+    """
+    resp = getattr(error, 'resp', None)
+    value = resp.get('retry-after') if isinstance(resp, dict) else None
+    if not isinstance(value, str):
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+class RateController:
+    """
+    Runs Drive calls with retries and an adaptive limit on the number in flight.
+
+    Retryable failures are retried with full-jitter exponential backoff, or after
+    the server's Retry-After delay. The concurrency limit grows by one call per
+    limit's worth of successes and halves on rate limit errors (AIMD), so
+    parallel runs settle at the highest throughput the quota allows.
+
+    Attributes:
+        max_retries (int): The number of retries after the first attempt.
+        base_delay (float): The backoff delay of the first retry, in seconds.
+        max_delay (float): The largest backoff delay, in seconds.
+        limit (float): The current number of calls allowed in flight.
+        stats (dict): The number of calls, retries and rate limit errors seen.
+        metrics (ApiMetrics): The per-call metrics every attempt is recorded in.
+    """
+
+    def __init__(self, max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                 initial_concurrency=INITIAL_CONCURRENCY, min_concurrency=MIN_CONCURRENCY,
+                 max_concurrency=MAX_CONCURRENCY, sleep=time.sleep, metrics=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limit = float(initial_concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.sleep = sleep
+        self.metrics = metrics or api_metrics
+        self.stats = {'calls': 0, 'retries': 0, 'rate_limited': 0}
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def _acquire(self):
+        with self._condition:
+            while self._in_flight >= max(self.min_concurrency, int(self.limit)):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def _release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def record_success(self):
+        """
+        Additive increase: one more call in flight per limit's worth of successes.
+        """
+        with self._condition:
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            self._condition.notify()
+
+    def record_error(self, error):
+        """
+        Multiplicative decrease: halves the limit on a rate limit error.
+
+        Args:
+            error (Exception): The error raised by (or passed back for) a Drive call.
+        """
+        if not is_rate_limit_error(error):
+            return
+        with self._condition:
+            self.stats['rate_limited'] += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= DECREASE_INTERVAL:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                self._last_decrease = now
+                logging.warning("Drive rate limit hit, concurrency reduced to %d", int(self.limit))
+
+    def backoff_delay(self, attempt, error):
+        """
+        Returns how long to wait before the given retry attempt.
+
+        Args:
+            attempt (int): The number of the retry (starting at 0).
+            error (Exception): The error that caused the retry.
+
+        Returns:
+            delay (float): The delay in seconds.
+        """
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))  # nosec B311
+
+    def call(self, function, *args, **kwargs):
+        """
+        Calls function with retries, holding one concurrency slot per attempt.
+
+        Args:
+            function (callable): The blocking call, e.g. request.execute.
+            *args: The positional arguments of the call.
+            **kwargs: The keyword arguments of the call.
+
+        Returns:
+            result: The result of the call.
+        """
+        # Calls of request.execute are recorded under the request's Drive method
+        method = self.metrics.meter(getattr(function, '__self__', None))
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            status = 'error'
+            started = time.perf_counter()
+            try:
+                self.stats['calls'] += 1
+                result = function(*args, **kwargs)
+                status = 200
+            except HttpError as error:
+                status = error_status(error) or 'error'
+                self.record_error(error)
+                if attempt == self.max_retries or not is_retryable_error(error):
+                    raise
+                delay = self.backoff_delay(attempt, error)
+                logging.warning("Retrying Drive call in %.1fs (%d/%d): %s",
+                                delay, attempt + 1, self.max_retries, error)
+                self.stats['retries'] += 1
+            else:
+                self.record_success()
+                return result
+            finally:
+                self.metrics.observe(method, status, time.perf_counter() - started,
+                                     retry=attempt > 0)
+                self._release()
+            self.metrics.observe_backoff(method, delay)
+            self.sleep(delay)
+        return None  # Unreachable: the last attempt returns or raises
+
+    def execute(self, request):
+        """
+        Executes a Drive request (anything with an execute() method) through the controller.
+
+        Args:
+            request: The request to execute, e.g. files().list(...).
+
+        Returns:
+            response (dict): The decoded response.
+        """
+        if isinstance(request, CachedRequest):
+            # Cache hits make no Drive call, so they are neither rate limited nor recorded
+            response = request.lookup()
+            if response is not None:
+                return response
+            return self.call(request.fetch)
+        return self.call(request.execute)
+
+# The controller every Drive call in a run goes through
+default_controller = RateController()
+
+# Define a function to execute a request through the shared controller
+def execute_request(request, controller=None):
+    """
+    Executes a Drive request with retries and adaptive concurrency.
+
+    Args:
+        request: The request to execute, e.g. files().list(...).
+        controller (RateController): The controller to use (optional, defaults to the shared one).
+
+    Returns:
+        response (dict): The decoded response.
+    """
+    return (controller or default_controller).execute(request)
@@ -0,0 +1,597 @@
+'''
+In-memory snapshots of Google Drive folder trees, built with a single traversal.
+'''
+import json
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from gcp.filters import filter_fields
+from gcp.listing import MIME_FOLDER, ThreadLocalServices, list_files
+from gcp.progress import item_size
+from gcp.ratelimit import execute_request
+
+# Fields stored for every item in a snapshot (size and md5Checksum feed the fingerprints)
+SNAPSHOT_FIELDS = 'files(id,name,mimeType,size,md5Checksum)'
+# Breadth-first listings split children back out by their parents
+BFS_FIELDS = 'files(id,name,mimeType,size,md5Checksum,parents)'
+# Corpus-wide enumeration rebuilds the tree from parent pointers
+CORPUS_FIELDS = 'files(id,parents,mimeType,name,size,md5Checksum)'
+
+# Conservative bound on the length of an OR-combined q parameter
+MAX_QUERY_LENGTH = 5000
+
+# Default number of folders listed at once by the concurrent traversal
+DEFAULT_WORKERS = 8
+
+# Define a function to describe an item for fingerprints and validation
+def item_signature(item):
+    """
+    Returns the parts of an item that a faithful copy shares with its source.
+
+    Args:
+        item (dict): The Drive file resource.
+
+    Returns:
+        signature (list): The name, mimeType, size and md5Checksum (empty if not available).
+    """
+    return [item['name'], item['mimeType'], item.get('size', ''), item.get('md5Checksum', '')]
+
+class TreeSnapshot:
+    """
+    An in-memory copy of a folder tree that every report is computed from.
+
+    Attributes:
+        root_id (str): The ID of the folder the snapshot was taken of.
+        root_name (str): The name of the root folder (optional).
+        items (dict): The item resources keyed by ID.
+        children (dict): The child IDs keyed by parent folder ID.
+        parents (dict): The parent folder IDs keyed by item ID.
+
+    Folder fingerprints are cached. A change only clears the fingerprints of
+    the folders above it, so they are recomputed in O(changed) after a refresh.
+    """
+
+    def __init__(self, root_id, root_name=None):
+        self.root_id = root_id
+        self.root_name = root_name
+        self.items = {}
+        self.children = {root_id: []}
+        self.parents = {}
+        self._counts = None
+        self._fingerprints = {}
+
+    def add_item(self, item, parent_id):
+        """
+        Adds an item (file or folder) under a parent folder.
+
+        Args:
+            item (dict): The Drive file resource (at least id, name and mimeType).
+            parent_id (str): The ID of the parent folder.
+        """
+        self.items[item['id']] = item
+        self.children.setdefault(parent_id, []).append(item['id'])
+        self.parents.setdefault(item['id'], []).append(parent_id)
+        if item['mimeType'] == MIME_FOLDER:
+            self.children.setdefault(item['id'], [])
+        self._counts = None
+        self._invalidate_fingerprints(parent_id)
+
+    def update_item(self, item, parent_ids):
+        """
+        Replaces an item's resource and moves it under the given parents, keeping its children.
+
+        Args:
+            item (dict): The Drive file resource (at least id, name and mimeType).
+            parent_ids (list): The IDs of the parent folders.
+        """
+        item_id = item['id']
+        for parent_id in self.parents.pop(item_id, []):
+            siblings = self.children.get(parent_id, [])
+            if item_id in siblings:
+                siblings.remove(item_id)
+            self._invalidate_fingerprints(parent_id)
+        self.items[item_id] = item
+        for parent_id in parent_ids:
+            self.children.setdefault(parent_id, []).append(item_id)
+            self.parents.setdefault(item_id, []).append(parent_id)
+            self._invalidate_fingerprints(parent_id)
+        if item['mimeType'] == MIME_FOLDER:
+            self.children.setdefault(item_id, [])
+        self._counts = None
+
+    def is_ancestor(self, item_id, folder_id):
+        """
+        Returns whether an item is the given folder or one of the folders above it.
+
+        Args:
+            item_id (str): The ID of the item.
+            folder_id (str): The ID of the folder.
+
+        Returns:
+            bool: True if folder_id is item_id or lies somewhere below it.
+        """
+        seen = set()
+        pending = [folder_id]
+        while pending:
+            current_id = pending.pop()
+            if current_id == item_id:
+                return True
+            if current_id not in seen:
+                seen.add(current_id)
+                pending.extend(self.parents.get(current_id, []))
+        return False
+
+    def remove_item(self, item_id):
+        """
+        Removes an item from every parent folder, and everything below it if it is a folder.
+
+        Args:
+            item_id (str): The ID of the item.
+        """
+        for parent_id in self.parents.pop(item_id, []):
+            siblings = self.children.get(parent_id, [])
+            if item_id in siblings:
+                siblings.remove(item_id)
+            self._invalidate_fingerprints(parent_id)
+        pending = [item_id]
+        while pending:
+            removed_id = pending.pop()
+            self.items.pop(removed_id, None)
+            self._fingerprints.pop(removed_id, None)
+            for child_id in self.children.pop(removed_id, []):
+                self.parents.pop(child_id, None)
+                pending.append(child_id)
+        self._counts = None
+
+    def to_dict(self):
+        """
+        Returns the snapshot as a JSON-serializable dict.
+
+        Returns:
+            data (dict): The root, items and children of the snapshot.
+        """
+        return {
+            'root_id': self.root_id,
+            'root_name': self.root_name,
+            'items': self.items,
+            'children': self.children,
+            'fingerprints': self._fingerprints,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a snapshot from the output of to_dict.
+
+        Args:
+            data (dict): The root, items and children of the snapshot.
+
+        Returns:
+            snapshot (TreeSnapshot): The restored snapshot.
+        """
+        snapshot = cls(data['root_id'], data.get('root_name'))
+        snapshot.items = data['items']
+        snapshot.children = data['children']
+        snapshot._fingerprints = data.get('fingerprints', {})  # pylint: disable=protected-access
+        for parent_id, child_ids in snapshot.children.items():
+            for child_id in child_ids:
+                snapshot.parents.setdefault(child_id, []).append(parent_id)
+        return snapshot
+
+    def is_folder(self, item_id):
+        """
+        Returns whether the given ID is a folder in the snapshot.
+
+        Args:
+            item_id (str): The ID of the item.
+
+        Returns:
+            bool: True if the item is a folder (or the root).
+        """
+        return item_id in self.children
+
+    def fingerprint(self, folder_id=None):
+        """
+        Returns the content fingerprint of a folder, computed bottom-up from its children.
+
+        Two folders have the same fingerprint when their trees have the same
+        names, mime types, sizes and checksums, whatever their IDs. Only the
+        folders whose fingerprints were cleared by a change are recomputed.
+
+        Args:
+            folder_id (str): The ID of the folder (optional, defaults to the root).
+
+        Returns:
+            fingerprint (str): The hex SHA-256 digest of the folder's tree.
+        """
+        folder_id = folder_id or self.root_id
+        # Post-order over the folders without a cached fingerprint, without recursion
+        stack = [(folder_id, False)]
+        while stack:
+            current_id, expanded = stack.pop()
+            if current_id in self._fingerprints:
+                continue
+            child_ids = self.children.get(current_id, [])
+            if not expanded:
+                stack.append((current_id, True))
+                stack.extend((child_id, False) for child_id in child_ids
+                             if self.is_folder(child_id) and child_id not in self._fingerprints)
+                continue
+            entries = sorted(item_signature(self.items[child_id])
+                             + [self._fingerprints.get(child_id, '')]
+                             for child_id in child_ids)
+            self._fingerprints[current_id] = hashlib.sha256(
+                json.dumps(entries).encode('utf-8')).hexdigest()
+        return self._fingerprints[folder_id]
+
+    def _invalidate_fingerprints(self, folder_id):
+        """
+        Clears the fingerprints of a folder and of every folder above it.
+        """
+        # A cached folder implies cached descendants, so the walk stops at the first uncached one
+        pending = [folder_id]
+        while pending:
+            current_id = pending.pop()
+            if self._fingerprints.pop(current_id, None) is not None:
+                pending.extend(self.parents.get(current_id, []))
+
+    def child_folders(self, folder_id=None):
+        """
+        Returns the direct child folders of a folder, sorted by name.
+
+        Args:
+            folder_id (str): The ID of the folder (optional, defaults to the root).
+
+        Returns:
+            folders (list): The child folder resources.
+        """
+        folder_id = folder_id or self.root_id
+        folders = [self.items[child_id] for child_id in self.children.get(folder_id, [])
+                   if self.is_folder(child_id)]
+        return sorted(folders, key=lambda folder: (folder['name'].lower(), folder['name']))
+
+    def total_size(self):
+        """
+        Returns the total size in bytes of the files in the snapshot (Google documents have none).
+        """
+        return sum(item_size(item) for item in self.items.values())
+
+    def count_child_objects(self, folder_id=None):
+        """
+        Counts the files and folders below a folder, at any depth.
+
+        Args:
+            folder_id (str): The ID of the folder (optional, defaults to the root).
+
+        Returns:
+            num_files (int): The total number of files in the folder and its subfolders.
+            num_folders (int): The total number of folders in the folder and its subfolders.
+        """
+        if self._counts is None:
+            self._counts = self._compute_counts()
+        return self._counts.get(folder_id or self.root_id, (0, 0))
+
+    def _compute_counts(self):
+        """
+        Computes the recursive counts of every folder bottom-up in one pass.
+
+        Returns:
+            counts (dict): The (num_files, num_folders) tuples keyed by folder ID.
+        """
+        # Depth-first order without recursion, so deep trees cannot hit the recursion limit
+        order = []
+        stack = [self.root_id]
+        while stack:
+            folder_id = stack.pop()
+            order.append(folder_id)
+            stack.extend(child_id for child_id in self.children.get(folder_id, [])
+                         if self.is_folder(child_id))
+
+        counts = {}
+        for folder_id in reversed(order):
+            num_files = 0
+            num_folders = 0
+            for child_id in self.children.get(folder_id, []):
+                if self.is_folder(child_id):
+                    child_num_files, child_num_folders = counts[child_id]
+                    num_files += child_num_files
+                    num_folders += child_num_folders + 1
+                else:
+                    num_files += 1
+            counts[folder_id] = (num_files, num_folders)
+        return counts
+
+    def folder_report(self, folder_id=None):
+        """
+        Returns the rows of a folder report: the TOTAL row, then one row per child folder.
+
+        Args:
+            folder_id (str): The ID of the folder (optional, defaults to the root).
+
+        Returns:
+            rows (list): The [name, num_files, num_folders] rows.
+        """
+        total_num_files, total_num_folders = self.count_child_objects(folder_id)
+        rows = [['TOTAL', total_num_files, total_num_folders]]
+        for folder in self.child_folders(folder_id):
+            num_files, num_folders = self.count_child_objects(folder['id'])
+            rows.append([folder['name'], num_files, num_folders])
+        return rows
+
+# Define a function to add a listed item without listing any folder twice
+def add_listed_item(snapshot, item, parent_id, seen):
+    """
+    Adds a listed item under its parent and returns whether it is a folder still to be listed.
+
+    A folder with several parents appears under each of them but is listed
+    once. It is not added under a folder below it, so a cycle of parents
+    cannot make the snapshot a cycle.
+
+    Args:
+        snapshot (TreeSnapshot): The snapshot being built.
+        item (dict): The Drive file resource.
+        parent_id (str): The ID of the folder it was listed in.
+        seen (set): The IDs of the folders already queued for listing (updated in place).
+
+    Returns:
+        bool: True if the item is a folder seen for the first time.
+    """
+    if item['id'] in seen:
+        if not snapshot.is_ancestor(item['id'], parent_id):
+            snapshot.add_item(item, parent_id)
+        return False
+    snapshot.add_item(item, parent_id)
+    if item['mimeType'] != MIME_FOLDER:
+        return False
+    seen.add(item['id'])
+    return True
+
+# Disable pylint for no-member at the function level
+# pylint: disable=no-member
+
+# Define a function to build a snapshot one folder at a time
+def build_tree_snapshot_recursive(folder_id, drive_service, root_name=None, fields=SNAPSHOT_FIELDS,
+                                  item_filter=None):
+    """
+    Lists every folder under folder_id exactly once and returns the resulting snapshot.
+
+    Args:
+        folder_id (str): The ID of the root folder.
+        drive_service: The Google Drive service object.
+        root_name (str): The name of the root folder (optional).
+        fields (str): The partial response projection for each listed item.
+        item_filter (ItemFilter): The filter files must match to be included (optional).
+
+    Returns:
+        snapshot (TreeSnapshot): The snapshot of the folder tree.
+    """
+    if item_filter is not None:
+        fields = filter_fields(fields, item_filter)
+    snapshot = TreeSnapshot(folder_id, root_name)
+    seen = {folder_id}
+    pending = [folder_id]
+    while pending:
+        parent_id = pending.pop()
+        query = f"'{parent_id}' in parents and trashed = false"
+        if item_filter is not None:
+            query = item_filter.query(query)
+        # Drain the listing before descending so the service is not shared with a prefetch
+        for item in list(list_files(drive_service, query, fields=fields)):
+            if item_filter is not None and not item_filter.matches(item):
+                continue
+            if add_listed_item(snapshot, item, parent_id, seen):
+                pending.append(item['id'])
+    return snapshot
+
+# Define a function to split a level of folders into OR-combined queries
+def chunk_parent_queries(folder_ids, max_query_length=MAX_QUERY_LENGTH):
+    """
+    Groups folder IDs into queries of the form ('a' in parents or 'b' in parents ...).
+
+    Args:
+        folder_ids (list): The IDs of the folders to list children for.
+        max_query_length (int): The maximum length of each query string.
+
+    Yields:
+        chunk (list): The folder IDs covered by the query.
+        query (str): The combined query, excluding trashed items.
+    """
+    suffix = ') and trashed = false'
+    chunk = []
+    clauses = []
+    length = len(suffix) + 1
+    for folder_id in folder_ids:
+        clause = f"'{folder_id}' in parents"
+        # Account for the ' or ' separator between clauses
+        clause_length = len(clause) + (4 if clauses else 0)
+        if clauses and length + clause_length > max_query_length:
+            yield chunk, '(' + ' or '.join(clauses) + suffix
+            chunk, clauses, length = [], [], len(suffix) + 1
+            clause_length = len(clause)
+        chunk.append(folder_id)
+        clauses.append(clause)
+        length += clause_length
+    if clauses:
+        yield chunk, '(' + ' or '.join(clauses) + suffix
+
+# Define a function to build a snapshot level by level
+def build_tree_snapshot_bfs(folder_id, drive_service, root_name=None, fields=BFS_FIELDS,
+                            max_query_length=MAX_QUERY_LENGTH, item_filter=None):
+    """
+    Builds a snapshot breadth-first, listing the children of many folders per request.
+
+    Each level of the tree is listed with OR-combined parent queries, and the
+    children are assigned to their folders using their parents field, so the
+    number of requests grows with folders / chunk size instead of folders.
+
+    Args:
+        folder_id (str): The ID of the root folder.
+        drive_service: The Google Drive service object.
+        root_name (str): The name of the root folder (optional).
+        fields (str): The partial response projection for each item (must include parents).
+        max_query_length (int): The maximum length of each combined query.
+        item_filter (ItemFilter): The filter files must match to be included (optional).
+
+    Returns:
+        snapshot (TreeSnapshot): The snapshot of the folder tree.
+    """
+    restriction = ''
+    if item_filter is not None:
+        fields = filter_fields(fields, item_filter)
+        restriction = item_filter.restriction
+    snapshot = TreeSnapshot(folder_id, root_name)
+    seen = {folder_id}
+    level = [folder_id]
+    while level:
+        next_level = []
+        # The filter clauses count towards the length of every query
+        for chunk, query in chunk_parent_queries(level, max_query_length - len(restriction)):
+            chunk_ids = set(chunk)
+            for item in list_files(drive_service, query + restriction, fields=fields):
+                if item_filter is not None and not item_filter.matches(item):
+                    continue
+                for parent_id in item.get('parents', []):
+                    if parent_id in chunk_ids and add_listed_item(snapshot, item, parent_id,
+                                                                  seen):
+                        next_level.append(item['id'])
+        level = next_level
+    return snapshot
+
+# Define a function to build a snapshot with a pool of worker threads
+def build_tree_snapshot_concurrent(folder_id, drive_service, root_name=None, fields=SNAPSHOT_FIELDS,
+                                   service_factory=None, max_workers=DEFAULT_WORKERS,
+                                   item_filter=None):
+    """
+    Builds a snapshot by listing up to max_workers folders at the same time.
+
+    Every worker thread uses its own service object from service_factory. The
+    snapshot itself is only modified by the calling thread as listings complete.
+
+    Args:
+        folder_id (str): The ID of the root folder.
+        drive_service: The Google Drive service object (unused, workers build their own).
+        root_name (str): The name of the root folder (optional).
+        fields (str): The partial response projection for each listed item.
+        service_factory (callable): Creates a new service object for each worker thread.
+        max_workers (int): The number of folders listed concurrently.
+        item_filter (ItemFilter): The filter files must match to be included (optional).
+
+    Returns:
+        snapshot (TreeSnapshot): The snapshot of the folder tree.
+    """
+    del drive_service  # Shared clients are not thread-safe
+    if service_factory is None:
+        raise ValueError("The concurrent traversal requires a service_factory")
+    services = ThreadLocalServices(service_factory)
+    if item_filter is not None:
+        fields = filter_fields(fields, item_filter)
+
+    def list_children(parent_id):
+        query = f"'{parent_id}' in parents and trashed = false"
+        if item_filter is None:
+            return parent_id, list(list_files(services.get(), query, fields=fields))
+        return parent_id, [item for item in list_files(services.get(), item_filter.query(query),
+                                                       fields=fields)
+                           if item_filter.matches(item)]
+
+    snapshot = TreeSnapshot(folder_id, root_name)
+    seen = {folder_id}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(list_children, folder_id)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                parent_id, items = future.result()
+                for item in items:
+                    if add_listed_item(snapshot, item, parent_id, seen):
+                        pending.add(executor.submit(list_children, item['id']))
+    return snapshot
+
+# Define a function to build a snapshot from one flat enumeration of the corpus
+def build_tree_snapshot_corpus(folder_id, drive_service, root_name=None, fields=CORPUS_FIELDS,
+                               drive_id=None, item_filter=None):
+    """
+    Enumerates the whole drive (or the user's corpus) in one paginated stream and
+    rebuilds the subtree under folder_id locally from the parents of every item.
+
+    When the folder is a large fraction of the drive, this takes far fewer
+    requests than listing folder by folder.
+
+    Args:
+        folder_id (str): The ID of the root folder.
+        drive_service: The Google Drive service object.
+        root_name (str): The name of the root folder (optional).
+        fields (str): The partial response projection for each item (must include parents).
+        drive_id (str): The ID of the shared drive to enumerate (optional, the drive of the
+            folder if not provided).
+        item_filter (ItemFilter): The filter files must match to be included (optional).
+
+    Returns:
+        snapshot (TreeSnapshot): The snapshot of the folder tree.
+    """
+    if drive_id is None:
+        # A folder of a shared drive is not part of the user's corpus
+        root = execute_request(drive_service.files().get(
+            fileId=folder_id, fields='id,name,driveId', supportsAllDrives=True))
+        drive_id = root.get('driveId')
+        root_name = root_name or root.get('name')
+
+    corpus_kwargs = {'supportsAllDrives': True, 'includeItemsFromAllDrives': True}
+    if drive_id:
+        corpus_kwargs.update(corpora='drive', driveId=drive_id)
+    else:
+        corpus_kwargs.update(corpora='user')
+
+    query = 'trashed = false'
+    if item_filter is not None:
+        query = item_filter.query(query)
+        fields = filter_fields(fields, item_filter)
+
+    # Index the whole corpus by parent
+    children = defaultdict(list)
+    for item in list_files(drive_service, query, fields=fields, **corpus_kwargs):
+        if item_filter is not None and not item_filter.matches(item):
+            continue
+        for parent_id in item.get('parents', []):
+            children[parent_id].append(item)
+
+    # Keep only what is reachable from the root folder
+    snapshot = TreeSnapshot(folder_id, root_name)
+    seen = {folder_id}
+    pending = [folder_id]
+    while pending:
+        parent_id = pending.pop()
+        for item in children.get(parent_id, []):
+            if add_listed_item(snapshot, item, parent_id, seen):
+                pending.append(item['id'])
+    return snapshot
+
+# Traversal engines selectable from the CLI
+TRAVERSALS = {
+    'recursive': build_tree_snapshot_recursive,
+    'bfs': build_tree_snapshot_bfs,
+    'concurrent': build_tree_snapshot_concurrent,
+    'corpus': build_tree_snapshot_corpus,
+}
+
+# Define a function to build a snapshot with the selected traversal engine
+def build_tree_snapshot(folder_id, drive_service, root_name=None, traversal='recursive', **kwargs):
+    """
+    Builds a snapshot of the tree under folder_id with one traversal.
+
+    Args:
+        folder_id (str): The ID of the root folder.
+        drive_service: The Google Drive service object.
+        root_name (str): The name of the root folder (optional).
+        traversal (str): The name of the traversal engine (a key of TRAVERSALS).
+        **kwargs: Any additional options for the traversal engine.
+
+    Returns:
+        snapshot (TreeSnapshot): The snapshot of the folder tree.
+    """
+    if traversal not in TRAVERSALS:
+        raise ValueError(f"Unknown traversal: {traversal}")
+    return TRAVERSALS[traversal](folder_id, drive_service, root_name, **kwargs)
+
+# Enable pylint for no-member again
+# pylint: enable=no-member
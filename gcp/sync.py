@@ -0,0 +1,209 @@
+'''
+Incremental sync: copy only the files that are new or changed since the last run.
+'''
+import logging
+from gcp.batch import BATCH_SIZE, execute_batched
+from gcp.listing import MIME_FOLDER
+from gcp.progress import item_size
+
+# Fields needed to match destination items to source items (parents for the bfs/corpus engines)
+SYNC_FIELDS = 'files(id,name,mimeType,parents,md5Checksum,size,modifiedTime)'
+
+# Define a function to decide whether a destination file is an up-to-date copy
+def is_unchanged(source_file, destination_file):
+    """
+    Returns whether a destination file has the same content as the source file.
+
+    Files with content checksums are compared by md5Checksum and size. Google
+    documents have neither, so they are compared by modifiedTime, which sync
+    copies carry over from the source.
+
+    Args:
+        source_file (dict): The source file resource.
+        destination_file (dict): The destination file resource with the same path.
+
+    Returns:
+        bool: True if the file does not need to be copied again.
+    """
+    if source_file['mimeType'] != destination_file['mimeType']:
+        return False
+    if source_file.get('md5Checksum') and destination_file.get('md5Checksum'):
+        return (source_file['md5Checksum'] == destination_file['md5Checksum']
+                and source_file.get('size') == destination_file.get('size'))
+    return (source_file.get('size') == destination_file.get('size')
+            and source_file.get('modifiedTime') == destination_file.get('modifiedTime'))
+
+# Disable pylint for no-member at the function level
+# pylint: disable=no-member
+
+class TreeSync:
+    """
+    Brings a destination tree up to date with a source tree, using snapshots of both.
+
+    Items are matched by path (their name within the matched parent folder),
+    then by content, so same-named siblings each pair with their own copy.
+    Missing and changed files are copied; stale copies of changed files that
+    no other source file matched are moved to the trash. Destination items that no longer
+    exist in the source are left alone.
+
+    Attributes:
+        source (TreeSnapshot): The snapshot of the source tree.
+        destination (TreeSnapshot): The snapshot of the destination tree (indexed first).
+        drive_service: The Google Drive service object.
+        batch_size (int): The maximum number of calls per batch request.
+        progress (CopyProgress): The progress every source item is counted in (optional).
+        stats (dict): The number of files copied, replaced and unchanged, and folders created.
+    """
+
+    def __init__(self, source, destination, drive_service, batch_size=BATCH_SIZE, progress=None):
+        self.source = source
+        self.destination = destination
+        self.drive_service = drive_service
+        self.batch_size = batch_size
+        self.progress = progress
+        self.stats = {'copied': 0, 'replaced': 0, 'unchanged': 0, 'folders': 0, 'failed': 0}
+
+    def _destination_children(self, dest_folder_id):
+        """
+        Returns the destination children of a folder grouped by name (None for new folders).
+        """
+        if dest_folder_id is None or dest_folder_id not in self.destination.children:
+            return {}
+        children = {}
+        for child_id in self.destination.children[dest_folder_id]:
+            item = self.destination.items[child_id]
+            children.setdefault(item['name'], []).append(item)
+        return children
+
+    @staticmethod
+    def _claim(candidates, claimed, matches):
+        """
+        Returns the first destination candidate no other source item claimed that matches.
+        """
+        for candidate in candidates:
+            if candidate['id'] not in claimed and matches(candidate):
+                claimed.add(candidate['id'])
+                return candidate
+        return None
+
+    def _execute(self, requests):
+        responses, failures = execute_batched(self.drive_service, requests, self.batch_size)
+        for key, error in failures:
+            logging.error('SYNC FAILED: %s: %s', key['name'], error)
+            self.stats['failed'] += 1
+        return responses
+
+    def _copy_files(self, files, dest_folder_id):
+        """
+        Copies files, carrying over modifiedTime so later runs can match them.
+        """
+        files_resource = self.drive_service.files()
+        requests = []
+        for file in files:
+            body = {'name': file['name'], 'parents': [dest_folder_id]}
+            if file.get('modifiedTime'):
+                body['modifiedTime'] = file['modifiedTime']
+            requests.append((file, files_resource.copy(fileId=file['id'], fields='id', body=body)))
+        return self._execute(requests)
+
+    def _trash_files(self, stale_files):
+        files_resource = self.drive_service.files()
+        requests = [(file, files_resource.update(fileId=file['id'], body={'trashed': True},
+                                                 fields='id'))
+                    for file in stale_files]
+        return self._execute(requests)
+
+    def _create_folders(self, folders, dest_folder_id):
+        files_resource = self.drive_service.files()
+        requests = [(folder, files_resource.create(fields='id', body={
+            'name': folder['name'],
+            'parents': [dest_folder_id],
+            'mimeType': MIME_FOLDER,
+        })) for folder in folders]
+        return [(folder, new_folder['id']) for folder, new_folder in self._execute(requests)]
+
+    def sync_folder(self, src_folder_id, dest_folder_id):
+        """
+        Syncs the contents of a source folder into its matched destination folder.
+
+        Args:
+            src_folder_id (str): The id for the source folder.
+            dest_folder_id (str): The id for the destination folder.
+        """
+        pending = [(src_folder_id, dest_folder_id)]
+        while pending:
+            src_id, dest_id = pending.pop()
+            existing = self._destination_children(dest_id)
+            # Destination items matched to a source item, which must never be trashed
+            claimed = set()
+            unmatched, new_folders = [], []
+
+            # Match by content first, so same-named siblings pair with their own copies
+            for child_id in self.source.children.get(src_id, []):
+                item = self.source.items[child_id]
+                candidates = existing.get(item['name'], [])
+                if self.source.is_folder(child_id):
+                    match = self._claim(candidates, claimed,
+                                        lambda candidate: candidate['mimeType'] == MIME_FOLDER)
+                    if match is not None:
+                        # Matched folders are compared in memory - no requests if nothing changed
+                        pending.append((child_id, match['id']))
+                        if self.progress:
+                            self.progress.skip(1)
+                    else:
+                        new_folders.append(item)
+                elif self._claim(candidates, claimed,
+                                 lambda candidate, item=item: is_unchanged(item, candidate)):
+                    self.stats['unchanged'] += 1
+                    if self.progress:
+                        self.progress.skip(1, item_size(item))
+                else:
+                    unmatched.append(item)
+
+            # Each changed file replaces one same-named file no other source item matched
+            new_files, stale_files = [], {}
+            for item in unmatched:
+                new_files.append(item)
+                stale = self._claim(existing.get(item['name'], []), claimed,
+                                    lambda candidate: candidate['mimeType'] != MIME_FOLDER)
+                if stale is not None:
+                    stale_files[item['id']] = stale
+
+            copied = self._copy_files(new_files, dest_id)
+            self.stats['copied'] += len(copied)
+            trashed = self._trash_files([stale_files[file['id']] for file, _ in copied
+                                         if file['id'] in stale_files])
+            self.stats['replaced'] += len(trashed)
+
+            created = self._create_folders(new_folders, dest_id)
+            for folder, new_folder_id in created:
+                self.stats['folders'] += 1
+                pending.append((folder['id'], new_folder_id))
+            if self.progress:
+                self.progress.advance(len(copied) + len(created),
+                                      sum(item_size(file) for file, _ in copied))
+                self.progress.fail(len(new_files) - len(copied) + len(new_folders) - len(created))
+
+# Enable pylint for no-member again
+# pylint: enable=no-member
+
+# Define a function to sync a source snapshot into a destination
+def sync_child_objects(source_snapshot, destination_snapshot, drive_service,
+                       batch_size=BATCH_SIZE, progress=None):
+    """
+    Copies only the files of the source tree that are missing or changed in the destination.
+
+    Args:
+        source_snapshot (TreeSnapshot): The snapshot of the source tree (SYNC_FIELDS).
+        destination_snapshot (TreeSnapshot): The snapshot of the destination tree (SYNC_FIELDS).
+        drive_service: The Google Drive service object.
+        batch_size (int): The maximum number of calls per batch request.
+        progress (CopyProgress): The progress every source item is counted in (optional).
+
+    Returns:
+        stats (dict): The number of files copied, replaced and unchanged, and folders created.
+    """
+    tree_sync = TreeSync(source_snapshot, destination_snapshot, drive_service, batch_size,
+                         progress)
+    tree_sync.sync_folder(source_snapshot.root_id, destination_snapshot.root_id)
+    return tree_sync.stats
@@ -0,0 +1,416 @@
+'''
+Streaming transfers for files that files.copy cannot copy, e.g. between accounts or
+domains: the content is downloaded in chunks and written back with a resumable upload,
+so only a few chunks of any file are ever held in memory.
+'''
+import io
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from gcp.journal import KIND_EXPORT, KIND_FILE
+from gcp.listing import MIME_FOLDER, ThreadLocalServices
+from gcp.progress import format_bytes, item_size
+from gcp.ratelimit import default_controller, error_status, execute_request, is_rate_limit_error
+
+# Resumable uploads must be sent in multiples of 256 KB
+UPLOAD_CHUNK_ALIGNMENT = 256 * 1024
+# Size of every download range and upload chunk
+CHUNK_SIZE = 8 * 1024 * 1024
+# Buffer of each transfer worker: the chunk behind the read position, the chunk being read
+# and the chunk being downloaded
+BUFFER_CHUNKS = 3
+
+DEFAULT_TRANSFER_WORKERS = 4
+
+# Statuses of files.copy a transfer may get around: the copying user cannot reach the source
+# (404), or the copy is forbidden between the accounts or domains (403)
+ACCESS_STATUSES = {403, 404}
+
+# Google documents have no content to download and are exported to these formats
+EXPORT_FORMATS = {
+    'application/vnd.google-apps.document':
+        'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.google-apps.spreadsheet':
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.google-apps.presentation':
+        'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'application/vnd.google-apps.drawing': 'application/pdf',
+}
+# Exports Drive converts back into Google documents on upload
+IMPORTED_TYPES = {
+    'application/vnd.google-apps.document',
+    'application/vnd.google-apps.spreadsheet',
+    'application/vnd.google-apps.presentation',
+}
+GOOGLE_APPS_PREFIX = 'application/vnd.google-apps.'
+# Name extensions of the exports that stay in the exported format
+EXPORT_EXTENSIONS = {'application/pdf': '.pdf'}
+
+# Fields of an uploaded file, so validation can expect what was created
+UPLOAD_FIELDS = 'id,name,mimeType,size,md5Checksum'
+
+# Define a function to decide whether a failed copy may be transferred instead
+def is_access_error(error):
+    """
+    Returns whether a files.copy error is about access rather than load or the request.
+
+    Args:
+        error (Exception): The error raised by (or passed back for) files.copy.
+
+    Returns:
+        bool: True for 404 and for 403 errors other than rate limits.
+    """
+    return error_status(error) in ACCESS_STATUSES and not is_rate_limit_error(error)
+
+# Define a function to decide whether a file's content can be streamed
+def is_transferable(file):
+    """
+    Returns whether a file has content to download or a format to export to.
+
+    Args:
+        file (dict): The Drive file resource (mimeType).
+
+    Returns:
+        bool: False for folders, shortcuts, forms and other Google types without an export.
+    """
+    mime_type = file.get('mimeType', '')
+    return (mime_type != MIME_FOLDER
+            and (not mime_type.startswith(GOOGLE_APPS_PREFIX) or mime_type in EXPORT_FORMATS))
+
+class DownloadStream(io.RawIOBase):
+    """
+    A seekable, read-only view of a file being downloaded, to upload it from.
+
+    A resumable upload reads the file front to back and rewinds at most to the
+    start of the chunk it is sending, to resend it. So the stream keeps a window
+    of the file in a fixed buffer of BUFFER_CHUNKS chunks, reused from one file to
+    the next: the chunk behind the read position, and the chunks read from and
+    downloaded into. Each range is downloaded just before the upload chunk that
+    needs it (see prepare()), or when it is first read.
+
+    Attributes:
+        chunk_size (int): The size of each download range.
+        size (int): The size of the file being streamed.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        super().__init__()
+        self.chunk_size = chunk_size
+        self._view = memoryview(bytearray(BUFFER_CHUNKS * chunk_size))
+        self.size = 0
+        self._downloader = None
+        self._done = True
+        self._position = 0
+        # File offset of the first byte in the buffer, and the number of bytes held
+        self._start = 0
+        self._length = 0
+
+    def open(self, request, size):
+        """
+        Starts streaming another file, reusing the buffer.
+
+        Args:
+            request: The media request of the file, e.g. files().get_media(...).
+            size (int): The size of the file.
+        """
+        # pylint: disable=import-outside-toplevel
+        from googleapiclient.http import MediaIoBaseDownload
+        # pylint: enable=import-outside-toplevel
+        self._downloader = MediaIoBaseDownload(self, request, chunksize=self.chunk_size)
+        self._done = size == 0
+        self.size = size
+        self._position = 0
+        self._start = 0
+        self._length = 0
+
+    def prepare(self, begin):
+        """
+        Downloads what the upload chunk starting at begin needs, before the chunk is sent.
+
+        Reading the chunk then makes no request, so a download never waits for a
+        concurrency slot of the rate controller while the upload holds one.
+
+        Args:
+            begin (int): The first byte of the chunk.
+        """
+        self.seek(begin)
+        end = min(begin + self.chunk_size, self.size)
+        while self._start + self._length < end:
+            self._fetch()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < self._start:
+            raise io.UnsupportedOperation(f"Cannot seek back to byte {offset}: the buffer "
+                                          f"starts at byte {self._start}")
+        self._position = offset
+        return offset
+
+    def read(self, size=-1):
+        # At most one chunk per call - short reads are allowed for raw streams
+        if size is None or size < 0 or size > self.chunk_size:
+            size = self.chunk_size
+        end = min(self._position + size, self.size)
+        while self._start + self._length < end:
+            self._fetch()
+        offset = self._position - self._start
+        data = self._view[offset:offset + max(end - self._position, 0)].tobytes()
+        self._position += len(data)
+        return data
+
+    def write(self, data):
+        # MediaIoBaseDownload writes each downloaded range here
+        end = self._length + len(data)
+        if end > len(self._view):
+            raise IOError(f"Received {len(data)} bytes for a range of {self.chunk_size}")
+        self._view[self._length:end] = data
+        self._length = end
+        return len(data)
+
+    def _fetch(self):
+        """
+        Drops what is more than one chunk behind the read position and downloads the next range.
+        """
+        if self._done:
+            raise IOError(f"Download ended at byte {self._start + self._length} of {self.size}")
+        keep_from = min(max(self._start, self._position - self.chunk_size),
+                        self._start + self._length)
+        drop = keep_from - self._start
+        if drop:
+            self._view[:self._length - drop] = self._view[drop:self._length]
+            self._start = keep_from
+            self._length -= drop
+        _, self._done = default_controller.call(self._downloader.next_chunk)
+
+# Disable pylint for no-member at the function level
+# pylint: disable=no-member
+
+class StreamingTransfer:
+    """
+    Copies the files files.copy could not by streaming their content through this machine.
+
+    Copy engines hand every file whose copy was refused for lack of access to
+    defer(). Once the copy is done, finish() transfers them on worker threads:
+    each file is downloaded from the source service one range at a time and
+    uploaded to the destination service in resumable chunks of the same size,
+    through the fixed buffer of the worker's DownloadStream. Google documents
+    are exported instead (to a spooled temporary file that moves to disk above one
+    chunk) and converted back on upload where Drive can import the format.
+
+    Attributes:
+        chunk_size (int): The size of each download range and upload chunk.
+        workers (int): The number of concurrent transfers.
+        pending (list): The (file, destination parent ID) pairs handed over by the copy.
+        exported (list): The (source file, created file) pairs of the exported documents.
+        stats (dict): The number of files transferred (exported included), exported and
+            failed, and the bytes transferred.
+    """
+
+    def __init__(self, source_factory, destination_factory=None,
+                 workers=DEFAULT_TRANSFER_WORKERS, chunk_size=CHUNK_SIZE):
+        if chunk_size <= 0 or chunk_size % UPLOAD_CHUNK_ALIGNMENT:
+            raise ValueError(f"The chunk size must be a multiple of {UPLOAD_CHUNK_ALIGNMENT} "
+                             f"bytes: {chunk_size}")
+        self.sources = ThreadLocalServices(source_factory)
+        self.destinations = ThreadLocalServices(destination_factory or source_factory)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.exported = []
+        self.stats = {'transferred': 0, 'exported': 0, 'failed': 0, 'bytes': 0}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def defer(self, file, dest_parent_id, error):
+        """
+        Takes over a file whose copy failed, if streaming it may succeed.
+
+        Args:
+            file (dict): The source file resource (id, name, mimeType and size).
+            dest_parent_id (str): The ID of the destination folder it was copied into.
+            error (Exception): The error of files.copy.
+
+        Returns:
+            bool: True if the file will be transferred and must not be counted as failed.
+        """
+        if not is_access_error(error) or not is_transferable(file):
+            return False
+        logging.warning("COPY DENIED: %s: %s (streaming the content instead)", file['name'],
+                        error)
+        self.pending.append((file, dest_parent_id))
+        return True
+
+    def _stream(self):
+        # Every worker thread reuses one buffer
+        stream = getattr(self._local, 'stream', None)
+        if stream is None:
+            stream = DownloadStream(self.chunk_size)
+            self._local.stream = stream
+        return stream
+
+    def _upload(self, fd, media_type, body):
+        """
+        Creates a file from a stream with a chunked resumable upload.
+
+        Args:
+            fd: The seekable stream to upload.
+            media_type (str): The MIME type of the content.
+            body (dict): The metadata of the new file.
+
+        Returns:
+            new_file (dict): The created file resource (UPLOAD_FIELDS).
+        """
+        # pylint: disable=import-outside-toplevel
+        from googleapiclient.http import MediaIoBaseUpload
+        # pylint: enable=import-outside-toplevel
+        media = MediaIoBaseUpload(fd, mimetype=media_type, chunksize=self.chunk_size,
+                                  resumable=True)
+        request = self.destinations.get().files().create(body=body, media_body=media,
+                                                         fields=UPLOAD_FIELDS)
+        response = None
+        while response is None:
+            if isinstance(fd, DownloadStream):
+                fd.prepare(request.resumable_progress)
+            _, response = default_controller.call(request.next_chunk)
+        return response
+
+    def transfer_file(self, file, dest_parent_id):
+        """
+        Streams (or exports) one file into a destination folder, on the calling thread.
+
+        Args:
+            file (dict): The source file resource (id, name, mimeType and size).
+            dest_parent_id (str): The ID of the destination folder.
+
+        Returns:
+            new_file (dict): The created file resource (UPLOAD_FIELDS).
+        """
+        source = self.sources.get()
+        body = {'name': file['name'], 'parents': [dest_parent_id]}
+        export_type = EXPORT_FORMATS.get(file['mimeType'])
+        if export_type is None:
+            size = file.get('size')
+            if size is None:
+                size = execute_request(source.files().get(fileId=file['id'], fields='size'))['size']
+            body['mimeType'] = file['mimeType']
+            stream = self._stream()
+            stream.open(source.files().get_media(fileId=file['id']), int(size))
+            return self._upload(stream, file['mimeType'], body)
+
+        # Exports have no size until they are downloaded
+        if file['mimeType'] in IMPORTED_TYPES:
+            body['mimeType'] = file['mimeType']
+        else:
+            # Kept in the exported format, e.g. a drawing becomes a PDF file
+            body['mimeType'] = export_type
+            extension = EXPORT_EXTENSIONS.get(export_type, '')
+            if not body['name'].lower().endswith(extension):
+                body['name'] += extension
+        # pylint: disable=import-outside-toplevel
+        from googleapiclient.http import MediaIoBaseDownload
+        # pylint: enable=import-outside-toplevel
+        with tempfile.SpooledTemporaryFile(max_size=self.chunk_size) as spool:
+            downloader = MediaIoBaseDownload(
+                spool, source.files().export_media(fileId=file['id'], mimeType=export_type),
+                chunksize=self.chunk_size)
+            done = False
+            while not done:
+                _, done = default_controller.call(downloader.next_chunk)
+            return self._upload(spool, export_type, body)
+
+    def _transfer(self, file, dest_parent_id, journal, progress):
+        try:
+            new_file = self.transfer_file(file, dest_parent_id)
+        except Exception as error:  # pylint: disable=broad-except
+            logging.error('TRANSFER FAILED: %s: %s', file['name'], error)
+            with self._lock:
+                self.stats['failed'] += 1
+            if progress is not None:
+                progress.fail(1)
+            return
+        exported = file['mimeType'] in EXPORT_FORMATS
+        if journal is not None:
+            journal.record(file['id'], new_file['id'], KIND_EXPORT if exported else KIND_FILE)
+        with self._lock:
+            self.stats['transferred'] += 1
+            self.stats['bytes'] += item_size(file)
+            if exported:
+                self.stats['exported'] += 1
+                self.exported.append((file, new_file))
+        if progress is not None:
+            progress.advance(1, item_size(file))
+
+    def finish(self, journal=None, progress=None):
+        """
+        Transfers every deferred file, workers at a time.
+
+        Args:
+            journal (CopyJournal): The checkpoint journal to record the new files in (optional).
+            progress (CopyProgress): The progress every transfer is counted in (optional).
+
+        Returns:
+            stats (dict): The number of files transferred, exported and failed, and the bytes
+                transferred.
+        """
+        pending, self.pending = self.pending, []
+        if pending:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for future in [executor.submit(self._transfer, file, dest_parent_id, journal,
+                                               progress)
+                               for file, dest_parent_id in pending]:
+                    future.result()
+        return self.stats
+
+    def update_snapshot(self, snapshot, journal=None):
+        """
+        Turns a source snapshot into what the destination should hold after finish().
+
+        Exported documents are created with another type, size or name than
+        their source, so they are replaced by the files their uploads created,
+        and validation compares the destination with what was meant to be copied.
+        Streamed files keep their content and need no change. A resumed copy skips
+        the documents an interrupted run already exported before they reach defer(),
+        so those are read from the journal and their copies fetched from Drive.
+
+        Args:
+            snapshot (TreeSnapshot): The snapshot of the source tree, updated in place.
+            journal (CopyJournal): The journal the exports were recorded in (optional).
+        """
+        exported = {file['id']: (file, new_file) for file, new_file in self.exported}
+        if journal is not None:
+            for file_id in journal.source_ids(KIND_EXPORT):
+                if file_id not in exported and file_id in snapshot.items:
+                    new_file = execute_request(self.destinations.get().files().get(
+                        fileId=journal.lookup(file_id), fields=UPLOAD_FIELDS))
+                    exported[file_id] = (snapshot.items[file_id], new_file)
+        for file_id, (file, new_file) in exported.items():
+            if file_id in snapshot.items:
+                item = {'name': file['name'], 'mimeType': file['mimeType'], **new_file,
+                        'id': file_id}
+                snapshot.update_item(item, snapshot.parents[file_id])
+
+    def log_summary(self):
+        """
+        Logs and prints the files and bytes transferred by streaming.
+        """
+        stats = self.stats
+        logging.info("TRANSFERRED: %d files (%d exported), %d bytes, %d failed",
+                     stats['transferred'], stats['exported'], stats['bytes'], stats['failed'])
+        print(f"TRANSFERRED: {stats['transferred']} files ({format_bytes(stats['bytes'])}) "
+              f"that could not be copied, {stats['failed']} failed")
+
+# Enable pylint for no-member again
+# pylint: enable=no-member
@@ -0,0 +1,93 @@
+'''
+A pooled HTTP transport that every Drive client of a run can share, so parallel
+workers reuse kept-alive (TLS) connections instead of opening one per client.
+'''
+# Default number of connections kept open per host
+DEFAULT_POOL_SIZE = 32
+# Seconds to wait for a connection and for each read
+DEFAULT_TIMEOUT = 120.0
+
+# Transports selectable from the CLI
+TRANSPORTS = ('httplib2', 'pooled')
+
+# Response headers that no longer describe the body once requests has decoded it
+DECODED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+class PooledHttp:
+    """
+    An httplib2.Http look-alike over a requests session with a connection pool.
+
+    The Drive client only calls request() and reads the status and headers of
+    the response, so this adapter is a drop-in replacement for the default
+    httplib2 transport. Unlike httplib2.Http, it is safe to share between
+    threads: every thread borrows a connection from the pool for the duration
+    of a request. With an AuthorizedSession, tokens are added and refreshed by
+    the session itself.
+
+    Attributes:
+        session (requests.Session): The session holding the connection pool.
+        credentials (google.auth.credentials.Credentials): The credentials (optional). Batch
+            requests read them to authorize their parts, as with AuthorizedHttp.
+        pool_size (int): The maximum number of connections per host. Threads beyond it wait.
+        keep_alive (bool): Whether connections are reused between requests.
+        timeout (float): The connect and read timeout in seconds.
+    """
+
+    # Listings over this transport are prefetched through the same service object
+    thread_safe = True
+
+    def __init__(self, credentials=None, pool_size=DEFAULT_POOL_SIZE, keep_alive=True,
+                 timeout=DEFAULT_TIMEOUT):
+        # requests is only needed by runs that ask for this transport
+        # pylint: disable=import-outside-toplevel
+        import requests
+        from requests.adapters import HTTPAdapter
+        from google.auth.transport.requests import AuthorizedSession
+        # pylint: enable=import-outside-toplevel
+
+        self.credentials = credentials
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.session = AuthorizedSession(credentials) if credentials else requests.Session()
+        # Block instead of opening throwaway connections when every pooled one is busy
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5,
+                connection_type=None):
+        """
+        Sends a request like httplib2.Http.request.
+
+        Args:
+            uri (str): The absolute URI.
+            method (str): The HTTP method.
+            body (str): The request body (optional).
+            headers (dict): The request headers (optional).
+            redirections (int): The maximum number of redirects to follow (0 for none).
+            connection_type: Ignored, the pool manages connections.
+
+        Returns:
+            response (httplib2.Response): The status and lower-case headers.
+            content (bytes): The decoded response body.
+        """
+        del connection_type
+        import httplib2  # pylint: disable=import-outside-toplevel
+        headers = dict(headers or {})
+        if not self.keep_alive:
+            headers['connection'] = 'close'
+        response = self.session.request(method, uri, data=body, headers=headers,
+                                        timeout=self.timeout, allow_redirects=redirections > 0)
+        info = {name.lower(): value for name, value in response.headers.items()
+                if name.lower() not in DECODED_HEADERS}
+        info['status'] = str(response.status_code)
+        result = httplib2.Response(info)
+        result.reason = response.reason
+        return result, response.content
+
+    def close(self):
+        """
+        Closes every pooled connection.
+        """
+        self.session.close()
@@ -0,0 +1,414 @@
+'''
+Streaming structural validation of a copy: a per-path diff of two trees or two sorted inventories.
+'''
+import csv
+import logging
+import itertools
+from contextlib import nullcontext
+from gcp.snapshot import item_signature
+
+# Inventory columns - one row per file or folder, sorted by path
+INVENTORY_HEADER = ['Path', 'Kind', 'Number of Files', 'Number of Child Folders', 'Size',
+                    'MD5 Checksum']
+DIFF_HEADER = ['Status', 'Path', 'Source', 'Destination']
+
+KIND_FILE = 'file'
+KIND_FOLDER = 'folder'
+
+MISSING = 'missing'
+EXTRA = 'extra'
+MISMATCH = 'mismatch'
+# Destination-only items a sync deliberately leaves in place
+KEPT = 'kept'
+
+# Maximum number of differences written to the log (all of them go to the diff file)
+LOGGED_DIFFERENCES = 100
+
+# Define a function to join path components
+def join_path(names):
+    """
+    Joins names into a path, escaping slashes inside names so it can be split again.
+
+    Args:
+        names (tuple): The names from the root down.
+
+    Returns:
+        path (str): The path, e.g. 'Reports/2024\\/Q1'.
+    """
+    return '/'.join(name.replace('\\', '\\\\').replace('/', '\\/') for name in names)
+
+# Define a function to split a path into its components
+def split_path(path):
+    """
+    Splits a path written by join_path back into its names.
+
+    Args:
+        path (str): The path.
+
+    Returns:
+        names (tuple): The names from the root down.
+    """
+    names = []
+    current = []
+    escaped = False
+    for char in path:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '/':
+            names.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    names.append(''.join(current))
+    return tuple(names)
+
+# Define a function to describe one item of an inventory
+def inventory_row(snapshot, item_id):
+    """
+    Returns the inventory columns of an item after its path.
+
+    Args:
+        snapshot (TreeSnapshot): The snapshot of the tree.
+        item_id (str): The ID of the file or folder.
+
+    Returns:
+        row (list): The kind, then the counts of a folder or the size and checksum of a file.
+    """
+    if snapshot.is_folder(item_id):
+        num_files, num_folders = snapshot.count_child_objects(item_id)
+        return [KIND_FOLDER, str(num_files), str(num_folders), '', '']
+    item = snapshot.items[item_id]
+    return [KIND_FILE, '', '', str(item.get('size', '')), item.get('md5Checksum', '')]
+
+# Define a function to list the children of a folder in name order
+def sorted_children(snapshot, folder_id):
+    """
+    Returns the (name, ID) pairs of the children of a folder, sorted by name.
+    """
+    return sorted((snapshot.items[child_id]['name'], child_id)
+                  for child_id in snapshot.children.get(folder_id, []))
+
+# Define a function to list a snapshot in path order
+def iter_inventory(snapshot):
+    """
+    Yields one row per item of a snapshot in sorted path order, starting with the root.
+
+    Children are visited depth-first in name order, which is exactly the order
+    of the paths as tuples of names, so the tree never has to be sorted as a
+    whole and two inventories can be merged line by line.
+
+    Args:
+        snapshot (TreeSnapshot): The snapshot of the tree.
+
+    Yields:
+        names (tuple): The path of the item below the root (empty for the root).
+        row (list): The inventory_row of the item.
+    """
+    stack = [((), snapshot.root_id)]
+    while stack:
+        names, item_id = stack.pop()
+        yield names, inventory_row(snapshot, item_id)
+        # Push in reverse so the first name is visited first
+        stack.extend((names + (name,), child_id)
+                     for name, child_id in reversed(sorted_children(snapshot, item_id)))
+
+# Define a function to write an inventory file
+def write_inventory(snapshot, inventory_file):
+    """
+    Writes the sorted inventory of a snapshot to a CSV file.
+
+    Args:
+        snapshot (TreeSnapshot): The snapshot of the tree.
+        inventory_file (str): The path to the CSV file.
+    """
+    with open(inventory_file, 'w', newline='', encoding='utf-8') as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(INVENTORY_HEADER)
+        for names, row in iter_inventory(snapshot):
+            writer.writerow([join_path(names), *row])
+
+# Define a function to read an inventory file
+def read_inventory(inventory_file):
+    """
+    Reads an inventory file one row at a time.
+
+    Args:
+        inventory_file (str): The path to a CSV file written by write_inventory.
+
+    Yields:
+        names (tuple): The path of the item below the root.
+        row (list): The inventory_row of the item.
+    """
+    with open(inventory_file, newline='', encoding='utf-8') as input_file:
+        reader = csv.reader(input_file)
+        next(reader, None)
+        for path, *row in reader:
+            yield (split_path(path) if path else ()), row
+
+# Define a function to pair up two sorted streams
+def merge_sorted(source_entries, destination_entries):
+    """
+    Pairs the entries of two streams sorted by their first element, holding one entry of each.
+
+    Entries with the same key are paired in order, so duplicate names are compared one to one.
+
+    Args:
+        source_entries (iterable): The source tuples, sorted by their first element.
+        destination_entries (iterable): The destination tuples, sorted by their first element.
+
+    Yields:
+        source (tuple): The source entry (None if the key is only in the destination).
+        destination (tuple): The destination entry (None if the key is only in the source).
+    """
+    source_iter = iter(source_entries)
+    destination_iter = iter(destination_entries)
+    source = next(source_iter, None)
+    destination = next(destination_iter, None)
+    while source is not None or destination is not None:
+        if destination is None or (source is not None and source[0] < destination[0]):
+            yield source, None
+            source = next(source_iter, None)
+        elif source is None or destination[0] < source[0]:
+            yield None, destination
+            destination = next(destination_iter, None)
+        else:
+            yield source, destination
+            source = next(source_iter, None)
+            destination = next(destination_iter, None)
+
+# Define a function to merge two sorted inventories
+def diff_inventories(source_rows, destination_rows):
+    """
+    Compares two sorted inventories in one pass and yields every difference.
+
+    Only the current row of each side is held in memory, so inventories of any
+    size are compared in constant memory.
+
+    Args:
+        source_rows (iterable): The (names, row) pairs of the source, sorted by names.
+        destination_rows (iterable): The (names, row) pairs of the destination, sorted by names.
+
+    Yields:
+        status (str): MISSING, EXTRA or MISMATCH.
+        names (tuple): The path of the item.
+        source_row (list): The source row (None if extra).
+        destination_row (list): The destination row (None if missing).
+    """
+    for source, destination in merge_sorted(source_rows, destination_rows):
+        if destination is None:
+            yield MISSING, source[0], source[1], None
+        elif source is None:
+            yield EXTRA, destination[0], None, destination[1]
+        elif source[1] != destination[1]:
+            yield MISMATCH, source[0], source[1], destination[1]
+
+# Define a function to describe the content of an item
+def content_key(snapshot, item_id):
+    """
+    Returns what a faithful copy of an item shares with it: its fingerprint or signature.
+    """
+    if snapshot.is_folder(item_id):
+        return (KIND_FOLDER, snapshot.fingerprint(item_id))
+    return (KIND_FILE, *item_signature(snapshot.items[item_id]))
+
+# Define a function to pair the children of two matched folders
+def pair_children(source, source_id, destination, destination_id):
+    """
+    Pairs the children of two folders by name, then same-named children by content.
+
+    Within a group of equal names, children with the same content key are
+    paired first and only the rest are paired in ID order, so siblings that
+    share a name are not reported as mismatched when their order differs.
+
+    Args:
+        source (TreeSnapshot): The snapshot of the source tree.
+        source_id (str): The ID of the source folder.
+        destination (TreeSnapshot): The snapshot of the destination tree.
+        destination_id (str): The ID of the destination folder.
+
+    Yields:
+        source_child (tuple): The (name, ID) of the source child (None if only in the destination).
+        destination_child (tuple): The (name, ID) of the destination child (None if only in
+            the source).
+    """
+    def grouped(snapshot, folder_id):
+        for name, group in itertools.groupby(sorted_children(snapshot, folder_id),
+                                             key=lambda child: child[0]):
+            yield name, [child_id for _, child_id in group]
+
+    for source_group, destination_group in merge_sorted(grouped(source, source_id),
+                                                        grouped(destination, destination_id)):
+        name = (source_group or destination_group)[0]
+        source_ids = source_group[1] if source_group else []
+        destination_ids = destination_group[1] if destination_group else []
+        pairs = []
+        if len(source_ids) > 1 or len(destination_ids) > 1:
+            unmatched = {}
+            for child_id in destination_ids:
+                unmatched.setdefault(content_key(destination, child_id), []).append(child_id)
+            source_left = []
+            for child_id in source_ids:
+                matches = unmatched.get(content_key(source, child_id))
+                if matches:
+                    pairs.append((child_id, matches.pop(0)))
+                else:
+                    source_left.append(child_id)
+            source_ids = source_left
+            destination_ids = sorted(child_id for ids in unmatched.values() for child_id in ids)
+        pairs.extend(itertools.zip_longest(source_ids, destination_ids))
+        for source_child_id, destination_child_id in pairs:
+            yield ((name, source_child_id) if source_child_id is not None else None,
+                   (name, destination_child_id) if destination_child_id is not None else None)
+
+# Define a function to compare two snapshots by their fingerprints
+def diff_trees(source, destination, keep_extra=False):
+    """
+    Compares two snapshots, descending only into folders whose fingerprints differ.
+
+    Yields the same differences, in the same order, as diff_inventories over
+    both inventories, but matching subtrees are skipped in O(1), so the cost
+    grows with what changed rather than with the size of the trees.
+
+    With keep_extra, destination-only items are yielded as KEPT, and folders
+    are not compared by their counts, which they would inflate. A missing or
+    mismatched item below a folder is still reported on its own path.
+
+    Args:
+        source (TreeSnapshot): The snapshot of the source tree.
+        destination (TreeSnapshot): The snapshot of the destination tree.
+        keep_extra (bool): Whether destination-only items are expected, as after a sync.
+
+    Yields:
+        status (str): MISSING, EXTRA, MISMATCH or KEPT.
+        names (tuple): The path of the item.
+        source_row (list): The source row (None if extra).
+        destination_row (list): The destination row (None if missing).
+    """
+    extra = KEPT if keep_extra else EXTRA
+    # Each task compares a matched pair of items, or lists an item only one side has
+    stack = [('pair', (), source.root_id, destination.root_id)]
+    while stack:
+        task, names, source_id, destination_id = stack.pop()
+        if task == MISSING:
+            yield MISSING, names, inventory_row(source, source_id), None
+            stack.extend((MISSING, names + (name,), child_id, None)
+                         for name, child_id in reversed(sorted_children(source, source_id)))
+            continue
+        if task == EXTRA:
+            yield extra, names, None, inventory_row(destination, destination_id)
+            stack.extend((EXTRA, names + (name,), None, child_id)
+                         for name, child_id in reversed(sorted_children(destination,
+                                                                        destination_id)))
+            continue
+
+        both_folders = source.is_folder(source_id) and destination.is_folder(destination_id)
+        if both_folders and (source.fingerprint(source_id)
+                             == destination.fingerprint(destination_id)):
+            continue
+        source_row = inventory_row(source, source_id)
+        destination_row = inventory_row(destination, destination_id)
+        if both_folders:
+            # Kept items inflate the counts of every folder above them
+            mismatched = not keep_extra and source_row != destination_row
+        else:
+            mismatched = source_row != destination_row or (
+                item_signature(source.items[source_id])
+                != item_signature(destination.items[destination_id]))
+        if mismatched:
+            yield MISMATCH, names, source_row, destination_row
+        if not both_folders:
+            continue
+
+        tasks = []
+        for source_child, destination_child in pair_children(source, source_id,
+                                                             destination, destination_id):
+            if destination_child is None:
+                tasks.append((MISSING, names + (source_child[0],), source_child[1], None))
+            elif source_child is None:
+                tasks.append((EXTRA, names + (destination_child[0],), None, destination_child[1]))
+            else:
+                tasks.append(('pair', names + (source_child[0],), source_child[1],
+                              destination_child[1]))
+        stack.extend(reversed(tasks))
+
+# Define a function to count the differences that fail a validation
+def failures(summary):
+    """
+    Returns the number of missing, extra and mismatched paths in a summary.
+    """
+    return summary[MISSING] + summary[EXTRA] + summary[MISMATCH]
+
+# Define a function to report the differences
+def report_differences(differences, diff_file=None):
+    """
+    Logs the differences, writes them all to a CSV file and logs the overall result.
+
+    Args:
+        differences (iterable): The output of diff_inventories.
+        diff_file (str): The path to the diff CSV file (optional).
+
+    Returns:
+        summary (dict): The number of missing, extra and mismatched (and any kept) paths.
+    """
+    summary = {MISSING: 0, EXTRA: 0, MISMATCH: 0}
+    with (open(diff_file, 'w', newline='', encoding='utf-8') if diff_file
+          else nullcontext()) as output_file:
+        writer = csv.writer(output_file) if output_file else None
+        if writer:
+            writer.writerow(DIFF_HEADER)
+        for status, names, source_row, destination_row in differences:
+            summary[status] = summary.get(status, 0) + 1
+            path = join_path(names) or '/'
+            source_text = ' '.join(filter(None, source_row or []))
+            destination_text = ' '.join(filter(None, destination_row or []))
+            if status != KEPT and failures(summary) <= LOGGED_DIFFERENCES:
+                logging.error("VALIDATION %s: %s (source: %s, destination: %s)", status.upper(),
+                              path, source_text or '-', destination_text or '-')
+            if writer:
+                writer.writerow([status, path, source_text, destination_text])
+
+    if summary.get(KEPT):
+        logging.info("VALIDATION: %d destination-only paths kept by the sync.", summary[KEPT])
+    if failures(summary):
+        logging.error("VALIDATION FAILED - %d missing, %d extra, %d mismatched paths.",
+                      summary[MISSING], summary[EXTRA], summary[MISMATCH])
+        print("ERROR: VALIDATION FAILED!")
+    else:
+        logging.info("VALIDATION SUCCESSFUL!")
+    return summary
+
+# Define a function to validate a copy from the two snapshots
+def validate_trees(source_snapshot, destination_snapshot, diff_file=None, keep_extra=False):
+    """
+    Compares the source and destination trees path by path, skipping matching subtrees.
+
+    Args:
+        source_snapshot (TreeSnapshot): The snapshot of the source tree.
+        destination_snapshot (TreeSnapshot): The snapshot of the destination tree.
+        diff_file (str): The path to the diff CSV file (optional).
+        keep_extra (bool): Whether destination-only items are kept rather than failures.
+
+    Returns:
+        summary (dict): The number of missing, extra and mismatched (and any kept) paths.
+    """
+    return report_differences(diff_trees(source_snapshot, destination_snapshot, keep_extra),
+                              diff_file)
+
+# Define a function to validate a copy from two inventory files
+def validate_inventory_files(source_file, destination_file, diff_file=None):
+    """
+    Compares two sorted inventory files line by line, in constant memory.
+
+    Args:
+        source_file (str): The inventory of the source tree.
+        destination_file (str): The inventory of the destination tree.
+        diff_file (str): The path to the diff CSV file (optional).
+
+    Returns:
+        summary (dict): The number of missing, extra and mismatched paths.
+    """
+    return report_differences(diff_inventories(read_inventory(source_file),
+                                               read_inventory(destination_file)), diff_file)
@@ -0,0 +1,55 @@
+"""Shared pytest fixtures."""
+from unittest.mock import MagicMock
+import pytest
+from googleapiclient.errors import HttpError
+from gcp.listing import default_prefetcher
+from gcp.ratelimit import default_controller
+
+
+@pytest.fixture(autouse=True)
+def no_backoff_sleep(monkeypatch):
+    """Skip the rate controller's backoff delays so retry tests run instantly."""
+    monkeypatch.setattr(default_controller, 'sleep', lambda _seconds: None)
+
+
+@pytest.fixture(autouse=True)
+def no_prefetch_services(monkeypatch):
+    """Drop the prefetch service factory a test of main() may have installed."""
+    monkeypatch.setattr(default_prefetcher, 'services', None)
+
+
+class FakeBatch:
+    """Executes added requests one by one and reports each through the batch callback."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        """Queue a request."""
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        """Execute every queued request and invoke the callback."""
+        for request_id, request in self.requests:
+            try:
+                response = request.execute()
+            except HttpError as error:
+                self.callback(request_id, None, error)
+            else:
+                self.callback(request_id, response, None)
+
+
+@pytest.fixture
+def batch_service():
+    """Create a mock service whose batches call back like the real client."""
+    mock_service = MagicMock()
+    batches = []
+
+    def new_batch(callback=None):
+        batches.append(FakeBatch(callback))
+        return batches[-1]
+
+    mock_service.new_batch_http_request.side_effect = new_batch
+    mock_service.batches = batches
+    return mock_service
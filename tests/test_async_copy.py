@@ -0,0 +1,116 @@
+"""Tests for the asyncio copy pipeline."""
+# pylint: disable=redefined-outer-name
+import asyncio
+import threading
+from unittest.mock import Mock, MagicMock
+import pytest
+from googleapiclient.errors import HttpError
+from gcp.async_copy import CopyPipeline, copy_child_objects_async
+
+FOLDER = 'application/vnd.google-apps.folder'
+
+TREE = {
+    'src': [
+        {'id': 'f1', 'name': 'one.txt', 'mimeType': 'text/plain'},
+        {'id': 'a', 'name': 'A', 'mimeType': FOLDER},
+    ],
+    'a': [
+        {'id': 'f2', 'name': 'two.txt', 'mimeType': 'text/plain'},
+        {'id': 'a1', 'name': 'A1', 'mimeType': FOLDER},
+    ],
+    'a1': [{'id': 'f3', 'name': 'three.txt', 'mimeType': 'text/plain'}],
+}
+
+
+class FakeDriveCalls:
+    """Records creates and copies made through any number of mock services."""
+
+    def __init__(self, failing_file_ids=(), failing_folder_names=(), tree=None):
+        self.lock = threading.Lock()
+        self.created = {}
+        self.copied = []
+        self.failing_file_ids = set(failing_file_ids)
+        self.failing_folder_names = set(failing_folder_names)
+        self.tree = tree or TREE
+
+    def service(self):
+        """Create a mock service backed by TREE and recording into this object."""
+        service = MagicMock()
+        files = service.files.return_value
+
+        def list_children(q=None, **_kwargs):
+            request = MagicMock()
+            request.execute.return_value = {'files': self.tree.get(q.split("'")[1], [])}
+            return request
+
+        def create(body=None, **_kwargs):
+            request = MagicMock()
+            if body['name'] in self.failing_folder_names:
+                request.execute.side_effect = HttpError(resp=Mock(status=500), content=b'Error')
+                return request
+            with self.lock:
+                new_id = f"new-{body['name']}"
+                self.created[new_id] = body['parents'][0]
+            request.execute.return_value = {'id': new_id}
+            return request
+
+        def copy(fileId=None, body=None, **_kwargs):  # pylint: disable=invalid-name
+            request = MagicMock()
+            if fileId in self.failing_file_ids:
+                request.execute.side_effect = HttpError(resp=Mock(status=500), content=b'Error')
+            else:
+                with self.lock:
+                    self.copied.append((fileId, body['parents'][0]))
+                request.execute.return_value = {'id': f'copy-{fileId}'}
+            return request
+
+        files.list.side_effect = list_children
+        files.create.side_effect = create
+        files.copy.side_effect = copy
+        return service
+
+
+class TestCopyPipeline:
+    """Test the asyncio copy engine."""
+
+    def test_copy_preserves_structure(self):
+        """Test that every file lands in the copy of its source folder."""
+        calls = FakeDriveCalls()
+
+        stats = copy_child_objects_async('src', 'dest', calls.service, copy_workers=4)
+
+        assert stats == {'folders': 2, 'files': 3, 'failed': 0}
+        assert calls.created == {'new-A': 'dest', 'new-A1': 'new-A'}
+        assert sorted(calls.copied) == [('f1', 'dest'), ('f2', 'new-A'), ('f3', 'new-A1')]
+
+    def test_copy_failures_are_counted(self):
+        """Test that a failing file is retried, logged and does not stop the pipeline."""
+        calls = FakeDriveCalls(failing_file_ids={'f2'})
+
+        stats = copy_child_objects_async('src', 'dest', calls.service, max_retries=2)
+
+        assert stats == {'folders': 2, 'files': 2, 'failed': 1}
+
+    def test_folder_failures_are_counted_per_item(self):
+        """Test that a folder that cannot be created fails its subtree but not its siblings."""
+        tree = dict(TREE, src=list(reversed(TREE['src'])))
+        calls = FakeDriveCalls(failing_folder_names={'A'}, tree=tree)
+        progress = MagicMock()
+
+        stats = copy_child_objects_async('src', 'dest', calls.service, progress=progress)
+
+        # A, two.txt, A1 and three.txt
+        assert stats == {'folders': 0, 'files': 1, 'failed': 4}
+        assert calls.copied == [('f1', 'dest')]
+        assert sum(call.args[0] for call in progress.fail.call_args_list) == 4
+
+    @pytest.mark.parametrize('queue_size', [1, 2])
+    def test_copy_with_small_queue(self, queue_size):
+        """Test that a tiny file queue applies backpressure without deadlocking."""
+        calls = FakeDriveCalls()
+        pipeline = CopyPipeline(calls.service, copy_workers=1, folder_workers=1,
+                                queue_size=queue_size)
+
+        stats = asyncio.run(pipeline.run('src', 'dest'))
+
+        assert stats['files'] == 3
@@ -0,0 +1,71 @@
+"""Tests for the benchmark suite and its fake Drive."""
+import pytest
+from benchmarks.bench_startup import measure_startup
+from benchmarks.bench_suite import ENGINES, compare_results, run_engine
+from benchmarks.fake_drive import SHAPES, FakeDrive
+
+
+class TestFakeDrive:
+    """Test the synthetic trees and the fake files resource."""
+
+    @pytest.mark.parametrize('shape', list(SHAPES))
+    def test_shapes_have_about_size_items(self, shape):
+        """Test that every shape builds at most, and near, the requested number of items."""
+        drive = SHAPES[shape](FakeDrive(), 500)
+        assert 200 <= len(drive.items) <= 500
+        assert sum(drive.count_items('root')) == len(drive.items)
+
+    def test_batch_is_one_round_trip(self):
+        """Test that batched calls count as API calls but share one HTTP request."""
+        drive = FakeDrive()
+        drive.add_item('f1', 'one.txt', 'text/plain', 'root')
+        responses = []
+        batch = drive.new_batch_http_request(
+            callback=lambda request_id, response, error: responses.append(response))
+        for index in range(3):
+            batch.add(drive.files().copy(fileId='f1', body={'name': f'{index}',
+                                                            'parents': ['dest']}))
+        batch.execute()
+
+        assert (drive.api_calls(), drive.round_trips) == (3, 1)
+        assert len(responses) == 3
+        assert drive.count_items('dest') == (3, 0)
+
+
+class TestSuite:
+    """Test running engines and comparing results."""
+
+    @pytest.mark.parametrize('engine', list(ENGINES))
+    def test_every_engine_counts_or_copies_the_tree(self, engine):
+        """Test that every engine matches the tree it ran on."""
+        tree = SHAPES['balanced'](FakeDrive(), 200)
+        result = run_engine(engine, tree, workers=2)
+        assert 'error' not in result
+        assert result['calls'] >= result['round_trips'] > 0
+        assert len(tree.items) == result['items']
+
+    def test_engine_over_http(self):
+        """Test that an engine runs through the real client against the emulator."""
+        tree = SHAPES['wide'](FakeDrive(), 50)
+        result = run_engine('snapshot-recursive', tree, emulate=True, trace_memory=False)
+        assert 'error' not in result
+        assert result['calls'] == 6
+
+    def test_compare_results_flags_regressions(self):
+        """Test that more calls or slower runs are reported and faster runs are not."""
+        baseline = [{'shape': 'wide', 'engine': 'bfs', 'seconds': 1.0, 'calls': 10,
+                     'peak_bytes': 100}]
+        slower = [dict(baseline[0], seconds=1.5, calls=11)]
+        faster = [dict(baseline[0], seconds=0.5)]
+
+        assert len(compare_results(slower, baseline)) == 2
+        assert not compare_results(faster, baseline)
+
+    def test_startup_results_compare_like_engines(self):
+        """Test that the cold start is measured as results a baseline can flag."""
+        results = measure_startup(1)
+
+        assert [result['engine'] for result in results] == ['help', 'first-request']
+        assert all(result['shape'] == 'startup' and result['seconds'] > 0 for result in results)
+        slower = [dict(result, seconds=result['seconds'] * 2) for result in results]
+        assert len(compare_results(slower, results)) == 2
@@ -0,0 +1,159 @@
+"""Tests for the on-disk metadata cache."""
+# pylint: disable=redefined-outer-name
+from unittest.mock import MagicMock
+import pytest
+from googleapiclient.http import HttpRequest
+from gcp.cache import CachedDriveService, MetadataCache
+from gcp.listing import list_files
+
+
+class FakeClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    """Create a fake clock."""
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    """Create a cache in a temporary directory."""
+    metadata_cache = MetadataCache(str(tmp_path / 'cache.sqlite3'), ttl=60, clock=clock)
+    yield metadata_cache
+    metadata_cache.close()
+
+
+@pytest.fixture
+def mock_service():
+    """Create a mock Google Drive service with one listed file."""
+    service = MagicMock()
+    service.files().list().execute.return_value = {
+        'files': [{'id': 'f1', 'name': 'one.txt', 'mimeType': 'text/plain'}]}
+    service.files().list.reset_mock()
+    return service
+
+
+class TestMetadataCache:
+    """Test TTL, eviction and invalidation."""
+
+    def test_get_put_and_ttl(self, cache, clock):
+        """Test that entries expire after the TTL."""
+        cache.put('key', {'files': []}, ['folder'])
+        assert cache.get('key') == {'files': []}
+
+        clock.now += 61
+        assert cache.get('key') is None
+        assert cache.stats['hits'] == 1
+        assert cache.stats['misses'] == 1
+
+    def test_invalidate_folder(self, cache):
+        """Test that every page depending on a folder is removed."""
+        cache.put('page-1', {'files': []}, ['folder'])
+        cache.put('page-2', {'files': []}, ['folder'])
+        cache.put('other', {'files': []}, ['other-folder'])
+
+        cache.invalidate('folder')
+
+        assert cache.get('page-1') is None
+        assert cache.get('page-2') is None
+        assert cache.get('other') is not None
+
+    def test_lru_eviction(self, tmp_path, clock):
+        """Test that the least recently used entries are evicted first."""
+        with MetadataCache(str(tmp_path / 'small.sqlite3'), max_bytes=60, clock=clock) as cache:
+            cache.put('old', {'value': 'x' * 10}, [])
+            clock.now += 1
+            cache.put('used', {'value': 'y' * 10}, [])
+            clock.now += 1
+            cache.get('old')
+            clock.now += 1
+            cache.put('new', {'value': 'z' * 10}, [])
+
+            assert cache.get('used') is None
+            assert cache.get('old') is not None
+            assert cache.stats['evictions'] == 1
+
+    def test_persists_between_runs(self, tmp_path, clock):
+        """Test that a second run reads what the first one stored."""
+        path = str(tmp_path / 'cache.sqlite3')
+        with MetadataCache(path, clock=clock) as cache:
+            cache.put('key', {'name': 'Folder'}, ['folder'])
+        with MetadataCache(path, clock=clock) as cache:
+            assert cache.get('key') == {'name': 'Folder'}
+
+
+class TestCachedDriveService:
+    """Test caching underneath the existing Drive calls."""
+
+    def test_repeated_listing_makes_no_calls(self, mock_service, cache):
+        """Test that a repeated listing is answered from the cache."""
+        cached_service = CachedDriveService(mock_service, cache)
+        query = "'folder' in parents and trashed = false"
+
+        first = list(list_files(cached_service, query, prefetch=False))
+        second = list(list_files(cached_service, query, prefetch=False))
+
+        assert first == second
+        assert mock_service.files().list().execute.call_count == 1
+
+    def test_copy_invalidates_destination(self, mock_service, cache):
+        """Test that copying into a folder invalidates its cached listing."""
+        cached_service = CachedDriveService(mock_service, cache)
+        query = "'dest' in parents and trashed = false"
+        list(list_files(cached_service, query, prefetch=False))
+
+        request = cached_service.files().copy(fileId='f9', body={'name': 'new', 'parents': ['dest']})
+        list(list_files(cached_service, query, prefetch=False))
+        assert mock_service.files().list().execute.call_count == 1
+
+        request.execute()
+        list(list_files(cached_service, query, prefetch=False))
+        assert mock_service.files().list().execute.call_count == 2
+
+    def test_update_invalidates_listed_folder(self, mock_service, cache):
+        """Test that trashing a listed file invalidates the folder it was listed in."""
+        cached_service = CachedDriveService(mock_service, cache)
+        query = "'dest' in parents and trashed = false"
+        list(list_files(cached_service, query, prefetch=False))
+
+        cached_service.files().update(fileId='f1', body={'trashed': True}).execute()
+
+        assert cache.stats['invalidations'] == 1
+
+    def test_batched_write_invalidates_on_response(self, mock_service, cache):
+        """Test that an API request invalidates when its response is handed to postproc."""
+        cache.put('listing', {'files': []}, ['dest'])
+        request = HttpRequest(None, lambda resp, content: content, 'https://example.com',
+                              method='POST', methodId='drive.files.copy')
+        mock_service.files().copy.return_value = request
+        cached_service = CachedDriveService(mock_service, cache)
+
+        assert cached_service.files().copy(fileId='f9', body={'parents': ['dest']}) is request
+        assert cache.get('listing') is not None
+
+        # What a batch does with each successful sub-response
+        request.postproc({'status': '200'}, b'{}')
+        assert cache.get('listing') is None
+
+    def test_listing_without_parent_is_not_cached(self, mock_service, cache):
+        """Test that a listing of a whole drive, which no write invalidates, is not cached."""
+        cached_service = CachedDriveService(mock_service, cache)
+
+        list(list_files(cached_service, 'trashed = false', prefetch=False))
+        list(list_files(cached_service, 'trashed = false', prefetch=False))
+
+        assert mock_service.files().list().execute.call_count == 2
+        assert len(cache) == 0
+
+    def test_other_resources_pass_through(self, mock_service, cache):
+        """Test that batches and other resources use the wrapped service."""
+        cached_service = CachedDriveService(mock_service, cache)
+        assert cached_service.new_batch_http_request is mock_service.new_batch_http_request
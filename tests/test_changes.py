@@ -0,0 +1,146 @@
+"""Tests for refreshing snapshots from the changes feed."""
+# pylint: disable=redefined-outer-name
+import json
+from unittest.mock import MagicMock
+import pytest
+from gcp.changes import apply_changes, change_fields, destination_state_path, refresh_snapshot
+from gcp.snapshot import SNAPSHOT_FIELDS, TreeSnapshot
+
+FOLDER = 'application/vnd.google-apps.folder'
+
+
+@pytest.fixture
+def mock_service():
+    """Create a mock Google Drive service."""
+    return MagicMock()
+
+
+@pytest.fixture
+def snapshot():
+    """Create a snapshot: root/{one.txt, A/{two.txt}}."""
+    tree = TreeSnapshot('root', 'Root')
+    tree.add_item({'id': 'f1', 'name': 'one.txt', 'mimeType': 'text/plain'}, 'root')
+    tree.add_item({'id': 'a', 'name': 'A', 'mimeType': FOLDER}, 'root')
+    tree.add_item({'id': 'f2', 'name': 'two.txt', 'mimeType': 'text/plain'}, 'a')
+    return tree
+
+
+def change(file_id, name=None, parents=None, mime_type='text/plain', **extra):
+    """Create a change resource for a file."""
+    if name is None:
+        return {'fileId': file_id, **extra}
+    return {'fileId': file_id, 'file': {'id': file_id, 'name': name, 'mimeType': mime_type,
+                                        'parents': parents or [], **extra}}
+
+
+class TestApplyChanges:
+    """Test applying the changes feed to a stored snapshot."""
+
+    def test_change_fields(self):
+        """Test that changed files are projected like snapshot items, plus parents and trashed."""
+        assert change_fields('files(id,name,mimeType)') == (
+            'nextPageToken,newStartPageToken,'
+            'changes(fileId,removed,file(id,name,mimeType,parents,trashed))')
+
+    def test_apply_changes_follows_pages(self, mock_service, snapshot):
+        """Test that every page is applied and the new cursor returned."""
+        mock_service.changes().list().execute.side_effect = [
+            {'changes': [change('f3', 'three.txt', ['a'])], 'nextPageToken': 'p2'},
+            {'changes': [change('f2', 'two.txt', ['a'], trashed=True)],
+             'newStartPageToken': 't2'},
+        ]
+
+        page_token, num_applied = apply_changes(snapshot, mock_service, 't1')
+
+        assert (page_token, num_applied) == ('t2', 2)
+        assert snapshot.count_child_objects() == (2, 1)
+        mock_service.changes().list.assert_called_with(
+            pageToken='p2', fields=change_fields(), includeRemoved=True, pageSize=1000,
+            supportsAllDrives=True, includeItemsFromAllDrives=True)
+
+    def test_changes_outside_subtree_are_ignored(self, mock_service, snapshot):
+        """Test that files elsewhere in the drive do not affect the snapshot."""
+        mock_service.changes().list().execute.return_value = {
+            'changes': [change('x', 'other.txt', ['elsewhere']), change('y', removed=True)],
+            'newStartPageToken': 't2',
+        }
+
+        _, num_applied = apply_changes(snapshot, mock_service, 't1')
+
+        assert num_applied == 0
+        assert snapshot.count_child_objects() == (2, 1)
+
+    def test_folder_moved_out_removes_subtree(self, mock_service, snapshot):
+        """Test that moving a folder out of the tree removes its contents."""
+        mock_service.changes().list().execute.return_value = {
+            'changes': [change('a', 'A', ['elsewhere'], FOLDER)],
+            'newStartPageToken': 't2',
+        }
+
+        apply_changes(snapshot, mock_service, 't1')
+
+        assert snapshot.count_child_objects() == (1, 0)
+        assert 'f2' not in snapshot.items
+
+    def test_folder_moved_in_lists_its_contents(self, mock_service, snapshot):
+        """Test that a folder moved into the tree is listed once for its existing files."""
+        mock_service.changes().list().execute.return_value = {
+            'changes': [change('b', 'B', ['root'], FOLDER)],
+            'newStartPageToken': 't2',
+        }
+        mock_service.files().list().execute.return_value = {
+            'files': [{'id': 'f4', 'name': 'four.txt', 'mimeType': 'text/plain'}]}
+
+        apply_changes(snapshot, mock_service, 't1')
+
+        assert snapshot.count_child_objects('b') == (1, 0)
+        assert snapshot.count_child_objects() == (3, 2)
+
+
+class TestRefreshSnapshot:
+    """Test the stored snapshot and cursor."""
+
+    def test_first_run_traverses_and_stores_cursor(self, mock_service, tmp_path):
+        """Test that the first run takes a cursor and a full snapshot."""
+        state_path = tmp_path / 'state.json'
+        mock_service.changes().getStartPageToken().execute.return_value = {'startPageToken': 't1'}
+        mock_service.files().list().execute.return_value = {
+            'files': [{'id': 'f1', 'name': 'one.txt', 'mimeType': 'text/plain'}]}
+
+        refreshed = refresh_snapshot('root', mock_service, 'Root', str(state_path))
+
+        assert refreshed.count_child_objects() == (1, 0)
+        state = json.loads(state_path.read_text(encoding='utf-8'))
+        assert state['page_token'] == 't1'
+
+    def test_later_runs_only_read_changes(self, mock_service, tmp_path, snapshot):
+        """Test that a stored snapshot is refreshed without listing any folder."""
+        state_path = tmp_path / 'state.json'
+        state_path.write_text(json.dumps({'page_token': 't1', 'fields': SNAPSHOT_FIELDS,
+                                          'snapshot': snapshot.to_dict()}), encoding='utf-8')
+        mock_service.changes().list().execute.return_value = {
+            'changes': [change('f3', 'three.txt', ['root'])], 'newStartPageToken': 't2'}
+
+        refreshed = refresh_snapshot('root', mock_service, 'Root', str(state_path))
+
+        assert refreshed.count_child_objects() == (3, 1)
+        mock_service.files().list.assert_not_called()
+        assert json.loads(state_path.read_text(encoding='utf-8'))['page_token'] == 't2'
+
+    def test_other_root_traverses_again(self, mock_service, tmp_path, snapshot):
+        """Test that a snapshot of a different folder is not reused."""
+        state_path = tmp_path / 'state.json'
+        state_path.write_text(json.dumps({'page_token': 't1', 'fields': SNAPSHOT_FIELDS,
+                                          'snapshot': snapshot.to_dict()}), encoding='utf-8')
+        mock_service.changes().getStartPageToken().execute.return_value = {'startPageToken': 't9'}
+        mock_service.files().list().execute.return_value = {'files': []}
+
+        refreshed = refresh_snapshot('other', mock_service, 'Other', str(state_path))
+
+        assert refreshed.root_id == 'other'
+        mock_service.changes().list.assert_not_called()
+
+    def test_destination_state_path(self):
+        """Test that the destination state is stored next to the source state."""
+        assert destination_state_path('./outputs/report-state.json') == (
+            './outputs/report-state-destination.json')
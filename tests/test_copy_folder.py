@@ -5,6 +5,7 @@ import pytest  # pylint: disable=import-error
 from gcp.copy_folder import (
     count_files_and_folders,
     authenticate_and_authorize,
+    authenticate_service_account,
     create_drive_service,
 )
 
@@ -27,7 +28,7 @@ def mock_credentials():
 class TestAuthentication:
     """Test authentication functions."""
 
-    @patch('gcp.copy_folder.InstalledAppFlow')
+    @patch('google_auth_oauthlib.flow.InstalledAppFlow')
     def test_authenticate_and_authorize_success(self, mock_flow):
         """Test successful authentication."""
         mock_creds = Mock()
@@ -39,7 +40,7 @@ class TestAuthentication:
         assert result == mock_creds
         assert result.valid is True
 
-    @patch('gcp.copy_folder.InstalledAppFlow')
+    @patch('google_auth_oauthlib.flow.InstalledAppFlow')
     def test_authenticate_and_authorize_invalid(self, mock_flow):
         """Test authentication with invalid credentials."""
         mock_creds = Mock()
@@ -50,16 +51,95 @@ class TestAuthentication:
 
         assert result is None
 
-    @patch('gcp.copy_folder.build')
+    @patch('google_auth_oauthlib.flow.InstalledAppFlow')
+    @patch('google.oauth2.credentials.Credentials')
+    def test_authenticate_with_saved_token(self, mock_token_credentials, mock_flow, tmp_path):
+        """Test that a valid saved token is used without opening the browser."""
+        token_file = tmp_path / 'token.json'
+        token_file.write_text('{}', encoding='utf-8')
+        saved = mock_token_credentials.from_authorized_user_file.return_value
+        saved.valid = True
+
+        result = authenticate_and_authorize('fake_client.json', ['scope1'], str(token_file))
+
+        assert result == saved
+        mock_flow.from_client_secrets_file.assert_not_called()
+
+    @patch('google_auth_oauthlib.flow.InstalledAppFlow')
+    @patch('google_auth_httplib2.Request')
+    @patch('google.oauth2.credentials.Credentials')
+    def test_authenticate_refreshes_expired_token(self, mock_token_credentials, mock_request,
+                                                  mock_flow, tmp_path):
+        """Test that an expired token is refreshed silently and saved again."""
+        token_file = tmp_path / 'token.json'
+        token_file.write_text('{}', encoding='utf-8')
+        saved = mock_token_credentials.from_authorized_user_file.return_value
+        saved.valid = False
+        saved.expired = True
+        saved.refresh_token = 'refresh'
+        saved.to_json.return_value = '{"token": "new"}'
+
+        result = authenticate_and_authorize('fake_client.json', ['scope1'], str(token_file))
+
+        assert result == saved
+        saved.refresh.assert_called_once_with(mock_request.return_value)
+        assert token_file.read_text(encoding='utf-8') == '{"token": "new"}'
+        mock_flow.from_client_secrets_file.assert_not_called()
+
+    @patch('google_auth_oauthlib.flow.InstalledAppFlow')
+    def test_authenticate_saves_new_token(self, mock_flow, tmp_path):
+        """Test that the first authorization is saved for later runs."""
+        token_file = tmp_path / 'nested' / 'token.json'
+        mock_creds = Mock()
+        mock_creds.valid = True
+        mock_creds.to_json.return_value = '{"token": "first"}'
+        mock_flow.from_client_secrets_file.return_value.run_local_server.return_value = mock_creds
+
+        authenticate_and_authorize('fake_client.json', ['scope1'], str(token_file))
+
+        assert token_file.read_text(encoding='utf-8') == '{"token": "first"}'
+        assert token_file.stat().st_mode & 0o777 == 0o600
+
+    @patch('google.oauth2.service_account')
+    def test_authenticate_service_account(self, mock_service_account):
+        """Test loading service account credentials with delegation."""
+        result = authenticate_service_account('key.json', ['scope1'], 'user@example.com')
+
+        mock_service_account.Credentials.from_service_account_file.assert_called_once_with(
+            'key.json', scopes=['scope1'], subject='user@example.com')
+        assert result == mock_service_account.Credentials.from_service_account_file.return_value
+
+    @patch('googleapiclient.discovery.build')
     def test_create_drive_service(self, mock_build, mock_credentials):
         """Test Drive service creation."""
         mock_build.return_value = 'mock_service'
 
         result = create_drive_service(mock_credentials)
 
-        mock_build.assert_called_once_with('drive', 'v3', credentials=mock_credentials)
+        mock_build.assert_called_once_with('drive', 'v3', credentials=mock_credentials,
+                                           static_discovery=True, cache_discovery=False)
         assert result == 'mock_service'
 
+    @patch('googleapiclient.discovery.build')
+    def test_create_drive_service_other_endpoint(self, mock_build, mock_credentials):
+        """Test that requests and batches go to another API server, e.g. an emulator."""
+        result = create_drive_service(mock_credentials, 'http://127.0.0.1:8080')
+
+        assert mock_build.call_args.kwargs['client_options'] == {
+            'api_endpoint': 'http://127.0.0.1:8080/drive/v3/'}
+        assert result.new_batch_http_request()._batch_uri == (  # pylint: disable=protected-access
+            'http://127.0.0.1:8080/batch/drive/v3')
+
+    @patch('googleapiclient.discovery.build')
+    def test_create_drive_service_shared_transport(self, mock_build, mock_credentials):
+        """Test that a shared transport is used instead of a new authorized connection."""
+        http = MagicMock()
+
+        create_drive_service(mock_credentials, http=http)
+
+        mock_build.assert_called_once_with('drive', 'v3', http=http, static_discovery=True,
+                                           cache_discovery=False)
+
 
 class TestFileOperations:
     """Test file counting operations."""
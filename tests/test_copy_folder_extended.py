@@ -121,7 +121,7 @@ class TestCopyChildObjects:
         ]
         mock_service.files().copy().execute.return_value = {'id': 'new_file'}
 
-        copy_child_objects('src', 'dest', mock_service)
+        copy_child_objects('src', 'dest', mock_service, batch_size=1)
 
         # Verify files were copied (MagicMock counts call() as one call)
         assert mock_service.files().copy.call_count >= 2
@@ -137,7 +137,7 @@ class TestCopyChildObjects:
         mock_service.files().copy().execute.return_value = {'id': 'new_file'}
         mock_service.files().create().execute.return_value = {'id': 'new_folder'}
 
-        copy_child_objects('src', 'dest', mock_service)
+        copy_child_objects('src', 'dest', mock_service, batch_size=1)
 
         # Verify file copy was called
         assert mock_service.files().copy.call_count >= 1
@@ -158,7 +158,7 @@ class TestCopyChildObjects:
             {'id': 'new_file'},
         ]
 
-        copy_child_objects('src', 'dest', mock_service, max_retries=2)
+        copy_child_objects('src', 'dest', mock_service, max_retries=2, batch_size=1)
 
         # Verify retry was attempted (includes the initial call() which is counted)
         assert mock_service.files().copy.call_count >= 2
@@ -175,11 +175,76 @@ class TestCopyChildObjects:
         mock_service.files().copy().execute.side_effect = http_error
 
         # Should not raise, just log and continue
-        copy_child_objects('src', 'dest', mock_service, max_retries=2)
+        copy_child_objects('src', 'dest', mock_service, max_retries=2, batch_size=1)
 
         assert mock_service.files().copy.call_count >= 2
 
 
+class TestBatchedCopy:
+    """Test copies and folder creation grouped into batch requests."""
+
+    def test_copy_files_grouped_into_batches(self, batch_service):
+        """Test that files are copied in batches of at most batch_size calls."""
+        batch_service.files().list().execute.side_effect = [
+            {'files': [{'id': f'file{index}', 'name': f'doc{index}.txt', 'mimeType': 'text/plain'}
+                       for index in range(5)]},
+            {'files': []},  # No folders
+        ]
+        batch_service.files().copy().execute.return_value = {'id': 'new_file'}
+
+        copy_child_objects('src', 'dest', batch_service, batch_size=2)
+
+        assert [len(batch.requests) for batch in batch_service.batches] == [2, 2, 1]
+
+    def test_created_folders_are_recursed(self, batch_service):
+        """Test that each created folder ID is mapped back to its source folder."""
+        batch_service.files().list().execute.side_effect = [
+            {'files': []},  # Files in root
+            {'files': [{'id': 'folder1', 'name': 'subfolder'}]},  # Folders in root
+            {'files': [{'id': 'file1', 'name': 'doc.txt', 'mimeType': 'text/plain'}]},
+            {'files': []},  # Folders in subfolder
+        ]
+        batch_service.files().create().execute.return_value = {'id': 'new_folder'}
+        batch_service.files().copy().execute.return_value = {'id': 'new_file'}
+
+        copy_child_objects('src', 'dest', batch_service)
+
+        batch_service.files().copy.assert_called_with(
+            fileId='file1', fields='id', body={'name': 'doc.txt', 'parents': ['new_folder']})
+
+    def test_failed_sub_requests_are_requeued(self, batch_service):
+        """Test that a rate-limited sub-request is retried in the next batch."""
+        batch_service.files().list().execute.side_effect = [
+            {'files': [{'id': 'file1', 'name': 'doc.txt', 'mimeType': 'text/plain'}]},
+            {'files': []},
+        ]
+        rate_limited = HttpError(resp=Mock(status=429), content=b'Too Many Requests')
+        batch_service.files().copy().execute.side_effect = [rate_limited, {'id': 'new_file'}]
+
+        copy_child_objects('src', 'dest', batch_service)
+
+        assert len(batch_service.batches) == 2
+        assert batch_service.files().copy().execute.call_count == 2
+
+    def test_failed_batch_request_fails_its_calls(self, batch_service):
+        """Test that a batch request that fails as a whole counts its calls as failed."""
+        batch_service.files().list().execute.side_effect = [
+            {'files': [{'id': f'file{index}', 'name': f'doc{index}.txt', 'mimeType': 'text/plain'}
+                       for index in range(3)]},
+            {'files': []},
+        ]
+        batch = MagicMock()
+        batch.execute.side_effect = HttpError(resp=Mock(status=400), content=b'Bad Request')
+        batch_service.new_batch_http_request.side_effect = None
+        batch_service.new_batch_http_request.return_value = batch
+        progress = MagicMock()
+
+        copy_child_objects('src', 'dest', batch_service, progress=progress)
+
+        assert batch.add.call_count == 3
+        progress.fail.assert_called_once_with(3)
+
+
 class TestHandleCopyError:
     """Test error handling."""
 
@@ -281,7 +346,7 @@ class TestCompareCSVFiles:
                 writer.writerows(data)
 
         # Should not raise, should log success
-        compare_csv_files(str(file1), str(file2))
+        assert compare_csv_files(str(file1), str(file2)) is True
 
     def test_compare_csv_files_different(self, tmp_path):
         """Test comparing different CSV files."""
@@ -297,7 +362,7 @@ class TestCompareCSVFiles:
             writer.writerows([['Name', 'Files', 'Folders'], ['Folder1', 15, 5]])
 
         # Should log failure but not raise
-        compare_csv_files(str(file1), str(file2))
+        assert compare_csv_files(str(file1), str(file2)) is False
 
     def test_compare_csv_files_different_structure(self, tmp_path):
         """Test comparing CSV files with different structures."""
@@ -313,4 +378,4 @@ class TestCompareCSVFiles:
             writer.writerows([['Name', 'Files', 'Folders'], ['Folder1', 10, 5]])
 
         # Should log failure
-        compare_csv_files(str(file1), str(file2))
+        assert compare_csv_files(str(file1), str(file2)) is False
@@ -0,0 +1,154 @@
+"""Tests for the content-deduplicating copy mode."""
+# pylint: disable=redefined-outer-name
+import io
+import pytest
+from benchmarks.fake_drive import FakeDrive
+from gcp.async_copy import copy_child_objects_async
+from gcp.copy_folder import copy_child_objects
+from gcp.dedup import MIME_SHORTCUT, DuplicateIndex
+from gcp.journal import CopyJournal
+from gcp.listing import MIME_FOLDER
+from gcp.plan import build_copy_plan, execute_copy_plan
+from gcp.progress import CopyProgress
+from gcp.snapshot import build_tree_snapshot
+from gcp.validate import diff_trees
+
+
+@pytest.fixture
+def drive():
+    """Create a tree with the same 100-byte file in three folders and unique files."""
+    fake = FakeDrive()
+    fake.add_item('dest', 'dest', MIME_FOLDER, 'top')
+    fake.add_item('a', 'a', MIME_FOLDER, 'root')
+    fake.add_item('b', 'b', MIME_FOLDER, 'a')
+    for file_id, parent_id in [('logo1', 'root'), ('logo2', 'a'), ('logo3', 'b')]:
+        fake.add_item(file_id, 'logo.png', 'image/png', parent_id, size='100',
+                      md5Checksum='aaa')
+    fake.add_item('other', 'other.png', 'image/png', 'a', size='100', md5Checksum='bbb')
+    # Same checksum, other size: not identical
+    fake.add_item('odd', 'odd.png', 'image/png', 'b', size='99', md5Checksum='aaa')
+    # Google documents have no checksum
+    fake.add_item('doc1', 'doc', 'application/vnd.google-apps.document', 'root')
+    fake.add_item('doc2', 'doc', 'application/vnd.google-apps.document', 'a')
+    return fake
+
+
+@pytest.fixture
+def journal(tmp_path):
+    """Open a fresh checkpoint journal."""
+    with CopyJournal(str(tmp_path / 'journal.sqlite3')) as copy_journal:
+        yield copy_journal
+
+
+def shortcuts(drive):
+    """Return the shortcut items created in the fake."""
+    return [item for item in drive.items.values() if item['mimeType'] == MIME_SHORTCUT]
+
+
+class TestDuplicateIndex:
+    """Test grouping files by content."""
+
+    def test_groups_by_checksum_and_size(self, drive):
+        """Test that the first file in breadth-first order is kept and the others deferred."""
+        dedup = DuplicateIndex(build_tree_snapshot('root', drive))
+        assert dedup.groups == 1
+        assert dedup.canonical == {'logo2': 'logo1', 'logo3': 'logo1'}
+
+    def test_unknown_mode(self, drive):
+        """Test that only the supported modes are accepted."""
+        with pytest.raises(ValueError, match='dedup mode'):
+            DuplicateIndex(build_tree_snapshot('root', drive), 'hardlink')
+
+
+class TestDedupCopy:
+    """Test deduplicated copies with every engine."""
+
+    @pytest.mark.parametrize('batch_size', [1, 100])
+    def test_shortcuts_to_the_canonical_copy(self, drive, journal, batch_size):
+        """Test that duplicates become shortcuts to the one copy and the savings are counted."""
+        source = build_tree_snapshot('root', drive)
+        dedup = DuplicateIndex(source)
+        progress = CopyProgress(total_items=9, stream=io.StringIO())
+
+        copy_child_objects('root', 'dest', drive, batch_size=batch_size, journal=journal,
+                           progress=progress, dedup=dedup)
+        stats = dedup.finish(drive, journal, progress=progress)
+
+        assert drive.calls['files.copy'] == 5
+        created = shortcuts(drive)
+        assert [item['shortcutDetails']['targetId'] for item in created] == [
+            journal.lookup('logo1')] * 2
+        assert (stats['shortcuts'], stats['copies_avoided'], stats['bytes_avoided']) == (2, 2, 200)
+        assert progress.status()['done'] == 9
+
+        # The destination matches the source once duplicates are expected as shortcuts
+        dedup.update_snapshot(source)
+        assert not list(diff_trees(source, build_tree_snapshot('dest', drive)))
+
+    @pytest.mark.parametrize('engine', ['sequential', 'async'])
+    def test_resume_validates_earlier_shortcuts(self, drive, tmp_path, engine):
+        """Test that shortcuts made before an interruption are expected by validation."""
+        path = str(tmp_path / 'resume.sqlite3')
+        with CopyJournal(path) as journal:
+            dedup = DuplicateIndex(build_tree_snapshot('root', drive))
+            copy_child_objects('root', 'dest', drive, journal=journal, dedup=dedup)
+            dedup.finish(drive, journal)
+
+        source = build_tree_snapshot('root', drive)
+        with CopyJournal(path, resume=True) as journal:
+            dedup = DuplicateIndex(source)
+            if engine == 'async':
+                copy_child_objects_async('root', 'dest', lambda: drive, journal=journal,
+                                         dedup=dedup)
+            else:
+                copy_child_objects('root', 'dest', drive, journal=journal, dedup=dedup)
+            stats = dedup.finish(drive, journal)
+            dedup.update_snapshot(source, journal)
+
+        assert stats['shortcuts'] == 0
+        assert len(shortcuts(drive)) == 2
+        assert not list(diff_trees(source, build_tree_snapshot('dest', drive)))
+
+    def test_skip(self, drive, journal):
+        """Test that skipped duplicates are left out of the destination."""
+        dedup = DuplicateIndex(build_tree_snapshot('root', drive), 'skip')
+
+        copy_child_objects('root', 'dest', drive, journal=journal, dedup=dedup)
+        stats = dedup.finish(drive, journal)
+
+        assert (stats['skipped'], stats['bytes_avoided']) == (2, 200)
+        assert not shortcuts(drive)
+        assert drive.count_items('dest') == (5, 2)
+
+    def test_copies_duplicates_without_canonical_copy(self, drive, journal):
+        """Test that duplicates are copied when the canonical copy does not exist."""
+        dedup = DuplicateIndex(build_tree_snapshot('root', drive))
+        dedup.defer(drive.items['logo2'], 'dest')
+
+        stats = dedup.finish(drive, journal)
+
+        assert (stats['copied'], stats['copies_avoided']) == (1, 0)
+        assert journal.lookup('logo2') is not None
+
+    def test_async_copy(self, drive, journal):
+        """Test the asyncio pipeline."""
+        dedup = DuplicateIndex(build_tree_snapshot('root', drive))
+
+        stats = copy_child_objects_async('root', 'dest', lambda: drive, copy_workers=2,
+                                         journal=journal, dedup=dedup)
+        dedup.finish(drive, journal)
+
+        assert stats['files'] == 5
+        assert len(shortcuts(drive)) == 2
+
+    def test_plan(self, drive, journal):
+        """Test copying a plan."""
+        source = build_tree_snapshot('root', drive)
+        dedup = DuplicateIndex(source)
+
+        stats = execute_copy_plan(build_copy_plan(source, 'dest'), drive, journal=journal,
+                                  dedup=dedup)
+        dedup.finish(drive, journal)
+
+        assert stats['files'] == 5
+        assert len(shortcuts(drive)) == 2
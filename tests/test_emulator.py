@@ -0,0 +1,96 @@
+"""Tests for the local Drive API emulator, through the real client and HTTP stack."""
+# pylint: disable=redefined-outer-name
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.errors import HttpError
+from benchmarks.emulator import DriveEmulator, TokenBucket, build_emulated_drive
+from gcp.changes import apply_changes, get_start_page_token
+from gcp.copy_folder import copy_child_objects, create_drive_service
+from gcp.ratelimit import is_rate_limit_error, is_retryable_error, retry_after_seconds
+from gcp.snapshot import TreeSnapshot, build_tree_snapshot
+
+
+@pytest.fixture
+def emulator():
+    """Serve a wide tree of about 100 items."""
+    with DriveEmulator(build_emulated_drive('wide', 100)) as running:
+        yield running
+
+
+def connect(emulator):
+    """Create a real Drive client pointed at the emulator."""
+    return create_drive_service(AnonymousCredentials(), emulator.url)
+
+
+class TestEmulatedApi:
+    """Test the emulated Drive v3 subset."""
+
+    @pytest.mark.parametrize('traversal', ['recursive', 'bfs', 'corpus'])
+    def test_traversals_match_the_tree(self, emulator, traversal):
+        """Test that listings with q parsing and pagination return the whole tree."""
+        snapshot = build_tree_snapshot('root', connect(emulator), traversal=traversal)
+        assert snapshot.count_child_objects() == emulator.drive.count_items('root')
+
+    def test_batched_copy_reuses_one_connection(self, emulator):
+        """Test that a batched copy goes through the batch endpoint on a kept-alive connection."""
+        copy_child_objects('root', 'dest', connect(emulator))
+
+        assert emulator.drive.count_items('dest') == emulator.drive.count_items('root')
+        assert emulator.stats['batches'] > 0
+        assert emulator.stats['calls'] > emulator.stats['requests']
+        assert emulator.stats['connections'] == 1
+
+    def test_changes_feed_reports_copies(self, emulator):
+        """Test that items created through the API appear in the changes feed."""
+        drive_service = connect(emulator)
+        page_token = get_start_page_token(drive_service)
+        snapshot = TreeSnapshot('dest')
+        drive_service.files().create(body={'name': 'new.txt', 'parents': ['dest']}).execute()
+
+        _, num_applied = apply_changes(snapshot, drive_service, page_token)
+
+        assert num_applied == 1
+        assert snapshot.count_child_objects() == (1, 0)
+
+    def test_unknown_file_is_404(self, emulator):
+        """Test that a missing file is reported like Drive does."""
+        with pytest.raises(HttpError) as error:
+            connect(emulator).files().get(fileId='missing').execute()
+        assert error.value.resp.status == 404
+
+
+class TestFaults:
+    """Test rate limits and injected server errors."""
+
+    @pytest.mark.parametrize('status', [403, 429])
+    def test_rate_limit(self, status):
+        """Test that calls over the per-user limit fail with a rate limit error."""
+        with DriveEmulator(build_emulated_drive('wide', 10), rate_limit=0.001, burst=1,
+                           rate_limit_status=status) as emulator:
+            drive_service = connect(emulator)
+            drive_service.files().get(fileId='root').execute()
+            with pytest.raises(HttpError) as error:
+                drive_service.files().get(fileId='root').execute()
+
+        assert is_rate_limit_error(error.value)
+        assert retry_after_seconds(error.value) == (1 if status == 429 else None)
+        assert emulator.stats['rate_limited'] == 1
+
+    def test_server_errors(self):
+        """Test that injected 5xx responses are retryable errors."""
+        with DriveEmulator(build_emulated_drive('wide', 10), error_rate=1.0, seed=1) as emulator:
+            with pytest.raises(HttpError) as error:
+                connect(emulator).files().get(fileId='root').execute()
+
+        assert error.value.resp.status in (500, 503)
+        assert is_retryable_error(error.value)
+
+    def test_token_bucket_refills(self):
+        """Test that a user may call again once the bucket refills."""
+        now = [0.0]
+        bucket = TokenBucket(rate=2, burst=1, clock=lambda: now[0])
+
+        assert bucket.allow('a') and not bucket.allow('a')
+        assert bucket.allow('b')
+        now[0] = 0.5
+        assert bucket.allow('a')
@@ -0,0 +1,196 @@
+"""Tests for item filters and their pushdown into the Drive query of every traversal."""
+# pylint: disable=redefined-outer-name
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+import pytest
+from benchmarks.fake_drive import FakeDrive
+from gcp.async_copy import copy_child_objects_async
+from gcp.changes import apply_changes, refresh_snapshot
+from gcp.copy_folder import copy_child_objects, count_child_objects
+from gcp.filters import ItemFilter, filter_fields, parse_filter_term
+from gcp.listing import MIME_FOLDER
+from gcp.snapshot import TRAVERSALS, BFS_FIELDS, build_tree_snapshot
+
+NOW = datetime(2024, 6, 30, 15, 45, tzinfo=timezone.utc)
+PDF = 'application/pdf'
+
+
+@pytest.fixture
+def drive():
+    """Create a tree of recent and old PDFs and text files, one of them trashed."""
+    fake = FakeDrive()
+    fake.add_item('a', 'a', MIME_FOLDER, 'root')
+    fake.add_item('new.pdf', 'new.pdf', PDF, 'root', size='100',
+                  modifiedTime='2024-06-01T10:00:00.000Z')
+    fake.add_item('old.pdf', 'old.pdf', PDF, 'a', size='200',
+                  modifiedTime='2023-01-01T10:00:00.000Z')
+    fake.add_item('big.pdf', 'big.pdf', PDF, 'a', size=str(5 * 1024 * 1024),
+                  modifiedTime='2024-06-02T10:00:00.000Z')
+    fake.add_item('notes.txt', 'notes.txt', 'text/plain', 'a', size='10',
+                  modifiedTime='2024-06-03T10:00:00.000Z')
+    fake.add_item('trash.pdf', 'trash.pdf', PDF, 'a', size='10', trashed=True,
+                  modifiedTime='2024-06-04T10:00:00.000Z')
+    return fake
+
+
+def snapshot_files(snapshot):
+    """Return the IDs of the files in a snapshot."""
+    return sorted(item_id for item_id in snapshot.items if not snapshot.is_folder(item_id))
+
+
+class TestParseFilterTerm:
+    """Test compiling filter terms."""
+
+    def test_query_clauses(self):
+        """Test the Drive query clause of every pushable field."""
+        assert parse_filter_term('mimeType=application/pdf,image/png').clause == (
+            "(mimeType = 'application/pdf' or mimeType = 'image/png')")
+        assert parse_filter_term('mimeType~image/').clause == "mimeType contains 'image/'"
+        assert parse_filter_term("name~O'Brien").clause == "name contains 'O\\'Brien'"
+        assert parse_filter_term('modifiedTime>=2024-01-31').clause == (
+            "modifiedTime >= '2024-01-31T00:00:00'")
+
+    def test_ages_start_at_midnight(self):
+        """Test that ages are relative to the start of the current day or hour (UTC)."""
+        assert parse_filter_term('modifiedTime>90d', NOW).clause == (
+            "modifiedTime > '2024-04-01T00:00:00'")
+        assert parse_filter_term('modifiedTime>2h', NOW).clause == (
+            "modifiedTime > '2024-06-30T13:00:00'")
+
+    def test_name_terms_match_prefixes(self, drive):
+        """Test that names match by prefix in any case, locally as in the Drive query."""
+        term = parse_filter_term('name~NEW')
+        assert term.predicate({'name': 'new.pdf'})
+        assert not term.predicate({'name': 'renew.pdf'})
+        listed = {item['id'] for item in drive.list_items(term.clause, 100, None)['files']}
+        assert listed == {item_id for item_id, item in drive.items.items()
+                          if term.predicate(item)} == {'new.pdf'}
+
+    def test_size_is_local(self):
+        """Test that sizes, which files.list cannot search, are checked on the items."""
+        term = parse_filter_term('size<1.5KB')
+        assert term.clause is None
+        assert term.predicate({'size': '1000'})
+        assert not term.predicate({'size': '2000'})
+
+    @pytest.mark.parametrize('expression', ['owner=me', 'size~1', 'size<lots', 'mimeType',
+                                            'modifiedTime>yesterday'])
+    def test_invalid_terms(self, expression):
+        """Test that unknown fields, operators and values are rejected."""
+        with pytest.raises(ValueError):
+            parse_filter_term(expression)
+
+
+class TestItemFilter:
+    """Test restricting queries and matching items."""
+
+    def test_restriction_keeps_folders(self):
+        """Test that listings of files and folders keep every folder."""
+        item_filter = ItemFilter(['mimeType=application/pdf', 'size<1MB'])
+        assert item_filter.query("'a' in parents") == (
+            f"'a' in parents and (mimeType = '{MIME_FOLDER}' or (mimeType = 'application/pdf'))")
+        assert item_filter.file_query("'a' in parents") == (
+            "'a' in parents and mimeType = 'application/pdf'")
+        assert ItemFilter(['size<1MB']).query("'a' in parents") == "'a' in parents"
+
+    def test_matches(self):
+        """Test that listed items are only checked against local terms."""
+        item_filter = ItemFilter(['mimeType=application/pdf', 'size<1KB'])
+        assert item_filter.matches({'mimeType': MIME_FOLDER})
+        assert item_filter.matches({'mimeType': 'text/plain', 'size': '10'})
+        assert not item_filter.matches({'mimeType': 'text/plain', 'size': '10'}, listed=False)
+        assert not item_filter.matches({'mimeType': PDF, 'size': '2048'})
+
+    def test_filter_fields(self):
+        """Test that the fields of local terms (or of every term) are requested."""
+        item_filter = ItemFilter(['modifiedTime>2024-01-01', 'size<1KB'])
+        assert filter_fields('files(id,mimeType)', item_filter) == 'files(id,mimeType,size)'
+        assert filter_fields('files(id,size)', item_filter, listed=False) == (
+            'files(id,size,modifiedTime)')
+
+
+class TestTraversals:
+    """Test that every traversal and copy engine applies the filter."""
+
+    @pytest.mark.parametrize('traversal', sorted(TRAVERSALS))
+    def test_snapshot(self, drive, traversal):
+        """Test that only matching, untrashed files are in the snapshot, with every folder."""
+        options = {'service_factory': lambda: drive} if traversal == 'concurrent' else {}
+        if traversal in ('bfs', 'corpus'):
+            options['fields'] = BFS_FIELDS
+        item_filter = ItemFilter(['mimeType=application/pdf', 'modifiedTime>2024-05-01',
+                                  'size<1MB'])
+
+        snapshot = build_tree_snapshot('root', drive, traversal=traversal,
+                                       item_filter=item_filter, **options)
+
+        assert snapshot_files(snapshot) == ['new.pdf']
+        assert snapshot.is_folder('a')
+
+    def test_excluded_files_are_not_listed(self):
+        """Test that pushable terms reach the server and local terms are checked locally."""
+        mock_service = MagicMock()
+        mock_service.files().list().execute.return_value = {'files': [
+            {'id': 'f1', 'mimeType': PDF, 'size': '10'},
+            {'id': 'f2', 'mimeType': PDF, 'size': '5000'},
+        ]}
+
+        counts = count_child_objects('root', mock_service,
+                                     ItemFilter(['mimeType=application/pdf', 'size<1KB']))
+
+        assert counts == (1, 0)
+        mock_service.files().list.assert_called_with(
+            q=f"'root' in parents and trashed = false and (mimeType = '{MIME_FOLDER}' or "
+              "(mimeType = 'application/pdf'))",
+            pageSize=1000, fields='nextPageToken,files(id,mimeType,size)')
+
+    @pytest.mark.parametrize('batch_size', [1, 100])
+    def test_copy_child_objects(self, drive, batch_size):
+        """Test that the copy skips trashed and excluded files."""
+        copy_child_objects('root', 'dest', drive, batch_size=batch_size,
+                           item_filter=ItemFilter(['mimeType=application/pdf', 'size<1MB']))
+
+        # new.pdf and old.pdf in a copy of folder a
+        assert drive.count_items('dest') == (2, 1)
+
+    def test_copy_without_filter_skips_trash(self, drive):
+        """Test that trashed files are never copied."""
+        copy_child_objects('root', 'dest', drive)
+        assert drive.count_items('dest') == (4, 1)
+
+    def test_async_copy(self, drive):
+        """Test the asyncio pipeline."""
+        stats = copy_child_objects_async('root', 'dest', lambda: drive, copy_workers=2,
+                                         item_filter=ItemFilter(['mimeType=text/plain']))
+        assert stats == {'folders': 1, 'files': 1, 'failed': 0}
+
+    def test_changes_drop_files_that_stop_matching(self, drive):
+        """Test that the changes feed, which is not filtered by Drive, is checked locally."""
+        item_filter = ItemFilter(['modifiedTime>2024-05-01'])
+        snapshot = build_tree_snapshot('root', drive, item_filter=item_filter)
+        modified = {'id': 'new.pdf', 'name': 'new.pdf', 'mimeType': PDF, 'parents': ['root'],
+                    'modifiedTime': '2024-01-01T00:00:00.000Z'}
+        mock_service = MagicMock()
+        mock_service.changes().list().execute.return_value = {
+            'changes': [{'fileId': 'new.pdf', 'file': modified}], 'newStartPageToken': 't2'}
+
+        apply_changes(snapshot, mock_service, 't1', item_filter=item_filter)
+
+        assert 'new.pdf' not in snapshot.items
+        fields = mock_service.changes().list.call_args.kwargs['fields']
+        assert 'modifiedTime' in fields
+
+    def test_refresh_drops_files_that_age_out(self, drive, tmp_path):
+        """Test that relative ages are resolved again on every refresh of a stored snapshot."""
+        state_path = str(tmp_path / 'state.json')
+        first = ItemFilter([parse_filter_term('modifiedTime>30d', NOW)])
+        snapshot = refresh_snapshot('root', drive, path=state_path, item_filter=first)
+        assert snapshot_files(snapshot) == ['big.pdf', 'new.pdf', 'notes.txt']
+
+        # Two days later, new.pdf is older than 30 days without having changed
+        later = ItemFilter([parse_filter_term('modifiedTime>30d', datetime(2024, 7, 2, 12,
+                                                                           tzinfo=timezone.utc))])
+        snapshot = refresh_snapshot('root', drive, path=state_path, item_filter=later)
+
+        assert snapshot_files(snapshot) == ['big.pdf', 'notes.txt']
+        assert drive.calls['files.list'] == 2
@@ -0,0 +1,100 @@
+"""Tests for the copy checkpoint journal and resumed copies."""
+# pylint: disable=redefined-outer-name
+from unittest.mock import MagicMock
+import sqlite3
+import pytest
+from gcp.journal import CopyJournal, KIND_FOLDER
+from gcp.copy_folder import copy_child_objects
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    """Path of a journal in a temporary directory."""
+    return str(tmp_path / 'journal.sqlite3')
+
+
+@pytest.fixture
+def mock_service():
+    """Create a mock Google Drive service."""
+    service = MagicMock()
+    return service
+
+
+class TestCopyJournal:
+    """Test recording and reloading completed copies."""
+
+    def test_record_and_lookup(self, journal_path):
+        """Test that recorded mappings are visible immediately."""
+        with CopyJournal(journal_path) as journal:
+            journal.record('src1', 'dest1')
+            assert journal.lookup('src1') == 'dest1'
+            assert journal.lookup('src2') is None
+
+    def test_resume_reloads_records(self, journal_path):
+        """Test that a resumed journal sees the records of the previous run."""
+        with CopyJournal(journal_path) as journal:
+            journal.record('src1', 'dest1')
+            journal.record('folder1', 'new_folder1', KIND_FOLDER)
+
+        with CopyJournal(journal_path, resume=True) as journal:
+            assert journal.lookup('src1') == 'dest1'
+            assert journal.lookup('folder1') == 'new_folder1'
+            assert len(journal) == 2
+
+    def test_fresh_run_clears_journal(self, journal_path, caplog):
+        """Test that a run without resume starts from an empty journal, with a warning."""
+        with CopyJournal(journal_path) as journal:
+            journal.record('src1', 'dest1')
+
+        with CopyJournal(journal_path) as journal:
+            assert len(journal) == 0
+        assert 'Discarding the checkpoint journal' in caplog.text
+
+    def test_writes_are_batched(self, journal_path):
+        """Test that records are only written once a batch is full."""
+        journal = CopyJournal(journal_path, batch_size=3, flush_seconds=3600)
+        journal.record('a', '1')
+        journal.record('b', '2')
+
+        def stored():
+            with sqlite3.connect(journal_path) as connection:
+                return connection.execute('SELECT COUNT(*) FROM copies').fetchone()[0]
+
+        assert stored() == 0
+        journal.record('c', '3')
+        assert stored() == 3
+        journal.close()
+
+    def test_check_roots_mismatch(self, journal_path):
+        """Test that a journal cannot resume a copy of different folders."""
+        with CopyJournal(journal_path) as journal:
+            journal.check_roots('source', 'destination')
+
+        with CopyJournal(journal_path, resume=True) as journal:
+            journal.check_roots('source', 'destination')
+            with pytest.raises(ValueError, match="belongs to a copy"):
+                journal.check_roots('source', 'other')
+
+
+class TestResumedCopy:
+    """Test that copies skip what the journal already holds."""
+
+    @pytest.mark.parametrize('batch_size', [1, 100])
+    def test_copy_skips_journaled_items(self, mock_service, journal_path, batch_size):
+        """Test that copied files are skipped and created folders are reused."""
+        mock_service.files().list().execute.side_effect = [
+            {'files': [{'id': 'done', 'name': 'done.txt', 'mimeType': 'text/plain'}]},
+            {'files': [{'id': 'folder1', 'name': 'subfolder'}]},
+            {'files': []},  # Files in subfolder
+            {'files': []},  # Folders in subfolder
+        ]
+
+        with CopyJournal(journal_path) as journal:
+            journal.record('done', 'copied_before')
+            journal.record('folder1', 'created_before', KIND_FOLDER)
+            copy_child_objects('src', 'dest', mock_service, batch_size=batch_size, journal=journal)
+
+        mock_service.files().copy.assert_not_called()
+        mock_service.files().create.assert_not_called()
+        # The reused folder is still listed so its remaining contents are copied
+        assert mock_service.files().list().execute.call_count == 4
@@ -0,0 +1,127 @@
+"""Tests for the paginated Drive listing helpers."""
+# pylint: disable=redefined-outer-name
+import threading
+from unittest.mock import MagicMock
+import pytest
+from benchmarks.fake_drive import FakeDrive
+from gcp.listing import list_files, PagePrefetcher, PAGE_SIZE, COUNT_FIELDS
+from gcp.copy_folder import count_child_objects, count_files_and_folders
+
+
+@pytest.fixture
+def mock_service():
+    """Create a mock Google Drive service."""
+    service = MagicMock()
+    return service
+
+
+class TestListFiles:
+    """Test the generator-based listing engine."""
+
+    def test_list_files_single_page(self, mock_service):
+        """Test that a response without nextPageToken is a single page."""
+        mock_service.files().list().execute.return_value = {
+            'files': [{'id': '1'}, {'id': '2'}]
+        }
+
+        items = list(list_files(mock_service, "'root' in parents"))
+
+        assert [item['id'] for item in items] == ['1', '2']
+
+    @pytest.mark.parametrize('prefetch', [True, False])
+    def test_list_files_follows_page_tokens(self, mock_service, prefetch):
+        """Test that every page is walked in order."""
+        mock_service.files().list().execute.side_effect = [
+            {'files': [{'id': '1'}], 'nextPageToken': 'page2'},
+            {'files': [{'id': '2'}], 'nextPageToken': 'page3'},
+            {'files': [{'id': '3'}]},
+        ]
+
+        items = list(list_files(mock_service, "'root' in parents", prefetch=prefetch))
+
+        assert [item['id'] for item in items] == ['1', '2', '3']
+        page_tokens = [call.kwargs.get('pageToken')
+                       for call in mock_service.files().list.call_args_list if call.kwargs]
+        assert page_tokens == [None, 'page2', 'page3']
+
+    def test_prefetch_lists_through_thread_services(self, mock_service, monkeypatch):
+        """Test that next pages are fetched through the prefetch threads' own services."""
+        threads = []
+
+        def new_service():
+            threads.append(threading.current_thread())
+            service = MagicMock()
+            service.files().list().execute.side_effect = lambda: {'files': [{'id': '2'}]}
+            return service
+
+        prefetcher = PagePrefetcher(new_service, workers=1)
+        monkeypatch.setattr('gcp.listing.default_prefetcher', prefetcher)
+        mock_service.files().list().execute.return_value = {
+            'files': [{'id': '1'}], 'nextPageToken': 'page2'}
+
+        for _ in range(2):
+            items = list(list_files(mock_service, "'root' in parents"))
+            assert [item['id'] for item in items] == ['1', '2']
+
+        # One thread of one shared pool, with one service of its own
+        assert mock_service.files().list().execute.call_count == 2
+        assert len(threads) == 1 and threads[0] is not threading.current_thread()
+
+    def test_prefetch_needs_thread_safe_services(self, mock_service):
+        """Test that without a service factory only thread-safe services are prefetched for."""
+        prefetcher = PagePrefetcher()
+        mock_service.files().list().execute.return_value = {'files': []}
+
+        assert prefetcher.submit(mock_service, {'q': ''}, 'page2') is None
+        assert prefetcher.submit(FakeDrive(), {'q': ''}, '0').result() == {'files': []}
+
+    def test_list_files_request_parameters(self, mock_service):
+        """Test that the page size and field projection are requested."""
+        mock_service.files().list().execute.return_value = {'files': []}
+
+        list(list_files(mock_service, "'root' in parents", fields=COUNT_FIELDS,
+                        order_by='name asc', supportsAllDrives=True))
+
+        mock_service.files().list.assert_called_with(
+            q="'root' in parents",
+            fields=f'nextPageToken,{COUNT_FIELDS}',
+            pageSize=PAGE_SIZE,
+            orderBy='name asc',
+            supportsAllDrives=True,
+        )
+
+
+class TestPaginatedCounts:
+    """Test that counting functions see every page."""
+
+    def test_count_files_and_folders_multiple_pages(self, mock_service):
+        """Test counting files spread across several pages."""
+        mock_service.files().list().execute.side_effect = [
+            {'files': [{'id': '1'}, {'id': '2'}], 'nextPageToken': 'next'},
+            {'files': [{'id': '3'}]},
+            {'files': [{'id': '4'}]},
+        ]
+
+        num_files, num_folders = count_files_and_folders('folder_id', mock_service)
+
+        assert num_files == 3
+        assert num_folders == 1
+
+    def test_count_child_objects_multiple_pages(self, mock_service):
+        """Test recursive counting when the root listing is paginated."""
+        mock_service.files().list().execute.side_effect = [
+            {
+                'files': [
+                    {'id': 'file1', 'mimeType': 'text/plain'},
+                    {'id': 'sub', 'mimeType': 'application/vnd.google-apps.folder'},
+                ],
+                'nextPageToken': 'next',
+            },
+            {'files': [{'id': 'file2', 'mimeType': 'text/plain'}]},
+            {'files': [{'id': 'file3', 'mimeType': 'text/plain'}]},  # Subfolder contents
+        ]
+
+        num_files, num_folders = count_child_objects('root', mock_service)
+
+        assert num_files == 3
+        assert num_folders == 1
@@ -3,7 +3,15 @@ Tests for the main entry point and CLI functionality of copy_folder.
 """
 from unittest.mock import patch, mock_open, MagicMock
 import pytest
-from gcp.copy_folder import main
+from google.auth.credentials import AnonymousCredentials
+from gcp.copy_folder import main, parse_args
+
+
+@pytest.fixture(autouse=True)
+def mock_write_metrics():
+    """Keep main() from writing the API metrics summaries."""
+    with patch('gcp.copy_folder.write_metrics') as mocked:
+        yield mocked
 
 
 class TestMainFunction:
@@ -11,10 +19,10 @@ class TestMainFunction:
 
     @patch('gcp.copy_folder.authenticate_and_authorize')
     @patch('gcp.copy_folder.create_drive_service')
-    @patch('gcp.copy_folder.count_child_objects')
-    @patch('gcp.copy_folder.add_child_folders')
+    @patch('gcp.snapshot.build_tree_snapshot')
+    @patch('gcp.journal.CopyJournal')
     @patch('gcp.copy_folder.copy_child_objects')
-    @patch('gcp.copy_folder.compare_csv_files')
+    @patch('gcp.validate.validate_trees')
     @patch('builtins.open', new_callable=mock_open)
     @patch('os.environ.get')
     # pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
@@ -24,8 +32,8 @@ class TestMainFunction:
         mock_file_open,
         mock_compare,
         mock_copy,
-        mock_add_child,
-        mock_count,
+        mock_journal,
+        mock_snapshot,
         mock_create_service,
         mock_auth
     ):
@@ -51,29 +59,45 @@ class TestMainFunction:
             {'name': 'Destination Folder'}
         ]
 
-        # Mock count_child_objects to return file and folder counts
-        mock_count.return_value = (10, 5)
+        # Mock the tree snapshot to return file and folder counts
+        mock_snapshot.return_value.count_child_objects.return_value = (10, 5)
+        mock_snapshot.return_value.folder_report.return_value = [['TOTAL', 10, 5]]
+        mock_snapshot.return_value.total_size.return_value = 4096
 
         # Execute main
-        main()
+        main([])
 
         # Verify authentication was called
         mock_auth.assert_called_once_with('client_id.json', [
             'https://www.googleapis.com/auth/drive',
             'https://www.googleapis.com/auth/drive.metadata.readonly'
-        ])
+        ], './outputs/token.json')
 
         # Verify service was created
-        mock_create_service.assert_called_once_with(mock_creds)
+        mock_create_service.assert_called_once_with(mock_creds, None, None)
 
-        # Verify count was called for source and destination
-        assert mock_count.call_count == 3  # Once for assessment-1, once each for assessment-2 & 3
+        # Verify each tree was traversed exactly once
+        assert mock_snapshot.call_count == 2  # Source for assessments 1 & 2, destination for 3
+        mock_snapshot.assert_any_call('source123', mock_service, 'Source Folder',
+                                      traversal='recursive')
+        mock_snapshot.assert_any_call('dest456', mock_service, 'Destination Folder',
+                                      traversal='recursive')
 
         # Verify copy was called
-        mock_copy.assert_called_once_with('source123', 'dest456', mock_service)
+        journal = mock_journal.return_value.__enter__.return_value
+        progress = mock_copy.call_args.kwargs['progress']
+        mock_copy.assert_called_once_with('source123', 'dest456', mock_service, journal=journal,
+                                          progress=progress, item_filter=None, dedup=None,
+                                          transfer=None)
+        # Progress counts against the totals of the source traversal
+        assert (progress.total_items, progress.total_bytes) == (15, 4096)
+        mock_journal.assert_called_once_with('./outputs/copy-journal.sqlite3', resume=False)
+        journal.check_roots.assert_called_once_with('source123', 'dest456')
 
         # Verify comparison was called
-        mock_compare.assert_called_once_with('./outputs/assessment-2.csv', './outputs/assessment-3.csv')
+        mock_compare.assert_called_once_with(mock_snapshot.return_value, mock_snapshot.return_value,
+                                             './outputs/validation-diff.csv',
+                                             keep_extra=False)
 
     @patch('os.environ.get')
     def test_main_missing_client_id(self, mock_env):
@@ -85,7 +109,7 @@ class TestMainFunction:
         mock_env.side_effect = env_vars.get
 
         with pytest.raises(ValueError, match="Missing environment variable.*Client ID"):
-            main()
+            main([])
 
     @patch('os.environ.get')
     def test_main_missing_source_folder_id(self, mock_env):
@@ -97,7 +121,7 @@ class TestMainFunction:
         mock_env.side_effect = env_vars.get
 
         with pytest.raises(ValueError, match="Missing environment variable.*Source folder"):
-            main()
+            main([])
 
     @patch('os.environ.get')
     def test_main_missing_destination_folder_id(self, mock_env):
@@ -109,7 +133,7 @@ class TestMainFunction:
         mock_env.side_effect = env_vars.get
 
         with pytest.raises(ValueError, match="Missing environment variable.*Destination folder"):
-            main()
+            main([])
 
     @patch('gcp.copy_folder.authenticate_and_authorize')
     @patch('os.environ.get')
@@ -126,14 +150,14 @@ class TestMainFunction:
         mock_auth.return_value = None
 
         with pytest.raises(RuntimeError, match="Failed to authenticate"):
-            main()
+            main([])
 
     @patch('gcp.copy_folder.authenticate_and_authorize')
     @patch('gcp.copy_folder.create_drive_service')
-    @patch('gcp.copy_folder.count_child_objects')
-    @patch('gcp.copy_folder.add_child_folders')
+    @patch('gcp.snapshot.build_tree_snapshot')
+    @patch('gcp.journal.CopyJournal')
     @patch('gcp.copy_folder.copy_child_objects')
-    @patch('gcp.copy_folder.compare_csv_files')
+    @patch('gcp.validate.validate_trees')
     @patch('builtins.open', new_callable=mock_open)
     @patch('os.environ.get')
     # pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
@@ -143,8 +167,8 @@ class TestMainFunction:
         mock_file_open,
         mock_compare,
         mock_copy,
-        mock_add_child,
-        mock_count,
+        mock_journal,
+        mock_snapshot,
         mock_create_service,
         mock_auth
     ):
@@ -166,9 +190,9 @@ class TestMainFunction:
             {'name': 'Dest'}
         ]
 
-        mock_count.return_value = (100, 20)
+        mock_snapshot.return_value.count_child_objects.return_value = (100, 20)
 
-        main()
+        main([])
 
         # Verify all CSV files were opened for writing
         expected_files = [
@@ -183,10 +207,10 @@ class TestMainFunction:
 
     @patch('gcp.copy_folder.authenticate_and_authorize')
     @patch('gcp.copy_folder.create_drive_service')
-    @patch('gcp.copy_folder.count_child_objects')
-    @patch('gcp.copy_folder.add_child_folders')
+    @patch('gcp.snapshot.build_tree_snapshot')
+    @patch('gcp.journal.CopyJournal')
     @patch('gcp.copy_folder.copy_child_objects')
-    @patch('gcp.copy_folder.compare_csv_files')
+    @patch('gcp.validate.validate_trees')
     @patch('builtins.open', new_callable=mock_open)
     @patch('os.environ.get')
     # pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
@@ -196,8 +220,8 @@ class TestMainFunction:
         mock_file_open,
         mock_compare,
         mock_copy,
-        mock_add_child,
-        mock_count,
+        mock_journal,
+        mock_snapshot,
         mock_create_service,
         mock_auth
     ):
@@ -221,9 +245,9 @@ class TestMainFunction:
             {'name': 'My Destination Folder'}
         ]
 
-        mock_count.return_value = (5, 3)
+        mock_snapshot.return_value.count_child_objects.return_value = (5, 3)
 
-        main()
+        main([])
 
         # Verify get was called with correct parameters for folder names
         assert mock_get.call_count >= 2
@@ -236,10 +260,10 @@ class TestMainIntegration:
 
     @patch('gcp.copy_folder.authenticate_and_authorize')
     @patch('gcp.copy_folder.create_drive_service')
-    @patch('gcp.copy_folder.count_child_objects')
-    @patch('gcp.copy_folder.add_child_folders')
+    @patch('gcp.snapshot.build_tree_snapshot')
+    @patch('gcp.journal.CopyJournal')
     @patch('gcp.copy_folder.copy_child_objects')
-    @patch('gcp.copy_folder.compare_csv_files')
+    @patch('gcp.validate.validate_trees')
     @patch('builtins.open', new_callable=mock_open)
     @patch('os.environ.get')
     # pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
@@ -249,8 +273,8 @@ class TestMainIntegration:
         mock_file_open,
         mock_compare,
         mock_copy,
-        mock_add_child,
-        mock_count,
+        mock_journal,
+        mock_snapshot,
         mock_create_service,
         mock_auth
     ):
@@ -269,24 +293,23 @@ class TestMainIntegration:
             {'name': 'Source'},
             {'name': 'Dest'}
         ]
-        mock_count.return_value = (50, 10)
+        mock_snapshot.return_value.count_child_objects.return_value = (50, 10)
 
-        main()
+        main([])
 
         # Verify workflow steps
         assert mock_auth.called
         assert mock_create_service.called
-        assert mock_count.call_count == 3  # Once for assessment-1, once each for 2 & 3
-        assert mock_add_child.call_count == 2  # assessment-2 and assessment-3
+        assert mock_snapshot.call_count == 2  # One traversal each for source and destination
         assert mock_copy.call_count == 1
         assert mock_compare.call_count == 1
 
     @patch('gcp.copy_folder.authenticate_and_authorize')
     @patch('gcp.copy_folder.create_drive_service')
-    @patch('gcp.copy_folder.count_child_objects')
-    @patch('gcp.copy_folder.add_child_folders')
+    @patch('gcp.snapshot.build_tree_snapshot')
+    @patch('gcp.journal.CopyJournal')
     @patch('gcp.copy_folder.copy_child_objects')
-    @patch('gcp.copy_folder.compare_csv_files')
+    @patch('gcp.validate.validate_trees')
     @patch('builtins.open', new_callable=mock_open)
     @patch('os.environ.get')
     # pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
@@ -296,8 +319,8 @@ class TestMainIntegration:
         mock_file_open,
         mock_compare,
         mock_copy,
-        mock_add_child,
-        mock_count,
+        mock_journal,
+        mock_snapshot,
         mock_create_service,
         mock_auth
     ):
@@ -316,12 +339,353 @@ class TestMainIntegration:
             {'name': 'TestSource'},
             {'name': 'TestDest'}
         ]
-        mock_count.return_value = (25, 8)
+        mock_snapshot.return_value.count_child_objects.return_value = (25, 8)
 
-        main()
+        main([])
 
         # Check that all three assessment files were created
         calls = [str(call) for call in mock_file_open.call_args_list]
         assert any('assessment-1.csv' in call for call in calls)
         assert any('assessment-2.csv' in call for call in calls)
         assert any('assessment-3.csv' in call for call in calls)
+
+
+    @patch('gcp.copy_folder.authenticate_and_authorize')
+    @patch('gcp.copy_folder.create_drive_service')
+    @patch('gcp.changes.refresh_snapshot')
+    @patch('gcp.snapshot.build_tree_snapshot')
+    @patch('gcp.copy_folder.copy_child_objects')
+    @patch('builtins.open', new_callable=mock_open)
+    @patch('os.environ.get')
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
+    def test_main_incremental_report_only(
+        self,
+        mock_env,
+        mock_file_open,
+        mock_copy,
+        mock_snapshot,
+        mock_refresh,
+        mock_create_service,
+        mock_auth
+    ):
+        """Test that an incremental report refreshes the stored snapshot and does not copy"""
+        env_vars = {
+            'GOOGLE_DRIVE_CLIENT_ID_FILE': 'test.json',
+            'GOOGLE_DRIVE_SOURCE_FOLDER_ID': 'abc',
+            'GOOGLE_DRIVE_DESTINATION_FOLDER_ID': 'xyz'
+        }
+        mock_env.side_effect = env_vars.get
+
+        mock_auth.return_value = MagicMock()
+        mock_service = MagicMock()
+        mock_create_service.return_value = mock_service
+        mock_service.files().get().execute.side_effect = [
+            {'name': 'TestSource'},
+            {'name': 'TestDest'}
+        ]
+        mock_refresh.return_value.count_child_objects.return_value = (25, 8)
+
+        main(['--incremental', '--report-only'])
+
+        assert mock_refresh.call_count == 1
+        assert mock_snapshot.call_count == 0
+        assert mock_copy.call_count == 0
+        calls = [str(call) for call in mock_file_open.call_args_list]
+        assert any('assessment-2.csv' in call for call in calls)
+        assert not any('assessment-3.csv' in call for call in calls)
+
+    @patch('gcp.copy_folder.authenticate_and_authorize')
+    @patch('gcp.copy_folder.create_drive_service')
+    @patch('gcp.snapshot.build_tree_snapshot')
+    @patch('gcp.metrics.api_metrics')
+    @patch('builtins.open', new_callable=mock_open)
+    @patch('os.environ.get')
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
+    def test_main_writes_api_metrics(
+        self,
+        mock_env,
+        mock_file_open,
+        mock_metrics,
+        mock_snapshot,
+        mock_create_service,
+        mock_auth,
+        mock_write_metrics
+    ):
+        """Test that API calls are recorded per phase and the summaries written at the end"""
+        env_vars = {
+            'GOOGLE_DRIVE_CLIENT_ID_FILE': 'test.json',
+            'GOOGLE_DRIVE_SOURCE_FOLDER_ID': 'abc',
+            'GOOGLE_DRIVE_DESTINATION_FOLDER_ID': 'xyz'
+        }
+        mock_env.side_effect = env_vars.get
+        mock_service = MagicMock()
+        mock_create_service.return_value = mock_service
+        mock_service.files().get().execute.side_effect = [
+            {'name': 'TestSource'},
+            {'name': 'TestDest'}
+        ]
+        mock_snapshot.return_value.count_child_objects.return_value = (1, 0)
+
+        main(['--report-only', '--metrics-json', 'metrics.json',
+              '--metrics-textfile', 'drive.prom'])
+
+        phases = [call.args[0] for call in mock_metrics.start_phase.call_args_list]
+        assert phases == ['assessment-1', 'assessment-2']
+        args = mock_write_metrics.call_args.args[0]
+        assert (args.metrics_json, args.metrics_textfile) == ('metrics.json', 'drive.prom')
+
+    @patch('gcp.copy_folder.authenticate_and_authorize')
+    @patch('gcp.copy_folder.create_drive_service')
+    @patch('gcp.snapshot.build_tree_snapshot')
+    @patch('gcp.copy_folder.copy_child_objects')
+    @patch('gcp.plan.write_plan')
+    @patch('builtins.open', new_callable=mock_open)
+    @patch('os.environ.get')
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
+    def test_main_dry_run(
+        self,
+        mock_env,
+        mock_file_open,
+        mock_write_plan,
+        mock_copy,
+        mock_snapshot,
+        mock_create_service,
+        mock_auth
+    ):
+        """Test that a dry run writes the plan with its estimates and does not copy"""
+        env_vars = {
+            'GOOGLE_DRIVE_CLIENT_ID_FILE': 'test.json',
+            'GOOGLE_DRIVE_SOURCE_FOLDER_ID': 'abc',
+            'GOOGLE_DRIVE_DESTINATION_FOLDER_ID': 'xyz'
+        }
+        mock_env.side_effect = env_vars.get
+        mock_service = MagicMock()
+        mock_create_service.return_value = mock_service
+        mock_service.files().get().execute.side_effect = [
+            {'name': 'TestSource'},
+            {'name': 'TestDest'}
+        ]
+        snapshot = mock_snapshot.return_value
+        snapshot.count_child_objects.return_value = (1, 0)
+        snapshot.root_id = 'abc'
+        snapshot.children = {'abc': ['f1']}
+        snapshot.items = {'f1': {'id': 'f1', 'name': 'f1.txt', 'size': '10', 'parents': ['abc']}}
+        snapshot.is_folder.return_value = False
+
+        main(['--dry-run', '--plan', 'plan.json'])
+
+        assert mock_copy.call_count == 0
+        plan, path = mock_write_plan.call_args.args
+        assert path == 'plan.json'
+        assert plan['totals'] == {'folders': 0, 'files': 1, 'bytes': 10}
+        assert plan['estimate']['engines']['plan']['calls'] == 1
+
+    @patch('gcp.copy_folder.authenticate_and_authorize')
+    @patch('gcp.copy_folder.create_drive_service')
+    @patch('gcp.snapshot.build_tree_snapshot')
+    @patch('gcp.plan.load_plan')
+    @patch('gcp.plan.plan_snapshot')
+    @patch('gcp.plan.execute_copy_plan')
+    @patch('gcp.journal.CopyJournal')
+    @patch('builtins.open', new_callable=mock_open)
+    @patch('os.environ.get')
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
+    def test_main_executes_plan(
+        self,
+        mock_env,
+        mock_file_open,
+        mock_journal,
+        mock_execute_plan,
+        mock_plan_snapshot,
+        mock_load_plan,
+        mock_snapshot,
+        mock_create_service,
+        mock_auth
+    ):
+        """Test that a plan is copied without traversing the source again"""
+        env_vars = {
+            'GOOGLE_DRIVE_CLIENT_ID_FILE': 'test.json',
+            'GOOGLE_DRIVE_SOURCE_FOLDER_ID': 'abc',
+            'GOOGLE_DRIVE_DESTINATION_FOLDER_ID': 'xyz'
+        }
+        mock_env.side_effect = env_vars.get
+        mock_service = MagicMock()
+        mock_create_service.return_value = mock_service
+        mock_service.files().get().execute.side_effect = [
+            {'name': 'TestSource'},
+            {'name': 'TestDest'}
+        ]
+        mock_load_plan.return_value = {'source_id': 'abc', 'destination_id': 'xyz'}
+        mock_plan_snapshot.return_value.count_child_objects.return_value = (1, 0)
+        mock_plan_snapshot.return_value.total_size.return_value = 10
+        mock_snapshot.return_value.count_child_objects.return_value = (1, 0)
+        mock_execute_plan.return_value = {'folders': 0, 'files': 1, 'skipped': 0, 'failed': 0}
+
+        main(['--plan', 'plan.json'])
+
+        mock_load_plan.assert_called_once_with('plan.json')
+        assert mock_execute_plan.call_args.args[0] is mock_load_plan.return_value
+        # Only the destination is traversed, for assessment 3
+        assert mock_snapshot.call_args.args[0] == 'xyz'
+        assert mock_snapshot.call_count == 1
+
+        mock_load_plan.return_value = {'source_id': 'other', 'destination_id': 'xyz'}
+        mock_service.files().get().execute.side_effect = [
+            {'name': 'TestSource'},
+            {'name': 'TestDest'}
+        ]
+        with pytest.raises(ValueError, match='not abc to xyz'):
+            main(['--plan', 'plan.json'])
+
+    @patch('gcp.copy_folder.authenticate_and_authorize')
+    @patch('gcp.copy_folder.create_drive_service')
+    @patch('gcp.snapshot.build_tree_snapshot')
+    @patch('builtins.open', new_callable=mock_open)
+    @patch('os.environ.get')
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
+    def test_main_filters_only_the_source(
+        self,
+        mock_env,
+        mock_file_open,
+        mock_snapshot,
+        mock_create_service,
+        mock_auth
+    ):
+        """Test that the filter applies to the source traversal, not to the destination index"""
+        env_vars = {
+            'GOOGLE_DRIVE_CLIENT_ID_FILE': 'test.json',
+            'GOOGLE_DRIVE_SOURCE_FOLDER_ID': 'abc',
+            'GOOGLE_DRIVE_DESTINATION_FOLDER_ID': 'xyz'
+        }
+        mock_env.side_effect = env_vars.get
+        mock_service = MagicMock()
+        mock_create_service.return_value = mock_service
+        mock_service.files().get().execute.side_effect = [
+            {'name': 'TestSource'},
+            {'name': 'TestDest'}
+        ]
+        mock_snapshot.return_value.count_child_objects.return_value = (1, 0)
+
+        main(['--sync', '--report-only', '--filter', 'mimeType=application/pdf'])
+
+        destination_call, source_call = mock_snapshot.call_args_list
+        assert destination_call.args[0] == 'xyz'
+        assert 'item_filter' not in destination_call.kwargs
+        assert source_call.args[0] == 'abc'
+        assert source_call.kwargs['item_filter'].expressions == ['mimeType=application/pdf']
+
+    @patch('gcp.copy_folder.authenticate_and_authorize')
+    @patch('gcp.copy_folder.create_drive_service')
+    @patch('gcp.snapshot.build_tree_snapshot')
+    @patch('builtins.open', new_callable=mock_open)
+    @patch('os.environ.get')
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
+    def test_main_api_endpoint_without_credentials(
+        self,
+        mock_env,
+        mock_file_open,
+        mock_snapshot,
+        mock_create_service,
+        mock_auth
+    ):
+        """Test that an emulator endpoint is used without any credentials file"""
+        env_vars = {
+            'GOOGLE_DRIVE_API_ENDPOINT': 'http://127.0.0.1:8080/',
+            'GOOGLE_DRIVE_SOURCE_FOLDER_ID': 'abc',
+            'GOOGLE_DRIVE_DESTINATION_FOLDER_ID': 'xyz'
+        }
+        mock_env.side_effect = env_vars.get
+        mock_service = MagicMock()
+        mock_create_service.return_value = mock_service
+        mock_service.files().get().execute.side_effect = [
+            {'name': 'TestSource'},
+            {'name': 'TestDest'}
+        ]
+        mock_snapshot.return_value.count_child_objects.return_value = (1, 0)
+
+        main(['--report-only'])
+
+        mock_auth.assert_not_called()
+        credentials, api_endpoint, _ = mock_create_service.call_args.args
+        assert isinstance(credentials, AnonymousCredentials)
+        assert api_endpoint == 'http://127.0.0.1:8080/'
+
+
+class TestParseArgs:
+    """Tests for command line options"""
+
+    def test_parse_args_defaults(self):
+        """Test the default traversal engine"""
+        args = parse_args([])
+        assert args.traversal == 'recursive'
+
+    def test_parse_args_traversal(self):
+        """Test selecting the breadth-first traversal"""
+        args = parse_args(['--traversal', 'bfs'])
+        assert args.traversal == 'bfs'
+
+    def test_parse_args_rejects_unknown_traversal(self):
+        """Test that unknown traversal engines are rejected"""
+        with pytest.raises(SystemExit):
+            parse_args(['--traversal', 'sideways'])
+
+    def test_parse_args_workers(self):
+        """Test selecting the concurrent traversal with a worker count"""
+        args = parse_args(['--traversal', 'concurrent', '--workers', '16'])
+        assert args.traversal == 'concurrent'
+        assert args.workers == 16
+
+    def test_parse_args_sync(self):
+        """Test selecting incremental sync mode"""
+        assert parse_args(['--sync']).sync is True
+        assert parse_args([]).sync is False
+
+    def test_parse_args_incremental(self):
+        """Test selecting an incremental report"""
+        args = parse_args(['--incremental', '--report-only', '--report-state', 'state.json'])
+        assert args.incremental is True
+        assert args.report_only is True
+        assert args.report_state == 'state.json'
+
+    def test_parse_args_plan(self):
+        """Test that plans cannot be combined with incremental sync"""
+        args = parse_args(['--dry-run', '--plan', 'plan.json'])
+        assert (args.dry_run, args.plan) == (True, 'plan.json')
+        with pytest.raises(SystemExit):
+            parse_args(['--sync', '--plan', 'plan.json'])
+
+    def test_parse_args_filter(self):
+        """Test that filter terms are combined and that invalid terms are rejected"""
+        args = parse_args(['--filter', 'mimeType=application/pdf', '--filter', 'size<1MB'])
+        assert args.item_filter.expressions == ['mimeType=application/pdf', 'size<1MB']
+        assert parse_args([]).item_filter is None
+        with pytest.raises(SystemExit):
+            parse_args(['--filter', 'owner=me'])
+
+    def test_parse_args_incremental_filter(self):
+        """Test that incremental reports reject the ages files could mature into"""
+        args = parse_args(['--incremental', '--filter', 'modifiedTime>90d'])
+        assert args.item_filter.expressions == ['modifiedTime>90d']
+        with pytest.raises(SystemExit):
+            parse_args(['--incremental', '--filter', 'modifiedTime<90d'])
+
+    def test_parse_args_dedup(self):
+        """Test that deduplication cannot be combined with incremental sync"""
+        assert parse_args(['--dedup', 'skip']).dedup == 'skip'
+        assert parse_args([]).dedup is None
+        with pytest.raises(SystemExit):
+            parse_args(['--sync', '--dedup', 'shortcut'])
+
+    def test_parse_args_transfer_fallback(self):
+        """Test that streaming transfers cannot be combined with incremental sync"""
+        args = parse_args(['--transfer-fallback', '--transfer-workers', '8'])
+        assert (args.transfer_fallback, args.transfer_workers) == (True, 8)
+        with pytest.raises(SystemExit):
+            parse_args(['--sync', '--transfer-fallback'])
+
+    def test_parse_args_cache(self):
+        """Test enabling the metadata cache"""
+        args = parse_args(['--cache', '--cache-ttl', '600'])
+        assert args.cache is True
+        assert args.cache_ttl == 600
+        assert parse_args([]).cache is False
@@ -0,0 +1,178 @@
+"""Tests for the per-call Drive API metrics."""
+# pylint: disable=redefined-outer-name
+import json
+from unittest.mock import MagicMock
+import httplib2
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.errors import HttpError
+from benchmarks.emulator import DriveEmulator, build_emulated_drive
+from gcp.batch import execute_batched
+from gcp.cache import CachedDriveService, MetadataCache
+from gcp.copy_folder import create_drive_service
+from gcp.metrics import ApiMetrics, method_name
+from gcp.ratelimit import RateController, execute_request
+
+
+def make_error(status):
+    """Create an HttpError like the ones the Drive API returns."""
+    return HttpError(httplib2.Response({'status': status}), b'{"error": {"code": %d}}' % status)
+
+
+class FakeRequest:
+    """A request of a Drive method that returns or raises the given outcomes in turn."""
+
+    def __init__(self, method, *outcomes):
+        self.methodId = f'drive.{method}' # pylint: disable=invalid-name
+        self.outcomes = list(outcomes)
+
+    def execute(self):
+        """Return or raise the next outcome."""
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def metrics():
+    """Create metrics on a clock that advances one second per phase."""
+    now = [0.0]
+
+    def clock():
+        now[0] += 1.0
+        return now[0]
+
+    return ApiMetrics(clock=clock)
+
+
+class TestApiMetrics:
+    """Test recording and summarizing calls."""
+
+    def test_method_name(self):
+        """Test that methods are named from the discovery method id."""
+        request = MagicMock(methodId='drive.files.list')
+        assert method_name(request) == 'files.list'
+        assert method_name(object()) == 'unknown'
+
+    def test_observe_by_phase(self, metrics):
+        """Test that attempts land in the latency buckets of the current phase."""
+        metrics.observe('files.list', 200, 0.07)
+        metrics.start_phase('copy')
+        metrics.observe('files.copy', 200, 0.3)
+        metrics.observe('files.copy', 429, 12.0, retry=True)
+        metrics.observe('files.copy', 200)
+        metrics.observe_backoff('files.copy', 2.0)
+
+        phases = metrics.summary()['phases']
+        assert phases['setup']['methods']['files.list']['latency_buckets']['0.1'] == 1
+        assert phases['setup']['seconds'] == 1.0
+        copy = phases['copy']['methods']['files.copy']
+        assert copy['calls'] == 3
+        assert copy['retries'] == 1
+        assert copy['statuses'] == {'200': 2, '429': 1}
+        assert copy['latency_buckets']['0.5'] == 1
+        assert copy['latency_buckets']['+Inf'] == 2
+        assert copy['mean_seconds'] == pytest.approx(6.15)
+        assert copy['backoff_seconds'] == 2.0
+
+    def test_meter_records_response_bytes_once(self, metrics):
+        """Test that the response handler is wrapped once and still decodes the body."""
+        request = MagicMock(methodId='drive.files.get')
+        request.postproc = lambda resp, content: json.loads(content)
+
+        assert metrics.meter(request) == 'files.get'
+        metrics.meter(request)
+        assert request.postproc(None, b'{"id": "a"}') == {'id': 'a'}
+
+        assert metrics.summary()['phases']['setup']['methods']['files.get']['response_bytes'] == 11
+
+    def test_prometheus_lines(self, metrics):
+        """Test the histogram and counters of the textfile."""
+        metrics.observe('files.list', 200, 0.2)
+        metrics.observe_bytes('files.list', 512)
+        lines = metrics.prometheus_lines()
+
+        labels = 'phase="setup",method="files.list"'
+        assert f'drive_copy_api_request_duration_seconds_bucket{{{labels},le="0.1"}} 0' in lines
+        assert f'drive_copy_api_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in lines
+        assert f'drive_copy_api_request_duration_seconds_count{{{labels}}} 1' in lines
+        assert f'drive_copy_api_response_bytes_total{{{labels}}} 512' in lines
+        assert f'drive_copy_api_responses_total{{{labels},status="200"}} 1' in lines
+        assert '# TYPE drive_copy_api_retries_total counter' in lines
+
+    def test_write(self, metrics, tmp_path):
+        """Test that both summaries are written and the current phase is closed."""
+        metrics.start_phase('validation')
+        metrics.observe('files.list', 200, 0.01)
+        json_path = tmp_path / 'metrics.json'
+        textfile_path = tmp_path / 'drive_copy.prom'
+
+        metrics.write(str(json_path), str(textfile_path))
+
+        summary = json.loads(json_path.read_text(encoding='utf-8'))
+        assert summary['phases']['validation']['seconds'] == 1.0
+        assert 'drive_copy_phase_duration_seconds{phase="validation"} 1.000000' in (
+            textfile_path.read_text(encoding='utf-8'))
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            'drive_copy.prom', 'metrics.json']
+
+
+class TestInstrumentation:
+    """Test that Drive calls are recorded where they are executed."""
+
+    def test_rate_controller_records_attempts(self, metrics):
+        """Test that retries, statuses and backoff are recorded per attempt."""
+        controller = RateController(sleep=lambda _seconds: None, metrics=metrics)
+        request = FakeRequest('files.copy', make_error(503), {'id': 'new'})
+
+        assert controller.call(request.execute) == {'id': 'new'}
+
+        stats = metrics.summary()['phases']['setup']['methods']['files.copy']
+        assert stats['calls'] == 2
+        assert stats['retries'] == 1
+        assert stats['statuses'] == {'200': 1, '503': 1}
+        assert stats['latency_buckets']['+Inf'] == 2
+        assert stats['backoff_seconds'] > 0
+
+    def test_batched_calls_record_outcomes(self, metrics, batch_service):
+        """Test that calls inside a batch are counted without their own latency."""
+        controller = RateController(sleep=lambda _seconds: None, metrics=metrics)
+        requests = [(0, FakeRequest('files.copy', {'id': 'a'})),
+                    (1, FakeRequest('files.copy', {'id': 'b'})),
+                    (2, FakeRequest('files.copy', make_error(404)))]
+
+        execute_batched(batch_service, requests, controller=controller)
+
+        stats = metrics.summary()['phases']['setup']['methods']['files.copy']
+        assert stats['calls'] == 3
+        assert stats['statuses'] == {'200': 2, '404': 1}
+        assert stats['mean_seconds'] is None
+
+    def test_cache_hits_are_not_recorded(self, metrics, tmp_path):
+        """Test that cached requests are recorded under their method, and only on a miss."""
+        controller = RateController(metrics=metrics)
+        drive_service = MagicMock()
+        drive_service.files().list.side_effect = lambda **_kwargs: FakeRequest(
+            'files.list', {'files': []})
+        with MetadataCache(str(tmp_path / 'cache.sqlite3')) as cache:
+            cached_service = CachedDriveService(drive_service, cache)
+            for _ in range(3):
+                execute_request(cached_service.files().list(q="'root' in parents"), controller)
+
+        methods = metrics.summary()['phases']['setup']['methods']
+        assert list(methods) == ['files.list']
+        assert methods['files.list']['calls'] == 1
+
+    def test_real_client_response_bytes(self, metrics):
+        """Test that response sizes are measured on the real client through the emulator."""
+        controller = RateController(metrics=metrics)
+        with DriveEmulator(build_emulated_drive('wide', 10)) as emulator:
+            drive_service = create_drive_service(AnonymousCredentials(), emulator.url)
+            request = drive_service.files().list(q="'root' in parents", fields='files(id)')
+            response = controller.call(request.execute)
+
+        stats = metrics.summary()['phases']['setup']['methods']['files.list']
+        assert response['files']
+        assert stats['response_bytes'] >= len(json.dumps(response))
+        assert stats['statuses'] == {'200': 1}
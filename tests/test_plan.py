@@ -0,0 +1,147 @@
+"""Tests for dry-run copy plans, their cost estimates and their execution."""
+# pylint: disable=redefined-outer-name
+import argparse
+from unittest.mock import Mock
+import pytest
+from googleapiclient.errors import HttpError
+from benchmarks.fake_drive import FakeDrive
+from gcp.cache import CachedDriveService, MetadataCache
+from gcp.copy_folder import copy_child_objects, write_dry_run_plan
+from gcp.journal import CopyJournal
+from gcp.listing import MIME_FOLDER
+from gcp.metrics import ApiMetrics
+from gcp.plan import (
+    DEFAULT_LATENCY_SECONDS,
+    build_copy_plan,
+    estimate_copy_cost,
+    execute_copy_plan,
+    load_plan,
+    plan_snapshot,
+    write_plan,
+)
+from gcp.ratelimit import default_controller
+from gcp.snapshot import build_tree_snapshot
+
+
+@pytest.fixture
+def drive():
+    """Create a source tree of 3 folders (2 levels deep) and 5 files of 100 bytes each."""
+    fake = FakeDrive()
+    fake.add_item('a', 'a', MIME_FOLDER, 'root')
+    fake.add_item('b', 'b', MIME_FOLDER, 'root')
+    fake.add_item('c', 'c', MIME_FOLDER, 'a')
+    for index, parent_id in enumerate(['root', 'a', 'a', 'b', 'c']):
+        fake.add_item(f'f{index}', f'f{index}.txt', 'text/plain', parent_id, size='100')
+    return fake
+
+
+@pytest.fixture
+def plan(drive):
+    """Plan the copy of the source tree into 'dest'."""
+    return build_copy_plan(build_tree_snapshot('root', drive), 'dest')
+
+
+class TestBuildCopyPlan:
+    """Test planning and estimating a copy."""
+
+    def test_totals_and_order(self, plan):
+        """Test that the plan counts every item and lists parents before children."""
+        assert plan['totals'] == {'folders': 3, 'files': 5, 'bytes': 500}
+        assert [folder['id'] for folder in plan['folders']] == ['a', 'b', 'c']
+        assert plan['folders'][2]['parent'] == 'a'
+        assert 'parents' not in plan['files'][0]
+
+    def test_estimate(self, plan):
+        """Test the calls and requests of each engine for a small tree."""
+        estimate = estimate_copy_cost(plan, latency=0.1, batch_size=100, copy_workers=4)
+        engines = estimate['engines']
+
+        assert sorted(engines) == ['async', 'plan', 'sequential']
+        # 4 folders listed twice (files, then subfolders), plus one batch per non-empty group
+        assert engines['sequential'] == {'calls': 16, 'requests': 14, 'seconds': pytest.approx(1.4)}
+        assert engines['async']['calls'] == 12
+        assert engines['async']['seconds'] == pytest.approx(0.3)
+        # One batch of folders per level, one batch of files, no listing
+        assert engines['plan'] == {'calls': 8, 'requests': 3, 'seconds': pytest.approx(0.3)}
+
+    def test_sequential_estimate_matches_copy(self, drive, plan):
+        """Test that the sequential estimate counts what --copy-engine sequential sends."""
+        estimate = estimate_copy_cost(plan)['engines']['sequential']
+        target = drive.clone()
+        # The CLI copies with the default batch size
+        copy_child_objects('root', 'dest', target)
+        assert (target.api_calls(), target.round_trips) == (estimate['calls'],
+                                                            estimate['requests'])
+
+    def test_dry_run_estimate_from_network_requests(self, drive, tmp_path, monkeypatch):
+        """Test that a dry run answered from the cache assumes the default latency."""
+        args = argparse.Namespace(copy_workers=4, plan=str(tmp_path / 'plan.json'))
+        with MetadataCache(str(tmp_path / 'cache.sqlite3')) as cache:
+            cached_drive = CachedDriveService(drive, cache)
+            for measured in (True, False):
+                metrics = ApiMetrics()
+                monkeypatch.setattr(default_controller, 'metrics', metrics)
+                monkeypatch.setattr('gcp.metrics.api_metrics', metrics)
+
+                estimate = write_dry_run_plan(build_tree_snapshot('root', cached_drive), 'dest',
+                                              args)['estimate']
+
+                assert estimate['latency_measured'] is measured
+        assert estimate['latency_seconds'] == DEFAULT_LATENCY_SECONDS
+
+    def test_write_and_load(self, plan, tmp_path):
+        """Test that a written plan loads back and that other versions are refused."""
+        path = str(tmp_path / 'plan.json')
+        write_plan(plan, path)
+        assert load_plan(path) == plan
+
+        write_plan(dict(plan, version=0), path)
+        with pytest.raises(ValueError, match='version'):
+            load_plan(path)
+
+    def test_plan_snapshot(self, plan):
+        """Test that the source snapshot is rebuilt from the plan alone."""
+        snapshot = plan_snapshot(plan)
+        assert snapshot.count_child_objects() == (5, 3)
+        assert snapshot.total_size() == 500
+
+
+class TestExecuteCopyPlan:
+    """Test copying a tree from its plan."""
+
+    def test_copies_without_listing(self, drive, plan):
+        """Test that the whole tree is copied with creates and copies only."""
+        target = drive.clone()
+        target.add_item('dest', 'dest', MIME_FOLDER, 'top')
+
+        stats = execute_copy_plan(plan, target)
+
+        assert stats == {'folders': 3, 'files': 5, 'skipped': 0, 'failed': 0}
+        assert target.count_items('dest') == target.count_items('root')
+        assert target.calls['files.list'] == 0
+        assert target.round_trips == 3
+
+    def test_resume_skips_journaled_items(self, drive, plan, tmp_path):
+        """Test that a resumed plan does not copy items of the interrupted run again."""
+        journal_path = str(tmp_path / 'journal.sqlite3')
+        with CopyJournal(journal_path) as journal:
+            journal.record('a', 'dest_a')
+            journal.record('f0', 'dest_f0')
+
+        with CopyJournal(journal_path, resume=True) as journal:
+            stats = execute_copy_plan(plan, drive, journal=journal)
+
+        assert stats == {'folders': 2, 'files': 4, 'skipped': 2, 'failed': 0}
+        assert drive.items['new0']['parents'] == ['dest']
+        assert drive.items['new1']['parents'] == ['dest_a']
+
+    def test_items_under_failed_folders_fail(self, batch_service, plan):
+        """Test that the contents of a folder that could not be created are not copied."""
+        batch_service.files().create().execute.side_effect = HttpError(
+            resp=Mock(status=404), content=b'Not Found')
+        batch_service.files().copy().execute.return_value = {'id': 'copied'}
+
+        stats = execute_copy_plan(plan, batch_service)
+
+        # Folders a and b fail, so c and the 4 files below them fail too
+        assert stats == {'folders': 0, 'files': 1, 'skipped': 0, 'failed': 7}
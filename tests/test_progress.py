@@ -0,0 +1,160 @@
+"""Tests for live copy progress, throughput and ETA."""
+# pylint: disable=redefined-outer-name
+import io
+import logging
+import pytest
+from benchmarks.fake_drive import FakeDrive
+from gcp.async_copy import copy_child_objects_async
+from gcp.copy_folder import copy_child_objects
+from gcp.listing import MIME_FOLDER
+from gcp.progress import CopyProgress, format_bytes, format_duration
+
+
+class FakeClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTerminal(io.StringIO):
+    """A text stream that claims to be a terminal."""
+
+    def isatty(self):
+        """Report a TTY."""
+        return True
+
+
+@pytest.fixture
+def clock():
+    """Create a manual clock."""
+    return FakeClock()
+
+
+def sized_tree():
+    """Create a source tree of 2 folders and 6 files of 100 bytes each."""
+    drive = FakeDrive()
+    drive.add_item('a', 'a', MIME_FOLDER, 'root')
+    drive.add_item('b', 'b', MIME_FOLDER, 'a')
+    for index, parent_id in enumerate(['root', 'root', 'a', 'a', 'b', 'b']):
+        drive.add_item(f'f{index}', f'f{index}.txt', 'text/plain', parent_id, size='100')
+    return drive
+
+
+class TestCopyProgress:
+    """Test counting, throughput, ETA and output."""
+
+    def test_rolling_throughput_and_eta(self, clock):
+        """Test that rates cover the rolling window and the ETA follows the remaining items."""
+        progress = CopyProgress(total_items=100, total_bytes=10000, stream=io.StringIO(),
+                                window_seconds=10, clock=clock)
+        for _ in range(10):
+            clock.now += 1
+            progress.advance(2, 200)
+
+        status = progress.status()
+        assert status['done'] == 20
+        assert status['items_per_second'] == pytest.approx(2.0, rel=0.1)
+        assert status['bytes_per_second'] == pytest.approx(200.0, rel=0.1)
+        assert status['eta_seconds'] == pytest.approx(40.0, rel=0.1)
+
+        # Only the last window counts: the rate drops when the copy slows down
+        for _ in range(20):
+            clock.now += 1
+            progress.advance(1, 100)
+        assert progress.status()['items_per_second'] == pytest.approx(1.0, rel=0.15)
+
+    def test_skipped_items_are_done_but_not_throughput(self, clock):
+        """Test that resumed or unchanged items shorten the ETA without inflating the rate."""
+        progress = CopyProgress(total_items=10, stream=io.StringIO(), clock=clock)
+        progress.skip(5, 500)
+        clock.now += 1
+        progress.advance(1)
+        progress.fail(1)
+
+        status = progress.status()
+        assert (status['done'], status['done_bytes'], status['failed']) == (7, 500, 1)
+        assert status['items_per_second'] == pytest.approx(1.0)
+        assert status['eta_seconds'] == pytest.approx(3.0)
+
+    def test_eta_unknown_before_any_copy(self, clock):
+        """Test that there is no ETA until something was copied."""
+        progress = CopyProgress(total_items=10, stream=io.StringIO(), clock=clock)
+        assert progress.status()['eta_seconds'] is None
+        assert 'ETA --:--:--' in progress.status_line(progress.status())
+
+    def test_status_line_on_terminal(self, clock):
+        """Test that a terminal gets a redrawn status line and a final newline."""
+        terminal = FakeTerminal()
+        progress = CopyProgress(total_items=4, total_bytes=2048, stream=terminal,
+                                refresh_seconds=1, clock=clock)
+        progress.advance(1, 1024)
+        assert terminal.getvalue() == ''
+
+        clock.now = 1.0
+        progress.advance(1, 1024)
+        progress.finish()
+
+        lines = terminal.getvalue().split('\r')[1:]
+        assert lines[0].startswith('2/4 items (50.0%) | 2.0 KB/2.0 KB | 2.0 items/s, 2.0 KB/s')
+        assert lines[-1].endswith('\n')
+
+    def test_no_status_line_without_terminal(self, clock):
+        """Test that redirected output is left alone."""
+        stream = io.StringIO()
+        progress = CopyProgress(total_items=1, stream=stream, refresh_seconds=0, clock=clock)
+        progress.advance()
+        progress.finish()
+        assert stream.getvalue() == ''
+
+    def test_periodic_log_records(self, clock, caplog):
+        """Test that records are logged every log_seconds and on finish, with the raw values."""
+        progress = CopyProgress(total_items=10, stream=io.StringIO(), refresh_seconds=1,
+                                log_seconds=5, clock=clock)
+        with caplog.at_level(logging.INFO):
+            for _ in range(10):
+                clock.now += 1
+                progress.advance()
+            progress.finish()
+
+        records = [record for record in caplog.records
+                   if record.getMessage().startswith('PROGRESS')]
+        assert len(records) == 3
+        assert 'done=5 total_items=10' in records[0].getMessage()
+        assert records[-1].progress['done'] == 10
+        assert records[-1].progress['eta_seconds'] == 0.0
+
+    def test_format_helpers(self):
+        """Test the sizes and durations of the status line."""
+        assert format_bytes(512) == '512 B'
+        assert format_bytes(1536) == '1.5 KB'
+        assert format_bytes(3 * 1024 ** 3) == '3.0 GB'
+        assert format_duration(3725) == '1:02:05'
+
+
+class TestCopyEngines:
+    """Test that every copy engine counts the whole tree."""
+
+    @pytest.mark.parametrize('batch_size', [1, 100])
+    def test_copy_child_objects(self, batch_size):
+        """Test the sequential and batched copy."""
+        drive = sized_tree()
+        progress = CopyProgress(total_items=8, total_bytes=600, stream=io.StringIO())
+
+        copy_child_objects('root', 'dest', drive, batch_size=batch_size, progress=progress)
+
+        status = progress.status()
+        assert (status['done'], status['items'], status['bytes']) == (8, 8, 600)
+
+    def test_async_copy(self):
+        """Test the asyncio pipeline."""
+        drive = sized_tree()
+        progress = CopyProgress(total_items=8, total_bytes=600, stream=io.StringIO())
+
+        copy_child_objects_async('root', 'dest', lambda: drive, copy_workers=2, progress=progress)
+
+        status = progress.status()
+        assert (status['done'], status['items'], status['bytes']) == (8, 8, 600)
@@ -0,0 +1,118 @@
+"""Tests for the shared Drive rate controller."""
+# pylint: disable=redefined-outer-name
+from unittest.mock import MagicMock
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+from gcp.ratelimit import (
+    RateController,
+    is_rate_limit_error,
+    is_retryable_error,
+    retry_after_seconds,
+)
+
+
+def make_error(status, reason=None, retry_after=None):
+    """Create an HttpError like the ones the Drive API returns."""
+    headers = {'status': status}
+    if retry_after is not None:
+        headers['retry-after'] = retry_after
+    content = b'{"error": {"code": %d, "message": "error"}}' % status
+    if reason:
+        content = (b'{"error": {"code": %d, "message": "error", "errors": [{"reason": "%s"}]}}'
+                   % (status, reason.encode()))
+    return HttpError(httplib2.Response(headers), content)
+
+
+@pytest.fixture
+def controller():
+    """Create a controller that records its sleeps instead of sleeping."""
+    sleeps = []
+    rate_controller = RateController(max_retries=3, sleep=sleeps.append)
+    rate_controller.sleeps = sleeps
+    return rate_controller
+
+
+class TestErrorClassification:
+    """Test which errors are retried and which reduce concurrency."""
+
+    def test_rate_limit_errors(self):
+        """Test 429s and 403 rate limit reasons."""
+        assert is_rate_limit_error(make_error(429))
+        assert is_rate_limit_error(make_error(403, 'userRateLimitExceeded'))
+        assert not is_rate_limit_error(make_error(403, 'insufficientFilePermissions'))
+
+    def test_retryable_errors(self):
+        """Test that server errors are retried but client errors are not."""
+        assert is_retryable_error(make_error(503))
+        assert is_retryable_error(make_error(403, 'rateLimitExceeded'))
+        assert not is_retryable_error(make_error(404))
+        assert not is_retryable_error(ValueError('not an HttpError'))
+
+    def test_retry_after_seconds(self):
+        """Test reading the Retry-After header."""
+        assert retry_after_seconds(make_error(429, retry_after='7')) == 7.0
+        assert retry_after_seconds(make_error(429)) is None
+
+
+class TestRateController:
+    """Test retries, backoff and AIMD concurrency."""
+
+    def test_retries_until_success(self, controller):
+        """Test that a rate limited call is retried with a bounded, jittered delay."""
+        request = MagicMock()
+        request.execute.side_effect = [make_error(429), make_error(500), {'id': 'ok'}]
+
+        assert controller.execute(request) == {'id': 'ok'}
+        assert request.execute.call_count == 3
+        assert len(controller.sleeps) == 2
+        assert 0 <= controller.sleeps[0] <= 1.0
+        assert 0 <= controller.sleeps[1] <= 2.0
+
+    def test_honors_retry_after(self, controller):
+        """Test that the server's Retry-After delay is used instead of backoff."""
+        request = MagicMock()
+        request.execute.side_effect = [make_error(429, retry_after='5'), {'id': 'ok'}]
+
+        controller.execute(request)
+
+        assert controller.sleeps == [5.0]
+
+    def test_non_retryable_error_raises(self, controller):
+        """Test that permission errors are raised without retrying."""
+        request = MagicMock()
+        request.execute.side_effect = make_error(404)
+
+        with pytest.raises(HttpError):
+            controller.execute(request)
+        assert request.execute.call_count == 1
+
+    def test_gives_up_after_max_retries(self, controller):
+        """Test that persistent failures are raised after max_retries retries."""
+        request = MagicMock()
+        request.execute.side_effect = make_error(503)
+
+        with pytest.raises(HttpError):
+            controller.execute(request)
+        assert request.execute.call_count == 4
+
+    def test_aimd_limit(self):
+        """Test additive increase on success and one halving per burst of rate limits."""
+        controller = RateController(initial_concurrency=8)
+
+        for _ in range(8):
+            controller.record_success()
+        assert 8.9 < controller.limit < 9.1
+
+        controller.record_error(make_error(429))
+        controller.record_error(make_error(429))
+        assert 4.4 < controller.limit < 4.6
+        assert controller.stats['rate_limited'] == 2
+
+    def test_non_quota_errors_keep_limit(self):
+        """Test that server errors do not reduce concurrency."""
+        controller = RateController(initial_concurrency=8)
+
+        controller.record_error(make_error(500))
+
+        assert controller.limit == 8.0
@@ -0,0 +1,327 @@
+"""Tests for single-pass tree snapshots."""
+# pylint: disable=redefined-outer-name
+from unittest.mock import MagicMock
+import pytest
+from benchmarks.fake_drive import FakeDrive
+from gcp.snapshot import (
+    TRAVERSALS,
+    TreeSnapshot,
+    build_tree_snapshot,
+    build_tree_snapshot_bfs,
+    build_tree_snapshot_concurrent,
+    build_tree_snapshot_corpus,
+    chunk_parent_queries,
+)
+from gcp.copy_folder import count_child_objects
+
+FOLDER = 'application/vnd.google-apps.folder'
+
+
+@pytest.fixture
+def mock_service():
+    """Create a mock Google Drive service."""
+    service = MagicMock()
+    return service
+
+
+@pytest.fixture
+def sample_snapshot():
+    """Create a snapshot: root/{a.txt, Beta/{b.txt, Nested/{c.txt}}, alpha/}."""
+    snapshot = TreeSnapshot('root', 'Root')
+    snapshot.add_item({'id': 'a', 'name': 'a.txt', 'mimeType': 'text/plain'}, 'root')
+    snapshot.add_item({'id': 'beta', 'name': 'Beta', 'mimeType': FOLDER}, 'root')
+    snapshot.add_item({'id': 'alpha', 'name': 'alpha', 'mimeType': FOLDER}, 'root')
+    snapshot.add_item({'id': 'b', 'name': 'b.txt', 'mimeType': 'text/plain'}, 'beta')
+    snapshot.add_item({'id': 'nested', 'name': 'Nested', 'mimeType': FOLDER}, 'beta')
+    snapshot.add_item({'id': 'c', 'name': 'c.txt', 'mimeType': 'text/plain'}, 'nested')
+    return snapshot
+
+
+class TestTreeSnapshot:
+    """Test in-memory counting and reports."""
+
+    def test_count_child_objects(self, sample_snapshot):
+        """Test recursive counts at the root and below."""
+        assert sample_snapshot.count_child_objects() == (3, 3)
+        assert sample_snapshot.count_child_objects('beta') == (2, 1)
+        assert sample_snapshot.count_child_objects('alpha') == (0, 0)
+
+    def test_counts_refresh_after_add(self, sample_snapshot):
+        """Test that adding an item invalidates cached counts."""
+        assert sample_snapshot.count_child_objects() == (3, 3)
+        sample_snapshot.add_item({'id': 'd', 'name': 'd.txt', 'mimeType': 'text/plain'}, 'alpha')
+        assert sample_snapshot.count_child_objects() == (4, 3)
+
+    def test_folder_report(self, sample_snapshot):
+        """Test that the report lists the total then child folders by name."""
+        assert sample_snapshot.folder_report() == [
+            ['TOTAL', 3, 3],
+            ['alpha', 0, 0],
+            ['Beta', 2, 1],
+        ]
+
+    def test_remove_item_removes_subtree(self, sample_snapshot):
+        """Test that removing a folder removes everything below it."""
+        sample_snapshot.remove_item('beta')
+        assert sample_snapshot.count_child_objects() == (1, 1)
+        assert 'c' not in sample_snapshot.items
+
+    def test_update_item_moves_folder_with_children(self, sample_snapshot):
+        """Test that moving a folder keeps its contents."""
+        sample_snapshot.update_item({'id': 'nested', 'name': 'Moved', 'mimeType': FOLDER},
+                                    ['alpha'])
+        assert sample_snapshot.count_child_objects('alpha') == (1, 1)
+        assert sample_snapshot.count_child_objects('beta') == (1, 0)
+
+    def test_dict_round_trip(self, sample_snapshot):
+        """Test that a restored snapshot produces the same report."""
+        restored = TreeSnapshot.from_dict(sample_snapshot.to_dict())
+        assert restored.folder_report() == sample_snapshot.folder_report()
+        assert restored.parents['c'] == ['nested']
+
+
+class TestFingerprints:
+    """Test the Merkle fingerprints of subtrees."""
+
+    def test_fingerprint_ignores_ids(self, sample_snapshot):
+        """Test that a copy with other IDs has the same fingerprints."""
+        copy = TreeSnapshot('copy')
+        copy.add_item({'id': 'n', 'name': 'Nested', 'mimeType': FOLDER}, 'copy')
+        copy.add_item({'id': 'n1', 'name': 'c.txt', 'mimeType': 'text/plain'}, 'n')
+        assert copy.fingerprint('n') == sample_snapshot.fingerprint('nested')
+
+    def test_change_clears_only_ancestors(self, sample_snapshot):
+        """Test that a change recomputes its ancestors and keeps sibling fingerprints."""
+        before = sample_snapshot.fingerprint()
+        alpha = sample_snapshot.fingerprint('alpha')
+
+        sample_snapshot.update_item({'id': 'c', 'name': 'c.txt', 'mimeType': 'text/plain',
+                                     'md5Checksum': 'changed'}, ['nested'])
+
+        assert set(sample_snapshot._fingerprints) == {'alpha'}  # pylint: disable=protected-access
+        assert sample_snapshot.fingerprint() != before
+        assert sample_snapshot.fingerprint('alpha') == alpha
+
+    def test_fingerprints_are_stored(self, sample_snapshot):
+        """Test that stored fingerprints are restored with the snapshot."""
+        fingerprint = sample_snapshot.fingerprint()
+        restored = TreeSnapshot.from_dict(sample_snapshot.to_dict())
+        assert restored._fingerprints['root'] == fingerprint  # pylint: disable=protected-access
+
+
+class TestBuildTreeSnapshot:
+    """Test building a snapshot with a single traversal."""
+
+    def test_build_tree_snapshot_lists_each_folder_once(self, mock_service):
+        """Test that every folder is listed exactly once."""
+        mock_service.files().list().execute.side_effect = [
+            {
+                'files': [
+                    {'id': 'file1', 'name': 'root.txt', 'mimeType': 'text/plain'},
+                    {'id': 'sub', 'name': 'Sub', 'mimeType': FOLDER},
+                ]
+            },
+            {'files': [{'id': 'file2', 'name': 'sub.txt', 'mimeType': 'text/plain'}]},
+        ]
+
+        snapshot = build_tree_snapshot('root', mock_service, 'Root')
+
+        assert mock_service.files().list().execute.call_count == 2
+        assert snapshot.count_child_objects() == (2, 1)
+        assert snapshot.folder_report() == [['TOTAL', 2, 1], ['Sub', 1, 0]]
+
+
+class TestSharedFolders:
+    """Test folders with several parents, and cycles of parents, in every traversal."""
+
+    @pytest.fixture
+    def drive(self):
+        """Create root/{A/{Shared/{s.txt}, Loop/}, B/} with Shared also in B and A in Loop."""
+        drive = FakeDrive()
+        drive.add_item('a', 'A', FOLDER, 'root')
+        drive.add_item('b', 'B', FOLDER, 'root')
+        drive.add_item('shared', 'Shared', FOLDER, 'a')
+        drive.add_item('s', 's.txt', 'text/plain', 'shared')
+        drive.add_item('loop', 'Loop', FOLDER, 'a')
+        for item_id, parent_id in (('shared', 'b'), ('a', 'loop')):
+            drive.items[item_id]['parents'].append(parent_id)
+            drive.children[parent_id].append(item_id)
+        return drive
+
+    @pytest.mark.parametrize('traversal', sorted(TRAVERSALS))
+    def test_each_folder_listed_once(self, drive, traversal):
+        """Test that a shared folder is listed once and a cycle of parents terminates."""
+        kwargs = {'service_factory': lambda: drive} if traversal == 'concurrent' else {}
+        snapshot = build_tree_snapshot('root', drive, 'Root', traversal=traversal, **kwargs)
+
+        if traversal in ('recursive', 'concurrent'):
+            # One listing per folder: root, A, B, Shared and Loop
+            assert drive.calls['files.list'] == 5
+        assert sorted(snapshot.children['a']) == ['loop', 'shared']
+        assert sorted(snapshot.parents['shared']) == ['a', 'b']
+        # A stays out of Loop, which lies below it
+        assert snapshot.children['loop'] == []
+        assert snapshot.count_child_objects('b') == (1, 1)
+        assert snapshot.fingerprint()
+
+
+class TestBreadthFirstTraversal:
+    """Test level-wise traversal with OR-combined parent queries."""
+
+    def test_chunk_parent_queries_single_chunk(self):
+        """Test that short levels become one query."""
+        chunks = list(chunk_parent_queries(['a', 'b']))
+
+        assert chunks == [(['a', 'b'], "('a' in parents or 'b' in parents) and trashed = false")]
+
+    def test_chunk_parent_queries_respects_max_length(self):
+        """Test that long levels are split without exceeding the limit."""
+        folder_ids = [f'folder{index:03d}' for index in range(50)]
+
+        chunks = list(chunk_parent_queries(folder_ids, max_query_length=200))
+
+        assert len(chunks) > 1
+        assert [folder_id for chunk, _ in chunks for folder_id in chunk] == folder_ids
+        assert all(len(query) <= 200 for _, query in chunks)
+
+    def test_build_tree_snapshot_bfs_one_request_per_level(self, mock_service):
+        """Test that each level is listed with a single combined request."""
+        mock_service.files().list().execute.side_effect = [
+            {
+                'files': [
+                    {'id': 'file1', 'name': 'root.txt', 'mimeType': 'text/plain', 'parents': ['root']},
+                    {'id': 'sub1', 'name': 'Sub1', 'mimeType': FOLDER, 'parents': ['root']},
+                    {'id': 'sub2', 'name': 'Sub2', 'mimeType': FOLDER, 'parents': ['root']},
+                ]
+            },
+            {
+                'files': [
+                    {'id': 'file2', 'name': 'a.txt', 'mimeType': 'text/plain', 'parents': ['sub1']},
+                    {'id': 'file3', 'name': 'b.txt', 'mimeType': 'text/plain', 'parents': ['sub2']},
+                    {'id': 'file4', 'name': 'c.txt', 'mimeType': 'text/plain', 'parents': ['sub2']},
+                ]
+            },
+        ]
+
+        snapshot = build_tree_snapshot_bfs('root', mock_service, 'Root')
+
+        assert mock_service.files().list().execute.call_count == 2
+        assert snapshot.folder_report() == [['TOTAL', 4, 2], ['Sub1', 1, 0], ['Sub2', 2, 0]]
+
+    def test_build_tree_snapshot_unknown_traversal(self, mock_service):
+        """Test that an unknown engine name is rejected."""
+        with pytest.raises(ValueError, match="Unknown traversal"):
+            build_tree_snapshot('root', mock_service, traversal='sideways')
+
+
+def make_tree_service(tree):
+    """Create a mock service whose files.list answers from a {parent_id: [items]} dict."""
+    service = MagicMock()
+
+    def list_children(q=None, **_kwargs):
+        request = MagicMock()
+        request.execute.return_value = {'files': tree.get(q.split("'")[1], [])}
+        return request
+
+    service.files.return_value.list.side_effect = list_children
+    return service
+
+
+class TestConcurrentTraversal:
+    """Test the thread-pool traversal engine."""
+
+    TREE = {
+        'root': [
+            {'id': 'f1', 'name': 'one.txt', 'mimeType': 'text/plain'},
+            {'id': 'a', 'name': 'A', 'mimeType': FOLDER},
+            {'id': 'b', 'name': 'B', 'mimeType': FOLDER},
+        ],
+        'a': [
+            {'id': 'f2', 'name': 'two.txt', 'mimeType': 'text/plain'},
+            {'id': 'a1', 'name': 'A1', 'mimeType': FOLDER},
+        ],
+        'a1': [{'id': 'f3', 'name': 'three.txt', 'mimeType': 'text/plain'}],
+        'b': [{'id': 'f4', 'name': 'four.txt', 'mimeType': 'text/plain'}],
+    }
+
+    def test_concurrent_matches_recursive_counters(self):
+        """Test that the concurrent engine reproduces count_child_objects exactly."""
+        factory_calls = []
+
+        def service_factory():
+            factory_calls.append(1)
+            return make_tree_service(self.TREE)
+
+        snapshot = build_tree_snapshot_concurrent('root', None, 'Root',
+                                                  service_factory=service_factory, max_workers=3)
+
+        sequential = make_tree_service(self.TREE)
+        assert snapshot.count_child_objects() == count_child_objects('root', sequential)
+        for folder_id in ('a', 'a1', 'b'):
+            assert snapshot.count_child_objects(folder_id) == count_child_objects(folder_id, sequential)
+        # Every worker thread builds at most one service of its own
+        assert 1 <= len(factory_calls) <= 3
+
+    def test_concurrent_requires_service_factory(self, mock_service):
+        """Test that a shared service is never used across threads."""
+        with pytest.raises(ValueError, match="service_factory"):
+            build_tree_snapshot_concurrent('root', mock_service)
+
+
+class TestCorpusTraversal:
+    """Test flat enumeration with local tree reconstruction."""
+
+    CORPUS = [
+        {'id': 'other', 'name': 'Other', 'mimeType': FOLDER, 'parents': ['drive']},
+        {'id': 'root', 'name': 'Root', 'mimeType': FOLDER, 'parents': ['drive']},
+        {'id': 'f0', 'name': 'outside.txt', 'mimeType': 'text/plain', 'parents': ['other']},
+        {'id': 'f2', 'name': 'two.txt', 'mimeType': 'text/plain', 'parents': ['sub']},
+        {'id': 'sub', 'name': 'Sub', 'mimeType': FOLDER, 'parents': ['root']},
+        {'id': 'f1', 'name': 'one.txt', 'mimeType': 'text/plain', 'parents': ['root']},
+    ]
+
+    def test_corpus_rebuilds_subtree(self, mock_service):
+        """Test that only items reachable from the root are kept, in any listing order."""
+        mock_service.files().get().execute.return_value = {'id': 'root', 'name': 'Root'}
+        mock_service.files().list().execute.side_effect = [
+            {'files': self.CORPUS[:3], 'nextPageToken': 'next'},
+            {'files': self.CORPUS[3:]},
+        ]
+
+        snapshot = build_tree_snapshot_corpus('root', mock_service, 'Root')
+
+        assert mock_service.files().list.call_args.kwargs['corpora'] == 'user'
+        assert mock_service.files().list().execute.call_count == 2
+        assert snapshot.folder_report() == [['TOTAL', 2, 1], ['Sub', 1, 0]]
+        assert 'f0' not in snapshot.items
+
+    def test_corpus_reads_drive_of_shared_root(self, mock_service):
+        """Test that a folder of a shared drive is enumerated from that drive."""
+        mock_service.files().get().execute.return_value = {'id': 'root', 'name': 'Root',
+                                                           'driveId': 'drive'}
+        mock_service.files().list().execute.return_value = {'files': self.CORPUS}
+
+        snapshot = build_tree_snapshot_corpus('root', mock_service)
+
+        get_kwargs = mock_service.files().get.call_args.kwargs
+        assert get_kwargs['fileId'] == 'root'
+        assert get_kwargs['supportsAllDrives'] is True
+        list_kwargs = mock_service.files().list.call_args.kwargs
+        assert list_kwargs['corpora'] == 'drive'
+        assert list_kwargs['driveId'] == 'drive'
+        assert snapshot.root_name == 'Root'
+        assert snapshot.folder_report() == [['TOTAL', 2, 1], ['Sub', 1, 0]]
+
+    def test_corpus_shared_drive_parameters(self, mock_service):
+        """Test that a shared drive is enumerated with the all-drives flags."""
+        mock_service.files().list().execute.return_value = {'files': []}
+
+        build_tree_snapshot_corpus('root', mock_service, drive_id='drive123')
+
+        mock_service.files().get.assert_not_called()
+
+        list_kwargs = mock_service.files().list.call_args.kwargs
+        assert list_kwargs['corpora'] == 'drive'
+        assert list_kwargs['driveId'] == 'drive123'
+        assert list_kwargs['supportsAllDrives'] is True
+        assert list_kwargs['includeItemsFromAllDrives'] is True
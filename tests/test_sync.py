@@ -0,0 +1,147 @@
+"""Tests for the incremental sync mode."""
+# pylint: disable=redefined-outer-name
+import pytest
+from benchmarks.fake_drive import FakeDrive
+from gcp.snapshot import TreeSnapshot, build_tree_snapshot
+from gcp.sync import is_unchanged, sync_child_objects
+from gcp.validate import EXTRA, KEPT, MISMATCH, MISSING, validate_trees
+
+FOLDER = 'application/vnd.google-apps.folder'
+DOC = 'application/vnd.google-apps.document'
+
+
+def pdf(item_id, name, md5):
+    """Create a binary file resource with a checksum."""
+    return {'id': item_id, 'name': name, 'mimeType': 'application/pdf', 'md5Checksum': md5,
+            'size': '10', 'modifiedTime': '2024-01-01T00:00:00.000Z'}
+
+
+@pytest.fixture
+def source():
+    """Source tree: src/{same.pdf, changed.pdf, new.pdf, Docs/{notes}, Fresh/{inner.pdf}}."""
+    snapshot = TreeSnapshot('src', 'Source')
+    snapshot.add_item(pdf('s1', 'same.pdf', 'aaa'), 'src')
+    snapshot.add_item(pdf('s2', 'changed.pdf', 'new-md5'), 'src')
+    snapshot.add_item(pdf('s3', 'new.pdf', 'ccc'), 'src')
+    snapshot.add_item({'id': 'docs', 'name': 'Docs', 'mimeType': FOLDER}, 'src')
+    snapshot.add_item({'id': 's4', 'name': 'notes', 'mimeType': DOC,
+                       'modifiedTime': '2024-02-01T00:00:00.000Z'}, 'docs')
+    snapshot.add_item({'id': 'fresh', 'name': 'Fresh', 'mimeType': FOLDER}, 'src')
+    snapshot.add_item(pdf('s5', 'inner.pdf', 'ddd'), 'fresh')
+    return snapshot
+
+
+@pytest.fixture
+def destination():
+    """Destination tree from the previous run: Fresh/ and new.pdf are missing."""
+    snapshot = TreeSnapshot('dst', 'Destination')
+    snapshot.add_item(pdf('d1', 'same.pdf', 'aaa'), 'dst')
+    snapshot.add_item(pdf('d2', 'changed.pdf', 'old-md5'), 'dst')
+    snapshot.add_item({'id': 'ddocs', 'name': 'Docs', 'mimeType': FOLDER}, 'dst')
+    snapshot.add_item({'id': 'd4', 'name': 'notes', 'mimeType': DOC,
+                       'modifiedTime': '2024-02-01T00:00:00.000Z'}, 'ddocs')
+    return snapshot
+
+
+class TestIsUnchanged:
+    """Test content matching."""
+
+    def test_checksum_match(self):
+        """Test that binary files are compared by checksum."""
+        assert is_unchanged(pdf('a', 'x', 'aaa'), pdf('b', 'x', 'aaa'))
+        assert not is_unchanged(pdf('a', 'x', 'aaa'), pdf('b', 'x', 'bbb'))
+
+    def test_google_documents_use_modified_time(self):
+        """Test that documents without checksums are compared by modifiedTime."""
+        older = {'mimeType': DOC, 'modifiedTime': '2024-01-01T00:00:00.000Z'}
+        newer = {'mimeType': DOC, 'modifiedTime': '2024-03-01T00:00:00.000Z'}
+        assert is_unchanged(older, dict(older))
+        assert not is_unchanged(newer, older)
+
+
+class TestSyncChildObjects:
+    """Test that only missing or changed files are copied."""
+
+    def test_sync_copies_only_changes(self, batch_service, source, destination):
+        """Test that unchanged files and subtrees cost no copies."""
+        batch_service.files().copy().execute.return_value = {'id': 'copied'}
+        batch_service.files().create().execute.return_value = {'id': 'new_fresh'}
+        batch_service.files().update().execute.return_value = {'id': 'd2'}
+
+        stats = sync_child_objects(source, destination, batch_service)
+
+        copied = sorted(call.kwargs['fileId'] for call in batch_service.files().copy.call_args_list
+                        if call.kwargs)
+        assert copied == ['s2', 's3', 's5']
+        trashed = [call.kwargs['fileId'] for call in batch_service.files().update.call_args_list
+                   if call.kwargs]
+        assert trashed == ['d2']
+        assert stats == {'copied': 3, 'replaced': 1, 'unchanged': 2, 'folders': 1, 'failed': 0}
+
+    def test_sync_preserves_modified_time(self, batch_service, source, destination):
+        """Test that copies carry the source modifiedTime so the next run can match them."""
+        batch_service.files().copy().execute.return_value = {'id': 'copied'}
+        batch_service.files().create().execute.return_value = {'id': 'new_fresh'}
+        batch_service.files().update().execute.return_value = {'id': 'd2'}
+
+        sync_child_objects(source, destination, batch_service)
+
+        batch_service.files().copy.assert_any_call(
+            fileId='s3', fields='id',
+            body={'name': 'new.pdf', 'parents': ['dst'], 'modifiedTime': '2024-01-01T00:00:00.000Z'})
+
+    def test_sync_in_sync_tree_makes_no_requests(self, batch_service, destination):
+        """Test that a second run over an identical tree makes no calls at all."""
+        stats = sync_child_objects(destination, destination, batch_service)
+
+        assert batch_service.batches == []
+        assert stats['copied'] == 0
+        assert stats['unchanged'] == 3
+
+    def test_sync_duplicate_names_match_by_content(self, batch_service):
+        """Test that same-named files pair with their own copies and matched copies stay."""
+        source = TreeSnapshot('src', 'Source')
+        source.add_item(pdf('s1', 'report.pdf', 'aaa'), 'src')
+        source.add_item(pdf('s2', 'report.pdf', 'bbb'), 'src')
+        source.add_item(pdf('s3', 'scan.pdf', 'ccc'), 'src')
+        source.add_item(pdf('s4', 'scan.pdf', 'new-md5'), 'src')
+        destination = TreeSnapshot('dst', 'Destination')
+        destination.add_item(pdf('d2', 'report.pdf', 'bbb'), 'dst')
+        destination.add_item(pdf('d1', 'report.pdf', 'aaa'), 'dst')
+        destination.add_item(pdf('d4', 'scan.pdf', 'old-md5'), 'dst')
+        destination.add_item(pdf('d3', 'scan.pdf', 'ccc'), 'dst')
+        batch_service.files().copy().execute.return_value = {'id': 'copied'}
+        batch_service.files().update().execute.return_value = {'id': 'd4'}
+
+        stats = sync_child_objects(source, destination, batch_service)
+
+        copied = [call.kwargs['fileId'] for call in batch_service.files().copy.call_args_list
+                  if call.kwargs]
+        assert copied == ['s4']
+        trashed = [call.kwargs['fileId'] for call in batch_service.files().update.call_args_list
+                   if call.kwargs]
+        assert trashed == ['d4']
+        assert stats == {'copied': 1, 'replaced': 1, 'unchanged': 3, 'folders': 0, 'failed': 0}
+
+
+class TestSyncValidation:
+    """Test validating a destination after a sync."""
+
+    def test_kept_items_do_not_fail_validation(self):
+        """Test that destination-only items are reported as kept, not as extra."""
+        drive = FakeDrive()
+        fields = {'size': '10', 'modifiedTime': '2024-01-01T00:00:00.000Z'}
+        drive.add_item('s1', 'same.pdf', 'application/pdf', 'src', md5Checksum='aaa', **fields)
+        drive.add_item('fresh', 'Fresh', FOLDER, 'src')
+        drive.add_item('s2', 'inner.pdf', 'application/pdf', 'fresh', md5Checksum='bbb', **fields)
+        drive.add_item('d1', 'same.pdf', 'application/pdf', 'dst', md5Checksum='aaa', **fields)
+        drive.add_item('d2', 'old.pdf', 'application/pdf', 'dst', md5Checksum='zzz', **fields)
+        source = build_tree_snapshot('src', drive)
+
+        sync_child_objects(source, build_tree_snapshot('dst', drive), drive)
+        destination = build_tree_snapshot('dst', drive)
+
+        assert validate_trees(source, destination, keep_extra=True) == {
+            MISSING: 0, EXTRA: 0, MISMATCH: 0, KEPT: 1}
+        # A plain copy must not have left old.pdf behind
+        assert validate_trees(source, destination) == {MISSING: 0, EXTRA: 1, MISMATCH: 1}
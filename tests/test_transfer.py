@@ -0,0 +1,363 @@
+"""Tests for streaming transfers of files that files.copy cannot copy."""
+# pylint: disable=redefined-outer-name
+import io
+import json
+import random
+import threading
+import urllib.parse
+from unittest.mock import MagicMock, Mock
+import httplib2
+import pytest
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from benchmarks.fake_drive import FakeDrive, FakeFiles
+from gcp.async_copy import CopyPipeline, copy_child_objects_async
+from gcp.copy_folder import copy_child_objects
+from gcp.journal import CopyJournal
+from gcp.plan import build_copy_plan, execute_copy_plan
+from gcp.progress import CopyProgress
+from gcp.ratelimit import default_controller
+from gcp.snapshot import TreeSnapshot, build_tree_snapshot, item_signature
+from gcp.transfer import (
+    EXPORT_FORMATS,
+    UPLOAD_CHUNK_ALIGNMENT,
+    DownloadStream,
+    StreamingTransfer,
+    is_access_error,
+)
+
+CHUNK = UPLOAD_CHUNK_ALIGNMENT
+DOC = 'application/vnd.google-apps.document'
+DRAWING = 'application/vnd.google-apps.drawing'
+
+
+def content(size, seed=0):
+    """Return size random bytes."""
+    return random.Random(seed).randbytes(size)
+
+
+class MediaServer:
+    """The Drive media endpoints behind the client's HTTP interface.
+
+    Serves ranged downloads and exports, and accepts resumable uploads, logging
+    every request so tests can check the order and size of the chunks.
+    """
+
+    def __init__(self, contents=None, exports=None, short_ack=False):
+        self.contents = contents or {}
+        self.exports = exports or {}
+        self.short_ack = short_ack
+        self.sessions = {}
+        self.created = {}
+        self.log = []
+        # Reading the body of an upload downloads from the server again
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def respond(status, body=b'', **headers):
+        """Return a response tuple."""
+        return httplib2.Response({'status': str(status), **headers}), body
+
+    def request(self, uri, method='GET', body=None, headers=None, **_kwargs):
+        """Handle one request of the client."""
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        url = urllib.parse.urlsplit(uri)
+        query = urllib.parse.parse_qs(url.query)
+        with self.lock:
+            if method == 'PUT':
+                return self.put(url.path, body, headers)
+            if method == 'POST':
+                session = f'/session/{len(self.sessions)}'
+                self.sessions[session] = {'metadata': json.loads(body),
+                                          'type': headers['x-upload-content-type'],
+                                          'data': bytearray()}
+                self.log.append(('POST',))
+                return self.respond(200, location=f'https://upload.test{session}')
+            file_id = url.path.split('/files/')[1]
+            if file_id.endswith('/export'):
+                data = self.exports[file_id[:-len('/export')]]
+                self.log.append(('EXPORT', query['mimeType'][0]))
+                return self.respond(200, data, **{'content-length': str(len(data))})
+            if file_id in self.created:
+                return self.respond(200, json.dumps(self.metadata(file_id)).encode())
+            if file_id not in self.contents:
+                return self.respond(404, b'{"error": {"code": 404, "message": "Not found"}}')
+            data = self.contents[file_id]
+            if query.get('alt') != ['media']:
+                return self.respond(200, json.dumps({'size': str(len(data))}).encode())
+            start, end = (int(value) for value in headers['range'][len('bytes='):].split('-'))
+            end = min(end, len(data) - 1)
+            self.log.append(('GET', start, end + 1))
+            return self.respond(206, data[start:end + 1],
+                                **{'content-range': f'bytes {start}-{end}/{len(data)}'})
+
+    def put(self, session, body, headers):
+        """Receive one chunk of a resumable upload."""
+        data = body.read() if hasattr(body, 'read') else (body or b'')
+        upload = self.sessions[session]
+        total = len(data)
+        if 'content-range' in headers:
+            first, total = headers['content-range'][len('bytes '):].split('/')
+            assert int(first.split('-')[0]) == len(upload['data'])
+            total = int(total)
+        if self.short_ack and len(upload['data']) + len(data) < total:
+            # Keep only part of the chunk, as a server may
+            self.short_ack = False
+            data = data[:len(data) // 2]
+        self.log.append(('PUT', len(upload['data']), len(upload['data']) + len(data)))
+        upload['data'] += data
+        if len(upload['data']) < total:
+            return self.respond(308, range=f"bytes=0-{len(upload['data']) - 1}")
+        new_id = f'new{len(self.created)}'
+        self.created[new_id] = upload
+        return self.respond(200, json.dumps(self.metadata(new_id)).encode())
+
+    def metadata(self, file_id):
+        """Return the resource of a created file."""
+        upload = self.created[file_id]
+        return {'id': file_id, 'name': upload['metadata']['name'],
+                'mimeType': upload['metadata'].get('mimeType', upload['type']),
+                'size': str(len(upload['data']))}
+
+    def service(self):
+        """Create a real Drive client that talks to this server."""
+        return build('drive', 'v3', http=self, static_discovery=True, cache_discovery=False)
+
+
+@pytest.fixture
+def server():
+    """Serve a file of 3.5 chunks, an empty file and a document."""
+    return MediaServer(contents={'big': content(3 * CHUNK + CHUNK // 2), 'empty': b''},
+                       exports={'doc': b'exported', 'drawing': b'%PDF'})
+
+
+def denied(status=403):
+    """Return a files.copy error that is not about rate limits."""
+    return HttpError(resp=Mock(status=status), content=b'Forbidden')
+
+
+class TestDownloadStream:
+    """Test reading a download through a fixed window."""
+
+    def test_reads_one_range_at_a_time(self, server):
+        """Test that the file is read whole while ranges are downloaded only when needed."""
+        stream = DownloadStream(CHUNK)
+        stream.open(server.service().files().get_media(fileId='big'), len(server.contents['big']))
+        assert stream.seek(0, io.SEEK_END) == len(server.contents['big'])
+        assert not server.log
+
+        stream.seek(0)
+        data = b''.join(iter(lambda: stream.read(8192), b''))
+
+        assert data == server.contents['big']
+        assert [end - start for _, start, end in server.log] == [CHUNK] * 3 + [CHUNK // 2]
+
+    def test_rewinds_at_most_one_chunk(self, server):
+        """Test that the chunk behind the read position is kept to resend it."""
+        stream = DownloadStream(CHUNK)
+        stream.open(server.service().files().get_media(fileId='big'), len(server.contents['big']))
+        stream.read(CHUNK)
+        stream.read(CHUNK)
+        stream.read(CHUNK // 2)
+
+        stream.seek(CHUNK + CHUNK // 2)
+        assert stream.read(10) == server.contents['big'][CHUNK + CHUNK // 2:][:10]
+        with pytest.raises(io.UnsupportedOperation):
+            stream.seek(0)
+
+
+class TestStreamingTransfer:
+    """Test transferring single files."""
+
+    def test_streams_chunks_into_a_resumable_upload(self, server, monkeypatch):
+        """Test that each chunk is downloaded just before it is uploaded."""
+        # Downloads must not wait for the slot the upload holds
+        monkeypatch.setattr(default_controller, 'limit', 1.0)
+        transfer = StreamingTransfer(server.service, chunk_size=CHUNK)
+        file = {'id': 'big', 'name': 'big.zip', 'mimeType': 'application/zip',
+                'size': str(len(server.contents['big']))}
+
+        new_file = transfer.transfer_file(file, 'dest')
+
+        upload = server.created[new_file['id']]
+        assert upload['data'] == server.contents['big']
+        assert upload['metadata'] == {'name': 'big.zip', 'parents': ['dest'],
+                                      'mimeType': 'application/zip'}
+        assert [entry[0] for entry in server.log] == ['GET', 'POST', 'PUT'] + ['GET', 'PUT'] * 3
+
+    def test_resends_unacknowledged_bytes(self, server):
+        """Test that the upload resumes where the server stopped, from the buffer."""
+        server.short_ack = True
+        transfer = StreamingTransfer(server.service, chunk_size=CHUNK)
+
+        # The size is looked up when the listing did not have it
+        new_file = transfer.transfer_file({'id': 'big', 'name': 'big', 'mimeType': 'text/plain'},
+                                          'dest')
+
+        assert server.created[new_file['id']]['data'] == server.contents['big']
+        puts = [entry for entry in server.log if entry[0] == 'PUT']
+        assert puts[:2] == [('PUT', 0, CHUNK // 2), ('PUT', CHUNK // 2, CHUNK + CHUNK // 2)]
+        # The resent half chunk came from the buffer
+        assert len([entry for entry in server.log if entry[0] == 'GET']) == 4
+
+    def test_empty_file(self, server):
+        """Test that an empty file is uploaded without downloading anything."""
+        transfer = StreamingTransfer(server.service, chunk_size=CHUNK)
+        new_file = transfer.transfer_file({'id': 'empty', 'name': 'empty', 'size': '0',
+                                           'mimeType': 'text/plain'}, 'dest')
+        assert server.created[new_file['id']]['data'] == b''
+        assert 'GET' not in [entry[0] for entry in server.log]
+
+    @pytest.mark.parametrize('file_id, mime_type, created_type, created_name', [
+        ('doc', DOC, DOC, 'doc'), ('drawing', DRAWING, 'application/pdf', 'drawing.pdf')])
+    def test_exports_google_documents(self, server, file_id, mime_type, created_type,
+                                      created_name):
+        """Test that documents are exported, and converted back where Drive can import them."""
+        transfer = StreamingTransfer(server.service, chunk_size=CHUNK)
+
+        new_file = transfer.transfer_file({'id': file_id, 'name': file_id,
+                                           'mimeType': mime_type}, 'dest')
+
+        upload = server.created[new_file['id']]
+        assert server.log[0] == ('EXPORT', EXPORT_FORMATS[mime_type])
+        assert upload['type'] == EXPORT_FORMATS[mime_type]
+        assert upload['metadata']['mimeType'] == created_type
+        assert upload['metadata']['name'] == created_name
+        assert upload['data'] == server.exports[file_id]
+
+    def test_update_snapshot_expects_exports(self, server):
+        """Test that validation expects the files exported documents were uploaded as."""
+        snapshot = TreeSnapshot('src')
+        for file_id, mime_type in [('big', 'application/zip'), ('doc', DOC), ('drawing', DRAWING)]:
+            snapshot.add_item({'id': file_id, 'name': file_id, 'mimeType': mime_type}, 'src')
+        transfer = StreamingTransfer(server.service, chunk_size=CHUNK)
+        for file_id in snapshot.children['src']:
+            transfer.defer(dict(snapshot.items[file_id]), 'dest', denied())
+
+        transfer.finish()
+        transfer.update_snapshot(snapshot)
+
+        assert snapshot.items['big'] == {'id': 'big', 'name': 'big', 'mimeType': 'application/zip'}
+        assert [item_signature(snapshot.items[file_id]) for file_id in ('doc', 'drawing')] == [
+            ['doc', DOC, '8', ''], ['drawing.pdf', 'application/pdf', '4', '']]
+        assert snapshot.parents['drawing'] == ['src']
+
+    def test_update_snapshot_reads_journaled_exports(self, server, tmp_path):
+        """Test that a resumed copy expects the exports of the interrupted run."""
+        snapshot = TreeSnapshot('src')
+        snapshot.add_item({'id': 'drawing', 'name': 'drawing', 'mimeType': DRAWING}, 'src')
+        journal_path = str(tmp_path / 'journal.sqlite3')
+        with CopyJournal(journal_path) as journal:
+            interrupted = StreamingTransfer(server.service, chunk_size=CHUNK)
+            interrupted.defer(dict(snapshot.items['drawing']), 'dest', denied())
+            interrupted.finish(journal)
+
+        # The resumed run skips the journaled drawing, so nothing is deferred again
+        with CopyJournal(journal_path, resume=True) as journal:
+            resumed = StreamingTransfer(server.service, chunk_size=CHUNK)
+            resumed.finish(journal)
+            resumed.update_snapshot(snapshot, journal)
+
+        assert item_signature(snapshot.items['drawing']) == [
+            'drawing.pdf', 'application/pdf', '4', '']
+        assert len(server.created) == 1
+
+    def test_defer(self):
+        """Test that only access errors on files with content are taken over."""
+        transfer = StreamingTransfer(MagicMock, chunk_size=CHUNK)
+        rate_limited = HttpError(httplib2.Response({'status': 403}), json.dumps({'error': {
+            'code': 403, 'message': 'error', 'errors': [{'reason': 'userRateLimitExceeded'}]}}
+        ).encode())
+
+        assert is_access_error(denied(404))
+        assert not is_access_error(rate_limited)
+        assert transfer.defer({'id': 'f', 'name': 'f', 'mimeType': DOC}, 'dest', denied())
+        assert not transfer.defer({'id': 'f', 'name': 'f', 'mimeType': 'text/plain'}, 'dest',
+                                  denied(400))
+        assert not transfer.defer({'id': 'form', 'name': 'form',
+                                   'mimeType': 'application/vnd.google-apps.form'}, 'dest',
+                                  denied())
+        assert len(transfer.pending) == 1
+
+    def test_finish(self, server, tmp_path):
+        """Test concurrent transfers, with failures counted and transfers journaled."""
+        transfer = StreamingTransfer(server.service, workers=2, chunk_size=CHUNK)
+        for file_id, mime_type in [('big', 'text/plain'), ('doc', DOC), ('gone', 'text/plain')]:
+            transfer.defer({'id': file_id, 'name': file_id, 'mimeType': mime_type, 'size': '10'},
+                           'dest', denied())
+        progress = CopyProgress(total_items=3, stream=io.StringIO())
+
+        with CopyJournal(str(tmp_path / 'journal.sqlite3')) as journal:
+            stats = transfer.finish(journal, progress)
+            assert journal.lookup('big') in server.created
+
+        assert stats == {'transferred': 2, 'exported': 1, 'failed': 1, 'bytes': 20}
+        assert progress.status()['done'] == 3
+        assert not transfer.pending
+
+    def test_chunk_size(self):
+        """Test that chunks must suit resumable uploads."""
+        with pytest.raises(ValueError, match='multiple'):
+            StreamingTransfer(MagicMock, chunk_size=1000)
+
+
+class TestCopyFallback:
+    """Test that every copy engine hands denied copies over."""
+
+    @pytest.fixture
+    def drive(self):
+        """Create a tree of two files in a subfolder."""
+        fake = FakeDrive()
+        fake.add_item('a', 'a', 'application/vnd.google-apps.folder', 'root')
+        fake.add_item('f1', 'f1', 'text/plain', 'a', size='10')
+        fake.add_item('f2', 'f2', 'text/plain', 'a', size='10')
+        return fake
+
+    def test_copy_child_objects(self, drive, monkeypatch):
+        """Test that deferred files are not counted as failed."""
+        monkeypatch.setattr(FakeFiles, 'copy', Mock(return_value=Mock(
+            execute=Mock(side_effect=denied()))))
+        transfer = StreamingTransfer(MagicMock, chunk_size=CHUNK)
+        progress = CopyProgress(total_items=3, stream=io.StringIO())
+
+        copy_child_objects('root', 'dest', drive, batch_size=1, progress=progress,
+                           transfer=transfer)
+
+        assert sorted(file['id'] for file, _ in transfer.pending) == ['f1', 'f2']
+        assert progress.status()['failed'] == 0
+
+    def test_batched_copy_child_objects(self, batch_service):
+        """Test that deferred files of a batch are not counted as failed, and others are."""
+        files = [{'id': 'f1', 'name': 'f1', 'mimeType': 'text/plain', 'size': '10'},
+                 {'id': 'f2', 'name': 'f2', 'mimeType': 'text/plain', 'size': '10'}]
+        batch_service.files().list().execute.side_effect = [{'files': files}, {'files': []}]
+        batch_service.files().copy().execute.side_effect = [denied(404), denied(400)]
+        transfer = StreamingTransfer(MagicMock, chunk_size=CHUNK)
+        progress = CopyProgress(total_items=2, stream=io.StringIO())
+
+        copy_child_objects('root', 'dest', batch_service, progress=progress, transfer=transfer)
+
+        assert transfer.pending == [(files[0], 'dest')]
+        assert progress.status()['failed'] == 1
+
+    def test_async_copy(self, drive, monkeypatch):
+        """Test the asyncio pipeline."""
+        monkeypatch.setattr(CopyPipeline, '_copy_file', Mock(side_effect=denied()))
+        transfer = StreamingTransfer(MagicMock, chunk_size=CHUNK)
+
+        stats = copy_child_objects_async('root', 'dest', lambda: drive, transfer=transfer)
+
+        assert stats == {'folders': 1, 'files': 0, 'failed': 0}
+        assert len(transfer.pending) == 2
+
+    def test_plan(self, drive, batch_service):
+        """Test copying a plan."""
+        plan = build_copy_plan(build_tree_snapshot('root', drive), 'dest')
+        batch_service.files().create().execute.return_value = {'id': 'dest_a'}
+        batch_service.files().copy().execute.side_effect = denied()
+        transfer = StreamingTransfer(MagicMock, chunk_size=CHUNK)
+
+        stats = execute_copy_plan(plan, batch_service, transfer=transfer)
+
+        assert stats['failed'] == 0
+        assert [dest_parent_id for _, dest_parent_id in transfer.pending] == ['dest_a'] * 2
@@ -0,0 +1,78 @@
+"""Tests for the pooled HTTP transport, through the real client against the emulator."""
+# pylint: disable=redefined-outer-name
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.errors import HttpError
+from benchmarks.emulator import DriveEmulator, build_emulated_drive
+from gcp.copy_folder import copy_child_objects, create_drive_service
+from gcp.snapshot import build_tree_snapshot
+from gcp.transport import PooledHttp
+
+
+@pytest.fixture
+def emulator():
+    """Serve a wide tree of about 200 items."""
+    with DriveEmulator(build_emulated_drive('wide', 200)) as running:
+        yield running
+
+
+def service_factory(emulator, http=None):
+    """Return a factory of real Drive clients pointed at the emulator."""
+    return lambda: create_drive_service(AnonymousCredentials(), emulator.url, http)
+
+
+class TestPooledHttp:
+    """Test sharing one connection pool between Drive clients."""
+
+    def test_workers_share_the_pool(self, emulator):
+        """Test that concurrent workers reuse at most pool_size connections."""
+        http = PooledHttp(AnonymousCredentials(), pool_size=2)
+        new_service = service_factory(emulator, http)
+
+        snapshot = build_tree_snapshot('root', new_service(), traversal='concurrent',
+                                       service_factory=new_service, max_workers=8)
+        http.close()
+
+        assert snapshot.count_child_objects() == emulator.drive.count_items('root')
+        assert emulator.stats['requests'] > 8
+        assert emulator.stats['connections'] <= 2
+
+    def test_httplib2_connects_per_client(self, emulator):
+        """Test the baseline: every worker's client opens its own connection."""
+        new_service = service_factory(emulator)
+
+        build_tree_snapshot('root', new_service(), traversal='concurrent',
+                            service_factory=new_service, max_workers=8)
+
+        assert emulator.stats['connections'] > 2
+
+    def test_batched_copy(self, emulator):
+        """Test that batch requests go through the pooled transport."""
+        http = PooledHttp(AnonymousCredentials())
+
+        copy_child_objects('root', 'dest', service_factory(emulator, http)())
+
+        assert emulator.drive.count_items('dest') == emulator.drive.count_items('root')
+        assert emulator.stats['batches'] > 0
+        assert emulator.stats['connections'] == 1
+
+    def test_without_keep_alive(self, emulator):
+        """Test that every request gets a new connection when keep-alive is off."""
+        http = PooledHttp(AnonymousCredentials(), keep_alive=False)
+        drive_service = service_factory(emulator, http)()
+        for _ in range(3):
+            drive_service.files().get(fileId='root').execute()
+
+        assert emulator.stats['connections'] == 3
+
+    def test_errors_keep_status_and_headers(self):
+        """Test that error responses are turned into HttpErrors like httplib2's."""
+        with DriveEmulator(build_emulated_drive('wide', 10), rate_limit=0.001, burst=1,
+                           rate_limit_status=429) as emulator:
+            drive_service = service_factory(emulator, PooledHttp(AnonymousCredentials()))()
+            drive_service.files().get(fileId='root').execute()
+            with pytest.raises(HttpError) as error:
+                drive_service.files().get(fileId='root').execute()
+
+        assert error.value.resp.status == 429
+        assert error.value.resp['retry-after'] == '1'
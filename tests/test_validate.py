@@ -0,0 +1,186 @@
+"""Tests for the streaming structural validator."""
+# pylint: disable=redefined-outer-name
+import csv
+import tracemalloc
+from unittest.mock import patch
+import pytest
+from gcp.snapshot import TreeSnapshot
+from gcp.validate import (
+    EXTRA,
+    KEPT,
+    MISMATCH,
+    MISSING,
+    diff_inventories,
+    diff_trees,
+    inventory_row,
+    iter_inventory,
+    join_path,
+    split_path,
+    validate_inventory_files,
+    validate_trees,
+    write_inventory,
+)
+
+FOLDER = 'application/vnd.google-apps.folder'
+TEXT = 'text/plain'
+
+
+def make_tree(root_id, items):
+    """Create a snapshot from (id, name, mimeType, parent) tuples."""
+    snapshot = TreeSnapshot(root_id)
+    for item_id, name, mime_type, parent_id in items:
+        snapshot.add_item({'id': item_id, 'name': name, 'mimeType': mime_type}, parent_id)
+    return snapshot
+
+
+@pytest.fixture
+def source():
+    """Source tree: {A/{x.txt}, AB/{}, a.txt}."""
+    return make_tree('src', [
+        ('a', 'A', FOLDER, 'src'),
+        ('ab', 'AB', FOLDER, 'src'),
+        ('f1', 'a.txt', TEXT, 'src'),
+        ('f2', 'x.txt', TEXT, 'a'),
+    ])
+
+
+class TestPaths:
+    """Test path encoding and ordering."""
+
+    def test_join_and_split_escape_slashes(self):
+        """Test that names containing slashes survive a round trip."""
+        names = ('Reports', '2024/Q1', 'back\\slash')
+        assert split_path(join_path(names)) == names
+
+    def test_inventory_is_sorted_by_path(self, source):
+        """Test that the depth-first order is the sorted path order."""
+        paths = [names for names, _ in iter_inventory(source)]
+        assert paths == sorted(paths)
+        assert paths == [(), ('A',), ('A', 'x.txt'), ('AB',), ('a.txt',)]
+
+
+class TestDiff:
+    """Test the per-path diff."""
+
+    def test_identical_trees(self, source):
+        """Test that a complete copy validates."""
+        copy = make_tree('dst', [
+            ('c', 'A', FOLDER, 'dst'),
+            ('cb', 'AB', FOLDER, 'dst'),
+            ('c1', 'a.txt', TEXT, 'dst'),
+            ('c2', 'x.txt', TEXT, 'c'),
+        ])
+        assert validate_trees(source, copy) == {MISSING: 0, EXTRA: 0, MISMATCH: 0}
+
+    def test_missing_extra_and_mismatch(self, source, tmp_path):
+        """Test that every kind of difference is reported with its path."""
+        copy = make_tree('dst', [
+            ('c', 'A', FOLDER, 'dst'),
+            ('c1', 'a.txt', TEXT, 'dst'),
+            ('c3', 'extra.txt', TEXT, 'dst'),
+        ])
+        diff_file = tmp_path / 'diff.csv'
+
+        summary = validate_trees(source, copy, str(diff_file))
+
+        assert summary == {MISSING: 2, EXTRA: 1, MISMATCH: 2}
+        with open(diff_file, newline='', encoding='utf-8') as input_file:
+            rows = list(csv.reader(input_file))
+        assert rows[1:] == [
+            [MISMATCH, '/', 'folder 2 2', 'folder 2 1'],
+            [MISMATCH, 'A', 'folder 1 0', 'folder 0 0'],
+            [MISSING, 'A/x.txt', 'file', ''],
+            [MISSING, 'AB', 'folder 0 0', ''],
+            [EXTRA, 'extra.txt', '', 'file'],
+        ]
+
+    def test_matching_subtrees_are_skipped(self, source):
+        """Test that folders with equal fingerprints are not descended into."""
+        copy = make_tree('dst', [
+            ('c', 'A', FOLDER, 'dst'),
+            ('cb', 'AB', FOLDER, 'dst'),
+            ('c1', 'a.txt', TEXT, 'dst'),
+            ('c2', 'x.txt', TEXT, 'c'),
+            ('c3', 'new.txt', TEXT, 'cb'),
+        ])
+
+        with patch('gcp.validate.inventory_row', wraps=inventory_row) as mock_row:
+            differences = list(diff_trees(source, copy))
+
+        assert [(status, names) for status, names, _, _ in differences] == [
+            (MISMATCH, ()), (MISMATCH, ('AB',)), (EXTRA, ('AB', 'new.txt'))]
+        visited = {call.args[1] for call in mock_row.call_args_list}
+        assert not visited & {'a', 'c', 'f2', 'c2'}
+
+    def test_kept_extras_still_report_missing(self, source):
+        """Test that with keep_extra only destination-only items stop failing."""
+        copy = make_tree('dst', [
+            ('c', 'A', FOLDER, 'dst'),
+            ('cb', 'AB', FOLDER, 'dst'),
+            ('c1', 'a.txt', TEXT, 'dst'),
+            ('c3', 'new.txt', TEXT, 'cb'),
+        ])
+
+        differences = list(diff_trees(source, copy, keep_extra=True))
+
+        assert [(status, names) for status, names, _, _ in differences] == [
+            (MISSING, ('A', 'x.txt')), (KEPT, ('AB', 'new.txt'))]
+
+    def test_checksum_mismatch(self, source):
+        """Test that a file with the same name but other content is reported."""
+        source.update_item({'id': 'f1', 'name': 'a.txt', 'mimeType': TEXT, 'size': '3',
+                            'md5Checksum': 'abc'}, ['src'])
+        copy = make_tree('dst', [
+            ('c', 'A', FOLDER, 'dst'),
+            ('cb', 'AB', FOLDER, 'dst'),
+            ('c2', 'x.txt', TEXT, 'c'),
+        ])
+        copy.add_item({'id': 'c1', 'name': 'a.txt', 'mimeType': TEXT, 'size': '3',
+                       'md5Checksum': 'xyz'}, 'dst')
+
+        assert [(status, names) for status, names, _, _ in diff_trees(source, copy)] == [
+            (MISMATCH, ('a.txt',))]
+
+    def test_same_named_siblings_pair_by_content(self):
+        """Test that swapped same-named siblings match, and only the leftovers are reported."""
+        def tree(root_id, checksums):
+            snapshot = TreeSnapshot(root_id)
+            for index, checksum in enumerate(checksums):
+                snapshot.add_item({'id': f'{root_id}{index}', 'name': 'a.txt', 'mimeType': TEXT,
+                                   'size': '3', 'md5Checksum': checksum}, root_id)
+            return snapshot
+
+        source = tree('src', ['aaa', 'bbb', 'ccc'])
+
+        assert not list(diff_trees(source, tree('dst', ['ccc', 'bbb', 'aaa'])))
+        differences = list(diff_trees(source, tree('dst', ['ccc', 'xyz', 'aaa'])))
+        assert [(status, names, source_row[4], destination_row[4])
+                for status, names, source_row, destination_row in differences] == [
+            (MISMATCH, ('a.txt',), 'bbb', 'xyz')]
+
+    def test_inventory_files(self, source, tmp_path):
+        """Test comparing two inventory files written by write_inventory."""
+        copy = make_tree('dst', [('c', 'A', FOLDER, 'dst')])
+        write_inventory(source, str(tmp_path / 'source.csv'))
+        write_inventory(copy, str(tmp_path / 'destination.csv'))
+
+        summary = validate_inventory_files(str(tmp_path / 'source.csv'),
+                                           str(tmp_path / 'destination.csv'))
+
+        assert summary == {MISSING: 3, EXTRA: 0, MISMATCH: 2}
+
+    def test_diff_runs_in_constant_memory(self):
+        """Test that large inventories are merged without holding them in memory."""
+        def rows(count, skip):
+            for index in range(count):
+                if index != skip:
+                    yield (f'{index:08d}',), ['file', '', '']
+
+        tracemalloc.start()
+        differences = list(diff_inventories(rows(50000, -1), rows(50000, 100)))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert [(status, names) for status, names, _, _ in differences] == [
+            (MISSING, ('00000100',))]
+        assert peak < 1024 * 1024